@@ -6,13 +6,16 @@
 __all__ = ["MAASClient", "MAASDispatcher", "MAASOAuth"]
 
 import collections
+from concurrent.futures import ThreadPoolExecutor
 import gzip
 from io import BytesIO
 import random
+import threading
 import time
 import urllib.error
 import urllib.parse
 import urllib.request
+import urllib.response
 import uuid
 
 import oauth.oauth as oauth
@@ -82,6 +85,125 @@ class RequestWithMethod(urllib.request.Request):
         )
 
 
+class ConnectionPool:
+    """Idle HTTP connections, kept open to be used again.
+
+    Connections are keyed by whatever identifies where they go to. At most
+    `max_idle` idle connections are kept for each key; more are closed.
+    """
+
+    def __init__(self, max_idle=1):
+        self.max_idle = max_idle
+        self._idle = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Take an idle connection for `key`, or return `None`."""
+        with self._lock:
+            idle = self._idle.get(key)
+            return idle.pop() if idle else None
+
+    def put(self, key, conn):
+        """Keep `conn` for another request to `key`."""
+        with self._lock:
+            idle = self._idle[key]
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        """Close every idle connection."""
+        with self._lock:
+            idle, self._idle = self._idle, collections.defaultdict(list)
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+
+class KeepAliveHandlerMixin:
+    """Send requests on connections from a `ConnectionPool`.
+
+    urllib's handlers open a new connection for every request and ask the
+    server to close it afterwards. These ask the server to keep it open,
+    then read the whole response and put the connection back in the pool.
+    A server may close an idle connection at any time, so a request that
+    fails on a pooled connection before a response arrives is sent again
+    on a new one.
+    """
+
+    def __init__(self, pool, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = pool
+
+    def do_open(self, http_class, req, **http_conn_args):
+        host = req.host
+        if not host:
+            raise urllib.error.URLError("no host given")
+        headers = dict(req.unredirected_hdrs)
+        headers.update(
+            (name, value)
+            for name, value in req.headers.items()
+            if name not in headers
+        )
+        headers["Connection"] = "keep-alive"
+        headers = {name.title(): value for name, value in headers.items()}
+        tunnel_headers = {}
+        if req._tunnel_host and "Proxy-Authorization" in headers:
+            tunnel_headers["Proxy-Authorization"] = headers.pop(
+                "Proxy-Authorization"
+            )
+        key = http_class, host, req._tunnel_host
+        conn = self.pool.get(key)
+        if conn is not None:
+            try:
+                return self._send(key, conn, req, headers)
+            except ConnectionError:
+                # The server closed it while it was idle.
+                pass
+        conn = http_class(host, timeout=req.timeout, **http_conn_args)
+        if req._tunnel_host:
+            conn.set_tunnel(req._tunnel_host, headers=tunnel_headers)
+        try:
+            return self._send(key, conn, req, headers)
+        except OSError as error:
+            raise urllib.error.URLError(error)
+
+    def _send(self, key, conn, req, headers):
+        try:
+            conn.request(
+                req.get_method(),
+                req.selector,
+                req.data,
+                headers,
+                encode_chunked=req.has_header("Transfer-encoding"),
+            )
+            response = conn.getresponse()
+            content = response.read()
+        except BaseException:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            self.pool.put(key, conn)
+        res = urllib.response.addinfourl(
+            BytesIO(content), response.msg, req.get_full_url(), response.status
+        )
+        res.msg = response.reason
+        return res
+
+
+class KeepAliveHTTPHandler(KeepAliveHandlerMixin, urllib.request.HTTPHandler):
+    """An `HTTPHandler` that keeps connections open; see `ConnectionPool`."""
+
+
+class KeepAliveHTTPSHandler(
+    KeepAliveHandlerMixin, urllib.request.HTTPSHandler
+):
+    """An `HTTPSHandler` that keeps connections open; see `ConnectionPool`."""
+
+
 class MAASDispatcher:
     """Helper class to connect to a MAAS server using blocking requests.
 
@@ -89,12 +211,48 @@ class MAASDispatcher:
     can be replaced with a Twisted-enabled alternative.  See the MAAS
     provider in Juju for the code this would require.
 
+    Connections are kept open and used again for later requests to the
+    same host, so a dispatcher is best kept for as long as there are
+    requests to make. It can be used from several threads at once. Each
+    response is read in full before it is returned.
+
     @ivar autodetect_proxies: Extract proxy information from the
         environment variables (http_proxy, no_proxy). Default True
+    @ivar concurrency: How many requests `fan_out` makes at once, and how
+        many idle connections are kept to each host. Default 1
     """
 
-    def __init__(self, autodetect_proxies=True):
+    def __init__(self, autodetect_proxies=True, concurrency=1):
         self.autodetect_proxies = autodetect_proxies
+        self.concurrency = concurrency
+        self.pool = ConnectionPool(max_idle=max(concurrency, 1))
+        handlers = [
+            KeepAliveHTTPHandler(self.pool),
+            KeepAliveHTTPSHandler(self.pool),
+        ]
+        if not self.autodetect_proxies:
+            handlers.append(urllib.request.ProxyHandler({}))
+        self.opener = urllib.request.build_opener(*handlers)
+
+    def close(self):
+        """Close the connections kept open for later requests."""
+        self.pool.close()
+
+    def fan_out(self, func, items):
+        """Call `func` with each of `items`, `concurrency` at a time.
+
+        `func` will usually make a request through this dispatcher, e.g.
+        with a `MAASClient` that uses it.
+
+        :return: A list of the results, in the order of `items`. If any
+            call raises an exception, the first such is raised instead.
+        """
+        items = list(items)
+        if self.concurrency <= 1 or len(items) <= 1:
+            return [func(item) for item in items]
+        workers = min(self.concurrency, len(items))
+        with ThreadPoolExecutor(workers) as executor:
+            return list(executor.map(func, items))
 
     def dispatch_query(self, request_url, headers, method="GET", data=None):
         """Synchronously dispatch an OAuth-signed request to L{request_url}.
@@ -125,13 +283,9 @@ class MAASDispatcher:
             data = bytes(data, "utf-8")
         req = RequestWithMethod(request_url, data, headers, method=method)
         # Retry the request maximum of 3 times.
-        handlers = []
-        if not self.autodetect_proxies:
-            handlers.append(urllib.request.ProxyHandler({}))
         for try_count in range(3):
-            opener = urllib.request.build_opener(*handlers)
             try:
-                res = opener.open(req)
+                res = self.opener.open(req)
             except urllib.error.HTTPError as exc:
                 if exc.code == 503:
                     # HTTP 503 Service Unavailable - MAAS might still be
@@ -156,12 +310,9 @@ class MAASDispatcher:
             and res.info().get("Content-Encoding") == "gzip"
         )
         if is_gzip:
-            # Workaround python's gzip failure, gzip.GzipFile wants to be able
-            # to seek the file object.
-            res_content_io = BytesIO(res.read())
-            ungz = gzip.GzipFile(mode="rb", fileobj=res_content_io)
-            res = urllib.request.addinfourl(
-                ungz, res.headers, res.url, res.code
+            content = gzip.decompress(res.read())
+            res = urllib.response.addinfourl(
+                BytesIO(content), res.headers, res.url, res.code
             )
         return res
 
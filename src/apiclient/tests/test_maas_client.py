@@ -7,23 +7,37 @@ __all__ = []
 
 from functools import wraps
 import gzip
+from http.server import BaseHTTPRequestHandler
 from io import BytesIO
 import json
 import os
 from random import randint
-from unittest.mock import ANY, MagicMock, patch
+import socket
+import threading
+from unittest.mock import ANY, MagicMock, Mock, patch
 import urllib.error
 import urllib.parse
 from urllib.parse import parse_qs, urljoin, urlparse
 import urllib.request
 
-from testtools.matchers import AfterPreprocessing, Equals, MatchesListwise
-
-from apiclient.maas_client import MAASClient, MAASDispatcher, MAASOAuth
+from fixtures import Fixture
+from testtools.matchers import (
+    AfterPreprocessing,
+    Equals,
+    LessThan,
+    MatchesListwise,
+)
+
+from apiclient.maas_client import (
+    ConnectionPool,
+    MAASClient,
+    MAASDispatcher,
+    MAASOAuth,
+)
 from apiclient.testing.django import APIClientTestCase
 from maastesting.factory import factory
 from maastesting.fixtures import TempWDFixture
-from maastesting.httpd import HTTPServerFixture
+from maastesting.httpd import HTTPServerFixture, ThreadingHTTPServer
 from maastesting.testcase import MAASTestCase
 
 
@@ -256,6 +270,185 @@ class TestMAASDispatcher(MAASTestCase):
                 raise AssertionError("ProxyHandler shouldn't be there")
 
 
+class KeepAliveRequestHandler(BaseHTTPRequestHandler):
+    """Answers every GET with its path, keeping the connection open."""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        content = self.path.encode("ascii")
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            content = gzip.compress(content)
+            self.send_response(200)
+            self.send_header("Content-Encoding", "gzip")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class KeepAliveServerFixture(Fixture):
+    """An HTTP/1.1 server that counts the connections made to it."""
+
+    def _setUp(self):
+        self.connections = []
+        fixture = self
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+
+            def process_request(self, request, client_address):
+                fixture.connections.append(request)
+                super().process_request(request, client_address)
+
+        self.server = Server(("127.0.0.1", 0), KeepAliveRequestHandler)
+        self.url = "http://127.0.0.1:%d/" % self.server.server_address[1]
+        thread = threading.Thread(
+            target=self.server.serve_forever, kwargs={"poll_interval": 0.01}
+        )
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+
+class TestConnectionPool(MAASTestCase):
+    def test_get_returns_None_when_empty(self):
+        pool = ConnectionPool()
+        self.assertIsNone(pool.get(factory.make_name("key")))
+
+    def test_get_returns_connection_put(self):
+        pool = ConnectionPool()
+        key, conn = factory.make_name("key"), Mock()
+        pool.put(key, conn)
+        self.assertIs(conn, pool.get(key))
+        self.assertIsNone(pool.get(key))
+        conn.close.assert_not_called()
+
+    def test_put_closes_connections_beyond_max_idle(self):
+        pool = ConnectionPool(max_idle=2)
+        key = factory.make_name("key")
+        conns = [Mock(), Mock(), Mock()]
+        for conn in conns:
+            pool.put(key, conn)
+        conns[0].close.assert_not_called()
+        conns[1].close.assert_not_called()
+        conns[2].close.assert_called_once_with()
+
+    def test_close_closes_idle_connections(self):
+        pool = ConnectionPool(max_idle=2)
+        conns = [Mock(), Mock()]
+        pool.put("a", conns[0])
+        pool.put("b", conns[1])
+        pool.close()
+        for conn in conns:
+            conn.close.assert_called_once_with()
+        self.assertIsNone(pool.get("a"))
+
+
+class TestMAASDispatcherKeepAlive(MAASTestCase):
+    def setUp(self):
+        super().setUp()
+        self.httpd = self.useFixture(KeepAliveServerFixture())
+        self.dispatcher = MAASDispatcher(autodetect_proxies=False)
+        self.addCleanup(self.dispatcher.close)
+
+    def test_uses_one_connection_for_several_requests(self):
+        paths = ["/%s" % factory.make_name("path") for _ in range(3)]
+        for path in paths:
+            response = self.dispatcher.dispatch_query(
+                urljoin(self.httpd.url, path), {}
+            )
+            self.assertEqual(200, response.code)
+            self.assertEqual(path.encode("ascii"), response.read())
+        self.assertEqual(1, len(self.httpd.connections))
+
+    def test_decodes_gzip_on_kept_connection(self):
+        url = urljoin(self.httpd.url, "/gzip")
+        for _ in range(2):
+            response = self.dispatcher.dispatch_query(url, {})
+            self.assertEqual(b"/gzip", response.read())
+        self.assertEqual(1, len(self.httpd.connections))
+
+    def test_reconnects_when_idle_connection_was_closed(self):
+        url = urljoin(self.httpd.url, "/path")
+        self.dispatcher.dispatch_query(url, {})
+        # The server closes the connection while it's idle.
+        self.httpd.connections[0].shutdown(socket.SHUT_RDWR)
+        response = self.dispatcher.dispatch_query(url, {})
+        self.assertEqual(b"/path", response.read())
+        self.assertEqual(2, len(self.httpd.connections))
+
+    def test_close_closes_idle_connections(self):
+        url = urljoin(self.httpd.url, "/path")
+        self.dispatcher.dispatch_query(url, {})
+        self.dispatcher.close()
+        self.dispatcher.dispatch_query(url, {})
+        self.assertEqual(2, len(self.httpd.connections))
+
+
+class TestMAASDispatcherFanOut(MAASTestCase):
+    def test_returns_results_in_order(self):
+        dispatcher = MAASDispatcher(concurrency=3)
+        items = list(range(10))
+        self.assertEqual(
+            [item * 2 for item in items],
+            dispatcher.fan_out(lambda item: item * 2, items),
+        )
+
+    def test_calls_concurrently(self):
+        dispatcher = MAASDispatcher(concurrency=3)
+        barrier = threading.Barrier(3, timeout=5)
+        self.assertEqual(
+            [0, 1, 2],
+            dispatcher.fan_out(lambda item: barrier.wait(), range(3)),
+        )
+
+    def test_calls_in_this_thread_without_concurrency(self):
+        dispatcher = MAASDispatcher()
+        self.assertEqual(
+            [threading.get_ident()] * 2,
+            dispatcher.fan_out(lambda item: threading.get_ident(), "ab"),
+        )
+
+    def test_raises_exception_from_call(self):
+        dispatcher = MAASDispatcher(concurrency=2)
+        exception = factory.make_exception()
+
+        def func(item):
+            if item == 1:
+                raise exception
+            return item
+
+        error = self.assertRaises(
+            type(exception), dispatcher.fan_out, func, range(3)
+        )
+        self.assertIs(exception, error)
+
+    def test_reuses_connections_concurrently(self):
+        httpd = self.useFixture(KeepAliveServerFixture())
+        dispatcher = MAASDispatcher(autodetect_proxies=False, concurrency=2)
+        self.addCleanup(dispatcher.close)
+        paths = ["/%d" % index for index in range(10)]
+
+        def get(path):
+            return dispatcher.dispatch_query(
+                urljoin(httpd.url, path), {}
+            ).read()
+
+        for _ in range(2):
+            self.assertEqual(
+                [path.encode("ascii") for path in paths],
+                dispatcher.fan_out(get, paths),
+            )
+        self.assertThat(len(httpd.connections), LessThan(5))
+
+
 def make_path():
     """Create an arbitrary resource path."""
     return "/" + "/".join(factory.make_string() for counter in range(2))
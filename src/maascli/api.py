@@ -7,7 +7,7 @@ __all__ = ["register_api_commands"]
 
 import argparse
 from collections import defaultdict
-from functools import partial
+from functools import lru_cache, partial
 import http.client
 import json
 from operator import itemgetter
@@ -35,9 +35,15 @@ from maascli.utils import (
 )
 
 
+@lru_cache(maxsize=None)
+def get_http(insecure=False):
+    """Return an `httplib2.Http`, shared so that connections are reused."""
+    return httplib2.Http(disable_ssl_certificate_validation=insecure)
+
+
 def http_request(url, method, body=None, headers=None, insecure=False):
     """Issue an http request."""
-    http = httplib2.Http(disable_ssl_certificate_validation=insecure)
+    http = get_http(insecure)
     try:
         # XXX mpontillo 2015-12-15: Should force input to be in bytes here.
         # This calls into httplib2, which is going to call a parser which
@@ -414,44 +420,51 @@ def register_handler(profile, handler, parser):
     register_actions(profile, handler, handler_parser)
 
 
+def represent_resource(profile, resource):
+    """Merge the actions of a resource's handlers into one handler.
+
+    :return: The merged handler, or `None` if the resource has no actions
+        for `profile`.
+    """
+    # Don't consider the authenticated handler if this profile has no
+    # credentials associated with it.
+    if profile["credentials"] is None:
+        handlers = [resource["anon"]]
+    else:
+        handlers = [resource["auth"], resource["anon"]]
+    # Merge actions from the active handlers. This could be slightly
+    # simpler using a dict and going through the handlers in reverse, but
+    # doing it forwards with a defaultdict(list) leaves an easier-to-debug
+    # structure, and ought to be easier to understand.
+    actions = defaultdict(list)
+    for handler in handlers:
+        if handler is not None:
+            for action in handler["actions"]:
+                action_name = action["name"]
+                actions[action_name].append(action)
+    # Always represent this resource using the authenticated handler, if
+    # defined, before the fall-back anonymous handler, even if this
+    # profile does not have credentials.
+    represent_as = dict(
+        resource["auth"] or resource["anon"], name=resource["name"], actions=[]
+    )
+    # Each value in the actions dict is a list of one or more action
+    # descriptions. Here we represent the handler with only the first of
+    # each of those.
+    if len(actions) == 0:
+        return None
+    represent_as["actions"].extend(value[0] for value in actions.values())
+    return represent_as
+
+
 def register_resources(profile, parser):
     """Register a profile's resources."""
-    anonymous = profile["credentials"] is None
     description = profile["description"]
     resources = description["resources"]
     for resource in sorted(resources, key=itemgetter("name")):
-        # Don't consider the authenticated handler if this profile has no
-        # credentials associated with it.
-        if anonymous:
-            handlers = [resource["anon"]]
-        else:
-            handlers = [resource["auth"], resource["anon"]]
-        # Merge actions from the active handlers. This could be slightly
-        # simpler using a dict and going through the handlers in reverse, but
-        # doing it forwards with a defaultdict(list) leaves an easier-to-debug
-        # structure, and ought to be easier to understand.
-        actions = defaultdict(list)
-        for handler in handlers:
-            if handler is not None:
-                for action in handler["actions"]:
-                    action_name = action["name"]
-                    actions[action_name].append(action)
-        # Always represent this resource using the authenticated handler, if
-        # defined, before the fall-back anonymous handler, even if this
-        # profile does not have credentials.
-        represent_as = dict(
-            resource["auth"] or resource["anon"],
-            name=resource["name"],
-            actions=[],
-        )
-        # Each value in the actions dict is a list of one or more action
-        # descriptions. Here we register the handler with only the first of
-        # each of those.
-        if len(actions) != 0:
-            represent_as["actions"].extend(
-                value[0] for value in actions.values()
-            )
-            register_handler(profile, represent_as, parser)
+        handler = represent_resource(profile, resource)
+        if handler is not None:
+            register_handler(profile, handler, parser)
 
 
 profile_help_paragraphs = [
@@ -473,21 +486,80 @@ profile_help = "\n\n".join(
 )
 
 
-def register_api_commands(parser):
-    """Register all profiles as subcommands on `parser`."""
+def register_profile(profile, parser):
+    """Register a profile, without its resources, and return its parser."""
+    return parser.subparsers.add_parser(
+        profile["name"],
+        help="Interact with %(url)s" % profile,
+        description=(
+            "Issue commands to the MAAS region controller at "
+            "%(url)s." % profile
+        ),
+        epilog=profile_help,
+    )
+
+
+HELP_OPTIONS = frozenset(["-h", "--help"])
+
+
+def register_named_resource(config, parser, argv):
+    """Register only what's needed to parse `argv`.
+
+    That's the profile and resource named in `argv`, loaded from the
+    profile's resource index, or nothing when `argv` names one of the CLI's
+    own commands. Only what's registered is shown in help and error
+    messages, so when help is asked for above the resource, or `argv`
+    doesn't name a known profile and resource, nothing is registered.
+
+    :return: Whether `argv` can be parsed with what was registered.
+    """
+    words = [
+        (index, arg)
+        for index, arg in enumerate(argv[1:])
+        if not arg.startswith("-")
+    ]
+    if len(words) == 0:
+        return False
+    profile_index, profile_name = words[0]
+    if not HELP_OPTIONS.isdisjoint(argv[1 : profile_index + 1]):
+        return False
+    try:
+        profile = config.get_summary(profile_name)
+    except KeyError:
+        # This is one of the CLI's own commands, or a mistake.
+        return profile_name in parser.subparsers.choices
+    if len(words) == 1:
+        return False
+    resource_index, resource_name = words[1]
+    if not HELP_OPTIONS.isdisjoint(argv[1 : resource_index + 1]):
+        return False
+    resource = config.get_resource(profile_name, resource_name)
+    if resource is None:
+        return False
+    handler = represent_resource(profile, resource)
+    if handler is None:
+        return False
+    register_handler(profile, handler, register_profile(profile, parser))
+    return True
+
+
+def register_api_commands(parser, argv=None):
+    """Register all profiles as subcommands on `parser`.
+
+    :param argv: The command line to be parsed, if known. Building the
+        whole tree of commands means loading the API description of every
+        profile, so when `argv` allows only its profile and resource are
+        registered; see `register_named_resource`.
+    """
     try:
         with ProfileConfig.open() as config:
+            if argv is not None and register_named_resource(
+                config, parser, argv
+            ):
+                return
             for profile_name in config:
                 profile = config[profile_name]
-                profile_parser = parser.subparsers.add_parser(
-                    profile["name"],
-                    help="Interact with %(url)s" % profile,
-                    description=(
-                        "Issue commands to the MAAS region controller at "
-                        "%(url)s." % profile
-                    ),
-                    epilog=profile_help,
-                )
+                profile_parser = register_profile(profile, parser)
                 register_resources(profile, profile_parser)
     except FileNotFoundError:
         return
@@ -6,18 +6,41 @@
 __all__ = ["ProfileConfig"]
 
 from contextlib import closing, contextmanager
+import hashlib
 import json
 import os
 from os.path import expanduser
 import sqlite3
 
+from maascli.utils import handler_command_name
+
+
+def get_description_hash(description):
+    """Return the hash of an API description.
+
+    This is the hash the region reports, or, for regions that don't, a
+    digest of the description itself.
+    """
+    description_hash = description.get("hash")
+    if description_hash is None:
+        data = json.dumps(description, sort_keys=True).encode("utf-8")
+        description_hash = hashlib.sha1(data).hexdigest()
+    return description_hash
+
 
 class ProfileConfig:
-    """Store profile configurations in an sqlite3 database."""
+    """Store profile configurations in an sqlite3 database.
+
+    Each profile's API description is also stored indexed by resource, so
+    that one resource can be loaded without loading the whole description;
+    see `get_summary` and `get_resource`. The index is rebuilt when the
+    hash of the description changes.
+    """
 
     def __init__(self, database):
         self.database = database
         self.cache = {}
+        self.__filled = False
         with self.cursor() as cursor:
             cursor.execute(
                 "CREATE TABLE IF NOT EXISTS profiles "
@@ -25,7 +48,19 @@ class ProfileConfig:
                 " name TEXT NOT NULL UNIQUE,"
                 " data BLOB)"
             )
-        self.__fill_cache()
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS profile_index "
+                "(name TEXT NOT NULL PRIMARY KEY,"
+                " hash TEXT NOT NULL,"
+                " data BLOB)"
+            )
+            cursor.execute(
+                "CREATE TABLE IF NOT EXISTS resource_index "
+                "(profile TEXT NOT NULL,"
+                " name TEXT NOT NULL,"
+                " data BLOB,"
+                " PRIMARY KEY (profile, name))"
+            )
 
     def cursor(self):
         return closing(self.database.cursor())
@@ -35,19 +70,24 @@ class ProfileConfig:
         needed to enforce a consistent view. Without it, the list of items can
         be out of sync with the items actually in the database leading to
         KeyErrors when traversing the profiles.
+
+        Loading every profile is slow when there are several, so this is
+        only done when the profiles are first traversed.
         """
-        for name in self:
+        if self.__filled:
+            return
+        with self.cursor() as cursor:
+            results = cursor.execute("SELECT name FROM profiles").fetchall()
+        for (name,) in results:
             try:
                 self[name]
             except KeyError:
                 pass
+        self.__filled = True
 
     def __iter__(self):
-        if self.cache:
-            return (name for name in self.cache)
-        with self.cursor() as cursor:
-            results = cursor.execute("SELECT name FROM profiles").fetchall()
-        return (name for (name,) in results)
+        self.__fill_cache()
+        return (name for name in list(self.cache))
 
     def __getitem__(self, name):
         if name in self.cache:
@@ -71,15 +111,102 @@ class ProfileConfig:
                 (name, json.dumps(data)),
             )
         self.cache[name] = data
+        self.__index(name, data)
 
     def __delitem__(self, name):
         with self.cursor() as cursor:
             cursor.execute("DELETE FROM profiles" " WHERE name = ?", (name,))
+        self.__drop_index(name)
         try:
             del self.cache[name]
         except KeyError:
             pass
 
+    def __index(self, name, data):
+        """Index the API description of profile `name` by resource.
+
+        Profiles without a description aren't indexed.
+        """
+        description = data.get("description")
+        if not isinstance(description, dict) or "resources" not in description:
+            self.__drop_index(name)
+            return
+        description_hash = get_description_hash(description)
+        summary = dict(data, description={})
+        if "hash" in description:
+            summary["description"]["hash"] = description["hash"]
+        with self.cursor() as cursor:
+            indexed = cursor.execute(
+                "SELECT hash FROM profile_index WHERE name = ?", (name,)
+            ).fetchone()
+            if indexed is None or indexed[0] != description_hash:
+                cursor.execute(
+                    "DELETE FROM resource_index WHERE profile = ?", (name,)
+                )
+                cursor.executemany(
+                    "INSERT OR REPLACE INTO resource_index "
+                    "(profile, name, data) VALUES (?, ?, ?)",
+                    (
+                        (
+                            name,
+                            handler_command_name(resource["name"]),
+                            json.dumps(resource),
+                        )
+                        for resource in description["resources"]
+                    ),
+                )
+            cursor.execute(
+                "INSERT OR REPLACE INTO profile_index (name, hash, data) "
+                "VALUES (?, ?, ?)",
+                (name, description_hash, json.dumps(summary)),
+            )
+
+    def __drop_index(self, name):
+        with self.cursor() as cursor:
+            cursor.execute("DELETE FROM profile_index WHERE name = ?", (name,))
+            cursor.execute(
+                "DELETE FROM resource_index WHERE profile = ?", (name,)
+            )
+
+    def get_summary(self, name):
+        """Return profile `name` without the body of its API description.
+
+        Only the description's hash is kept, if it has one. Profiles stored
+        before the index existed are indexed now.
+
+        :raise KeyError: If there's no such profile, or it has no API
+            description.
+        """
+        with self.cursor() as cursor:
+            row = cursor.execute(
+                "SELECT data FROM profile_index WHERE name = ?", (name,)
+            ).fetchone()
+        if row is None:
+            self.__index(name, self[name])
+            with self.cursor() as cursor:
+                row = cursor.execute(
+                    "SELECT data FROM profile_index WHERE name = ?", (name,)
+                ).fetchone()
+            if row is None:
+                raise KeyError(name)
+        return json.loads(row[0])
+
+    def get_resource(self, name, resource_name):
+        """Return a resource from the API description of profile `name`.
+
+        :param resource_name: The resource's command name; see
+            `handler_command_name`.
+        :return: The resource's description, or `None` if profile `name`
+            has no such resource.
+        """
+        with self.cursor() as cursor:
+            row = cursor.execute(
+                "SELECT data FROM resource_index"
+                " WHERE profile = ? AND name = ?",
+                (name, resource_name),
+            ).fetchone()
+        return None if row is None else json.loads(row[0])
+
     @classmethod
     def create_database(cls, dbpath):
         # Initialise the database file with restrictive permissions.
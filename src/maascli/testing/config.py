@@ -5,6 +5,7 @@
 
 __all__ = ["FakeConfig", "make_configs", "make_profile"]
 
+from maascli.utils import handler_command_name
 from maastesting.factory import factory
 
 
@@ -17,6 +18,19 @@ class FakeConfig(dict):
     def __exit__(self, *args, **kwargs):
         pass
 
+    def get_summary(self, name):
+        description = self[name]["description"]
+        summary = dict(self[name], description={})
+        if "hash" in description:
+            summary["description"]["hash"] = description["hash"]
+        return summary
+
+    def get_resource(self, name, resource_name):
+        for resource in self[name]["description"]["resources"]:
+            if handler_command_name(resource["name"]) == resource_name:
+                return resource
+        return None
+
 
 def make_handler():
     """Create a fake handler entry."""
@@ -9,6 +9,7 @@ from base64 import b64encode
 from functools import partial
 import http.client
 import json
+import random
 import sys
 from textwrap import dedent
 from unittest.mock import Mock, sentinel
@@ -76,6 +77,82 @@ class TestRegisterAPICommands(MAASTestCase):
                 self.assertIsInstance(options.execute, api.Action)
 
 
+class TestRegisterAPICommandsLazily(MAASTestCase):
+    """Tests for `register_api_commands` given the command line."""
+
+    def setUp(self):
+        super().setUp()
+        self.configs = make_configs(3)
+        self.patch(ProfileConfig, "open").return_value = self.configs
+        self.profile_name = sorted(self.configs)[0]
+        profile = self.configs[self.profile_name]
+        self.resource_names = [
+            handler_command_name(resource["name"])
+            for resource in profile["description"]["resources"]
+        ]
+
+    def register(self, *args):
+        parser = ArgumentParser()
+        parser.subparsers.add_parser("list")
+        api.register_api_commands(parser, ("maas",) + args)
+        return parser
+
+    def get_resource_names(self, parser):
+        profile_parser = parser.subparsers.choices[self.profile_name]
+        return set(profile_parser.subparsers.choices)
+
+    def test_registers_only_named_profile_and_resource(self):
+        resource_name = self.resource_names[0]
+        parser = self.register(self.profile_name, resource_name, "-d")
+        self.assertEqual(
+            {"list", self.profile_name}, set(parser.subparsers.choices)
+        )
+        self.assertEqual({resource_name}, self.get_resource_names(parser))
+        resource_parser = parser.subparsers.choices[
+            self.profile_name
+        ].subparsers.choices[resource_name]
+        action_name = random.choice(list(resource_parser.subparsers.choices))
+        options = parser.parse_args(
+            (self.profile_name, resource_name, action_name)
+        )
+        self.assertIsInstance(options.execute, api.Action)
+        self.assertEqual(
+            self.configs.get_summary(self.profile_name),
+            options.execute.profile,
+        )
+
+    def test_registers_nothing_for_cli_command(self):
+        parser = self.register("list")
+        self.assertEqual({"list"}, set(parser.subparsers.choices))
+
+    def test_registers_everything_for_profile_help(self):
+        parser = self.register(self.profile_name, "--help")
+        self.assertEqual(
+            {"list"} | set(self.configs), set(parser.subparsers.choices)
+        )
+        self.assertEqual(
+            set(self.resource_names), self.get_resource_names(parser)
+        )
+
+    def test_registers_everything_for_help_before_resource(self):
+        parser = self.register("-h", self.profile_name, self.resource_names[0])
+        self.assertEqual(
+            set(self.resource_names), self.get_resource_names(parser)
+        )
+
+    def test_registers_everything_for_unknown_resource(self):
+        parser = self.register(self.profile_name, "unknown")
+        self.assertEqual(
+            set(self.resource_names), self.get_resource_names(parser)
+        )
+
+    def test_registers_everything_for_unknown_command(self):
+        parser = self.register("unknown")
+        self.assertEqual(
+            {"list"} | set(self.configs), set(parser.subparsers.choices)
+        )
+
+
 class TestFunctions(MAASTestCase):
     """Test for miscellaneous functions in `maascli.api`."""
 
@@ -153,6 +230,13 @@ class TestFunctions(MAASTestCase):
         )
         self.assertEqual(error_expected, "%s" % error)
 
+    def test_get_http_is_shared_so_connections_are_reused(self):
+        self.assertIs(api.get_http(), api.get_http())
+        self.assertIsNot(api.get_http(), api.get_http(insecure=True))
+        self.assertTrue(
+            api.get_http(insecure=True).disable_ssl_certificate_validation
+        )
+
     def test_get_action_class_returns_None_for_unknown_handler(self):
         handler = {"name": factory.make_name("handler")}
         action = {"name": "create"}
@@ -6,6 +6,7 @@
 __all__ = []
 
 import contextlib
+import json
 import os.path
 import sqlite3
 from unittest import TestCase
@@ -14,6 +15,8 @@ from unittest.mock import patch
 from twisted.python.filepath import FilePath
 
 from maascli import api
+from maascli.testing.config import make_profile
+from maascli.utils import handler_command_name
 from maastesting.testcase import MAASTestCase
 
 
@@ -116,3 +119,137 @@ class TestProfileConfig(MAASTestCase):
         with api.ProfileConfig.open(config_file):
             perms = FilePath(config_file).getPermissions()
             self.assertEqual("rw-r--r--", perms.shorthand())
+
+
+class TestProfileConfigIndex(MAASTestCase):
+    """Tests for the resource index of `ProfileConfig`."""
+
+    def make_config(self):
+        return api.ProfileConfig(sqlite3.connect(":memory:"))
+
+    def make_profile(self, name, description_hash=None):
+        profile = make_profile(name)
+        if description_hash is not None:
+            profile["description"]["hash"] = description_hash
+        return profile
+
+    def test_get_summary_omits_description(self):
+        config = self.make_config()
+        profile = self.make_profile("alice", "abc123")
+        config["alice"] = profile
+        self.assertEqual(
+            dict(profile, description={"hash": "abc123"}),
+            config.get_summary("alice"),
+        )
+
+    def test_get_summary_omits_description_without_hash(self):
+        config = self.make_config()
+        profile = self.make_profile("alice")
+        config["alice"] = profile
+        self.assertEqual(
+            dict(profile, description={}), config.get_summary("alice")
+        )
+
+    def test_get_summary_raises_KeyError(self):
+        config = self.make_config()
+        config["bob"] = {"abc": 123}
+        self.assertRaises(KeyError, config.get_summary, "alice")
+        self.assertRaises(KeyError, config.get_summary, "bob")
+
+    def test_get_summary_indexes_profiles_stored_before_index(self):
+        database = sqlite3.connect(":memory:")
+        profile = self.make_profile("alice")
+        database.execute(
+            "CREATE TABLE profiles "
+            "(id INTEGER PRIMARY KEY, name TEXT NOT NULL UNIQUE, data BLOB)"
+        )
+        database.execute(
+            "INSERT INTO profiles (name, data) VALUES (?, ?)",
+            ("alice", json.dumps(profile)),
+        )
+        config = api.ProfileConfig(database)
+        self.assertEqual(
+            dict(profile, description={}), config.get_summary("alice")
+        )
+        resource = profile["description"]["resources"][0]
+        self.assertEqual(
+            resource,
+            config.get_resource(
+                "alice", handler_command_name(resource["name"])
+            ),
+        )
+
+    def test_get_resource(self):
+        config = self.make_config()
+        profile = self.make_profile("alice")
+        config["alice"] = profile
+        for resource in profile["description"]["resources"]:
+            self.assertEqual(
+                resource,
+                config.get_resource(
+                    "alice", handler_command_name(resource["name"])
+                ),
+            )
+        self.assertIsNone(config.get_resource("alice", "unknown"))
+        self.assertIsNone(config.get_resource("bob", "unknown"))
+
+    def test_reindexes_when_hash_changes(self):
+        config = self.make_config()
+        old = self.make_profile("alice", "old")
+        config["alice"] = old
+        new = self.make_profile("alice", "new")
+        config["alice"] = new
+        [old_resource, _] = old["description"]["resources"]
+        [new_resource, _] = new["description"]["resources"]
+        self.assertIsNone(
+            config.get_resource(
+                "alice", handler_command_name(old_resource["name"])
+            )
+        )
+        self.assertEqual(
+            new_resource,
+            config.get_resource(
+                "alice", handler_command_name(new_resource["name"])
+            ),
+        )
+
+    def test_does_not_reindex_when_hash_is_unchanged(self):
+        config = self.make_config()
+        profile = self.make_profile("alice", "abc123")
+        config["alice"] = profile
+        with config.cursor() as cursor:
+            cursor.execute("UPDATE resource_index SET data = '{}'")
+        profile["credentials"] = None
+        config["alice"] = profile
+        resource = profile["description"]["resources"][0]
+        self.assertEqual(
+            {},
+            config.get_resource(
+                "alice", handler_command_name(resource["name"])
+            ),
+        )
+        self.assertIsNone(config.get_summary("alice")["credentials"])
+
+    def test_removing_profile_removes_index(self):
+        config = self.make_config()
+        profile = self.make_profile("alice")
+        config["alice"] = profile
+        del config["alice"]
+        self.assertRaises(KeyError, config.get_summary, "alice")
+        resource = profile["description"]["resources"][0]
+        self.assertIsNone(
+            config.get_resource(
+                "alice", handler_command_name(resource["name"])
+            )
+        )
+
+    def test_loads_only_profiles_asked_for(self):
+        database = sqlite3.connect(":memory:")
+        config = api.ProfileConfig(database)
+        config["alice"] = self.make_profile("alice")
+        config["bob"] = self.make_profile("bob")
+        config = api.ProfileConfig(database)
+        config.get_summary("alice")
+        self.assertEqual({}, config.cache)
+        self.assertEqual({"alice", "bob"}, set(config))
+        self.assertEqual({"alice", "bob"}, set(config.cache))
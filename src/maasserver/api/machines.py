@@ -9,6 +9,7 @@ __all__ = [
 ]
 
 from collections import namedtuple
+from itertools import islice
 import json
 import re
 
@@ -340,6 +341,100 @@ def get_allocated_composed_machine(
     return machine, storage, interfaces
 
 
+def compose_machine_for_allocation(
+    request, form, storage, interfaces, zone, input_constraints
+):
+    """Compose a machine in a pod to satisfy an allocation request.
+
+    :return: A ``(machine, storage, interfaces)`` tuple, where `machine` is
+        `None` if no pod could compose a matching machine.
+    """
+    cores = form.cleaned_data.get("cpu_count")
+    if cores is not None:
+        cores = int(cores)
+    memory = form.cleaned_data.get("mem")
+    if memory is not None:
+        memory = int(memory)
+    architecture = None
+    architectures = form.cleaned_data.get("arch")
+    if architectures is not None:
+        architecture = None if len(architectures) == 0 else min(architectures)
+    storage = form.cleaned_data.get("storage")
+    interfaces = form.cleaned_data.get("interfaces")
+    data = {
+        "cores": cores,
+        "memory": memory,
+        "architecture": architecture,
+        "storage": storage,
+        "interfaces": interfaces,
+    }
+    pods = Pod.objects.get_pods(request.user, PodPermission.dynamic_compose)
+    if zone is not None:
+        pods = pods.filter(zone__name=zone)
+    if not pods:
+        return None, storage, interfaces
+    return get_allocated_composed_machine(
+        request, data, storage, interfaces, pods, form, input_constraints
+    )
+
+
+def describe_unavailable_machines(form, input_constraints):
+    """Explain that no machine matches the constraints in `form`."""
+    constraints = form.describe_constraints()
+    if constraints == "":
+        # No constraints. That means no machines at all were available.
+        return "No machine available."
+    else:
+        return (
+            "No available machine matches constraints: %s "
+            '(resolved to "%s")' % (str(input_constraints), constraints)
+        )
+
+
+def acquire_machine(request, machine, options):
+    """Acquire `machine` for the requesting user with `options`."""
+    machine.acquire(
+        request.user,
+        agent_name=options.agent_name,
+        comment=options.comment,
+        bridge_all=options.bridge_all,
+        bridge_type=options.bridge_type,
+        bridge_stp=options.bridge_stp,
+        bridge_fd=options.bridge_fd,
+    )
+
+
+def set_constraints_by_type(machine, storage, interfaces, verbose):
+    """Record on `machine` which of its devices matched the constraints."""
+    machine.constraint_map = storage.get(machine.id, {})
+    machine.constraints_by_type = {}
+    # Need to get the interface constraints map into the proper format
+    # to return it here.
+    # Backward compatibility: provide the storage constraints in both
+    # formats.
+    if len(machine.constraint_map) > 0:
+        machine.constraints_by_type["storage"] = {}
+        new_storage = machine.constraints_by_type["storage"]
+        # Convert this to the "new style" constraints map format.
+        for storage_key in machine.constraint_map:
+            # Each key in the storage map is actually a value which
+            # contains the ID of the matching storage device.
+            # Convert this to a label: list-of-matches format, to
+            # match how the constraints will be done going forward.
+            new_key = machine.constraint_map[storage_key]
+            matches = new_storage.get(new_key, [])
+            matches.append(storage_key)
+            new_storage[new_key] = matches
+    if len(interfaces) > 0:
+        machine.constraints_by_type["interfaces"] = {
+            label: interfaces.get(label, {}).get(machine.id)
+            for label in interfaces
+        }
+    if verbose:
+        machine.constraints_by_type["verbose_storage"] = storage
+        machine.constraints_by_type["verbose_interfaces"] = interfaces
+
+
 class MachineHandler(NodeHandler, OwnerDataMixin, PowerMixin):
     """
     Manage an individual machine.
@@ -2406,107 +2501,121 @@ class MachinesHandler(NodesHandler, PowersMixin):
         if not form.is_valid():
             raise MAASAPIValidationError(form.errors)
 
-        # This lock prevents a machine we've picked as available from
-        # becoming unavailable before our transaction commits.
-        with locks.node_acquire:
-            machines = self.base_model.objects.get_available_machines_for_acquisition(
-                request.user
-            )
-            machines, storage, interfaces = form.filter_nodes(machines)
+        machines = self.base_model.objects.get_available_machines_for_acquisition(
+            request.user
+        )
+        machines, storage, interfaces = form.filter_nodes(machines)
+        if dry_run:
             machine = get_first(machines)
-            if machine is None:
-                cores = form.cleaned_data.get("cpu_count")
-                if cores is not None:
-                    cores = int(cores)
-                memory = form.cleaned_data.get("mem")
-                if memory is not None:
-                    memory = int(memory)
-                architecture = None
-                architectures = form.cleaned_data.get("arch")
-                if architectures is not None:
-                    architecture = (
-                        None if len(architectures) == 0 else min(architectures)
-                    )
-                storage = form.cleaned_data.get("storage")
-                interfaces = form.cleaned_data.get("interfaces")
-                data = {
-                    "cores": cores,
-                    "memory": memory,
-                    "architecture": architecture,
-                    "storage": storage,
-                    "interfaces": interfaces,
-                }
-                pods = Pod.objects.get_pods(
-                    request.user, PodPermission.dynamic_compose
+        else:
+            # Concurrent requests pass over machines that are claimed here,
+            # so allocations of existing machines don't wait on each other.
+            machine = get_first(
+                self.base_model.objects.claim_machines_for_acquisition(
+                    machines
                 )
-                if zone is not None:
-                    pods = pods.filter(zone__name=zone)
-                if pods:
-                    (
-                        machine,
-                        storage,
-                        interfaces,
-                    ) = get_allocated_composed_machine(
-                        request,
-                        data,
-                        storage,
-                        interfaces,
-                        pods,
-                        form,
-                        input_constraints,
-                    )
+            )
+        if machine is None:
+            # This lock serialises composition, so concurrent requests don't
+            # compose more machines than the pods have room for.
+            with locks.node_acquire:
+                machine, storage, interfaces = compose_machine_for_allocation(
+                    request, form, storage, interfaces, zone, input_constraints
+                )
+        if machine is None:
+            raise NodesNotAvailable(
+                describe_unavailable_machines(form, input_constraints)
+            )
+        if not dry_run:
+            acquire_machine(request, machine, options)
+        set_constraints_by_type(machine, storage, interfaces, verbose)
+        return machine
 
-            if machine is None:
-                constraints = form.describe_constraints()
-                if constraints == "":
-                    # No constraints. That means no machines at all were
-                    # available.
-                    message = "No machine available."
-                else:
-                    message = (
-                        "No available machine matches constraints: %s "
-                        '(resolved to "%s")'
-                        % (str(input_constraints), constraints)
-                    )
-                raise NodesNotAvailable(message)
-            if not dry_run:
-                machine.acquire(
-                    request.user,
-                    agent_name=options.agent_name,
-                    comment=options.comment,
-                    bridge_all=options.bridge_all,
-                    bridge_type=options.bridge_type,
-                    bridge_stp=options.bridge_stp,
-                    bridge_fd=options.bridge_fd,
+    @operation(idempotent=False)
+    def allocate_many(self, request):
+        """@description-title Allocate several machines
+        @description Allocates `count` available machines that match the
+        given constraints, all in one transaction. Either every machine is
+        allocated or none are. Machines are never composed in pods.
+
+        Takes the same constraints and options as the ``allocate``
+        operation, for example ``arch``, ``tags``, ``zone``, ``pool``,
+        ``agent_name`` and ``comment``.
+
+        @param (int) "count" [required=true] The number of machines to
+        allocate.
+
+        @param (boolean) "dry_run" [required=false] Optional boolean to
+        indicate that the machines should not actually be allocated (this is
+        for support/testing).
+
+        @param (boolean) "verbose" [required=false] Optional boolean to
+        indicate that the user would like additional verbosity in the
+        constraints_by_type field (each constraint will be prefixed by
+        ``verbose_``, and contain the full data structure that indicates
+        which machine(s) matched).
+
+        @success (http-status-code) "server-success" 200
+        @success (json) "success-json" A JSON list of the allocated machine
+        objects.
+        @success-example "success-json" [exkey=machines-placeholder]
+        placeholder text
+
+        @error (http-status-code) "409" 409
+        @error (content) "no-match" Fewer than `count` machines matching the
+        given constraints could be found.
+        """
+        count = get_mandatory_param(
+            request.POST, "count", validator=Int(min=1)
+        )
+        form = AcquireNodeForm(data=request.data)
+        input_constraints = [
+            param
+            for param in request.data.lists()
+            if param[0] not in ("op", "count")
+        ]
+        maaslog.info(
+            "Request from user %s to acquire %d machines with constraints: "
+            "%s",
+            request.user.username,
+            count,
+            str(input_constraints),
+        )
+        options = get_allocation_options(request)
+        verbose = get_optional_param(
+            request.POST, "verbose", default=False, validator=StringBool
+        )
+        dry_run = get_optional_param(
+            request.POST, "dry_run", default=False, validator=StringBool
+        )
+
+        if not form.is_valid():
+            raise MAASAPIValidationError(form.errors)
+
+        machines = self.base_model.objects.get_available_machines_for_acquisition(
+            request.user
+        )
+        machines, storage, interfaces = form.filter_nodes(machines)
+        if dry_run:
+            machines = list(islice(machines, count))
+        else:
+            machines = self.base_model.objects.claim_machines_for_acquisition(
+                machines, count=count
+            )
+        if len(machines) < count:
+            raise NodesNotAvailable(
+                "Only %d of %d machines are available. %s"
+                % (
+                    len(machines),
+                    count,
+                    describe_unavailable_machines(form, input_constraints),
                 )
-            machine.constraint_map = storage.get(machine.id, {})
-            machine.constraints_by_type = {}
-            # Need to get the interface constraints map into the proper format
-            # to return it here.
-            # Backward compatibility: provide the storage constraints in both
-            # formats.
-            if len(machine.constraint_map) > 0:
-                machine.constraints_by_type["storage"] = {}
-                new_storage = machine.constraints_by_type["storage"]
-                # Convert this to the "new style" constraints map format.
-                for storage_key in machine.constraint_map:
-                    # Each key in the storage map is actually a value which
-                    # contains the ID of the matching storage device.
-                    # Convert this to a label: list-of-matches format, to
-                    # match how the constraints will be done going forward.
-                    new_key = machine.constraint_map[storage_key]
-                    matches = new_storage.get(new_key, [])
-                    matches.append(storage_key)
-                    new_storage[new_key] = matches
-            if len(interfaces) > 0:
-                machine.constraints_by_type["interfaces"] = {
-                    label: interfaces.get(label, {}).get(machine.id)
-                    for label in interfaces
-                }
-            if verbose:
-                machine.constraints_by_type["verbose_storage"] = storage
-                machine.constraints_by_type["verbose_interfaces"] = interfaces
-            return machine
+            )
+        for machine in machines:
+            if not dry_run:
+                acquire_machine(request, machine, options)
+            set_constraints_by_type(machine, storage, interfaces, verbose)
+        return machines
 
     @admin_method
     @operation(idempotent=False)
@@ -9,14 +9,17 @@ __all__ = [
 ]
 
 from base64 import b64decode
-from itertools import chain
+from itertools import chain, islice
 import json
 
 import bson
-from django.db.models import Prefetch
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
 from formencode.validators import Int, StringBool
+from piston3.emitters import JSONEmitter
+from piston3.handler import typemapper
 from piston3.utils import rc
 
 from maasserver.api.support import (
@@ -24,6 +27,7 @@ from maasserver.api.support import (
     AnonymousOperationsHandler,
     operation,
     OperationsHandler,
+    StreamingOperationsResponse,
 )
 from maasserver.api.utils import (
     get_mandatory_param,
@@ -182,6 +186,47 @@ NODES_PREFETCH = [
     "numanode_set",
 ]
 
+# The fields that need each of the relations in `NODES_PREFETCH`, keyed by
+# the first component of the lookup. Relations that none of the requested
+# fields need are not prefetched when listing a selection of fields.
+NODES_PREFETCH_FIELDS = {
+    "domain": {"domain", "fqdn", "ip_addresses"},
+    "ownerdata_set": {"owner_data"},
+    "special_filesystems": {"special_filesystems"},
+    "gateway_link_ipv4": {"default_gateways"},
+    "gateway_link_ipv6": {"default_gateways"},
+    "blockdevice_set": {
+        "bcaches",
+        "blockdevice_set",
+        "boot_disk",
+        "cache_sets",
+        "iscsiblockdevice_set",
+        "physicalblockdevice_set",
+        "raids",
+        "storage",
+        "virtualblockdevice_set",
+        "volume_groups",
+    },
+    "boot_interface": {"boot_interface"},
+    "interface_set": {
+        "boot_interface",
+        "default_gateways",
+        "interface_set",
+        "ip_addresses",
+    },
+    "tags": {"tag_names"},
+    "nodemetadata_set": {"hardware_info"},
+    "numanode_set": {"numanode_set"},
+}
+
+# Nodes are fetched from a server-side cursor in batches of this size when
+# the listing is streamed.
+NODES_STREAM_BATCH_SIZE = 200
+
+# Query parameters that control how nodes are listed, as opposed to which
+# nodes are listed.
+NODES_LISTING_PARAMS = ("limit", "after", "fields")
+
 
 def store_node_power_parameters(node, request):
     """Store power parameters in request.
@@ -731,6 +776,119 @@ class AnonNodesHandler(AnonymousOperationsHandler):
         return ("nodes_handler", [])
 
 
+def get_field_name(field):
+    """Return the name of a handler field, which may be a nested tuple."""
+    return field[0] if isinstance(field, tuple) else field
+
+
+def get_lookup_root(prefetch):
+    """Return the first relation in a lookup from `NODES_PREFETCH`."""
+    if isinstance(prefetch, Prefetch):
+        prefetch = prefetch.prefetch_through
+    return prefetch.split("__")[0]
+
+
+def get_nodes_prefetch(field_names=None):
+    """Return the prefetches needed to emit `field_names` of nodes.
+
+    All of `NODES_PREFETCH` is returned when `field_names` is `None`.
+    """
+    if field_names is None:
+        return list(NODES_PREFETCH)
+    return [
+        prefetch
+        for prefetch in NODES_PREFETCH
+        if not NODES_PREFETCH_FIELDS[get_lookup_root(prefetch)].isdisjoint(
+            field_names
+        )
+    ]
+
+
+def set_node_parents(node, relations):
+    """Set the node on the node's prefetched `relations`.
+
+    This means no extra queries are needed to get back to the node.
+    """
+    if "interface_set" in relations:
+        for interface in node.interface_set.all():
+            interface.node = node
+    if "blockdevice_set" in relations:
+        for block_device in node.blockdevice_set.all():
+            block_device.node = node
+
+
+class FieldsHandler:
+    """Stand-in for a handler that emits only some of its fields.
+
+    Piston emits models with the fields of the handler registered for them
+    in `typemapper`, regardless of the fields given to the emitter, so this
+    takes the place of that handler.
+    """
+
+    def __init__(self, handler, fields):
+        self.handler = handler
+        self.fields = fields
+
+    def __getattr__(self, name):
+        return getattr(self.handler, name)
+
+
+def get_fields_typemapper(model, field_names):
+    """Return a copy of `typemapper` that emits `field_names` of `model`.
+
+    :raise MAASAPIValidationError: If any of `field_names` are not emitted
+        for `model` by its handler.
+    """
+    mapper = {}
+    for handler, (handler_model, anonymous) in typemapper.items():
+        if handler_model is model and not anonymous:
+            known = {get_field_name(field) for field in handler.fields}
+            unknown = set(field_names).difference(known)
+            if unknown:
+                raise MAASAPIValidationError(
+                    {
+                        "fields": "Unknown fields: %s"
+                        % ", ".join(sorted(unknown))
+                    }
+                )
+            handler = FieldsHandler(
+                handler,
+                tuple(
+                    field
+                    for field in handler.fields
+                    if get_field_name(field) in field_names
+                ),
+            )
+        mapper[handler] = (handler_model, anonymous)
+    return mapper
+
+
+def stream_nodes(request, nodes, handler, mapper, prefetches):
+    """Yield `nodes` as a JSON list, as emitted by `handler`.
+
+    Nodes are read from a server-side cursor and `prefetches` are done a
+    batch at a time. Streaming responses are not run within the request's
+    transaction, so this opens its own.
+    """
+    relations = {get_lookup_root(prefetch) for prefetch in prefetches}
+    yield "["
+    separator = ""
+    with transaction.atomic():
+        rows = nodes.iterator()
+        batch = list(islice(rows, NODES_STREAM_BATCH_SIZE))
+        while len(batch) != 0:
+            prefetch_related_objects(batch, *prefetches)
+            for node in batch:
+                set_node_parents(node, relations)
+                # Without fields of its own, the emitter takes them from the
+                # handler that `mapper` has for the node.
+                emitter = JSONEmitter(node, mapper, handler, (), False)
+                yield separator + emitter.render(request)
+                separator = ","
+            batch = list(islice(rows, NODES_STREAM_BATCH_SIZE))
+    yield "]"
+
+
 class NodesHandler(OperationsHandler):
     """Manage the collection of all the nodes in the MAAS."""
 
@@ -746,6 +904,9 @@ class NodesHandler(OperationsHandler):
 
         Nodes are sorted by id (i.e. most recent last) and grouped by type.
 
+        Listing many nodes at once can be slow. Use ``limit`` and ``after`` to
+        page through them, and ``fields`` to only include what is needed.
+
         @param (string) "hostname" [required=false] Only nodes relating to the
         node with the matching hostname will be returned. This can be specified
         multiple times to see multiple nodes.
@@ -812,6 +973,18 @@ class NodesHandler(OperationsHandler):
         @param (string) "not_pod_type": [required=false] Only nodes that don't
         belong a pod of the specified type will be returned.
 
+        @param (int) "limit" [required=false] Only return up to this many
+        nodes. Not available when listing all nodes.
+
+        @param (string) "after" [required=false] Only return nodes after the
+        node with this system id, e.g. the last node of the previous page.
+        Not available when listing all nodes.
+
+        @param (string) "fields" [required=false] Only include these fields
+        of each node. This can be specified multiple times or as a
+        comma-separated list. The system_id is always included. Not
+        available when listing all nodes.
+
         @success (http-status-code) "200" 200
 
         @success (json) "success_json" A JSON object containing a list of node
@@ -830,36 +1003,91 @@ class NodesHandler(OperationsHandler):
                 RegionControllersHandler,
             )
 
-            racks = RackControllersHandler().read(request).order_by("id")
+            racks = (
+                RackControllersHandler()
+                ._read_nodes(request, request.GET)
+                .order_by("id")
+            )
             nodes = list(
                 chain(
-                    DevicesHandler().read(request).order_by("id"),
-                    MachinesHandler().read(request).order_by("id"),
+                    DevicesHandler()
+                    ._read_nodes(request, request.GET)
+                    .order_by("id"),
+                    MachinesHandler()
+                    ._read_nodes(request, request.GET)
+                    .order_by("id"),
                     racks,
                     RegionControllersHandler()
-                    .read(request)
+                    ._read_nodes(request, request.GET)
                     .exclude(id__in=racks)
                     .order_by("id"),
                 )
             )
             return nodes
-        else:
-            form = ReadNodesForm(data=request.GET)
-            if not form.is_valid():
-                raise MAASAPIValidationError(form.errors)
-            nodes = self.base_model.objects.get_nodes(
-                request.user, NodePermission.view
+
+        data = request.GET.copy()
+        limit = get_optional_param(data, "limit", validator=Int(min=1))
+        after = get_optional_param(data, "after")
+        field_names = get_optional_list(data, "fields")
+        if limit is None and after is None and field_names is None:
+            return self._read_nodes(request, data)
+        for param in NODES_LISTING_PARAMS:
+            data.pop(param, None)
+
+        nodes = self._filter_nodes(request, data).order_by("id")
+        if after is not None:
+            after_id = (
+                Node.objects.filter(system_id=after)
+                .values_list("id", flat=True)
+                .first()
             )
-            nodes, _, _ = form.filter_nodes(nodes)
-            nodes = nodes.select_related(*NODES_SELECT_RELATED)
-            nodes = prefetch_queryset(nodes, NODES_PREFETCH).order_by("id")
-            # Set related node parents so no extra queries are needed.
-            for node in nodes:
-                for interface in node.interface_set.all():
-                    interface.node = node
-                for block_device in node.blockdevice_set.all():
-                    block_device.node = node
-            return nodes
+            if after_id is None:
+                raise MAASAPIValidationError(
+                    {"after": "No node with system_id %s." % after}
+                )
+            nodes = nodes.filter(id__gt=after_id)
+        if limit is not None:
+            nodes = nodes[:limit]
+        if field_names is None:
+            mapper = typemapper
+        else:
+            # Each field can be given separately or comma-separated, and the
+            # system_id is always included so that the next page can be
+            # requested after the last node.
+            field_names = {
+                name.strip()
+                for names in field_names
+                for name in names.split(",")
+                if name.strip() != ""
+            }
+            field_names.add("system_id")
+            mapper = get_fields_typemapper(self.base_model, field_names)
+        return StreamingOperationsResponse(
+            stream_nodes(
+                request, nodes, self, mapper, get_nodes_prefetch(field_names)
+            ),
+            content_type="application/json; charset=utf-8",
+        )
+
+    def _filter_nodes(self, request, data):
+        """Return the nodes visible to the user, filtered by `data`."""
+        form = ReadNodesForm(data=data)
+        if not form.is_valid():
+            raise MAASAPIValidationError(form.errors)
+        nodes = self.base_model.objects.get_nodes(
+            request.user, NodePermission.view
+        )
+        nodes, _, _ = form.filter_nodes(nodes)
+        return nodes.select_related(*NODES_SELECT_RELATED)
+
+    def _read_nodes(self, request, data):
+        """Return every node visible to the user, filtered by `data`."""
+        nodes = self._filter_nodes(request, data)
+        nodes = prefetch_queryset(nodes, NODES_PREFETCH).order_by("id")
+        # Set related node parents so no extra queries are needed.
+        for node in nodes:
+            set_node_parents(node, {"interface_set", "blockdevice_set"})
+        return nodes
 
     @operation(idempotent=True)
     def is_registered(self, request):
@@ -10,13 +10,15 @@ __all__ = [
     "ModelOperationsHandler",
     "operation",
     "OperationsHandler",
+    "StreamingOperationsResponse",
 ]
 
 from abc import ABCMeta, abstractproperty
 from functools import wraps
 
 from django.core.exceptions import PermissionDenied
-from django.http import Http404
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.http.response import HttpResponseBase
 from django.shortcuts import get_object_or_404
 from piston3.authentication import NoAuthentication
 from piston3.emitters import Emitter
@@ -82,6 +84,21 @@ class OperationsResource(Resource):
         )
 
 
+class StreamingOperationsResponse(StreamingHttpResponse, HttpResponse):
+    """A streaming response that operations can return.
+
+    Piston only passes responses through untouched when they are instances
+    of `HttpResponse`; anything else is handed to an emitter. This is also
+    an `HttpResponse` so that Piston leaves it alone, but it behaves as a
+    `StreamingHttpResponse` everywhere else.
+    """
+
+    def __init__(self, streaming_content=(), *args, **kwargs):
+        # Skip `HttpResponse.__init__`, which would try to set `content`.
+        HttpResponseBase.__init__(self, *args, **kwargs)
+        self.streaming_content = streaming_content
+
+
 class RestrictedResource(OperationsResource):
     """A resource that's restricted to active users."""
 
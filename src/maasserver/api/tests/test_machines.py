@@ -48,6 +48,7 @@ from maasserver.utils.django_urls import reverse
 from maasserver.utils.orm import reload_object
 from maastesting.djangotestcase import count_queries
 from maastesting.matchers import (
+    MockCalledOnce,
     MockCalledOnceWith,
     MockCalledWith,
     MockNotCalled,
@@ -479,6 +480,116 @@ class TestMachinesAPI(APITestCase.ForUser):
             extract_system_ids(parsed_result),
         )
 
+    def get_streamed_result(self, response):
+        self.assertEqual(http.client.OK, response.status_code)
+        self.assertTrue(response.streaming)
+        return json.loads(
+            b"".join(response.streaming_content).decode(
+                settings.DEFAULT_CHARSET
+            )
+        )
+
+    def test_GET_with_limit_and_after_pages_by_id(self):
+        machines = [factory.make_Node() for _ in range(5)]
+        parsed_result = self.get_streamed_result(
+            self.client.get(reverse("machines_handler"), {"limit": 2})
+        )
+        self.assertSequenceEqual(
+            [machine.system_id for machine in machines[:2]],
+            extract_system_ids(parsed_result),
+        )
+        parsed_result = self.get_streamed_result(
+            self.client.get(
+                reverse("machines_handler"),
+                {"limit": 2, "after": machines[2].system_id},
+            )
+        )
+        self.assertSequenceEqual(
+            [machine.system_id for machine in machines[3:]],
+            extract_system_ids(parsed_result),
+        )
+
+    def test_GET_with_limit_streams_same_machines_as_unpaginated(self):
+        for _ in range(3):
+            factory.make_Node_with_Interface_on_Subnet()
+        response = self.client.get(reverse("machines_handler"))
+        expected = json.loads(
+            response.content.decode(settings.DEFAULT_CHARSET)
+        )
+        parsed_result = self.get_streamed_result(
+            self.client.get(reverse("machines_handler"), {"limit": 10})
+        )
+        self.assertEqual(expected, parsed_result)
+
+    def test_GET_with_limit_applies_filters(self):
+        zone = factory.make_Zone()
+        machine = factory.make_Node(zone=zone)
+        factory.make_Node()
+        parsed_result = self.get_streamed_result(
+            self.client.get(
+                reverse("machines_handler"), {"limit": 10, "zone": zone.name}
+            )
+        )
+        self.assertEqual(
+            [machine.system_id], extract_system_ids(parsed_result)
+        )
+
+    def test_GET_with_unknown_after_returns_bad_request(self):
+        response = self.client.get(
+            reverse("machines_handler"), {"after": factory.make_name("id")}
+        )
+        self.assertEqual(http.client.BAD_REQUEST, response.status_code)
+
+    def test_GET_with_fields_only_includes_fields(self):
+        machine = factory.make_Node()
+        parsed_result = self.get_streamed_result(
+            self.client.get(
+                reverse("machines_handler"),
+                {"fields": ["hostname,status_name", "tag_names"]},
+            )
+        )
+        self.assertEqual(
+            [
+                {
+                    "system_id": machine.system_id,
+                    "hostname": machine.hostname,
+                    "status_name": machine.status_name,
+                    "tag_names": [],
+                    "resource_uri": reverse(
+                        "machine_handler", args=[machine.system_id]
+                    ),
+                }
+            ],
+            parsed_result,
+        )
+
+    def test_GET_with_fields_rejects_unknown_fields(self):
+        response = self.client.get(
+            reverse("machines_handler"), {"fields": "hostname,bogus"}
+        )
+        self.assertEqual(http.client.BAD_REQUEST, response.status_code)
+
+    def test_GET_with_fields_skips_unneeded_prefetches(self):
+        # Patch middleware so it does not affect query counting.
+        self.patch(
+            middleware.ExternalComponentsMiddleware,
+            "_check_rack_controller_connectivity",
+        )
+        for _ in range(3):
+            node = factory.make_Node_with_Interface_on_Subnet()
+            factory.make_VirtualBlockDevice(node=node)
+
+        def list_machines(**params):
+            response = self.client.get(reverse("machines_handler"), params)
+            return self.get_streamed_result(response)
+
+        num_queries_all, _ = count_queries(list_machines, limit=10)
+        num_queries_fields, parsed_result = count_queries(
+            list_machines, limit=10, fields="hostname"
+        )
+        self.assertEqual(3, len(parsed_result))
+        self.assertLess(num_queries_fields, num_queries_all)
+
     def test_GET_with_id_returns_matching_machines(self):
         # The "read" operation takes optional "id" parameters.  Only
         # machines with matching ids will be returned.
@@ -1446,19 +1557,128 @@ class TestMachinesAPI(APITestCase.ForUser):
         machine = Machine.objects.get(system_id=machine.system_id)
         self.assertEqual(self.user, machine.owner)
 
-    def test_POST_allocate_uses_machine_acquire_lock(self):
-        # The "allocate" operation allocates the machine it returns.
-        available_status = NODE_STATUS.READY
-        factory.make_Node(
-            status=available_status, owner=None, with_boot_disk=True
+    def test_POST_allocate_claims_machine_without_acquire_lock(self):
+        # Existing machines are claimed with row locks, so allocations
+        # don't serialise on the global lock.
+        machine = factory.make_Node(
+            status=NODE_STATUS.READY, owner=None, with_boot_disk=True
         )
         machine_acquire = self.patch(machines_module.locks, "node_acquire")
+        claim = self.patch(Machine.objects, "claim_machines_for_acquisition")
+        claim.return_value = [machine]
+        response = self.client.post(
+            reverse("machines_handler"), {"op": "allocate"}
+        )
+        self.assertEqual(http.client.OK, response.status_code)
+        self.assertThat(claim, MockCalledOnce())
+        self.assertThat(machine_acquire.__enter__, MockNotCalled())
+
+    def test_POST_allocate_uses_machine_acquire_lock_to_compose(self):
+        factory.make_Pod(architectures=["amd64/generic"])
+        machine = factory.make_Node(
+            status=NODE_STATUS.READY, owner=None, with_boot_disk=True
+        )
+        mock_filter_nodes = self.patch(AcquireNodeForm, "filter_nodes")
+        mock_filter_nodes.return_value = Node.objects.none(), {}, {}
+        mock_compose = self.patch(ComposeMachineForPodsForm, "compose")
+        mock_compose.return_value = machine
+        machine_acquire = self.patch(machines_module.locks, "node_acquire")
         self.client.post(reverse("machines_handler"), {"op": "allocate"})
         self.assertThat(machine_acquire.__enter__, MockCalledOnceWith())
         self.assertThat(
             machine_acquire.__exit__, MockCalledOnceWith(None, None, None)
         )
 
+    def test_POST_allocate_dry_run_does_not_claim_machine(self):
+        factory.make_Node(
+            status=NODE_STATUS.READY, owner=None, with_boot_disk=True
+        )
+        claim = self.patch(Machine.objects, "claim_machines_for_acquisition")
+        response = self.client.post(
+            reverse("machines_handler"), {"op": "allocate", "dry_run": True}
+        )
+        self.assertEqual(http.client.OK, response.status_code)
+        self.assertThat(claim, MockNotCalled())
+
+    def test_POST_allocate_many_allocates_count_machines(self):
+        machines = [
+            factory.make_Node(
+                status=NODE_STATUS.READY, owner=None, with_boot_disk=True
+            )
+            for _ in range(3)
+        ]
+        response = self.client.post(
+            reverse("machines_handler"), {"op": "allocate_many", "count": 2}
+        )
+        self.assertEqual(http.client.OK, response.status_code)
+        parsed_result = json.loads(
+            response.content.decode(settings.DEFAULT_CHARSET)
+        )
+        self.assertEqual(2, len(parsed_result))
+        allocated = Machine.objects.filter(owner=self.user)
+        self.assertItemsEqual(
+            [machine["system_id"] for machine in parsed_result],
+            [machine.system_id for machine in allocated],
+        )
+        self.assertTrue(
+            set(allocated).issubset(machines), "Allocated unknown machines."
+        )
+
+    def test_POST_allocate_many_allocates_nothing_if_too_few_match(self):
+        factory.make_Node(
+            status=NODE_STATUS.READY, owner=None, with_boot_disk=True
+        )
+        response = self.client.post(
+            reverse("machines_handler"), {"op": "allocate_many", "count": 2}
+        )
+        self.assertEqual(http.client.CONFLICT, response.status_code)
+        self.assertIn(
+            "Only 1 of 2 machines are available.",
+            response.content.decode(settings.DEFAULT_CHARSET),
+        )
+        self.assertFalse(Machine.objects.filter(owner=self.user).exists())
+
+    def test_POST_allocate_many_dry_run_does_not_allocate(self):
+        factory.make_Node(
+            status=NODE_STATUS.READY, owner=None, with_boot_disk=True
+        )
+        response = self.client.post(
+            reverse("machines_handler"),
+            {"op": "allocate_many", "count": 1, "dry_run": True},
+        )
+        self.assertEqual(http.client.OK, response.status_code)
+        self.assertFalse(Machine.objects.filter(owner=self.user).exists())
+
+    def test_POST_allocate_many_requires_count(self):
+        response = self.client.post(
+            reverse("machines_handler"), {"op": "allocate_many"}
+        )
+        self.assertEqual(http.client.BAD_REQUEST, response.status_code)
+
+    def test_POST_allocate_many_applies_constraints(self):
+        zone = factory.make_Zone()
+        matching = factory.make_Node(
+            status=NODE_STATUS.READY,
+            owner=None,
+            zone=zone,
+            with_boot_disk=True,
+        )
+        factory.make_Node(
+            status=NODE_STATUS.READY, owner=None, with_boot_disk=True
+        )
+        response = self.client.post(
+            reverse("machines_handler"),
+            {"op": "allocate_many", "count": 1, "zone": zone.name},
+        )
+        self.assertEqual(http.client.OK, response.status_code)
+        parsed_result = json.loads(
+            response.content.decode(settings.DEFAULT_CHARSET)
+        )
+        self.assertEqual(
+            [matching.system_id],
+            [machine["system_id"] for machine in parsed_result],
+        )
+
     def test_POST_allocate_sets_agent_name(self):
         available_status = NODE_STATUS.READY
         machine = factory.make_Node(
@@ -3,7 +3,7 @@
 
 """DNS management module."""
 
-__all__ = ["dns_force_reload", "dns_update_all_zones"]
+__all__ = ["dns_force_reload", "dns_update_all_zones", "published_zones"]
 
 from collections import defaultdict
 
@@ -25,6 +25,7 @@ from maasserver.models.subnet import Subnet
 from provisioningserver.dns.actions import (
     bind_reload,
     bind_reload_with_retries,
+    bind_reload_zones,
     bind_write_configuration,
     bind_write_options,
     bind_write_zones,
@@ -33,6 +34,65 @@ from provisioningserver.logger import get_maas_logger
 
 maaslog = get_maas_logger("dns")
 
+# The source of the publication made by `dns_force_reload`.
+FORCE_RELOAD_SOURCE = "Force reload"
+
+
+class PublishedZones:
+    """What this process last published to BIND.
+
+    `dns_update_all_zones` uses this to publish incrementally: only the
+    zones whose records have changed since are rewritten and reloaded.
+
+    :ivar publication_id: The ID of the `DNSPublication` that was current
+        when the zones were published.
+    :ivar configuration: Everything else that was published: the names of
+        the zones, and the options and trusted networks. If this changes,
+        BIND's configuration must be rewritten, so all zones are published.
+    :ivar fingerprints: A dict mapping each zone name to a fingerprint of
+        its records.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """Forget what was published, so the next update is a full one."""
+        self.publication_id = None
+        self.configuration = None
+        self.fingerprints = {}
+
+    def update(self, publication_id, configuration, fingerprints):
+        self.publication_id = publication_id
+        self.configuration = configuration
+        self.fingerprints = fingerprints
+
+    def get_changed_zones(self, publication_id, configuration, fingerprints):
+        """Return the names of the zones that must be published.
+
+        :return: A list of zone names, or `None` if everything must be
+            published. That's the case when nothing has been published yet,
+            BIND's configuration has changed, or a reload has been forced
+            since the last publication.
+        """
+        if self.publication_id is None:
+            return None
+        if configuration != self.configuration:
+            return None
+        forced = DNSPublication.objects.filter(
+            id__gt=self.publication_id, source=FORCE_RELOAD_SOURCE
+        ).exists()
+        if forced:
+            return None
+        return sorted(
+            zone_name
+            for zone_name, fingerprint in fingerprints.items()
+            if self.fingerprints.get(zone_name) != fingerprint
+        )
+
+
+published_zones = PublishedZones()
+
 
 def current_zone_serial():
     return "%0.10d" % DNSPublication.objects.get_most_recent().serial
@@ -45,10 +105,12 @@ def is_dns_enabled():
 
 def dns_force_reload():
     """Force the DNS to be regenerated."""
-    DNSPublication(source="Force reload").save()
+    DNSPublication(source=FORCE_RELOAD_SOURCE).save()
 
 
-def dns_update_all_zones(reload_retry=False, reload_timeout=2):
+def dns_update_all_zones(
+    reload_retry=False, reload_timeout=2, incremental=False
+):
     """Update all zone files for all domains.
 
     Serving these zone files means updating BIND's configuration to include
@@ -57,6 +119,12 @@ def dns_update_all_zones(reload_retry=False, reload_timeout=2):
     :param reload_retry: Should the DNS server reload be retried in case
         of failure? Defaults to `False`.
     :type reload_retry: bool
+    :param incremental: Only rewrite and reload the zones that changed since
+        this process last published them, if that's possible. See
+        `PublishedZones`. Defaults to `False`.
+    :type incremental: bool
+    :return: A tuple of the serial, whether BIND was reloaded, and the names
+        of the domains that were published with that serial.
     """
     if not is_dns_enabled():
         return
@@ -72,6 +140,70 @@ def dns_update_all_zones(reload_retry=False, reload_timeout=2):
         serial,
         internal_domains=[get_internal_domain()],
     ).as_list()
+    upstream_dns = get_upstream_dns()
+    dnssec_validation = get_dnssec_validation()
+    trusted_networks = get_trusted_networks()
+
+    fingerprints = {}
+    for zone in zones:
+        fingerprints.update(zone.get_zone_fingerprints())
+    configuration = (
+        sorted(fingerprints),
+        upstream_dns,
+        dnssec_validation,
+        sorted(trusted_networks),
+    )
+    publication_id = DNSPublication.objects.get_most_recent().id
+    if incremental:
+        changed_zones = published_zones.get_changed_zones(
+            publication_id, configuration, fingerprints
+        )
+    else:
+        changed_zones = None
+
+    if changed_zones is None:
+        reloaded = _dns_publish_all_zones(
+            zones,
+            upstream_dns,
+            dnssec_validation,
+            trusted_networks,
+            reload_retry,
+            reload_timeout,
+        )
+        domain_names = [domain.name for domain in domains]
+    else:
+        # Only the records in some zones have changed. Zones that have not
+        # changed are left alone, still with the serial they were last
+        # published with.
+        bind_write_zones(zones, zone_names=changed_zones)
+        if len(changed_zones) > 0:
+            reloaded = bind_reload_zones(changed_zones, timeout=reload_timeout)
+        else:
+            reloaded = True
+        domain_names = [
+            domain.name for domain in domains if domain.name in changed_zones
+        ]
+
+    if reloaded:
+        published_zones.update(publication_id, configuration, fingerprints)
+    else:
+        # It's not known what BIND has loaded, so publish everything next
+        # time.
+        published_zones.clear()
+
+    # Return the current serial and list of domain names.
+    return serial, reloaded, domain_names
+
+
+def _dns_publish_all_zones(
+    zones,
+    upstream_dns,
+    dnssec_validation,
+    trusted_networks,
+    reload_retry,
+    reload_timeout,
+):
+    """Write every zone and BIND's configuration, then reload BIND."""
     bind_write_zones(zones)
 
     # We should not be calling bind_write_options() here; call-sites should be
@@ -80,27 +212,23 @@ def dns_update_all_zones(reload_retry=False, reload_timeout=2):
     # some that call it for this side-effect alone. At present all it does is
     # set the upstream DNS servers, nothing to do with serving zones at all!
     bind_write_options(
-        upstream_dns=get_upstream_dns(),
-        dnssec_validation=get_dnssec_validation(),
+        upstream_dns=upstream_dns, dnssec_validation=dnssec_validation
     )
 
     # Nor should we be rewriting ACLs that are related only to allowing
     # recursive queries to the upstream DNS servers. Again, this is legacy,
     # where the "trusted" ACL ended up in the same configuration file as the
     # zone stanzas, and so both need to be rewritten at the same time.
-    bind_write_configuration(zones, trusted_networks=get_trusted_networks())
+    bind_write_configuration(zones, trusted_networks=trusted_networks)
 
     # Reloading with retries may be a legacy from Celery days, or it may be
     # necessary to recover from races during start-up. We're not sure if it is
     # actually needed but it seems safer to maintain this behaviour until we
     # have a better understanding.
     if reload_retry:
-        reloaded = bind_reload_with_retries(timeout=reload_timeout)
+        return bind_reload_with_retries(timeout=reload_timeout)
     else:
-        reloaded = bind_reload(timeout=reload_timeout)
-
-    # Return the current serial and list of domain names.
-    return serial, reloaded, [domain.name for domain in domains]
+        return bind_reload(timeout=reload_timeout)
 
 
 def get_upstream_dns():
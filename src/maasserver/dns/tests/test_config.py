@@ -33,6 +33,7 @@ from maasserver.dns.config import (
     get_trusted_acls,
     get_trusted_networks,
     get_upstream_dns,
+    published_zones,
 )
 from maasserver.dns.zonegenerator import InternalDomainResourseRecord
 from maasserver.enum import IPADDRESS_TYPE, NODE_STATUS
@@ -42,7 +43,11 @@ from maasserver.models.dnspublication import DNSPublication
 from maasserver.testing.config import RegionConfigurationFixture
 from maasserver.testing.factory import factory
 from maasserver.testing.testcase import MAASServerTestCase
-from maastesting.matchers import MockCalledOnceWith
+from maastesting.matchers import (
+    MockCalledOnce,
+    MockCalledOnceWith,
+    MockNotCalled,
+)
 from provisioningserver.dns.commands import get_named_conf, setup_dns
 from provisioningserver.dns.config import compose_config_path, DNSConfig
 from provisioningserver.dns.testing import (
@@ -406,6 +411,105 @@ class TestDNSConfigModifications(TestDNSServer):
         )
 
 
+class TestDNSIncrementalUpdates(TestDNSServer):
+    """Tests for `dns_update_all_zones` with `incremental=True`."""
+
+    def setUp(self):
+        super(TestDNSIncrementalUpdates, self).setUp()
+        self.patch(settings, "DNS_CONNECT", True)
+        published_zones.clear()
+        self.addCleanup(published_zones.clear)
+
+    def read_zone_file(self, zone_name):
+        with open(compose_config_path("zone.%s" % zone_name)) as fd:
+            return fd.read()
+
+    def test_publishes_everything_first(self):
+        node, static = self.create_node_with_static_ip()
+        bind_reload = self.patch_autospec(dns_config_module, "bind_reload")
+        bind_reload.return_value = True
+        serial, reloaded, domains = dns_update_all_zones(incremental=True)
+        self.assertThat(bind_reload, MockCalledOnceWith(timeout=2))
+        self.assertThat(domains, Contains(node.domain.name))
+
+    def test_publishes_only_changed_zones(self):
+        domain1 = factory.make_Domain()
+        domain2 = factory.make_Domain()
+        node1, static1 = self.create_node_with_static_ip(domain=domain1)
+        dns_update_all_zones(incremental=True)
+        self.assertDNSMatches(node1.hostname, domain1.name, static1.ip)
+        domain1_zone = self.read_zone_file(domain1.name)
+        bind_reload = self.patch_autospec(dns_config_module, "bind_reload")
+        node2, static2 = self.create_node_with_static_ip(
+            domain=domain2, subnet=static1.subnet
+        )
+        serial, reloaded, domains = dns_update_all_zones(incremental=True)
+        self.assertThat(reloaded, Is(True))
+        self.assertThat(domains, Equals([domain2.name]))
+        self.assertThat(bind_reload, MockNotCalled())
+        self.assertDNSMatches(node2.hostname, domain2.name, static2.ip)
+        # The zone that didn't change was not rewritten.
+        self.assertThat(
+            self.read_zone_file(domain1.name), Equals(domain1_zone)
+        )
+
+    def test_does_nothing_when_nothing_changed(self):
+        self.create_node_with_static_ip()
+        dns_update_all_zones(incremental=True)
+        bind_reload = self.patch_autospec(dns_config_module, "bind_reload")
+        bind_reload_zones = self.patch_autospec(
+            dns_config_module, "bind_reload_zones"
+        )
+        serial, reloaded, domains = dns_update_all_zones(incremental=True)
+        self.assertThat(reloaded, Is(True))
+        self.assertThat(domains, Equals([]))
+        self.assertThat(bind_reload, MockNotCalled())
+        self.assertThat(bind_reload_zones, MockNotCalled())
+
+    def test_publishes_everything_when_zones_added(self):
+        dns_update_all_zones(incremental=True)
+        bind_reload = self.patch_autospec(dns_config_module, "bind_reload")
+        bind_reload.return_value = True
+        domain = factory.make_Domain()
+        serial, reloaded, domains = dns_update_all_zones(incremental=True)
+        self.assertThat(bind_reload, MockCalledOnceWith(timeout=2))
+        self.assertThat(domains, Contains(domain.name))
+
+    def test_publishes_everything_when_options_change(self):
+        dns_update_all_zones(incremental=True)
+        bind_write_options = self.patch_autospec(
+            dns_config_module, "bind_write_options"
+        )
+        Config.objects.set_config("upstream_dns", factory.make_ipv4_address())
+        dns_update_all_zones(incremental=True)
+        self.assertThat(bind_write_options, MockCalledOnce())
+
+    def test_publishes_everything_after_forced_reload(self):
+        dns_update_all_zones(incremental=True)
+        bind_reload = self.patch_autospec(dns_config_module, "bind_reload")
+        bind_reload.return_value = True
+        dns_force_reload()
+        dns_update_all_zones(incremental=True)
+        self.assertThat(bind_reload, MockCalledOnceWith(timeout=2))
+
+    def test_publishes_everything_after_failed_reload(self):
+        node, static = self.create_node_with_static_ip()
+        dns_update_all_zones(incremental=True)
+        bind_reload_zones = self.patch_autospec(
+            dns_config_module, "bind_reload_zones"
+        )
+        bind_reload_zones.return_value = False
+        self.create_node_with_static_ip(
+            domain=node.domain, subnet=static.subnet
+        )
+        serial, reloaded, domains = dns_update_all_zones(incremental=True)
+        self.assertThat(reloaded, Is(False))
+        bind_reload = self.patch_autospec(dns_config_module, "bind_reload")
+        bind_reload.return_value = True
+        dns_update_all_zones(incremental=True)
+        self.assertThat(bind_reload, MockCalledOnceWith(timeout=2))
+
+
 class TestDNSDynamicIPAddresses(TestDNSServer):
     """Allocated nodes with IP addresses in the dynamic range get a DNS
     record.
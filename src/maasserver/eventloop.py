@@ -132,10 +132,24 @@ def make_RackControllerService(ipcWorker, postgresListener):
     return RackControllerService(ipcWorker, postgresListener)
 
 
+def make_BootConfigService(postgresListener):
+    from maasserver.regiondservices.boot_config import BootConfigService
+
+    return BootConfigService(postgresListener)
+
+
+def make_ExternalConfigService(postgresListener):
+    from maasserver.regiondservices.external_config import (
+        ExternalConfigService,
+    )
+
+    return ExternalConfigService(postgresListener)
+
+
 def make_StatusWorkerService(dbtasks):
     from metadataserver.api_twisted import StatusWorkerService
 
-    return StatusWorkerService(dbtasks)
+    return StatusWorkerService(dbtasks, batch_size=100)
 
 
 def make_ServiceMonitorService():
@@ -362,6 +376,16 @@ class RegionEventLoop:
             "factory": make_RackControllerService,
             "requires": ["ipc-worker", "postgres-listener-worker"],
         },
+        "boot-config": {
+            "only_on_master": False,
+            "factory": make_BootConfigService,
+            "requires": ["postgres-listener-worker"],
+        },
+        "external-config": {
+            "only_on_master": False,
+            "factory": make_ExternalConfigService,
+            "requires": ["postgres-listener-worker"],
+        },
         "ntp": {
             "only_on_master": True,
             "factory": make_NetworkTimeProtocolService,
@@ -5,7 +5,7 @@
 
 __all__ = ["PostgresListenerNotifyError", "PostgresListenerService"]
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from contextlib import closing
 from errno import ENOENT
 
@@ -25,6 +25,7 @@ from twisted.logger import Logger
 from twisted.python.failure import Failure
 from zope.interface import implementer
 
+from provisioningserver.prometheus.metrics import PROMETHEUS_METRICS
 from provisioningserver.utils.enum import map_enum
 from provisioningserver.utils.events import EventGroup
 from provisioningserver.utils.twisted import callOut, suppress, synchronous
@@ -51,6 +52,71 @@ class PostgresListenerUnregistrationError(Exception):
     """Error raised when unregistering a handler fails."""
 
 
+class PendingNotifications:
+    """Queue of pending non-system notifications.
+
+    Notifications are coalesced on their channel and payload (the primary
+    key of the object that changed) so that an object changed many times
+    before the listener gets to it is only handled once. A delete supersedes
+    any pending create or update, and an update never replaces a pending
+    create or delete. Iteration yields ``(channel, payload)`` in the order
+    the objects were first notified.
+    """
+
+    def __init__(self):
+        # (name, payload) -> [action, first seen, last seen]
+        self._pending = OrderedDict()
+        self.received = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __iter__(self):
+        for (name, payload), (action, _, _) in self._pending.items():
+            yield self._join(name, action), payload
+
+    def _join(self, name, action):
+        return "%s_%s" % (name, action) if action else name
+
+    def add(self, notification, now=0):
+        """Add a `(channel, payload)` notification to the queue."""
+        channel, payload = notification
+        self.received += 1
+        name, _, action = channel.partition("_")
+        key = name, payload
+        entry = self._pending.get(key)
+        if entry is None:
+            self._pending[key] = [action, now, now]
+            return
+        if action != ACTIONS.UPDATE or entry[0] not in (
+            ACTIONS.CREATE,
+            ACTIONS.DELETE,
+        ):
+            entry[0] = action
+        entry[2] = now
+
+    def pop(self, now=0, quiet=0, max_delay=0):
+        """Remove and return the notifications that are ready.
+
+        A notification is ready when it has not been notified again for
+        `quiet` seconds, or has been waiting for at least `max_delay`
+        seconds. With no `quiet` period every notification is ready.
+        """
+        ready = []
+        for key, (action, first_seen, last_seen) in list(
+            self._pending.items()
+        ):
+            if (
+                quiet <= 0
+                or now - last_seen >= quiet
+                or now - first_seen >= max_delay
+            ):
+                del self._pending[key]
+                name, payload = key
+                ready.append((self._join(name, action), payload))
+        return ready
+
+
 @implementer(interfaces.IReadDescriptor)
 class PostgresListenerService(Service, object):
     """Listens for NOTIFY messages from postgres.
@@ -68,6 +134,12 @@ class PostgresListenerService(Service, object):
         other times.
     :ivar disconnecting: a :class:`Deferred` while disconnecting, `None`
         at all other times.
+    :ivar coalesceWindow: seconds between handling batches of notifications;
+        notifications for the same object within a window are coalesced.
+    :ivar quietPeriod: seconds an object must go without a new notification
+        before it is handled, or 0 to handle everything each window.
+    :ivar maxDelay: the longest a notification is held back by
+        `quietPeriod`.
     """
 
     # Seconds to wait to handle new notifications. When the notifications set
@@ -75,14 +147,26 @@ class PostgresListenerService(Service, object):
     # notifications.
     HANDLE_NOTIFY_DELAY = 0.5
     CHANNEL_REGISTRAR_DELAY = 0.5
+    NOTIFY_QUIET_PERIOD = 0
+    NOTIFY_MAX_DELAY = 2.0
 
-    def __init__(self, alias="default"):
+    def __init__(self, alias="default", coalesceWindow=None, quietPeriod=None):
         self.alias = alias
         self.listeners = defaultdict(list)
+        self.batchListeners = set()
         self.autoReconnect = False
         self.connection = None
         self.connectionFileno = None
-        self.notifications = set()
+        self.coalesceWindow = (
+            self.HANDLE_NOTIFY_DELAY
+            if coalesceWindow is None
+            else coalesceWindow
+        )
+        self.quietPeriod = (
+            self.NOTIFY_QUIET_PERIOD if quietPeriod is None else quietPeriod
+        )
+        self.maxDelay = max(self.NOTIFY_MAX_DELAY, self.quietPeriod)
+        self.notifications = PendingNotifications()
         self.notifier = task.LoopingCall(self.handleNotifies)
         self.notifierDone = None
         self.connecting = None
@@ -146,9 +230,9 @@ class PostgresListenerService(Service, object):
             #
             self.loseConnection(Failure(error.ConnectionLost()))
         else:
-            # Add each notify to to the notifications set. This removes
-            # duplicate notifications when one entity in the database is
-            # updated multiple times in a short interval. Accumulating
+            # Add each notify to to the pending notifications. This
+            # coalesces notifications when one entity in the database is
+            # changed multiple times in a short interval. Accumulating
             # notifications and allowing the listener to pick them up in
             # batches is imperfect but good enough, and simple.
             notifies = self.connection.connection.notifies
@@ -175,7 +259,7 @@ class PostgresListenerService(Service, object):
                         # Place non-system messages into the queue to be
                         # processed.
                         self.notifications.add(
-                            (notify.channel, notify.payload)
+                            (notify.channel, notify.payload), reactor.seconds()
                         )
                 # Delete the contents of the connection's notifies list so
                 # that we don't process them a second time.
@@ -203,11 +287,16 @@ class PostgresListenerService(Service, object):
         finally:
             self.connectionFileno = None
 
-    def register(self, channel, handler):
+    def register(self, channel, handler, batch=False):
         """Register listening for notifications from a channel.
 
         When a notification is received for that `channel` the `handler` will
         be called with the action and object id.
+
+        :param batch: If True, `handler` is instead called once per action
+            with a list of the object ids notified in the same window, so
+            it can handle them all in one go. Not supported for system
+            channels.
         """
         handlers = self.listeners[channel]
         if self.isSystemChannel(channel) and len(handlers) > 0:
@@ -219,8 +308,14 @@ class PostgresListenerService(Service, object):
             raise PostgresListenerRegistrationError(
                 "System channel '%s' has already been registered." % channel
             )
+        elif batch and self.isSystemChannel(channel):
+            raise PostgresListenerRegistrationError(
+                "System channel '%s' cannot use batch delivery." % channel
+            )
         else:
             handlers.append(handler)
+            if batch:
+                self.batchListeners.add((channel, handler))
         self.runChannelRegistrar()
 
     def unregister(self, channel, handler):
@@ -235,6 +330,8 @@ class PostgresListenerService(Service, object):
         handlers = self.listeners[channel]
         if handler in handlers:
             handlers.remove(handler)
+            if handler not in handlers:
+                self.batchListeners.discard((channel, handler))
         else:
             raise PostgresListenerUnregistrationError(
                 "Handler is not registered on that channel '%s'." % channel
@@ -296,7 +393,7 @@ class PostgresListenerService(Service, object):
                 else:
                     return failure
 
-            def connect(interval=self.HANDLE_NOTIFY_DELAY):
+            def connect(interval=self.coalesceWindow):
                 d = deferToThread(self.startConnection)
                 d.addCallback(callOut, self.runChannelRegistrar)
                 d.addCallback(lambda result: self.channelRegistrarDone)
@@ -460,43 +557,96 @@ class PostgresListenerService(Service, object):
             return succeed(None)
 
     def handleNotifies(self, clock=reactor):
-        """Process all notify message in the notifications set."""
+        """Process the notifications that are ready to be handled."""
+        pending = len(self.notifications)
+        received = self.notifications.received
+        self.notifications.received = 0
+        notifications = self.notifications.pop(
+            clock.seconds(), self.quietPeriod, self.maxDelay
+        )
+        PROMETHEUS_METRICS.update(
+            "maas_listener_notify_queue_depth", "set", value=pending
+        )
+        PROMETHEUS_METRICS.update(
+            "maas_listener_notifies_received", "inc", value=received
+        )
+        PROMETHEUS_METRICS.update(
+            "maas_listener_notifies_dispatched",
+            "inc",
+            value=len(notifications),
+        )
 
-        def gen_notifications(notifications):
-            while len(notifications) != 0:
-                yield notifications.pop()
+        batches = OrderedDict()
+        for channel, payload in notifications:
+            batches.setdefault(channel, []).append(payload)
 
-        return task.coiterate(
-            self.handleNotify(notification, clock=clock)
-            for notification in gen_notifications(self.notifications)
-        )
+        def gen_handlers():
+            for channel, payloads in batches.items():
+                for payload in payloads:
+                    yield self.handleNotify((channel, payload), clock=clock)
+                yield self.handleNotifyBatch(channel, payloads, clock=clock)
 
-    def handleNotify(self, notification, clock=reactor):
-        """Process a notify message in the notifications set."""
-        channel, payload = notification
+        return task.coiterate(gen_handlers())
+
+    def _convertChannelOrLog(self, channel):
         try:
-            channel, action = self.convertChannel(channel)
+            return self.convertChannel(channel)
         except PostgresListenerNotifyError:
             # Log the error and continue processing the remaining
             # notifications.
             self.log.failure(
                 "Failed to convert channel {channel!r}.", channel=channel
             )
-        else:
-            defers = []
-            handlers = self.listeners[channel]
-            # XXX: There could be an arbitrary number of listeners. Should we
-            # limit concurrency here? Perhaps even do one at a time.
-            for handler in handlers:
-                d = defer.maybeDeferred(handler, action, payload)
-                d.addErrback(
-                    lambda failure: self.log.failure(
-                        "Failure while handling notification to {channel!r}: "
-                        "{payload!r}",
-                        failure,
-                        channel=channel,
-                        payload=payload,
-                    )
+            return None
+
+    def _callHandlers(self, handlers, action, payload, channel):
+        defers = []
+        # XXX: There could be an arbitrary number of listeners. Should we
+        # limit concurrency here? Perhaps even do one at a time.
+        for handler in handlers:
+            d = defer.maybeDeferred(handler, action, payload)
+            d.addErrback(
+                lambda failure: self.log.failure(
+                    "Failure while handling notification to {channel!r}: "
+                    "{payload!r}",
+                    failure,
+                    channel=channel,
+                    payload=payload,
                 )
-                defers.append(d)
-            return defer.DeferredList(defers)
+            )
+            defers.append(d)
+        return defer.DeferredList(defers)
+
+    def handleNotify(self, notification, clock=reactor):
+        """Process a notify message in the notifications set.
+
+        Handlers registered for batch delivery are skipped; they are called
+        from `handleNotifyBatch`.
+        """
+        channel, payload = notification
+        converted = self._convertChannelOrLog(channel)
+        if converted is not None:
+            channel, action = converted
+            handlers = [
+                handler
+                for handler in self.listeners[channel]
+                if (channel, handler) not in self.batchListeners
+            ]
+            return self._callHandlers(handlers, action, payload, channel)
+
+    def handleNotifyBatch(self, channel, payloads, clock=reactor):
+        """Process all `payloads` notified on `channel` in one window.
+
+        Only handlers registered for batch delivery are called.
+        """
+        if not self.batchListeners:
+            return None
+        converted = self._convertChannelOrLog(channel)
+        if converted is not None:
+            channel, action = converted
+            handlers = [
+                handler
+                for handler in self.listeners[channel]
+                if (channel, handler) in self.batchListeners
+            ]
+            return self._callHandlers(handlers, action, payloads, channel)
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+
+from django.db import migrations
+
+# Records changes to the rows each subnet's free IP ranges are calculated
+# from. It's maintained by triggers; see `maasserver.triggers.system`. Each
+# change counts one in `changes` and takes a new `generation` from the
+# sequence, so a generation from a transaction that was rolled back is never
+# seen again. There is deliberately no foreign key to the subnet, because
+# deleting a subnet deletes its addresses first, which records a change.
+table_create = """\
+CREATE SEQUENCE maasserver_subnetgeneration_seq;
+CREATE TABLE maasserver_subnetgeneration (
+    subnet_id integer PRIMARY KEY,
+    changes bigint NOT NULL,
+    generation bigint NOT NULL
+);
+"""
+
+table_drop = """\
+DROP TABLE IF EXISTS maasserver_subnetgeneration;
+DROP SEQUENCE IF EXISTS maasserver_subnetgeneration_seq;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("maasserver", "0207_notification_dismissable")]
+
+    operations = [migrations.RunSQL(table_create, table_drop)]
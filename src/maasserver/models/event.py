@@ -24,7 +24,7 @@ from maasserver.fields import MAASIPAddressField
 from maasserver.models.cleansave import CleanSave
 from maasserver.models.eventtype import EventType
 from maasserver.models.node import Node
-from maasserver.models.timestampedmodel import TimestampedModel
+from maasserver.models.timestampedmodel import now, TimestampedModel
 from maasserver.utils.dns import validate_hostname
 from provisioningserver.events import EVENT_DETAILS
 from provisioningserver.logger import get_maas_logger
@@ -89,6 +89,41 @@ class EventManager(Manager):
             created=created,
         )
 
+    def register_node_events(self, node, events):
+        """Register several events for `node` with a single insert.
+
+        :param events: a list of dicts of keyword arguments as accepted by
+            `register_event_and_event_type`, without `system_id`, `user`,
+            `ip_address`, `endpoint` or `user_agent`. Events are created in
+            the order given, so they keep that order in the event log.
+        """
+        event_types = {}
+        objs = []
+        for event in events:
+            type_name = event["type_name"]
+            if type_name not in event_types:
+                event_types[type_name] = EventType.objects.register(
+                    type_name,
+                    event.get("type_description", ""),
+                    event.get("type_level", logging.INFO),
+                )
+            created = event.get("created")
+            if created is None:
+                created = now()
+            objs.append(
+                Event(
+                    type=event_types[type_name],
+                    node=node,
+                    node_system_id=node.system_id,
+                    node_hostname=node.hostname,
+                    action=event.get("event_action", ""),
+                    description=event.get("event_description", ""),
+                    created=created,
+                    updated=created,
+                )
+            )
+        return self.bulk_create(objs)
+
     def create_node_event(
         self,
         system_id,
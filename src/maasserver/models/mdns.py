@@ -5,25 +5,37 @@
 
 __all__ = ["MDNS"]
 
+from collections import defaultdict
 
+from django.db import connection
 from django.db.models import (
     CASCADE,
     CharField,
     ForeignKey,
     IntegerField,
     Manager,
+    Q,
 )
 from netaddr import IPAddress
 
 from maasserver import DefaultMeta
 from maasserver.fields import MAASIPAddressField
 from maasserver.models.cleansave import CleanSave
-from maasserver.models.timestampedmodel import TimestampedModel
+from maasserver.models.timestampedmodel import now, TimestampedModel
 from maasserver.utils.orm import get_one, UniqueViolation
 from provisioningserver.logger import get_maas_logger
 
 maaslog = get_maas_logger("mDNS")
 
+# New entries are logged by `Interface.update_mdns_entry`, so the bulk path
+# logs them under the same tag.
+interface_maaslog = get_maas_logger("interface")
+
+
+def _ip_key(ip):
+    """Return a key to compare IP addresses by value."""
+    return None if ip is None else IPAddress(ip)
+
 
 class MDNSManager(Manager):
     """Manager for mDNS data."""
@@ -85,6 +97,142 @@ class MDNSManager(Manager):
         # a UniqueViolation so this operation can be retried.
         return get_one(query, exception_class=UniqueViolation)
 
+    def update_mdns_entries(self, entries):
+        """Record many mDNS entries at once.
+
+        This has the same effect as calling `Interface.update_mdns_entry` for
+        each entry in turn, and logs the same messages, but it reads the
+        existing bindings with one query and writes all the changes in bulk.
+
+        :param entries: A list of `(interface, avahi_json)` tuples, in the
+            order they were observed. Entries on interfaces with mDNS
+            discovery disabled are ignored.
+        """
+        entries = [
+            (interface, entry)
+            for interface, entry in entries
+            if interface.mdns_discovery_state is not False
+        ]
+        if len(entries) == 0:
+            return
+        interface_ids = {interface.id for interface, _ in entries}
+        hostnames = {entry["hostname"] for _, entry in entries}
+        ips = {entry["address"] for _, entry in entries}
+        # Maps interface IDs to the bindings on that interface that share a
+        # hostname or an IP address with one of the entries.
+        bindings = defaultdict(list)
+        existing = self.filter(interface_id__in=interface_ids).filter(
+            Q(hostname__in=hostnames) | Q(ip__in=ips)
+        )
+        for binding in existing.order_by("id"):
+            bindings[binding.interface_id].append(binding)
+        deleted, updated, created = set(), {}, []
+
+        def remove(binding):
+            current.remove(binding)
+            if binding.id is None:
+                created.remove(binding)
+            else:
+                deleted.add(binding.id)
+                updated.pop(binding.id, None)
+
+        for interface, entry in entries:
+            ip = entry["address"]
+            ip_key = _ip_key(ip)
+            hostname = entry["hostname"]
+            current = bindings[interface.id]
+            moved = False
+            # Check if this hostname was previously assigned to a different
+            # IP address, but don't move hostnames between address families.
+            for binding in list(current):
+                binding_ip_key = _ip_key(binding.ip)
+                if (
+                    binding.hostname == hostname
+                    and binding_ip_key != ip_key
+                    and binding_ip_key is not None
+                    and binding_ip_key.version == ip_key.version
+                ):
+                    maaslog.info(
+                        "%s: Hostname '%s' moved from %s to %s."
+                        % (
+                            interface.get_log_string(),
+                            hostname,
+                            binding.ip,
+                            ip,
+                        )
+                    )
+                    remove(binding)
+                    moved = True
+            # Check if this IP address had a different hostname assigned.
+            for binding in list(current):
+                if (
+                    _ip_key(binding.ip) == ip_key
+                    and binding.hostname != hostname
+                ):
+                    maaslog.info(
+                        "%s: Hostname for %s updated from '%s' to '%s'."
+                        % (
+                            interface.get_log_string(),
+                            ip,
+                            binding.hostname,
+                            hostname,
+                        )
+                    )
+                    remove(binding)
+                    moved = True
+            for binding in current:
+                if (
+                    binding.hostname == hostname
+                    and _ip_key(binding.ip) == ip_key
+                ):
+                    binding.count += 1
+                    if binding.id is not None:
+                        updated[binding.id] = binding
+                    break
+            else:
+                binding = self.model(
+                    interface=interface, ip=ip, hostname=hostname
+                )
+                current.append(binding)
+                created.append(binding)
+                # If we removed a previous entry, then we have already
+                # generated a log statement about this mDNS entry.
+                if not moved:
+                    interface_maaslog.info(
+                        "%s: New mDNS entry resolved: '%s' on %s."
+                        % (interface.get_log_string(), hostname, ip)
+                    )
+        if len(deleted) > 0:
+            self.filter(id__in=deleted).delete()
+        if len(updated) > 0:
+            self._update_counts(updated.values())
+        if len(created) > 0:
+            created_time = now()
+            for binding in created:
+                binding.created = binding.updated = created_time
+            self.bulk_create(created)
+
+    def _update_counts(self, bindings):
+        """Save the `count` of `bindings` with one query."""
+        updated = now()
+        values = []
+        for binding in bindings:
+            binding.updated = updated
+            values.extend((binding.id, binding.count))
+        rows = ", ".join(["(%s, %s)"] * (len(values) // 2))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """\
+                UPDATE maasserver_mdns AS mdns
+                SET "count" = seen.seen_count, updated = %s
+                FROM (VALUES {rows}) AS seen(id, seen_count)
+                WHERE mdns.id = seen.id
+                """.format(
+                    rows=rows
+                ),
+                [updated, *values],
+            )
+
 
 class MDNS(CleanSave, TimestampedModel):
     """Represents data gathered from mDNS-browse for a particular IP address.
@@ -5,20 +5,33 @@
 
 __all__ = ["Neighbour"]
 
+from collections import defaultdict
+
+from django.db import connection
 from django.db.models import CASCADE, ForeignKey, IntegerField, Manager
 from django.db.models.query import QuerySet
+from netaddr import EUI, IPAddress
 
 from maasserver import DefaultMeta
 from maasserver.fields import MAASIPAddressField, MACAddressField
 from maasserver.models.cleansave import CleanSave
 from maasserver.models.interface import Interface
-from maasserver.models.timestampedmodel import TimestampedModel
+from maasserver.models.timestampedmodel import now, TimestampedModel
 from maasserver.utils.orm import get_one, MAASQueriesMixin, UniqueViolation
 from provisioningserver.logger import get_maas_logger
 from provisioningserver.utils.network import get_mac_organization
 
 maaslog = get_maas_logger("neighbour")
 
+# New bindings are logged by `Interface.update_neighbour`, so the bulk path
+# logs them under the same tag.
+interface_maaslog = get_maas_logger("interface")
+
+
+def _mac_key(mac):
+    """Return a key to compare MAC addresses by value."""
+    return None if mac is None else EUI(str(mac))
+
 
 class NeighbourQueriesMixin(MAASQueriesMixin):
     def get_specifiers_q(self, specifiers, separator=":", **kwargs):
@@ -129,6 +142,125 @@ class NeighbourManager(Manager, NeighbourQueriesMixin):
         # a UniqueViolation so this operation can be retried.
         return get_one(query, exception_class=UniqueViolation)
 
+    def update_neighbours(self, observations):
+        """Record many neighbour observations at once.
+
+        This has the same effect as calling `Interface.update_neighbour` for
+        each observation in turn, and logs the same messages, but it reads
+        the existing bindings with one query and writes all the changes in
+        bulk.
+
+        :param observations: A list of `(interface, neighbour_json)` tuples,
+            in the order they were observed. Observations on interfaces with
+            neighbour discovery disabled are ignored.
+        """
+        observations = [
+            (interface, neighbour)
+            for interface, neighbour in observations
+            if interface.neighbour_discovery_state is not False
+        ]
+        if len(observations) == 0:
+            return
+        interface_ids = {interface.id for interface, _ in observations}
+        ips = {neighbour["ip"] for _, neighbour in observations}
+        # Maps (interface ID, IP, VID) to a dict of the bindings for that
+        # key, by MAC address.
+        bindings = defaultdict(dict)
+        existing = self.filter(interface_id__in=interface_ids, ip__in=ips)
+        for binding in existing.order_by("id"):
+            key = (binding.interface_id, IPAddress(binding.ip), binding.vid)
+            bindings[key][_mac_key(binding.mac_address)] = binding
+        deleted, updated, created = set(), {}, []
+        for interface, neighbour in observations:
+            ip = neighbour["ip"]
+            mac = neighbour["mac"]
+            vid = neighbour.get("vid", None)
+            current = bindings[(interface.id, IPAddress(ip), vid)]
+            mac_key = _mac_key(mac)
+            # Remove any bindings for this IP to other MACs.
+            moved = False
+            for other_mac_key, binding in list(current.items()):
+                if other_mac_key == mac_key:
+                    continue
+                maaslog.info(
+                    "%s: IP address %s%s moved from %s to %s"
+                    % (
+                        interface.get_log_string(),
+                        ip,
+                        self.get_vid_log_snippet(vid),
+                        binding.mac_address,
+                        mac,
+                    )
+                )
+                del current[other_mac_key]
+                if binding.id is None:
+                    created.remove(binding)
+                else:
+                    deleted.add(binding.id)
+                    updated.pop(binding.id, None)
+                moved = True
+            binding = current.get(mac_key)
+            if binding is None:
+                binding = self.model(
+                    interface=interface,
+                    ip=ip,
+                    vid=vid,
+                    mac_address=mac,
+                    time=neighbour["time"],
+                )
+                current[mac_key] = binding
+                created.append(binding)
+                # If we removed a previous binding, then we have already
+                # generated a log statement about this neighbour.
+                if not moved:
+                    interface_maaslog.info(
+                        "%s: New MAC, IP binding observed%s: %s, %s"
+                        % (
+                            interface.get_log_string(),
+                            self.get_vid_log_snippet(vid),
+                            mac,
+                            ip,
+                        )
+                    )
+            else:
+                binding.time = neighbour["time"]
+                binding.count += 1
+                if binding.id is not None:
+                    updated[binding.id] = binding
+        if len(deleted) > 0:
+            self.filter(id__in=deleted).delete()
+        if len(updated) > 0:
+            self._update_times_and_counts(updated.values())
+        if len(created) > 0:
+            created_time = now()
+            for binding in created:
+                binding.created = binding.updated = created_time
+            self.bulk_create(created)
+
+    def _update_times_and_counts(self, bindings):
+        """Save the `time` and `count` of `bindings` with one query."""
+        updated = now()
+        values = []
+        for binding in bindings:
+            binding.updated = updated
+            values.extend((binding.id, binding.time, binding.count))
+        rows = ", ".join(["(%s, %s, %s)"] * (len(values) // 3))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """\
+                UPDATE maasserver_neighbour AS neighbour
+                SET
+                    "time" = seen.seen_time,
+                    "count" = seen.seen_count,
+                    updated = %s
+                FROM (VALUES {rows}) AS seen(id, seen_time, seen_count)
+                WHERE neighbour.id = seen.id
+                """.format(
+                    rows=rows
+                ),
+                [updated, *values],
+            )
+
     def get_by_updated_with_related_nodes(self):
         """Returns a `QuerySet` of neighbours, while also selecting related
         interfaces and nodes.
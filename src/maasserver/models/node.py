@@ -613,6 +613,39 @@ class MachineManager(BaseNodeManager):
         available_machines = self.get_nodes(for_user, NodePermission.edit)
         return available_machines.filter(status=NODE_STATUS.READY)
 
+    def claim_machines_for_acquisition(self, candidates, count=1):
+        """Lock up to `count` of `candidates` that can still be acquired.
+
+        Candidates are claimed in order with ``SELECT ... FOR UPDATE SKIP
+        LOCKED``, so machines that a concurrent transaction has already
+        claimed are passed over instead of waited for. The locks are held
+        until the end of the transaction.
+
+        :param candidates: An ordered `QuerySet` of machines, usually from
+            `get_available_machines_for_acquisition`.
+        :return: A list of at most `count` machines, in candidate order.
+        """
+        # Filtering can join the same machine more than once.
+        candidate_ids = list(
+            OrderedDict.fromkeys(candidates.values_list("id", flat=True))
+        )
+        if len(candidate_ids) == 0:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """\
+                SELECT id FROM maasserver_node
+                WHERE id = ANY(%s) AND status = %s AND owner_id IS NULL
+                ORDER BY array_position(%s, id)
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+                """,
+                [candidate_ids, NODE_STATUS.READY, candidate_ids, count],
+            )
+            claimed_ids = [row[0] for row in cursor.fetchall()]
+        machines = self.in_bulk(claimed_ids)
+        return [machines[machine_id] for machine_id in claimed_ids]
+
 
 class DeviceManager(BaseNodeManager):
     """Devices are all the non-deployable nodes."""
@@ -1409,10 +1442,14 @@ class Node(CleanSave, TimestampedModel):
         else:
             return self.hostname
 
-    def reset_status_expires(self):
-        """Reset status_expires if set and in a monitored status."""
+    def reset_status_expires(self, node_timeout=None):
+        """Reset status_expires if set and in a monitored status.
+
+        :param node_timeout: The `node_timeout` config value, if the caller
+            already has it.
+        """
         if self.status_expires is not None:
-            minutes = get_node_timeout(self.status)
+            minutes = get_node_timeout(self.status, node_timeout=node_timeout)
             if minutes is not None:
                 self.status_expires = now() + timedelta(minutes=minutes)
 
@@ -3706,7 +3743,14 @@ class Node(CleanSave, TimestampedModel):
             status__in=SCRIPT_STATUS_RUNNING_OR_PENDING,
         )
         qs.update(status=script_result_status, updated=now())
+        self.set_failed_status(comment=comment, commit=commit)
 
+    def set_failed_status(self, comment=None, commit=True):
+        """Move this node into the failed status matching its status.
+
+        Unlike `mark_failed` no event is registered and the node's script
+        results are left as they are.
+        """
         new_status = get_failed_status(self.status)
         if new_status is not None:
             self.status = new_status
@@ -6740,18 +6784,26 @@ class Controller(Node):
             Neighbour data is gathered directly from the ARP monitoring process
             running on each rack interface.
         """
+        # Avoid circular imports.
+        from maasserver.models.neighbour import Neighbour
+
         # Determine which interfaces' neighbours need updating.
         interface_set = {neighbour["interface"] for neighbour in neighbours}
         interfaces = Interface.objects.get_interface_dict_for_node(
             self, names=interface_set, fetch_fabric_vlan=True
         )
+        observations = []
+        reported_vids = {}
         for neighbour in neighbours:
             interface = interfaces.get(neighbour["interface"], None)
             if interface is not None:
-                interface.update_neighbour(neighbour)
+                observations.append((interface, neighbour))
                 vid = neighbour.get("vid", None)
                 if vid is not None:
-                    interface.report_vid(vid)
+                    reported_vids[(interface.id, vid)] = interface
+        Neighbour.objects.update_neighbours(observations)
+        for (_, vid), interface in reported_vids.items():
+            interface.report_vid(vid)
 
     def report_mdns_entries(self, entries):
         """Update the mDNS entries on this controller.
@@ -6760,15 +6812,21 @@ class Controller(Node):
             entries. mDNS data is gathered from an `avahi-browse` process
             running on each rack interface.
         """
+        # Avoid circular imports.
+        from maasserver.models.mdns import MDNS
+
         # Determine which interfaces' entries need updating.
         interface_set = {entry["interface"] for entry in entries}
         interfaces = Interface.objects.get_interface_dict_for_node(
             self, names=interface_set
         )
-        for entry in entries:
-            interface = interfaces.get(entry["interface"], None)
-            if interface is not None:
-                interface.update_mdns_entry(entry)
+        MDNS.objects.update_mdns_entries(
+            [
+                (interfaces[entry["interface"]], entry)
+                for entry in entries
+                if entry["interface"] in interfaces
+            ]
+        )
 
     def get_discovery_state(self):
         """Returns the interface monitoring state for this Controller.
@@ -5,9 +5,13 @@
 
 __all__ = ["signals"]
 
-from django.db.models.signals import post_delete
+from django.db import connection
+from django.db.models.signals import post_delete, post_save
 
+from maasserver.models.bootresource import BootResource
 from maasserver.models.bootresourcefile import BootResourceFile
+from maasserver.models.bootresourceset import BootResourceSet
+from maasserver.models.bootsourcecache import BootSourceCache
 from maasserver.models.largefile import LargeFile
 from maasserver.utils.signals import SignalsManager
 
@@ -34,5 +38,28 @@ def delete_large_file(sender, instance, **kwargs):
 signals.watch(post_delete, delete_large_file, BootResourceFile)
 
 
+def notify_boot_resources_changed(sender, instance, **kwargs):
+    """Notify the regions that the usable boot resources may have changed.
+
+    Boot configurations cached by the regions depend on which boot
+    resources are complete, so they are dropped when this arrives. The
+    notification is only sent when the transaction commits, and repeats of
+    it within one transaction are sent once.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("NOTIFY sys_boot_resources;")
+
+
+for klass in [
+    BootResource,
+    BootResourceSet,
+    BootResourceFile,
+    BootSourceCache,
+    LargeFile,
+]:
+    signals.watch(post_save, notify_boot_resources_changed, klass)
+    signals.watch(post_delete, notify_boot_resources_changed, klass)
+
+
 # Enable all signals by default.
 signals.enable()
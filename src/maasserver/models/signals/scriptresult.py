@@ -21,30 +21,31 @@ from provisioningserver.events import EVENT_TYPES
 signals = SignalsManager()
 
 
-def emit_script_result_status_transition_event(
-    script_result, old_values, **kwargs
-):
-    """Send a status transition event."""
-    [old_status] = old_values
-
+def get_script_result_event_name(script_result):
+    """Return the name of `script_result` used in its events."""
     if script_result.physical_blockdevice and script_result.interface:
-        script_name = "%s on %s and %s" % (
+        return "%s on %s and %s" % (
             script_result.name,
             script_result.physical_blockdevice.name,
             script_result.interface.name,
         )
     elif script_result.physical_blockdevice:
-        script_name = "%s on %s" % (
+        return "%s on %s" % (
             script_result.name,
             script_result.physical_blockdevice.name,
         )
     elif script_result.interface:
-        script_name = "%s on %s" % (
-            script_result.name,
-            script_result.interface.name,
-        )
+        return "%s on %s" % (script_result.name, script_result.interface.name)
     else:
-        script_name = script_result.name
+        return script_result.name
+
+
+def emit_script_result_status_transition_event(
+    script_result, old_values, **kwargs
+):
+    """Send a status transition event."""
+    [old_status] = old_values
+    script_name = get_script_result_event_name(script_result)
 
     if (
         script_result.script_set.result_type == RESULT_TYPE.TESTING
@@ -1,14 +1,15 @@
 # Copyright 2019 Canonical Ltd.  This software is licensed under the
 # GNU Affero General Public License version 3 (see the file LICENSE).
 
-"""Respond to Subnet CIDR changes."""
+"""Respond to Subnet changes."""
 
 __all__ = ["signals"]
 
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 
 from maasserver.enum import IPADDRESS_TYPE
 from maasserver.models import StaticIPAddress, Subnet
+from maasserver.models.subnet import forget_free_ip_index
 from maasserver.utils.signals import SignalsManager
 
 signals = SignalsManager()
@@ -42,8 +43,13 @@ def updated_cidr(instance, old_values, **kwargs):
     update_referenced_ip_addresses(instance)
 
 
+def post_deleted(sender, instance, **kwargs):
+    forget_free_ip_index(instance.id)
+
+
 signals.watch(post_save, post_created, sender=Subnet)
 signals.watch_fields(updated_cidr, Subnet, ["cidr"], delete=False)
+signals.watch(post_delete, post_deleted, sender=Subnet)
 
 # Enable all signals by default.
 signals.enable()
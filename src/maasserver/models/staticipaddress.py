@@ -291,9 +291,11 @@ class StaticIPAddressManager(Manager):
             requested_address = subnet.get_next_ip_for_allocation(
                 exclude_addresses=exclude_addresses
             )
-            return self._attempt_allocation_of_free_address(
+            ipaddress = self._attempt_allocation_of_free_address(
                 requested_address, alloc_type, user=user, subnet=subnet
             )
+            subnet.record_allocated_ip(requested_address)
+            return ipaddress
         else:
             requested_address = IPAddress(requested_address)
             # Circular imports.
@@ -5,12 +5,13 @@
 
 __all__ = ["create_cidr", "get_allocated_ips", "Subnet"]
 
-from operator import attrgetter
+import threading
 from typing import Iterable, Optional
 
 from django.contrib.postgres.fields import ArrayField
 from django.core.exceptions import PermissionDenied, ValidationError
 from django.core.validators import RegexValidator
+from django.db import connection
 from django.db.models import (
     BooleanField,
     CharField,
@@ -50,6 +51,7 @@ from provisioningserver.utils.network import (
     MaybeIPAddress,
     parse_integer,
 )
+from provisioningserver.utils.network import FreeIPRangeIndex
 from provisioningserver.utils.network import IPRANGE_TYPE as MAASIPRANGE_TYPE
 
 maaslog = get_maas_logger("subnet")
@@ -61,6 +63,26 @@ SUBNET_NAME_VALIDATOR = RegexValidator(r"^[.: \w/-]+$")
 # Typing for list of IP addresses to exclude.
 IPAddressExcludeList = Optional[Iterable[MaybeIPAddress]]
 
+# Records changes to the rows that the free ranges of a subnet are calculated
+# from: how many there have been and a generation that is unique to the last.
+# Triggers maintain it; see `maasserver.triggers.system`. A subnet that has
+# not changed since the triggers were installed has no row.
+FREE_IP_INDEX_GENERATION_SQL = """
+    SELECT changes, generation FROM maasserver_subnetgeneration
+    WHERE subnet_id = %s
+"""
+
+# Free ranges for allocation, by subnet ID. Each is a (key, index) tuple; see
+# `Subnet.get_free_ip_index`.
+_free_ip_indexes = {}
+_free_ip_indexes_lock = threading.Lock()
+
+
+def forget_free_ip_index(subnet_id):
+    """Forget the cached free IP index for the subnet with `subnet_id`."""
+    with _free_ip_indexes_lock:
+        _free_ip_indexes.pop(subnet_id, None)
+
 
 def create_cidr(network, subnet_mask=None):
     """Given the specified network and subnet mask, create a CIDR string.
@@ -150,6 +172,52 @@ class SubnetQueriesMixin(MAASQueriesMixin):
         else:
             return None
 
+    # The same ordering as `find_best_subnet_for_ip_query`, for every IP
+    # address in the given array at once.
+    find_best_subnets_for_ips_query = """
+        SELECT DISTINCT ON (ip.address)
+            host(ip.address) "address",
+            subnet.id "subnet_id"
+        FROM unnest(%s::inet[]) AS ip(address)
+        INNER JOIN maasserver_subnet AS subnet
+            ON ip.address << subnet.cidr
+        INNER JOIN maasserver_vlan AS vlan
+            ON subnet.vlan_id = vlan.id
+        ORDER BY
+            ip.address,
+            vlan.dhcp_on DESC,
+            masklen(subnet.cidr) DESC
+        """
+
+    def get_best_subnets_for_ips(self, ips):
+        """Find the most-specific managed Subnet for each of `ips`.
+
+        This is `get_best_subnet_for_ip` for many IP addresses at once, in
+        two queries.
+
+        :return: A dict mapping each IP address given to its `Subnet`. IP
+            addresses that do not belong to any subnet are left out.
+        """
+        addresses = {}
+        for ip in ips:
+            address = IPAddress(ip)
+            if address.is_ipv4_mapped():
+                address = address.ipv4()
+            addresses.setdefault(str(address), []).append(ip)
+        if len(addresses) == 0:
+            return {}
+        with connection.cursor() as cursor:
+            cursor.execute(
+                self.find_best_subnets_for_ips_query, [list(addresses)]
+            )
+            best = cursor.fetchall()
+        subnets = self.in_bulk({subnet_id for _, subnet_id in best})
+        return {
+            ip: subnets[subnet_id]
+            for address, subnet_id in best
+            for ip in addresses[str(IPAddress(address))]
+        }
+
     def validate_filter_specifiers(self, specifiers):
         """Validate the given filter string."""
         try:
@@ -770,17 +838,27 @@ class Subnet(CleanSave, TimestampedModel):
         """
         if exclude_addresses is None:
             exclude_addresses = []
-        free_ranges = self.get_ipranges_not_in_use(
-            exclude_addresses=exclude_addresses,
-            with_neighbours=avoid_observed_neighbours,
-        )
-        if len(free_ranges) == 0 and avoid_observed_neighbours is True:
+        free_ranges = self.get_free_ip_index()
+        network = self.get_ipnetwork()
+        for address in exclude_addresses:
+            if address in network:
+                free_ranges.claim(address)
+        if avoid_observed_neighbours:
+            for neighbour in self.get_maasipset_for_neighbours():
+                for address in range(neighbour.first, neighbour.last + 1):
+                    free_ranges.claim(address)
+        # The purpose of this is to that we ensure we always get an IP address
+        # from the *smallest* free contiguous range. This way, larger ranges
+        # can be preserved in case they need to be used for applications
+        # requiring them.
+        free_range = free_ranges.get_smallest_range()
+        if free_range is None and avoid_observed_neighbours is True:
             # Try again recursively, but this time consider neighbours to be
             # "free" IP addresses. (We'll pick the least recently seen IP.)
             return self.get_next_ip_for_allocation(
                 exclude_addresses, avoid_observed_neighbours=False
             )
-        elif len(free_ranges) == 0:
+        elif free_range is None:
             raise StaticIPAddressExhaustion(
                 "No more IPs available in subnet: %s." % self.cidr
             )
@@ -806,13 +884,76 @@ class Subnet(CleanSave, TimestampedModel):
                     )
                 )
                 return str(discovery.ip)
-        # The purpose of this is to that we ensure we always get an IP address
-        # from the *smallest* free contiguous range. This way, larger ranges
-        # can be preserved in case they need to be used for applications
-        # requiring them.
-        free_range = min(free_ranges, key=attrgetter("num_addresses"))
         return str(IPAddress(free_range.first))
 
+    def _get_free_ip_index_key(self):
+        """Return a key for everything this subnet's free ranges are
+        calculated from.
+
+        This is a tuple of the subnet's own fields that matter, and the
+        count and generation of changes to the rows that matter. Two calls
+        return the same key only if the free ranges would be the same.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(FREE_IP_INDEX_GENERATION_SQL, [self.id])
+            row = cursor.fetchone()
+        changes, generation = (0, 0) if row is None else row
+        dns_servers = () if self.dns_servers is None else self.dns_servers
+        fields = (
+            str(self.cidr),
+            str(self.gateway_ip),
+            tuple(dns_servers),
+            self.managed,
+        )
+        return fields, changes, generation
+
+    def get_free_ip_index(self) -> FreeIPRangeIndex:
+        """Return an index of the ranges addresses can be allocated from.
+
+        This is the same as `get_ipranges_not_in_use()`, but indexed. The
+        index is cached between calls and only recalculated when anything
+        it depends on changes. A copy is returned, so the caller is free
+        to change it.
+        """
+        key = self._get_free_ip_index_key()
+        # Remember what this transaction saw, for record_allocated_ip().
+        self._free_ip_index_key = key
+        with _free_ip_indexes_lock:
+            cached = _free_ip_indexes.get(self.id)
+            if cached is not None and cached[0] == key:
+                return cached[1].copy()
+        index = FreeIPRangeIndex.from_maasipset(
+            self.get_ipranges_not_in_use(),
+            version=self.get_ipnetwork().version,
+        )
+        with _free_ip_indexes_lock:
+            _free_ip_indexes[self.id] = key, index
+        return index.copy()
+
+    def record_allocated_ip(self, address):
+        """Record that `address` has been allocated from this subnet.
+
+        If the cached free IP index was used to choose `address`, and the
+        allocation is the only change since, then it's updated so the next
+        allocation doesn't need to recalculate it.
+        """
+        previous = getattr(self, "_free_ip_index_key", None)
+        if previous is None:
+            return
+        key = self._get_free_ip_index_key()
+        fields, changes, _ = key
+        with _free_ip_indexes_lock:
+            cached = _free_ip_indexes.get(self.id)
+            if (
+                cached is not None
+                and cached[0] == previous
+                and fields == previous[0]
+                and changes == previous[1] + 1
+            ):
+                cached[1].claim(address)
+                _free_ip_indexes[self.id] = key, cached[1]
+        self._free_ip_index_key = key
+
     def render_json_for_related_ips(
         self, with_username=True, with_summary=True
     ):
@@ -71,6 +71,36 @@ class EventTest(MAASServerTestCase):
         self.assertEqual(description, event.description)
         self.assertEqual(action, event.action)
 
+    def test_register_node_events_creates_events_in_order(self):
+        node = factory.make_Node()
+        type_name = factory.make_name("type_name")
+        created = factory.make_date()
+        events = [
+            {
+                "type_name": type_name,
+                "event_action": factory.make_name("action"),
+                "event_description": "Event %d" % i,
+                "created": created,
+            }
+            for i in range(3)
+        ]
+        Event.objects.register_node_events(node, events)
+        registered = list(Event.objects.filter(node=node).order_by("id"))
+        self.assertEqual(
+            [event["event_description"] for event in events],
+            [event.description for event in registered],
+        )
+        self.assertEqual(
+            [event["event_action"] for event in events],
+            [event.action for event in registered],
+        )
+        for event in registered:
+            self.assertEqual(type_name, event.type.name)
+            self.assertEqual(node.system_id, event.node_system_id)
+            self.assertEqual(node.hostname, event.node_hostname)
+            self.assertEqual(created, event.created)
+        self.assertEqual(1, EventType.objects.filter(name=type_name).count())
+
     def test_register_event_and_event_type_registers_event_type(self):
         # EventType does not exist
         node = factory.make_Node()
@@ -5,10 +5,15 @@
 
 __all__ = []
 
-from testtools.matchers import Equals
+import random
 
+from fixtures import FakeLogger
+from testtools.matchers import Equals, HasLength
+
+from maasserver.models import MDNS
 from maasserver.testing.factory import factory
 from maasserver.testing.testcase import MAASServerTestCase
+from maastesting.djangotestcase import count_queries
 
 
 class TestMDNSModel(MAASServerTestCase):
@@ -16,3 +21,119 @@ class TestMDNSModel(MAASServerTestCase):
         mdns = factory.make_MDNS(hostname="Living room")
         # Expect no exception.
         self.assertThat(mdns.hostname, Equals("Living room"))
+
+
+class TestMDNSManagerUpdateMDNSEntries(MAASServerTestCase):
+    """Tests for `MDNSManager.update_mdns_entries`."""
+
+    def make_interface(self, mdns_discovery_state=True):
+        rack = factory.make_RackController()
+        interface = factory.make_Interface(node=rack)
+        interface.mdns_discovery_state = mdns_discovery_state
+        interface.save()
+        return interface
+
+    def make_mdns_entry_json(self, ip=None, hostname=None):
+        if ip is None:
+            ip = factory.make_ipv4_address()
+        if hostname is None:
+            hostname = factory.make_hostname()
+        return {"address": ip, "hostname": hostname}
+
+    def get_entries(self):
+        return sorted(
+            (str(entry.ip), entry.hostname, entry.count)
+            for entry in MDNS.objects.all()
+        )
+
+    def test__ignores_interfaces_without_mdns_discovery(self):
+        interface = self.make_interface(mdns_discovery_state=False)
+        MDNS.objects.update_mdns_entries(
+            [(interface, self.make_mdns_entry_json())]
+        )
+        self.assertThat(MDNS.objects.all(), HasLength(0))
+
+    def test__creates_new_entries_and_logs(self):
+        interface = self.make_interface()
+        entries = [(interface, self.make_mdns_entry_json()) for _ in range(3)]
+        with FakeLogger("maas.interface") as maaslog:
+            MDNS.objects.update_mdns_entries(entries)
+        self.assertThat(MDNS.objects.all(), HasLength(3))
+        self.assertThat(
+            maaslog.output.splitlines(),
+            Equals(
+                [
+                    "%s: New mDNS entry resolved: '%s' on %s."
+                    % (
+                        interface.get_log_string(),
+                        json["hostname"],
+                        json["address"],
+                    )
+                    for _, json in entries
+                ]
+            ),
+        )
+
+    def test__updates_existing_entries(self):
+        interface = self.make_interface()
+        entry = factory.make_MDNS(
+            interface=interface, ip=factory.make_ipv4_address()
+        )
+        json = self.make_mdns_entry_json(
+            ip=str(entry.ip), hostname=entry.hostname
+        )
+        MDNS.objects.update_mdns_entries([(interface, json)])
+        entry.refresh_from_db()
+        self.assertThat(entry.count, Equals(2))
+
+    def test__uses_constant_number_of_queries(self):
+        interface = self.make_interface()
+        existing = [
+            factory.make_MDNS(
+                interface=interface, ip=factory.make_ipv4_address()
+            )
+            for _ in range(5)
+        ]
+        entries = [
+            (
+                interface,
+                self.make_mdns_entry_json(
+                    ip=str(entry.ip), hostname=entry.hostname
+                ),
+            )
+            for entry in existing
+        ]
+        entries.extend(
+            (interface, self.make_mdns_entry_json()) for _ in range(5)
+        )
+        entries.append(
+            (interface, self.make_mdns_entry_json(ip=str(existing[0].ip)))
+        )
+        count, _ = count_queries(MDNS.objects.update_mdns_entries, entries)
+        # One query to read, and one each to delete, update and insert.
+        self.assertThat(count, Equals(4))
+
+    def test__matches_update_mdns_entry(self):
+        interface = self.make_interface()
+        ips = [factory.make_ipv4_address() for _ in range(3)]
+        ips.append(factory.make_ipv6_address())
+        hostnames = [factory.make_hostname() for _ in range(3)]
+        entries = [
+            (
+                interface,
+                self.make_mdns_entry_json(
+                    ip=random.choice(ips), hostname=random.choice(hostnames)
+                ),
+            )
+            for _ in range(30)
+        ]
+        with FakeLogger("maas") as maaslog:
+            for iface, json in entries:
+                iface.update_mdns_entry(json)
+        expected_entries = self.get_entries()
+        expected_log = maaslog.output
+        MDNS.objects.all().delete()
+        with FakeLogger("maas") as maaslog:
+            MDNS.objects.update_mdns_entries(entries)
+        self.assertThat(self.get_entries(), Equals(expected_entries))
+        self.assertThat(maaslog.output, Equals(expected_log))
@@ -5,8 +5,15 @@
 
 __all__ = []
 
+import random
+
+from fixtures import FakeLogger
+from testtools.matchers import Equals, HasLength
+
+from maasserver.models import Neighbour
 from maasserver.testing.factory import factory
 from maasserver.testing.testcase import MAASServerTestCase
+from maastesting.djangotestcase import count_queries
 from maastesting.matchers import IsNonEmptyString
 
 
@@ -14,3 +21,144 @@ class TestNeighbourModel(MAASServerTestCase):
     def test_mac_organization(self):
         neighbour = factory.make_Neighbour(mac_address="48:51:b7:00:00:00")
         self.assertThat(neighbour.mac_organization, IsNonEmptyString)
+
+
+class TestNeighbourManagerUpdateNeighbours(MAASServerTestCase):
+    """Tests for `NeighbourManager.update_neighbours`."""
+
+    def make_interface(self, neighbour_discovery_state=True):
+        rack = factory.make_RackController()
+        interface = factory.make_Interface(node=rack)
+        interface.neighbour_discovery_state = neighbour_discovery_state
+        interface.save()
+        return interface
+
+    def make_neighbour_json(self, ip=None, mac=None, vid=None, time=None):
+        if ip is None:
+            ip = factory.make_ipv4_address()
+        if mac is None:
+            mac = factory.make_mac_address()
+        if time is None:
+            time = random.randint(0, 200000000)
+        return {"ip": ip, "mac": mac, "time": time, "vid": vid}
+
+    def get_neighbours(self):
+        return sorted(
+            (str(n.ip), str(n.mac_address), n.vid, n.time, n.count)
+            for n in Neighbour.objects.all()
+        )
+
+    def test__ignores_interfaces_without_neighbour_discovery(self):
+        interface = self.make_interface(neighbour_discovery_state=False)
+        Neighbour.objects.update_neighbours(
+            [(interface, self.make_neighbour_json())]
+        )
+        self.assertThat(Neighbour.objects.all(), HasLength(0))
+
+    def test__creates_new_neighbours_and_logs(self):
+        interface = self.make_interface()
+        observations = [
+            (interface, self.make_neighbour_json()) for _ in range(3)
+        ]
+        with FakeLogger("maas.interface") as maaslog:
+            Neighbour.objects.update_neighbours(observations)
+        self.assertThat(Neighbour.objects.all(), HasLength(3))
+        self.assertThat(
+            maaslog.output.splitlines(),
+            Equals(
+                [
+                    "%s: New MAC, IP binding observed: %s, %s"
+                    % (interface.get_log_string(), json["mac"], json["ip"])
+                    for _, json in observations
+                ]
+            ),
+        )
+
+    def test__updates_existing_neighbours(self):
+        interface = self.make_interface()
+        neighbour = factory.make_Neighbour(interface=interface, count=3)
+        json = self.make_neighbour_json(
+            ip=str(neighbour.ip),
+            mac=str(neighbour.mac_address),
+            vid=neighbour.vid,
+        )
+        Neighbour.objects.update_neighbours([(interface, json)])
+        neighbour.refresh_from_db()
+        self.assertThat(neighbour.time, Equals(json["time"]))
+        self.assertThat(neighbour.count, Equals(4))
+
+    def test__replaces_and_logs_moved_neighbours(self):
+        interface = self.make_interface()
+        neighbour = factory.make_Neighbour(interface=interface, vid=None)
+        json = self.make_neighbour_json(ip=str(neighbour.ip))
+        with FakeLogger("maas.neighbour") as maaslog:
+            Neighbour.objects.update_neighbours([(interface, json)])
+        self.assertThat(
+            self.get_neighbours(),
+            Equals([(json["ip"], json["mac"], None, json["time"], 1)]),
+        )
+        self.assertThat(
+            maaslog.output.strip(),
+            Equals(
+                "%s: IP address %s moved from %s to %s"
+                % (
+                    interface.get_log_string(),
+                    json["ip"],
+                    neighbour.mac_address,
+                    json["mac"],
+                )
+            ),
+        )
+
+    def test__uses_constant_number_of_queries(self):
+        interface = self.make_interface()
+        existing = [
+            factory.make_Neighbour(interface=interface, vid=None)
+            for _ in range(5)
+        ]
+        observations = [
+            (
+                interface,
+                self.make_neighbour_json(
+                    ip=str(neighbour.ip), mac=str(neighbour.mac_address)
+                ),
+            )
+            for neighbour in existing
+        ]
+        observations.extend(
+            (interface, self.make_neighbour_json()) for _ in range(5)
+        )
+        observations.append(
+            (interface, self.make_neighbour_json(ip=str(existing[0].ip)))
+        )
+        count, _ = count_queries(
+            Neighbour.objects.update_neighbours, observations
+        )
+        # One query to read, and one each to delete, update and insert.
+        self.assertThat(count, Equals(4))
+
+    def test__matches_update_neighbour(self):
+        interface = self.make_interface()
+        ips = [factory.make_ipv4_address() for _ in range(3)]
+        macs = [factory.make_mac_address() for _ in range(3)]
+        observations = [
+            (
+                interface,
+                self.make_neighbour_json(
+                    ip=random.choice(ips),
+                    mac=random.choice(macs),
+                    vid=random.choice([None, 1]),
+                ),
+            )
+            for _ in range(30)
+        ]
+        with FakeLogger("maas") as maaslog:
+            for iface, json in observations:
+                iface.update_neighbour(json)
+        expected_neighbours = self.get_neighbours()
+        expected_log = maaslog.output
+        Neighbour.objects.all().delete()
+        with FakeLogger("maas") as maaslog:
+            Neighbour.objects.update_neighbours(observations)
+        self.assertThat(self.get_neighbours(), Equals(expected_neighbours))
+        self.assertThat(maaslog.output, Equals(expected_log))
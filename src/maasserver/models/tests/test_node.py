@@ -90,6 +90,8 @@ from maasserver.models import (
     Interface,
     LicenseKey,
     Machine,
+    MDNS,
+    Neighbour,
     Node,
 )
 from maasserver.models import (
@@ -545,6 +547,74 @@ class TestMachineManager(MAASServerTestCase):
             list(Machine.objects.get_available_machines_for_acquisition(user)),
         )
 
+    def test_claim_machines_returns_machines_in_candidate_order(self):
+        machines = [self.make_machine() for _ in range(3)]
+        candidates = Machine.objects.filter(
+            id__in=[machine.id for machine in machines]
+        ).order_by("-id")
+        self.assertEqual(
+            list(reversed(machines)),
+            Machine.objects.claim_machines_for_acquisition(
+                candidates, count=3
+            ),
+        )
+
+    def test_claim_machines_claims_at_most_count(self):
+        machines = [self.make_machine() for _ in range(3)]
+        candidates = Machine.objects.order_by("id")
+        self.assertEqual(
+            machines[:2],
+            Machine.objects.claim_machines_for_acquisition(
+                candidates, count=2
+            ),
+        )
+
+    def test_claim_machines_defaults_to_one(self):
+        self.make_machine()
+        self.make_machine()
+        self.assertEqual(
+            1,
+            len(
+                Machine.objects.claim_machines_for_acquisition(
+                    Machine.objects.all()
+                )
+            ),
+        )
+
+    def test_claim_machines_skips_machines_no_longer_available(self):
+        # The candidates may have been chosen before another transaction
+        # acquired some of them.
+        taken = self.make_machine(factory.make_User())
+        available = self.make_machine()
+        candidates = Machine.objects.filter(id__in=[taken.id, available.id])
+        self.assertEqual(
+            [available],
+            Machine.objects.claim_machines_for_acquisition(
+                candidates, count=2
+            ),
+        )
+
+    def test_claim_machines_claims_duplicate_candidates_once(self):
+        machine = self.make_machine()
+        for name in ("first", "second"):
+            tag = factory.make_Tag(name, definition="", populate=False)
+            machine.tags.add(tag)
+        candidates = Machine.objects.filter(tags__name__in=["first", "second"])
+        self.assertEqual(
+            [machine],
+            Machine.objects.claim_machines_for_acquisition(
+                candidates, count=2
+            ),
+        )
+
+    def test_claim_machines_returns_empty_list_without_candidates(self):
+        self.assertEqual(
+            [],
+            Machine.objects.claim_machines_for_acquisition(
+                Machine.objects.none()
+            ),
+        )
+
 
 class TestControllerManager(MAASServerTestCase):
     def test_controller_lists_node_type_rack_and_region(self):
@@ -5250,6 +5320,22 @@ class TestNode(MAASServerTestCase):
             node.status_expires, expected_time + timedelta(minutes=1)
         )
 
+    def test_reset_status_expires_uses_given_node_timeout(self):
+        status = random.choice(MONITORED_STATUSES)
+        node = factory.make_Node(status=status)
+        node.status_expires = factory.make_date()
+        node_timeout = random.randint(100, 200)
+        node.reset_status_expires(node_timeout=node_timeout)
+        expected_time = now() + timedelta(
+            minutes=get_node_timeout(status, node_timeout=node_timeout)
+        )
+        self.assertGreaterEqual(
+            node.status_expires, expected_time - timedelta(minutes=1)
+        )
+        self.assertLessEqual(
+            node.status_expires, expected_time + timedelta(minutes=1)
+        )
+
     def test_reset_status_expires_does_nothing_when_not_set(self):
         status = random.choice(MONITORED_STATUSES)
         node = factory.make_Node(status=status)
@@ -9745,21 +9831,20 @@ class TestControllerUpdateDiscoveryState(MAASServerTestCase):
 class TestReportNeighbours(MAASServerTestCase):
     """Tests for `Controller.report_neighbours()."""
 
-    def test__calls_update_neighbour_for_each_neighbour(self):
+    def test__calls_update_neighbours_with_each_neighbour(self):
         rack = factory.make_RackController()
-        factory.make_Interface(name="eth0", node=rack)
-        factory.make_Interface(name="eth1", node=rack)
-        update_neighbour = self.patch(
-            interface_module.Interface, "update_neighbour"
-        )
+        eth0 = factory.make_Interface(name="eth0", node=rack)
+        eth1 = factory.make_Interface(name="eth1", node=rack)
+        update_neighbours = self.patch(Neighbour.objects, "update_neighbours")
         neighbours = [
             {"interface": "eth0", "mac": factory.make_mac_address()},
             {"interface": "eth1", "mac": factory.make_mac_address()},
+            {"interface": "eth2", "mac": factory.make_mac_address()},
         ]
         rack.report_neighbours(neighbours)
         self.assertThat(
-            update_neighbour,
-            MockCallsMatch(*[call(neighbour) for neighbour in neighbours]),
+            update_neighbours,
+            MockCalledOnceWith([(eth0, neighbours[0]), (eth1, neighbours[1])]),
         )
 
     def test__calls_report_vid_for_each_vid(self):
@@ -9767,7 +9852,7 @@ class TestReportNeighbours(MAASServerTestCase):
         factory.make_Interface(name="eth0", node=rack)
         factory.make_Interface(name="eth1", node=rack)
         # Just make this a no-op for simplicity.
-        self.patch(interface_module.Interface, "update_neighbour")
+        self.patch(Neighbour.objects, "update_neighbours")
         report_vid = self.patch(interface_module.Interface, "report_vid")
         neighbours = [
             {"interface": "eth0", "mac": factory.make_mac_address(), "vid": 3},
@@ -9776,25 +9861,55 @@ class TestReportNeighbours(MAASServerTestCase):
         rack.report_neighbours(neighbours)
         self.assertThat(report_vid, MockCallsMatch(call(3), call(7)))
 
+    def test__calls_report_vid_once_per_interface_and_vid(self):
+        rack = factory.make_RackController()
+        factory.make_Interface(name="eth0", node=rack)
+        self.patch(Neighbour.objects, "update_neighbours")
+        report_vid = self.patch(interface_module.Interface, "report_vid")
+        neighbours = [
+            {"interface": "eth0", "mac": factory.make_mac_address(), "vid": 3}
+            for _ in range(3)
+        ]
+        rack.report_neighbours(neighbours)
+        self.assertThat(report_vid, MockCalledOnceWith(3))
+
+    def test__updates_neighbours(self):
+        rack = factory.make_RackController()
+        eth0 = factory.make_Interface(name="eth0", node=rack)
+        eth0.neighbour_discovery_state = True
+        eth0.save()
+        ip = factory.make_ipv4_address()
+        mac = factory.make_mac_address()
+        neighbours = [
+            {"interface": "eth0", "ip": ip, "mac": mac, "time": time}
+            for time in (1, 2)
+        ]
+        rack.report_neighbours(neighbours)
+        self.assertThat(
+            get_one(Neighbour.objects.all()),
+            MatchesStructure.byEquality(
+                interface=eth0, ip=ip, mac_address=mac, time=2, count=2
+            ),
+        )
+
 
 class TestReportMDNSEntries(MAASServerTestCase):
     """Tests for `Controller.report_mdns_entries()."""
 
-    def test__calls_update_mdns_entry_for_each_entry(self):
+    def test__calls_update_mdns_entries_with_each_entry(self):
         rack = factory.make_RackController()
-        factory.make_Interface(name="eth0", node=rack)
-        factory.make_Interface(name="eth1", node=rack)
-        update_mdns_entry = self.patch(
-            interface_module.Interface, "update_mdns_entry"
-        )
+        eth0 = factory.make_Interface(name="eth0", node=rack)
+        eth1 = factory.make_Interface(name="eth1", node=rack)
+        update_mdns_entries = self.patch(MDNS.objects, "update_mdns_entries")
         entries = [
             {"interface": "eth0", "hostname": factory.make_name("eth0")},
             {"interface": "eth1", "hostname": factory.make_name("eth1")},
+            {"interface": "eth2", "hostname": factory.make_name("eth2")},
         ]
         rack.report_mdns_entries(entries)
         self.assertThat(
-            update_mdns_entry,
-            MockCallsMatch(*[call(entry) for entry in entries]),
+            update_mdns_entries,
+            MockCalledOnceWith([(eth0, entries[0]), (eth1, entries[1])]),
         )
 
 
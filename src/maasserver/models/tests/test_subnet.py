@@ -32,8 +32,13 @@ from maasserver.enum import (
     RDNS_MODE_CHOICES,
 )
 from maasserver.exceptions import StaticIPAddressExhaustion
-from maasserver.models import Config, Notification, Space
-from maasserver.models.subnet import create_cidr, get_allocated_ips, Subnet
+from maasserver.models import Config, Notification, Space, StaticIPAddress
+from maasserver.models.subnet import (
+    _free_ip_indexes,
+    create_cidr,
+    get_allocated_ips,
+    Subnet,
+)
 from maasserver.models.timestampedmodel import now
 from maasserver.permissions import NodePermission
 from maasserver.testing.factory import factory, RANDOM, RANDOM_OR_NONE
@@ -41,7 +46,7 @@ from maasserver.testing.orm import rollback
 from maasserver.testing.testcase import MAASServerTestCase
 from maasserver.utils.orm import get_one, reload_object
 from maastesting.djangotestcase import count_queries, CountQueries
-from maastesting.matchers import DocTestMatches
+from maastesting.matchers import DocTestMatches, MockNotCalled
 from provisioningserver.utils.network import inet_ntop, MAASIPRange
 
 
@@ -825,6 +830,53 @@ class TestGetBestSubnetForIP(MAASServerTestCase):
         self.expectThat(subnet, Is(None))
 
 
+class TestGetBestSubnetsForIPs(MAASServerTestCase):
+    def test__returns_most_specific_subnet_for_each_ip(self):
+        factory.make_Subnet(cidr="10.0.0.0/8")
+        subnet_24 = factory.make_Subnet(cidr="10.1.1.0/24")
+        subnet_16 = factory.make_Subnet(cidr="10.1.0.0/16")
+        subnet_64 = factory.make_Subnet(cidr="2001:db8:1:2::/64")
+        factory.make_Subnet(cidr="2001:db8::/32")
+        self.assertEqual(
+            {
+                "10.1.1.1": subnet_24,
+                "10.1.2.1": subnet_16,
+                "::ffff:10.1.1.2": subnet_24,
+                "2001:db8:1:2::1": subnet_64,
+            },
+            Subnet.objects.get_best_subnets_for_ips(
+                ["10.1.1.1", "10.1.2.1", "::ffff:10.1.1.2", "2001:db8:1:2::1"]
+            ),
+        )
+
+    def test__matches_get_best_subnet_for_ip(self):
+        for _ in range(3):
+            factory.make_Subnet(
+                cidr=str(factory.make_ipv4_network(slash=16).cidr),
+                dhcp_on=factory.pick_bool(),
+            )
+        subnets = list(Subnet.objects.all())
+        ips = [
+            factory.pick_ip_in_network(subnet.get_ipnetwork())
+            for subnet in subnets
+        ]
+        self.assertEqual(
+            {ip: Subnet.objects.get_best_subnet_for_ip(ip) for ip in ips},
+            Subnet.objects.get_best_subnets_for_ips(ips),
+        )
+
+    def test__leaves_out_ips_without_subnet(self):
+        factory.make_Subnet(cidr="10.0.0.0/8")
+        self.assertEqual({}, Subnet.objects.get_best_subnets_for_ips(["::"]))
+
+    def test__returns_empty_dict_without_query_for_no_ips(self):
+        count, result = count_queries(
+            Subnet.objects.get_best_subnets_for_ips, []
+        )
+        self.assertEqual({}, result)
+        self.assertEqual(0, count)
+
+
 class SubnetLabelTest(MAASServerTestCase):
     def test__returns_cidr_for_null_name(self):
         network = factory.make_ip4_or_6_network()
@@ -1441,6 +1493,95 @@ class TestSubnetGetNextIPForAllocation(MAASServerTestCase):
         self.assertThat(ip, Equals("10.0.0.5"))
 
 
+class TestSubnetGetFreeIPIndex(MAASServerTestCase):
+    def make_Subnet(self):
+        # Note: 10.0.0.0/29 --> 10.0.0.1 through 10.0.0.0.6 are usable.
+        return factory.make_Subnet(
+            cidr="10.0.0.0/29", gateway_ip=None, dns_servers=None
+        )
+
+    def test__matches_ipranges_not_in_use(self):
+        subnet = self.make_Subnet()
+        factory.make_StaticIPAddress(ip="10.0.0.4", cidr="10.0.0.0/29")
+        self.assertEqual(
+            [
+                (item.first, item.last)
+                for item in subnet.get_ipranges_not_in_use()
+            ],
+            [(item.first, item.last) for item in subnet.get_free_ip_index()],
+        )
+
+    def test__is_cached(self):
+        subnet = self.make_Subnet()
+        subnet.get_free_ip_index()
+        get_ipranges_not_in_use = self.patch(subnet, "get_ipranges_not_in_use")
+        subnet.get_free_ip_index()
+        self.assertThat(get_ipranges_not_in_use, MockNotCalled())
+
+    def test__returns_copy(self):
+        subnet = self.make_Subnet()
+        subnet.get_free_ip_index().claim("10.0.0.1")
+        self.assertThat(subnet.get_free_ip_index(), Contains("10.0.0.1"))
+
+    def test__recalculated_when_address_assigned(self):
+        subnet = self.make_Subnet()
+        subnet.get_free_ip_index()
+        factory.make_StaticIPAddress(ip="10.0.0.1", cidr="10.0.0.0/29")
+        self.assertThat(subnet.get_free_ip_index(), Not(Contains("10.0.0.1")))
+
+    def test__recalculated_when_address_released(self):
+        subnet = self.make_Subnet()
+        sip = factory.make_StaticIPAddress(ip="10.0.0.1", cidr="10.0.0.0/29")
+        subnet.get_free_ip_index()
+        sip.delete()
+        self.assertThat(subnet.get_free_ip_index(), Contains("10.0.0.1"))
+
+    def test__recalculated_when_range_changes(self):
+        subnet = self.make_Subnet()
+        iprange = factory.make_IPRange(
+            subnet,
+            start_ip="10.0.0.1",
+            end_ip="10.0.0.2",
+            alloc_type=IPRANGE_TYPE.RESERVED,
+        )
+        self.assertThat(subnet.get_free_ip_index(), Contains("10.0.0.3"))
+        iprange.end_ip = "10.0.0.3"
+        iprange.save()
+        self.assertThat(subnet.get_free_ip_index(), Not(Contains("10.0.0.3")))
+
+    def test__recalculated_when_subnet_changes(self):
+        subnet = self.make_Subnet()
+        subnet.get_free_ip_index()
+        subnet.gateway_ip = "10.0.0.1"
+        subnet.save()
+        self.assertThat(subnet.get_free_ip_index(), Not(Contains("10.0.0.1")))
+
+    def test__allocation_updates_cached_index(self):
+        subnet = self.make_Subnet()
+        StaticIPAddress.objects.allocate_new(subnet)
+        get_ipranges_not_in_use = self.patch(subnet, "get_ipranges_not_in_use")
+        index = subnet.get_free_ip_index()
+        self.assertThat(get_ipranges_not_in_use, MockNotCalled())
+        self.assertThat(index, Not(Contains("10.0.0.1")))
+        self.assertThat(index, Contains("10.0.0.2"))
+
+    def test__allocation_does_not_update_index_after_other_changes(self):
+        subnet = self.make_Subnet()
+        subnet.get_free_ip_index()
+        factory.make_StaticIPAddress(ip="10.0.0.5", cidr="10.0.0.0/29")
+        factory.make_StaticIPAddress(ip="10.0.0.1", cidr="10.0.0.0/29")
+        subnet.record_allocated_ip("10.0.0.1")
+        self.assertThat(subnet.get_free_ip_index(), Not(Contains("10.0.0.5")))
+
+    def test__forgotten_when_subnet_deleted(self):
+        subnet = self.make_Subnet()
+        subnet.get_free_ip_index()
+        self.assertIn(subnet.id, _free_ip_indexes)
+        subnet_id = subnet.id
+        subnet.delete()
+        self.assertNotIn(subnet_id, _free_ip_indexes)
+
+
 class TestUnmanagedSubnets(MAASServerTestCase):
     def test__allocation_uses_reserved_range(self):
         # Note: 10.0.0.0/29 --> 10.0.0.1 through 10.0.0.0.6 are usable.
@@ -129,6 +129,7 @@ IGNORED_FIELDS = {
     "verbose",
     "op",
     "agent_name",
+    "count",
 }
 
 
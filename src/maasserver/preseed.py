@@ -17,9 +17,12 @@ __all__ = [
 ]
 
 from collections import namedtuple
+import copy
 import json
 import os.path
 from pipes import quote
+import threading
+import time
 from urllib.parse import urlencode, urlparse
 
 from crochet import TimeoutError
@@ -62,6 +65,7 @@ from metadataserver.models import NodeKey
 from metadataserver.user_data.snippets import get_snippet_context
 from provisioningserver.drivers.osystem.ubuntu import UbuntuOS
 from provisioningserver.logger import get_maas_logger, LegacyLogger
+from provisioningserver.prometheus.metrics import PROMETHEUS_METRICS
 from provisioningserver.rpc.exceptions import NoConnectionsAvailable
 from provisioningserver.utils import typed
 from provisioningserver.utils.url import compose_URL
@@ -721,18 +725,9 @@ def get_preseed_template(filenames):
     """
     assert not isinstance(filenames, (bytes, str))
     assert all(isinstance(filename, str) for filename in filenames)
-    for location in settings.PRESEED_TEMPLATE_LOCATIONS:
-        for filename in filenames:
-            filepath = os.path.join(location, filename)
-            try:
-                with open(filepath, "r", encoding="utf-8") as stream:
-                    content = stream.read()
-            except IOError:
-                pass  # Ignore.
-            else:
-                return filepath, content
-    else:
-        return None, None
+    return preseed_template_cache.find(
+        settings.PRESEED_TEMPLATE_LOCATIONS, filenames
+    )
 
 
 def get_escape_singleton():
@@ -757,6 +752,153 @@ class PreseedTemplate(tempita.Template):
     )
 
 
+class PreseedTemplateCache:
+    """Process-wide cache of preseed template files and compiled templates.
+
+    Finding a template means trying up to a dozen filenames in each of the
+    template locations. Instead, the names of the files in each location
+    are listed once, and listed again only when the location's directory
+    changes, so lookups of names that don't exist are cached too. Template
+    files are read again only when they change, and compiled templates are
+    reused for as long as the file's content is the same.
+
+    A file or directory is only trusted not to have changed if it had not
+    been modified for `racy_interval` seconds before it was read, since a
+    change within the resolution of the filesystem's timestamps would not
+    be noticed otherwise.
+
+    Preseeds are rendered in database threads, so all access to the cache
+    is serialised with a lock.
+    """
+
+    racy_interval = 2
+
+    def __init__(self):
+        self.enabled = True
+        self._listings = {}
+        self._files = {}
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def clear(self):
+        """Forget everything that has been cached."""
+        with self._lock:
+            self._listings.clear()
+            self._files.clear()
+            self._templates.clear()
+
+    def _stat(self, path):
+        """Return a stamp for `path` that changes when it's modified.
+
+        This is None if the path doesn't exist, or if it was modified too
+        recently to be sure a later change would alter the stamp.
+        """
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if time.time() - st.st_mtime < self.racy_interval:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def _cached(self, cache, path, load):
+        """Return `load(path)`, reusing the last result if `path` is the same.
+
+        :return: A tuple of the result and whether it was cached.
+        """
+        stamp = self._stat(path)
+        with self._lock:
+            entry = cache.get(path)
+        if stamp is not None and entry is not None and entry[0] == stamp:
+            return entry[1], True
+        value = load(path)
+        with self._lock:
+            if stamp is None:
+                cache.pop(path, None)
+            else:
+                cache[path] = stamp, value
+        return value, False
+
+    def _list(self, location):
+        try:
+            return frozenset(os.listdir(location))
+        except OSError:
+            return frozenset()
+
+    def _read(self, filepath):
+        try:
+            with open(filepath, "r", encoding="utf-8") as stream:
+                return stream.read()
+        except IOError:
+            return None
+
+    def find(self, locations, filenames):
+        """Get the path and content for the first template found.
+
+        :param locations: The directories to look in, in order.
+        :param filenames: Relative filenames to look for, in order.
+        """
+        if not self.enabled:
+            listings = [None] * len(locations)
+            hit = False
+        else:
+            results = [
+                self._cached(self._listings, location, self._list)
+                for location in locations
+            ]
+            listings = [listing for listing, _ in results]
+            hit = all(cached for _, cached in results)
+        PROMETHEUS_METRICS.update(
+            "maas_preseed_template_cache_requests",
+            "inc",
+            labels={"kind": "lookup", "result": "hit" if hit else "miss"},
+        )
+        for location, listing in zip(locations, listings):
+            for filename in filenames:
+                if listing is not None and filename not in listing:
+                    continue
+                filepath = os.path.join(location, filename)
+                if self.enabled:
+                    content, _ = self._cached(
+                        self._files, filepath, self._read
+                    )
+                else:
+                    content = self._read(filepath)
+                if content is not None:
+                    return filepath, content
+        return None, None
+
+    def compile(self, filepath, content, get_template):
+        """Return a `PreseedTemplate` for `content`, read from `filepath`.
+
+        The template is compiled once for each file and content, and a copy
+        using `get_template` to load other templates is returned.
+        """
+        with self._lock:
+            entry = self._templates.get(filepath)
+        if self.enabled and entry is not None and entry[0] == content:
+            template = copy.copy(entry[1])
+            template.get_template = get_template
+            result = "hit"
+        else:
+            template = PreseedTemplate(
+                content, name=filepath, get_template=get_template
+            )
+            if self.enabled:
+                with self._lock:
+                    self._templates[filepath] = content, template
+            result = "miss"
+        PROMETHEUS_METRICS.update(
+            "maas_preseed_template_cache_requests",
+            "inc",
+            labels={"kind": "template", "result": result},
+        )
+        return template
+
+
+preseed_template_cache = PreseedTemplateCache()
+
+
 class TemplateNotFoundError(Exception):
     """The template has not been found."""
 
@@ -788,9 +930,7 @@ def load_preseed_template(node, prefix, osystem="", release=""):
             raise TemplateNotFoundError(name)
         # This is where the closure happens: pass `get_template` when
         # instanciating PreseedTemplate.
-        return PreseedTemplate(
-            content, name=filepath, get_template=get_template
-        )
+        return preseed_template_cache.compile(filepath, content, get_template)
 
     return get_template(prefix, None, default=True)
 
@@ -10,7 +10,9 @@ DNS:
     The regiond process listens for messages from Postgres on channel
     'sys_dns'. Any time a message is recieved on that channel the DNS is marked
     as requiring an update. Once marked for update the DNS configuration is
-    updated and bind9 is told to reload.
+    updated and bind9 is told to reload. Only the zones that have changed
+    since they were last published are rewritten and reloaded, unless the
+    configuration of bind9 itself needs to change.
 
 Proxy:
     The regiond process listens for messages from Postgres on channel
@@ -178,7 +180,9 @@ class RegionControllerService(Service):
         defers = []
         if self.needsDNSUpdate:
             self.needsDNSUpdate = False
-            d = deferToDatabase(transactional(dns_update_all_zones))
+            d = deferToDatabase(
+                transactional(dns_update_all_zones), incremental=True
+            )
             d.addCallback(self._checkSerial)
             d.addCallback(self._logDNSReload)
             # Order here matters, first needsDNSUpdate is set then pass the
@@ -0,0 +1,94 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Service that keeps the boot config cache of a region process current."""
+
+__all__ = ["BootConfigService"]
+
+from twisted.application.internet import TimerService
+
+from maasserver.rpc.bootcache import boot_config_cache, boot_write_behind
+from maasserver.utils.threads import deferToDatabase
+from provisioningserver.logger import LegacyLogger
+
+log = LegacyLogger()
+
+
+# How often, in seconds, the node updates and events queued by boot config
+# requests are written.
+FLUSH_INTERVAL = 1
+
+# A change notified on any of these channels may change the boot config of
+# any machine.
+GLOBAL_CHANNELS = (
+    "config",
+    "controller",
+    "domain",
+    "fabric",
+    "subnet",
+    "tag",
+    "vlan",
+)
+
+# A change notified on any of these channels only changes the boot config
+# of the node that changed.
+NODE_CHANNELS = ("machine", "device")
+
+
+class BootConfigService(TimerService):
+    """Enable the boot config cache and write-behind while running.
+
+    Cached boot configs are dropped when the database notifies a change
+    that may affect them. While the listener is disconnected notifications
+    can be missed, so the cache is disabled until it reconnects.
+    """
+
+    def __init__(self, postgresListener):
+        super().__init__(FLUSH_INTERVAL, self.flush)
+        self.listener = postgresListener
+
+    def startService(self):
+        for channel in GLOBAL_CHANNELS:
+            self.listener.register(channel, self.clearCache)
+        for channel in NODE_CHANNELS:
+            self.listener.register(channel, self.invalidateNode)
+        self.listener.register("sys_boot_resources", self.clearCache)
+        self.listener.events.connected.registerHandler(self.enableCache)
+        self.listener.events.disconnected.registerHandler(self.disableCache)
+        self.enableCache()
+        boot_write_behind.enabled = True
+        super().startService()
+
+    def stopService(self):
+        self.disableCache()
+        boot_write_behind.enabled = False
+        self.listener.events.connected.unregisterHandler(self.enableCache)
+        self.listener.events.disconnected.unregisterHandler(self.disableCache)
+        self.listener.unregister("sys_boot_resources", self.clearCache)
+        for channel in NODE_CHANNELS:
+            self.listener.unregister(channel, self.invalidateNode)
+        for channel in GLOBAL_CHANNELS:
+            self.listener.unregister(channel, self.clearCache)
+        d = super().stopService()
+        # Write what was queued after the last flush.
+        d.addCallback(lambda _: self.flush())
+        return d
+
+    def enableCache(self):
+        boot_config_cache.clear()
+        boot_config_cache.enabled = True
+
+    def disableCache(self, reason=None):
+        boot_config_cache.enabled = False
+        boot_config_cache.clear()
+
+    def clearCache(self, *args):
+        boot_config_cache.clear()
+
+    def invalidateNode(self, action, system_id):
+        boot_config_cache.invalidate_node(system_id)
+
+    def flush(self):
+        d = deferToDatabase(boot_write_behind.flush)
+        d.addErrback(log.err, "Failed to write boot config node updates.")
+        return d
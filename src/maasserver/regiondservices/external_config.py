@@ -0,0 +1,139 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Service that keeps rack controllers' external services configuration
+current."""
+
+__all__ = ["ExternalConfigService"]
+
+from twisted.application.service import Service
+from twisted.internet import reactor
+from twisted.internet.defer import DeferredLock, inlineCallbacks
+from twisted.protocols.amp import UnhandledCommand
+
+from maasserver.rpc import getAllClients
+from maasserver.rpc.externalconfig import (
+    external_config_digests,
+    get_config_digests,
+)
+from maasserver.utils.threads import deferToDatabase
+from provisioningserver.logger import LegacyLogger
+from provisioningserver.rpc.cluster import RefreshExternalServices
+from provisioningserver.rpc.exceptions import NoSuchNode
+
+log = LegacyLogger()
+
+
+# A change notified on any of these channels may change the configuration
+# of any rack controller's external services.
+CHANNELS = (
+    "config",
+    "controller",
+    "fabric",
+    "space",
+    "staticroute",
+    "subnet",
+    "vlan",
+)
+
+
+class ExternalConfigService(Service):
+    """Keep rack controllers' external services configuration current.
+
+    While running, the configuration digests of rack controllers are cached
+    (see `external_config_digests`). When the database notifies a change
+    that may affect them the cache is cleared, and each connected rack
+    controller whose digests differ from those last sent to it is told to
+    refresh. Changes often come in bursts, so this waits `PUSH_DELAY`
+    seconds after the first to gather the rest.
+
+    While the listener is disconnected notifications can be missed, so the
+    cache is disabled until it reconnects, and then every rack controller
+    is checked. Rack controllers also still poll, slowly, in case a push is
+    missed.
+
+    Every region worker runs this, and each rack controller is connected to
+    all of them, so a rack controller is told about a change several times;
+    it only fetches the configuration once.
+    """
+
+    PUSH_DELAY = 2
+
+    def __init__(self, postgresListener, clock=reactor):
+        super().__init__()
+        self.listener = postgresListener
+        self.clock = clock
+        # The digests last sent to each rack controller.
+        self._pushed = {}
+        self._call = None
+        self._lock = DeferredLock()
+
+    def startService(self):
+        for channel in CHANNELS:
+            self.listener.register(channel, self.configChanged)
+        self.listener.events.connected.registerHandler(self.enableCache)
+        self.listener.events.disconnected.registerHandler(self.disableCache)
+        self.enableCache()
+        super().startService()
+
+    def stopService(self):
+        self.disableCache()
+        self.listener.events.connected.unregisterHandler(self.enableCache)
+        self.listener.events.disconnected.unregisterHandler(self.disableCache)
+        for channel in CHANNELS:
+            self.listener.unregister(channel, self.configChanged)
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._call = None
+        return super().stopService()
+
+    def enableCache(self):
+        external_config_digests.clear()
+        external_config_digests.enabled = True
+        self.schedulePush()
+
+    def disableCache(self, reason=None):
+        external_config_digests.enabled = False
+        external_config_digests.clear()
+
+    def configChanged(self, *args):
+        external_config_digests.clear()
+        self.schedulePush()
+
+    def schedulePush(self):
+        if self._call is None or not self._call.active():
+            self._call = self.clock.callLater(self.PUSH_DELAY, self.push)
+
+    def push(self):
+        d = self._lock.run(self._push)
+        d.addErrback(log.err, "Failed to push external services changes.")
+        return d
+
+    @inlineCallbacks
+    def _push(self):
+        clients = getAllClients()
+        idents = {client.ident for client in clients}
+        for ident in set(self._pushed) - idents:
+            del self._pushed[ident]
+        for client in clients:
+            try:
+                digests = yield deferToDatabase(
+                    get_config_digests, client.ident
+                )
+            except NoSuchNode:
+                continue
+            if self._pushed.get(client.ident) == digests:
+                continue
+            try:
+                yield client(RefreshExternalServices, digests=digests)
+            except UnhandledCommand:
+                # An older rack controller; it'll notice when it polls.
+                pass
+            except Exception:
+                log.err(
+                    None,
+                    "Failed to push external services changes to %s."
+                    % client.ident,
+                )
+                continue
+            self._pushed[client.ident] = digests
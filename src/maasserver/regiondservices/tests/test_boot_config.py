@@ -0,0 +1,108 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for the boot config cache service."""
+
+__all__ = []
+
+from unittest.mock import call, Mock
+
+from twisted.internet.defer import succeed
+
+from maasserver.regiondservices import boot_config
+from maasserver.regiondservices.boot_config import BootConfigService
+from maasserver.rpc.bootcache import BootConfigCache, BootWriteBehind
+from maastesting.matchers import MockCalledOnceWith, MockCallsMatch
+from maastesting.testcase import MAASTestCase
+
+
+class TestBootConfigService(MAASTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = BootConfigCache()
+        self.patch(boot_config, "boot_config_cache", self.cache)
+        self.write_behind = BootWriteBehind()
+        self.patch(boot_config, "boot_write_behind", self.write_behind)
+        self.deferToDatabase = self.patch(boot_config, "deferToDatabase")
+        self.deferToDatabase.return_value = succeed(None)
+
+    def test_registers_and_unregisters_listener(self):
+        listener = Mock()
+        service = BootConfigService(listener)
+        service.startService()
+        expected_calls = [
+            call(channel, service.clearCache)
+            for channel in boot_config.GLOBAL_CHANNELS
+        ]
+        expected_calls.extend(
+            call(channel, service.invalidateNode)
+            for channel in boot_config.NODE_CHANNELS
+        )
+        expected_calls.append(call("sys_boot_resources", service.clearCache))
+        self.assertThat(listener.register, MockCallsMatch(*expected_calls))
+        self.assertThat(
+            listener.events.connected.registerHandler,
+            MockCalledOnceWith(service.enableCache),
+        )
+        self.assertThat(
+            listener.events.disconnected.registerHandler,
+            MockCalledOnceWith(service.disableCache),
+        )
+        service.stopService()
+        self.assertItemsEqual(
+            expected_calls, listener.unregister.call_args_list
+        )
+        self.assertThat(
+            listener.events.connected.unregisterHandler,
+            MockCalledOnceWith(service.enableCache),
+        )
+        self.assertThat(
+            listener.events.disconnected.unregisterHandler,
+            MockCalledOnceWith(service.disableCache),
+        )
+
+    def test_enables_cache_and_write_behind_while_running(self):
+        service = BootConfigService(Mock())
+        service.startService()
+        self.assertTrue(self.cache.enabled)
+        self.assertTrue(self.write_behind.enabled)
+        service.stopService()
+        self.assertFalse(self.cache.enabled)
+        self.assertFalse(self.write_behind.enabled)
+
+    def test_flushes_periodically_and_on_stop(self):
+        service = BootConfigService(Mock())
+        service.startService()
+        service.stopService()
+        self.assertThat(
+            self.deferToDatabase,
+            MockCallsMatch(
+                call(self.write_behind.flush), call(self.write_behind.flush)
+            ),
+        )
+
+    def test_disconnect_disables_cache_until_reconnected(self):
+        service = BootConfigService(Mock())
+        self.cache.enabled = True
+        self.cache.set("kind", "key", "value", self.cache.token())
+        service.disableCache(Mock())
+        self.assertFalse(self.cache.enabled)
+        self.assertEqual(0, len(self.cache))
+        service.enableCache()
+        self.assertTrue(self.cache.enabled)
+
+    def test_clearCache_drops_everything(self):
+        service = BootConfigService(Mock())
+        self.cache.enabled = True
+        self.cache.set("kind", "key", "value", self.cache.token())
+        service.clearCache("sys_boot_resources", "")
+        self.assertEqual(0, len(self.cache))
+
+    def test_invalidateNode_drops_node(self):
+        service = BootConfigService(Mock())
+        self.cache.enabled = True
+        token = self.cache.token()
+        self.cache.set("kind", "key", "value", token)
+        self.cache.set("kind", "node", "value", token, system_id="abc")
+        service.invalidateNode("update", "abc")
+        self.assertEqual(1, len(self.cache))
@@ -0,0 +1,187 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for the external services configuration service."""
+
+__all__ = []
+
+from unittest.mock import call, Mock
+
+from twisted.internet.defer import fail, succeed
+from twisted.internet.task import Clock
+from twisted.protocols.amp import UnhandledCommand
+
+from maasserver.regiondservices import external_config
+from maasserver.regiondservices.external_config import ExternalConfigService
+from maasserver.rpc.externalconfig import (
+    ExternalConfigDigests,
+    get_config_digests,
+)
+from maastesting.factory import factory
+from maastesting.matchers import (
+    MockCalledOnceWith,
+    MockCallsMatch,
+    MockNotCalled,
+)
+from maastesting.testcase import MAASTestCase
+from maastesting.twisted import TwistedLoggerFixture
+from provisioningserver.rpc.cluster import RefreshExternalServices
+from provisioningserver.rpc.exceptions import NoSuchNode
+
+
+def make_client(ident=None):
+    client = Mock(return_value=succeed({}))
+    client.ident = factory.make_name("system_id") if ident is None else ident
+    return client
+
+
+class TestExternalConfigService(MAASTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = ExternalConfigDigests()
+        self.patch(external_config, "external_config_digests", self.cache)
+        self.digests = {}
+        self.deferToDatabase = self.patch(external_config, "deferToDatabase")
+        self.deferToDatabase.side_effect = lambda func, system_id: succeed(
+            self.digests.setdefault(system_id, {"dns": "digest"})
+        )
+        self.clients = []
+        self.patch(
+            external_config, "getAllClients"
+        ).side_effect = lambda: self.clients
+
+    def make_service(self):
+        return ExternalConfigService(Mock(), Clock())
+
+    def test_registers_and_unregisters_listener(self):
+        listener = Mock()
+        service = ExternalConfigService(listener, Clock())
+        service.startService()
+        expected_calls = [
+            call(channel, service.configChanged)
+            for channel in external_config.CHANNELS
+        ]
+        self.assertThat(listener.register, MockCallsMatch(*expected_calls))
+        self.assertThat(
+            listener.events.connected.registerHandler,
+            MockCalledOnceWith(service.enableCache),
+        )
+        self.assertThat(
+            listener.events.disconnected.registerHandler,
+            MockCalledOnceWith(service.disableCache),
+        )
+        service.stopService()
+        self.assertItemsEqual(
+            expected_calls, listener.unregister.call_args_list
+        )
+        self.assertThat(
+            listener.events.connected.unregisterHandler,
+            MockCalledOnceWith(service.enableCache),
+        )
+        self.assertThat(
+            listener.events.disconnected.unregisterHandler,
+            MockCalledOnceWith(service.disableCache),
+        )
+
+    def test_enables_cache_while_running(self):
+        service = self.make_service()
+        service.startService()
+        self.assertTrue(self.cache.enabled)
+        service.stopService()
+        self.assertFalse(self.cache.enabled)
+        self.assertFalse(service.clock.getDelayedCalls())
+
+    def test_disconnect_disables_cache_until_reconnected(self):
+        service = self.make_service()
+        self.cache.enabled = True
+        self.cache.get_or_compute("abc", dict)
+        service.disableCache(Mock())
+        self.assertFalse(self.cache.enabled)
+        self.assertEqual(0, len(self.cache))
+        service.enableCache()
+        self.assertTrue(self.cache.enabled)
+
+    def test_configChanged_clears_cache_and_pushes_after_delay(self):
+        client = make_client()
+        self.clients = [client]
+        service = self.make_service()
+        self.cache.enabled = True
+        self.cache.get_or_compute("abc", dict)
+        service.configChanged("config", "update", "")
+        service.configChanged("subnet", "update", "")
+        self.assertEqual(0, len(self.cache))
+        self.assertThat(client, MockNotCalled())
+        service.clock.advance(service.PUSH_DELAY)
+        self.assertThat(
+            client,
+            MockCalledOnceWith(
+                RefreshExternalServices, digests=self.digests[client.ident]
+            ),
+        )
+        self.assertThat(
+            self.deferToDatabase,
+            MockCalledOnceWith(get_config_digests, client.ident),
+        )
+
+    def test_push_skips_racks_whose_digests_are_unchanged(self):
+        unchanged, changed = make_client(), make_client()
+        self.clients = [unchanged, changed]
+        service = self.make_service()
+        service.push()
+        self.digests[changed.ident] = {"dns": "changed"}
+        service.push()
+        self.assertThat(
+            unchanged,
+            MockCalledOnceWith(
+                RefreshExternalServices, digests={"dns": "digest"}
+            ),
+        )
+        self.assertThat(
+            changed,
+            MockCallsMatch(
+                call(RefreshExternalServices, digests={"dns": "digest"}),
+                call(RefreshExternalServices, digests={"dns": "changed"}),
+            ),
+        )
+
+    def test_push_forgets_disconnected_racks(self):
+        client = make_client()
+        self.clients = [client]
+        service = self.make_service()
+        service.push()
+        self.clients = []
+        service.push()
+        self.assertEqual({}, service._pushed)
+
+    def test_push_ignores_older_racks(self):
+        client = make_client()
+        client.return_value = fail(UnhandledCommand())
+        self.clients = [client]
+        service = self.make_service()
+        with TwistedLoggerFixture() as logger:
+            service.push()
+        self.assertEqual("", logger.output)
+        self.assertIn(client.ident, service._pushed)
+
+    def test_push_ignores_unknown_racks(self):
+        client = make_client()
+        self.clients = [client]
+        self.deferToDatabase.side_effect = lambda *args: fail(NoSuchNode())
+        service = self.make_service()
+        service.push()
+        self.assertThat(client, MockNotCalled())
+
+    def test_push_logs_failure_and_tries_again_next_time(self):
+        client = make_client()
+        client.return_value = fail(factory.make_exception())
+        self.clients = [client]
+        service = self.make_service()
+        with TwistedLoggerFixture() as logger:
+            service.push()
+        self.assertIn(
+            "Failed to push external services changes to %s." % client.ident,
+            logger.output,
+        )
+        client.return_value = succeed({})
+        service.push()
+        self.assertEqual(2, client.call_count)
@@ -28,10 +28,11 @@ from maasserver.preseed import (
     compose_enlistment_preseed_url,
     compose_preseed_url,
 )
+from maasserver.rpc.bootcache import boot_config_cache, boot_write_behind
 from maasserver.third_party_drivers import get_third_party_driver
 from maasserver.utils.orm import transactional
 from maasserver.utils.osystems import validate_hwe_kernel
-from provisioningserver.events import EVENT_TYPES
+from provisioningserver.events import EVENT_DETAILS, EVENT_TYPES
 from provisioningserver.logger import get_maas_logger
 from provisioningserver.rpc.exceptions import BootConfigNoResponse
 from provisioningserver.utils.network import get_source_address
@@ -43,6 +44,22 @@ maaslog = get_maas_logger("rpc.boot")
 
 DEFAULT_ARCH = "i386"
 
+# The configuration needed to answer a boot config request.
+CONFIG_KEYS = [
+    "commissioning_osystem",
+    "commissioning_distro_series",
+    "enable_third_party_drivers",
+    "default_min_hwe_kernel",
+    "default_osystem",
+    "default_distro_series",
+    "kernel_opts",
+    "use_rack_proxy",
+    "maas_internal_domain",
+    "remote_syslog",
+    "maas_syslog_port",
+    "node_timeout",
+]
+
 
 def get_node_from_mac_or_hardware_uuid(mac=None, hardware_uuid=None):
     """Get a Node object from a MAC address or hardware UUID string.
@@ -80,6 +97,23 @@ def event_log_pxe_request(machine, purpose):
         "local": "local boot",
         "poweroff": "power off",
     }
+    if boot_write_behind.enabled:
+        boot_write_behind.log_events(
+            machine,
+            [
+                {
+                    "type_name": event_type,
+                    "type_description": EVENT_DETAILS[event_type].description,
+                    "type_level": EVENT_DETAILS[event_type].level,
+                    "event_description": description,
+                }
+                for event_type, description in [
+                    (EVENT_TYPES.NODE_PXE_REQUEST, options[purpose]),
+                    (EVENT_TYPES.PERFORMING_PXE_BOOT, ""),
+                ]
+            ],
+        )
+        return
     Event.objects.create_node_event(
         machine,
         event_type=EVENT_TYPES.NODE_PXE_REQUEST,
@@ -91,6 +125,18 @@ def event_log_pxe_request(machine, purpose):
     )
 
 
+def save_boot_fields(machine):
+    """Save the fields a boot config request changes on `machine`.
+
+    The write is queued instead when boot write-behind is enabled.
+    """
+    if boot_write_behind.enabled:
+        boot_write_behind.update_node(machine)
+    else:
+        # Does nothing if the machine hasn't changed.
+        machine.save()
+
+
 def get_boot_filenames(
     arch,
     subarch,
@@ -299,6 +345,16 @@ def get_base_url_for_local_ip(local_ip, internal_domain):
         return "http://%s:5248/" % local_ip
 
 
+def get_cached_base_url_for_local_ip(local_ip, internal_domain, token):
+    """Get the base URL for the preseed, using the boot config cache."""
+    return boot_config_cache.get_or_compute(
+        "base_url",
+        (local_ip, internal_domain),
+        lambda: get_base_url_for_local_ip(local_ip, internal_domain),
+        token,
+    )
+
+
 def get_final_boot_purpose(machine, arch, purpose):
     """Return the final boot purpose."""
     if machine is None and arch == DEFAULT_ARCH:
@@ -332,11 +388,18 @@ def get_config(
     for :py:class:`~provisioningserver.rpc.region.GetBootConfig`.
 
     Raises BootConfigNoResponse when booting machine should fail to next file.
+
+    When the boot config cache is enabled, a request that was answered
+    before, and whose answer hasn't been invalidated since, only needs the
+    query that looks up the booting machine.
     """
-    rack_controller = RackController.objects.get(system_id=system_id)
-    region_ip = None
-    if remote_ip is not None:
-        region_ip = get_source_address(remote_ip)
+    token = boot_config_cache.token()
+    rack_controller = boot_config_cache.get_or_compute(
+        "rack",
+        system_id,
+        lambda: RackController.objects.get(system_id=system_id),
+        token,
+    )
     machine = get_node_from_mac_or_hardware_uuid(mac, hardware_uuid)
 
     # Fail with no response early so no extra work is performed.
@@ -349,21 +412,43 @@ def get_config(
         # request so PXELinux will move onto the next request.
         raise BootConfigNoResponse()
 
+    if machine is None:
+        cache_kind = "enlistment"
+        cache_key = (system_id, local_ip, remote_ip, arch, subarch)
+        params = boot_config_cache.get(cache_kind, cache_key)
+        if params is not None:
+            return dict(params)
+    else:
+        cache_kind = "machine"
+        cache_key = (
+            system_id,
+            local_ip,
+            remote_ip,
+            mac,
+            machine.id,
+            machine.updated,
+        )
+        cached = boot_config_cache.get(
+            cache_kind, cache_key, system_id=machine.system_id
+        )
+        if cached is not None:
+            params, event_purpose, boot_interface_id, node_timeout = cached
+            machine.boot_cluster_ip = local_ip
+            machine.bios_boot_method = bios_boot_method
+            machine.boot_interface_id = boot_interface_id
+            machine.reset_status_expires(node_timeout=node_timeout)
+            save_boot_fields(machine)
+            if event_purpose is not None:
+                event_log_pxe_request(machine, event_purpose)
+            return dict(params)
+
+    region_ip = None
+    if remote_ip is not None:
+        region_ip = get_source_address(remote_ip)
+
     # Get all required configuration objects in a single query.
-    configs = Config.objects.get_configs(
-        [
-            "commissioning_osystem",
-            "commissioning_distro_series",
-            "enable_third_party_drivers",
-            "default_min_hwe_kernel",
-            "default_osystem",
-            "default_distro_series",
-            "kernel_opts",
-            "use_rack_proxy",
-            "maas_internal_domain",
-            "remote_syslog",
-            "maas_syslog_port",
-        ]
+    configs = boot_config_cache.get_or_compute(
+        "configs", None, lambda: Config.objects.get_configs(CONFIG_KEYS), token
     )
 
     # Compute the syslog server.
@@ -433,17 +518,15 @@ def get_config(
         # Reset the machine's status_expires whenever the boot_config is called
         # on a known machine. This allows a machine to take up to the maximum
         # timeout status to POST.
-        machine.reset_status_expires()
-
-        # Does nothing if the machine hasn't changed.
-        machine.save()
+        machine.reset_status_expires(node_timeout=configs["node_timeout"])
+        save_boot_fields(machine)
 
         arch, subarch = machine.split_arch()
         if configs["use_rack_proxy"]:
             preseed_url = compose_preseed_url(
                 machine,
-                base_url=get_base_url_for_local_ip(
-                    local_ip, configs["maas_internal_domain"]
+                base_url=get_cached_base_url_for_local_ip(
+                    local_ip, configs["maas_internal_domain"], token
                 ),
             )
         else:
@@ -475,7 +558,7 @@ def get_config(
                 # on the rack.
                 purpose = "local-device"
 
-            return {
+            params = {
                 "system_id": machine.system_id,
                 "arch": arch,
                 "subarch": subarch,
@@ -494,6 +577,19 @@ def get_config(
                 "extra_opts": "",
                 "http_boot": True,
             }
+            boot_config_cache.set(
+                cache_kind,
+                cache_key,
+                (
+                    params,
+                    None,
+                    machine.boot_interface_id,
+                    configs["node_timeout"],
+                ),
+                token,
+                system_id=machine.system_id,
+            )
+            return dict(params)
 
         # Log the request into the event log for that machine.
         if (
@@ -501,9 +597,10 @@ def get_config(
             in [NODE_STATUS.ENTERING_RESCUE_MODE, NODE_STATUS.RESCUE_MODE]
             and purpose == "commissioning"
         ):
-            event_log_pxe_request(machine, "rescue")
+            event_purpose = "rescue"
         else:
-            event_log_pxe_request(machine, purpose)
+            event_purpose = purpose
+        event_log_pxe_request(machine, event_purpose)
 
         osystem, series, subarch = get_boot_config_for_machine(
             machine, configs, purpose
@@ -549,8 +646,8 @@ def get_config(
         purpose = "commissioning"  # enlistment
         if configs["use_rack_proxy"]:
             preseed_url = compose_enlistment_preseed_url(
-                base_url=get_base_url_for_local_ip(
-                    local_ip, configs["maas_internal_domain"]
+                base_url=get_cached_base_url_for_local_ip(
+                    local_ip, configs["maas_internal_domain"], token
                 )
             )
         else:
@@ -600,13 +697,25 @@ def get_config(
         extra_kernel_opts = configs["kernel_opts"]
 
     boot_purpose = get_final_boot_purpose(machine, arch, purpose)
-    kernel, initrd, boot_dtb = get_boot_filenames(
-        arch,
-        subarch,
-        osystem,
-        series,
-        commissioning_osystem=configs["commissioning_osystem"],
-        commissioning_distro_series=configs["commissioning_distro_series"],
+    kernel, initrd, boot_dtb = boot_config_cache.get_or_compute(
+        "boot_filenames",
+        (
+            arch,
+            subarch,
+            osystem,
+            series,
+            configs["commissioning_osystem"],
+            configs["commissioning_distro_series"],
+        ),
+        lambda: get_boot_filenames(
+            arch,
+            subarch,
+            osystem,
+            series,
+            commissioning_osystem=configs["commissioning_osystem"],
+            commissioning_distro_series=configs["commissioning_distro_series"],
+        ),
+        token,
     )
 
     # Return the params to the rack controller. Include the system_id only
@@ -631,6 +740,20 @@ def get_config(
         # rack controllers use HTTP boot as well.
         "http_boot": True,
     }
-    if machine is not None:
+    if machine is None:
+        boot_config_cache.set(cache_kind, cache_key, params, token)
+    else:
         params["system_id"] = machine.system_id
-    return params
+        boot_config_cache.set(
+            cache_kind,
+            cache_key,
+            (
+                params,
+                event_purpose,
+                machine.boot_interface_id,
+                configs["node_timeout"],
+            ),
+            token,
+            system_id=machine.system_id,
+        )
+    return dict(params)
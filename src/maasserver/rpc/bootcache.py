@@ -0,0 +1,236 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Cache and write-behind for boot configuration requests.
+
+When a large number of machines PXE boot at the same time every rack
+controller asks the region for the boot configuration of each of them,
+often several times per machine. Almost everything needed to answer is
+shared: configuration, rack controllers, subnets and the usable boot
+resources. `BootConfigCache` keeps what was worked out for one request so
+that the next ones can reuse it, until a notification from the database
+says it may have changed.
+
+Each request also updates a few fields on the booting node and logs events
+for it. `BootWriteBehind` queues those writes so they can be done for many
+requests at once, instead of in the transaction of each request.
+"""
+
+__all__ = ["boot_config_cache", "boot_write_behind"]
+
+from collections import OrderedDict
+import threading
+
+from django.db.models import Case, DateTimeField, F, Value, When
+
+from maasserver.models import Event, Interface, Node
+from maasserver.models.timestampedmodel import now
+from maasserver.utils.orm import transactional
+from provisioningserver.prometheus.metrics import PROMETHEUS_METRICS
+
+
+class BootConfigCache:
+    """Per-process cache of values used to answer boot config requests.
+
+    Entries are keyed by a kind, naming what the value is, and a key within
+    that kind. Entries computed for a particular node are also tagged with
+    its system_id, so they can be dropped when only that node changes.
+
+    Each invalidation advances a counter. `token` must be read before the
+    data for a value is loaded from the database and passed back to `set`,
+    so a value computed from data read before an invalidation is never
+    stored after it.
+
+    Cached values are shared between requests, so callers must treat them
+    as read-only.
+
+    The cache is read and written from database threads and invalidated
+    from the reactor, so all access is serialised with a lock. It starts
+    disabled; it is enabled by the service that invalidates it.
+    """
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.enabled = False
+        self._entries = OrderedDict()
+        self._counter = 0
+        self._cleared_at = 0
+        self._invalidated_at = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def token(self):
+        """Return the current invalidation token."""
+        with self._lock:
+            return self._counter
+
+    def _is_current(self, token, system_id):
+        return token >= self._cleared_at and token >= (
+            self._invalidated_at.get(system_id, 0)
+        )
+
+    def invalidate_node(self, system_id):
+        """Drop every cached value computed for `system_id`."""
+        with self._lock:
+            self._counter += 1
+            self._invalidated_at[system_id] = self._counter
+            stale = [
+                key
+                for key, (entry_id, _, _) in self._entries.items()
+                if entry_id == system_id
+            ]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        """Drop every cached value."""
+        with self._lock:
+            self._counter += 1
+            self._cleared_at = self._counter
+            self._invalidated_at.clear()
+            self._entries.clear()
+
+    def get(self, kind, key, system_id=None):
+        """Return the cached value or `None` if there is none."""
+        if not self.enabled:
+            return None
+        cache_key = (kind, key)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and self._is_current(entry[1], system_id):
+                self._entries.move_to_end(cache_key)
+                value = entry[2]
+            else:
+                value = None
+        PROMETHEUS_METRICS.update(
+            "maas_boot_config_cache_requests",
+            "inc",
+            labels={
+                "kind": kind,
+                "result": "miss" if value is None else "hit",
+            },
+        )
+        return value
+
+    def set(self, kind, key, value, token, system_id=None):
+        """Store `value` unless it was invalidated since `token`."""
+        if not self.enabled or value is None:
+            return
+        cache_key = (kind, key)
+        with self._lock:
+            if not self._is_current(token, system_id):
+                return
+            self._entries[cache_key] = (system_id, token, value)
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, kind, key, compute, token, system_id=None):
+        """Return the cached value, calling `compute` to fill it if needed."""
+        value = self.get(kind, key, system_id=system_id)
+        if value is None:
+            value = compute()
+            self.set(kind, key, value, token, system_id=system_id)
+        return value
+
+
+class BootWriteBehind:
+    """Queue of node updates and events made by boot config requests.
+
+    Only the fields that a boot config request changes are written: the
+    boot cluster IP, the BIOS boot method, the boot interface and the
+    status expiry. The status expiry is only written if the node is still
+    in the status it was in when the request was made.
+
+    Queued writes are lost if the process stops before they are flushed;
+    they only record the last boot request, which the next one replaces.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._updates = {}
+        self._events = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._updates) + len(self._events)
+
+    def update_node(self, node):
+        """Queue writing the boot fields of `node`."""
+        fields = {
+            "boot_cluster_ip": node.boot_cluster_ip,
+            "bios_boot_method": node.bios_boot_method,
+            "boot_interface_id": node.boot_interface_id,
+        }
+        if node.status_expires is not None:
+            fields["status_expires"] = (node.status, node.status_expires)
+        with self._lock:
+            self._updates[node.id] = fields
+
+    def log_events(self, node, events):
+        """Queue registering `events` for `node`.
+
+        :param events: a list of event dicts as accepted by
+            `EventManager.register_node_events`.
+        """
+        created = now()
+        with self._lock:
+            self._events.extend(
+                (node.id, dict(event, created=created)) for event in events
+            )
+
+    def flush(self):
+        """Write everything queued so far."""
+        with self._lock:
+            updates, self._updates = self._updates, {}
+            events, self._events = self._events, []
+        if updates or events:
+            self._write(updates, events)
+
+    @transactional
+    def _write(self, updates, events):
+        node_ids = set(updates)
+        node_ids.update(node_id for node_id, _ in events)
+        nodes = Node.objects.in_bulk(node_ids)
+        interface_ids = {
+            fields["boot_interface_id"]
+            for fields in updates.values()
+            if fields["boot_interface_id"] is not None
+        }
+        if interface_ids:
+            # The boot interface may have been deleted since the request.
+            interface_ids = set(
+                Interface.objects.filter(id__in=interface_ids).values_list(
+                    "id", flat=True
+                )
+            )
+        for node_id, fields in updates.items():
+            if node_id not in nodes:
+                continue
+            values = dict(fields)
+            if (
+                values["boot_interface_id"] is not None
+                and values["boot_interface_id"] not in interface_ids
+            ):
+                del values["boot_interface_id"]
+            if "status_expires" in values:
+                status, expires = values["status_expires"]
+                values["status_expires"] = Case(
+                    When(status=status, then=Value(expires)),
+                    default=F("status_expires"),
+                    output_field=DateTimeField(),
+                )
+            Node.objects.filter(id=node_id).update(**values)
+        node_events = OrderedDict()
+        for node_id, event in events:
+            if node_id in nodes:
+                node_events.setdefault(node_id, []).append(event)
+        for node_id, node_event_list in node_events.items():
+            Event.objects.register_node_events(nodes[node_id], node_event_list)
+
+
+boot_config_cache = BootConfigCache()
+boot_write_behind = BootWriteBehind()
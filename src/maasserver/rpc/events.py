@@ -3,11 +3,21 @@
 
 """RPC helpers relating to events."""
 
-__all__ = ["register_event_type", "send_event", "send_event_mac_address"]
+__all__ = [
+    "register_event_type",
+    "send_event",
+    "send_event_mac_address",
+    "send_events",
+]
+
+from datetime import datetime
+
+from netaddr import AddrFormatError, EUI, IPAddress
 
 from maasserver.enum import INTERFACE_TYPE
 from maasserver.models import Event, EventType, Interface, Node
 from maasserver.utils.orm import transactional
+from provisioningserver.events import EVENT_DETAILS
 from provisioningserver.logger import LegacyLogger
 from provisioningserver.rpc.exceptions import NoSuchEventType
 from provisioningserver.utils.twisted import synchronous
@@ -129,3 +139,136 @@ def send_event_ip_address(ip_address, type_name, description, timestamp):
             description=description,
             created=timestamp,
         )
+
+
+def _get_event_types(type_names):
+    """Return the event types named, by name.
+
+    Types the region doesn't know yet are registered if they're described in
+    `EVENT_DETAILS`, otherwise they're left out.
+    """
+    event_types = {
+        event_type.name: event_type
+        for event_type in EventType.objects.filter(name__in=type_names)
+    }
+    for type_name in set(type_names).difference(event_types):
+        details = EVENT_DETAILS.get(type_name)
+        if details is not None:
+            event_types[type_name] = EventType.objects.register(
+                type_name, details.description, details.level
+            )
+    return event_types
+
+
+def _get_identifiers(events, key):
+    return {event[key] for event in events if event.get(key)}
+
+
+def _parse_addresses(addresses, parse):
+    parsed = {}
+    for address in addresses:
+        try:
+            parsed[address] = parse(address)
+        except (AddrFormatError, TypeError, ValueError):
+            pass
+    return parsed
+
+
+def _get_nodes(events):
+    """Find the nodes for `events`, with one query for each way to find them.
+
+    :return: A function that takes an event and returns the ``(id,
+        system_id, hostname)`` of its node, or None.
+    """
+    system_ids = _get_identifiers(events, "system_id")
+    macs = _parse_addresses(_get_identifiers(events, "mac_address"), EUI)
+    ips = _parse_addresses(_get_identifiers(events, "ip_address"), IPAddress)
+
+    node_ids_by_mac = {}
+    if len(macs) != 0:
+        interfaces = Interface.objects.filter(
+            type=INTERFACE_TYPE.PHYSICAL, mac_address__in=list(macs)
+        ).exclude(node=None)
+        for mac, node_id in interfaces.values_list("mac_address", "node_id"):
+            node_ids_by_mac[EUI(str(mac))] = node_id
+
+    node_ids_by_ip = {}
+    if len(ips) != 0:
+        nodes = Node.objects.filter(
+            interface__ip_addresses__ip__in=[str(ip) for ip in ips.values()]
+        )
+        for ip, node_id in nodes.values_list(
+            "interface__ip_addresses__ip", "id"
+        ):
+            node_ids_by_ip.setdefault(IPAddress(ip), node_id)
+
+    node_ids = set(node_ids_by_mac.values()).union(node_ids_by_ip.values())
+    nodes_by_id, nodes_by_system_id = {}, {}
+    if len(system_ids) != 0 or len(node_ids) != 0:
+        nodes = Node.objects.filter(id__in=node_ids) | Node.objects.filter(
+            system_id__in=system_ids
+        )
+        for node in nodes.values_list("id", "system_id", "hostname"):
+            nodes_by_id[node[0]] = node
+            nodes_by_system_id[node[1]] = node
+
+    def get_node(event):
+        system_id = event.get("system_id")
+        mac_address = event.get("mac_address")
+        ip_address = event.get("ip_address")
+        if system_id:
+            return nodes_by_system_id.get(system_id)
+        elif mac_address in macs:
+            return nodes_by_id.get(node_ids_by_mac.get(macs[mac_address]))
+        elif ip_address in ips:
+            return nodes_by_id.get(node_ids_by_ip.get(ips[ip_address]))
+        else:
+            return None
+
+    return get_node
+
+
+@synchronous
+@transactional
+def send_events(events):
+    """Store a batch of node events.
+
+    for :py:class:`~provisioningserver.rpc.region.SendEvents`.
+
+    The nodes are found with one query per kind of identifier, and the
+    events are inserted together, in the order given. Events for unknown
+    nodes or event types are skipped.
+    """
+    event_types = _get_event_types({event["type_name"] for event in events})
+    get_node = _get_nodes(events)
+    objs = []
+    for event in events:
+        event_type = event_types.get(event["type_name"])
+        node = get_node(event)
+        if event_type is None or node is None:
+            log.debug(
+                "Event '{type}: {description}' sent for unknown event type "
+                "or non-existent node '{node}'.",
+                type=event["type_name"],
+                description=event["description"],
+                node=(
+                    event.get("system_id")
+                    or event.get("mac_address")
+                    or event.get("ip_address")
+                ),
+            )
+            continue
+        node_id, system_id, hostname = node
+        created = datetime.fromtimestamp(event["timestamp"])
+        objs.append(
+            Event(
+                type=event_type,
+                node_id=node_id,
+                node_system_id=system_id,
+                node_hostname=hostname,
+                description=event["description"],
+                created=created,
+                updated=created,
+            )
+        )
+    Event.objects.bulk_create(objs)
@@ -0,0 +1,177 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Configuration of the external services that rack controllers run.
+
+Rack controllers run NTP, DNS, proxy and syslog for their machines,
+configured from the region. Rather than fetching every kind of
+configuration on a timer, they ask for a digest of each kind and only
+fetch the kinds whose digest has changed. Digests are cached until a
+database notification says the configuration may have changed, when
+`ExternalConfigService` tells the rack controllers whose digests changed.
+"""
+
+__all__ = [
+    "external_config_digests",
+    "get_config_digests",
+    "get_dns_configuration",
+    "get_proxy_configuration",
+    "get_syslog_configuration",
+]
+
+import hashlib
+import json
+import threading
+
+from maasserver.dns.config import get_trusted_networks
+from maasserver.models.config import Config
+from maasserver.models.subnet import Subnet
+from maasserver.rpc.nodes import get_controller_type, get_time_configuration
+from maasserver.utils.orm import transactional
+from provisioningserver.prometheus.metrics import PROMETHEUS_METRICS
+from provisioningserver.utils.twisted import synchronous
+
+
+@synchronous
+@transactional
+def get_dns_configuration(system_id):
+    """Get settings to use for configuring DNS.
+
+    For consistency `system_id` is passed, but at the moment it is not used
+    to customise the DNS configuration.
+
+    :return: See `GetDNSConfiguration`.
+    """
+    return {"trusted_networks": get_trusted_networks()}
+
+
+@synchronous
+@transactional
+def get_proxy_configuration(system_id):
+    """Get settings to use for configuring proxy.
+
+    For consistency `system_id` is passed, but at the moment it is not used
+    to customise the proxy configuration.
+
+    :return: See `GetProxyConfiguration`.
+    """
+    allowed_subnets = Subnet.objects.filter(allow_proxy=True)
+    cidrs = [subnet.cidr for subnet in allowed_subnets]
+    configs = Config.objects.get_configs(
+        ["maas_proxy_port", "prefer_v4_proxy", "enable_http_proxy"]
+    )
+    return {
+        "enabled": configs["enable_http_proxy"],
+        "port": configs["maas_proxy_port"],
+        "allowed_cidrs": cidrs,
+        "prefer_v4_proxy": configs["prefer_v4_proxy"],
+    }
+
+
+@synchronous
+@transactional
+def get_syslog_configuration(system_id):
+    """Get settings to use for configuring syslog.
+
+    For consistency `system_id` is passed, but at the moment it is not used
+    to customise the syslog configuration.
+
+    :return: See `GetSyslogConfiguration`.
+    """
+    return {"port": Config.objects.get_config("maas_syslog_port")}
+
+
+# Each kind of configuration that a digest is published for, and how to
+# get it for a rack controller.
+CONFIG_KINDS = {
+    "controller_type": get_controller_type,
+    "time": get_time_configuration,
+    "dns": get_dns_configuration,
+    "proxy": get_proxy_configuration,
+    "syslog": get_syslog_configuration,
+}
+
+
+def get_digest(config):
+    """Return a digest of `config`.
+
+    Rack controllers treat the lists in their configuration as sets, and
+    some configuration is returned as sets, so the digest doesn't depend on
+    the order of their items. Addresses and networks are digested as
+    strings.
+    """
+    normalised = {
+        key: (
+            sorted(map(str, value))
+            if isinstance(value, (list, set, frozenset))
+            else value
+        )
+        for key, value in config.items()
+    }
+    data = json.dumps(normalised, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class ExternalConfigDigests:
+    """Per-process cache of the configuration digests of rack controllers.
+
+    Each clear advances a counter, so digests computed from data read
+    before a clear are never stored after it.
+
+    The cache is read and written from database threads and cleared from
+    the reactor, so all access is serialised with a lock. It starts
+    disabled; it is enabled by the service that clears it.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._digests = {}
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._digests)
+
+    def clear(self):
+        """Drop every cached digest."""
+        with self._lock:
+            self._counter += 1
+            self._digests.clear()
+
+    def get_or_compute(self, system_id, compute):
+        """Return the digests for `system_id`, calling `compute` if needed."""
+        with self._lock:
+            digests = self._digests.get(system_id) if self.enabled else None
+            token = self._counter
+        PROMETHEUS_METRICS.update(
+            "maas_external_config_cache_requests",
+            "inc",
+            labels={"result": "miss" if digests is None else "hit"},
+        )
+        if digests is None:
+            digests = compute()
+            with self._lock:
+                if self.enabled and token == self._counter:
+                    self._digests[system_id] = digests
+        return digests
+
+
+external_config_digests = ExternalConfigDigests()
+
+
+@synchronous
+@transactional
+def get_config_digests(system_id):
+    """Get a digest of each kind of configuration for a rack controller.
+
+    :param system_id: system_id of the rack controller.
+    :return: A dict of digests, keyed by the kinds in `CONFIG_KINDS`.
+    """
+
+    def compute():
+        return {
+            kind: get_digest(get_config(system_id))
+            for kind, get_config in CONFIG_KINDS.items()
+        }
+
+    return external_config_digests.get_or_compute(system_id, compute)
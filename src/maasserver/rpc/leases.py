@@ -3,16 +3,18 @@
 
 """RPC helpers relating to DHCP leases."""
 
-__all__ = ["update_lease"]
+__all__ = ["update_lease", "update_leases"]
 
+from collections import defaultdict
 from datetime import datetime
 
-from netaddr import IPAddress
+from netaddr import EUI, IPAddress
 
-from maasserver.enum import IPADDRESS_FAMILY, IPADDRESS_TYPE
+from maasserver.enum import IPADDRESS_FAMILY, IPADDRESS_TYPE, IPRANGE_TYPE
 from maasserver.models import (
     DNSResource,
     Interface,
+    IPRange,
     Node,
     StaticIPAddress,
     Subnet,
@@ -39,6 +41,51 @@ def _is_valid_hostname(hostname):
     )
 
 
+def _check_action(action):
+    """Raise `LeaseUpdateError` unless `action` is a valid lease action."""
+    if action not in ["commit", "expiry", "release"]:
+        raise LeaseUpdateError("Unknown lease action: %s" % action)
+
+
+def _check_subnet(ip_family, ip, subnet):
+    """Raise `LeaseUpdateError` unless `subnet` can hold a lease for `ip`.
+
+    :return: The IP address family of `subnet`.
+    """
+    if subnet is None:
+        raise LeaseUpdateError("No subnet exists for: %s" % ip)
+
+    # Check that the subnet family is the same.
+    subnet_family = subnet.get_ipnetwork().version
+    if ip_family == "ipv4" and subnet_family != IPADDRESS_FAMILY.IPv4:
+        raise LeaseUpdateError(
+            "Family for the subnet does not match. Expected: %s" % ip_family
+        )
+    elif ip_family == "ipv6" and subnet_family != IPADDRESS_FAMILY.IPv6:
+        raise LeaseUpdateError(
+            "Family for the subnet does not match. Expected: %s" % ip_family
+        )
+    return subnet_family
+
+
+def _log_lease(action, mac, ip, created, lease_time, hostname):
+    log.msg(
+        "Lease update: %s for %s on %s at %s%s%s"
+        % (
+            action,
+            ip,
+            mac,
+            created,
+            " (lease time: %ss)" % lease_time
+            if lease_time is not None
+            else "",
+            " (hostname: %s)" % hostname
+            if _is_valid_hostname(hostname)
+            else "",
+        )
+    )
+
+
 @synchronous
 @transactional
 def update_lease(
@@ -74,43 +121,15 @@ def update_lease(
     :raises NoSuchCluster: If the cluster identified by `cluster_uuid` does not
         exist.
     """
-    # Check for a valid action.
-    if action not in ["commit", "expiry", "release"]:
-        raise LeaseUpdateError("Unknown lease action: %s" % action)
+    _check_action(action)
 
     # Get the subnet for this IP address. If no subnet exists then something
     # is wrong as we should not be recieving message about unknown subnets.
     subnet = Subnet.objects.get_best_subnet_for_ip(ip)
-    if subnet is None:
-        raise LeaseUpdateError("No subnet exists for: %s" % ip)
-
-    # Check that the subnet family is the same.
-    subnet_family = subnet.get_ipnetwork().version
-    if ip_family == "ipv4" and subnet_family != IPADDRESS_FAMILY.IPv4:
-        raise LeaseUpdateError(
-            "Family for the subnet does not match. Expected: %s" % ip_family
-        )
-    elif ip_family == "ipv6" and subnet_family != IPADDRESS_FAMILY.IPv6:
-        raise LeaseUpdateError(
-            "Family for the subnet does not match. Expected: %s" % ip_family
-        )
+    subnet_family = _check_subnet(ip_family, ip, subnet)
 
     created = datetime.fromtimestamp(timestamp)
-    log.msg(
-        "Lease update: %s for %s on %s at %s%s%s"
-        % (
-            action,
-            ip,
-            mac,
-            created,
-            " (lease time: %ss)" % lease_time
-            if lease_time is not None
-            else "",
-            " (hostname: %s)" % hostname
-            if _is_valid_hostname(hostname)
-            else "",
-        )
-    )
+    _log_lease(action, mac, ip, created, lease_time, hostname)
 
     # We will recieve actions on all addresses in the subnet. We only want
     # to update the addresses in the dynamic range.
@@ -120,6 +139,133 @@ def update_lease(
         return {}
 
     interfaces = list(Interface.objects.filter(mac_address=mac))
+    _apply_lease(
+        action,
+        mac,
+        ip,
+        subnet,
+        subnet_family,
+        interfaces,
+        created,
+        lease_time,
+        hostname,
+    )
+    return {}
+
+
+def _coalesce_leases(leases):
+    """Drop repeated leases with the same action for a MAC and IP address.
+
+    Of each run of leases with the same action for a MAC and IP address only
+    the last is kept, in the place of its last appearance, so that applying
+    the leases returned has the same outcome as applying all of `leases` in
+    turn. A repeated commit without a hostname keeps the hostname of the
+    commit before it, as that remains the dynamic hostname for the address.
+    """
+    coalesced = []
+    positions = {}
+    for lease in leases:
+        key = (EUI(lease["mac"]), IPAddress(lease["ip"]))
+        position = positions.get(key)
+        if position is not None:
+            previous = coalesced[position]
+            if previous["action"] == lease["action"]:
+                coalesced[position] = None
+                if lease["action"] == "commit" and not _is_valid_hostname(
+                    lease.get("hostname")
+                ):
+                    lease = dict(lease, hostname=previous.get("hostname"))
+        positions[key] = len(coalesced)
+        coalesced.append(lease)
+    return [lease for lease in coalesced if lease is not None]
+
+
+@synchronous
+@transactional
+def update_leases(leases):
+    """Update many DHCP leases from a cluster in one transaction.
+
+    This has the same effect as calling `update_lease` with each of `leases`
+    in turn. Repeated updates with the same action for the same MAC and IP
+    address are coalesced, and the subnets, dynamic ranges and interfaces
+    for all the leases are each found with a single query.
+
+    A lease that `update_lease` would reject with `LeaseUpdateError` is
+    logged and skipped; the rest of the leases are still updated.
+
+    :param leases: A list of dicts, each with the arguments to
+        `update_lease`, as found in the updates of
+        :py:class`~provisioningserver.rpc.region.UpdateLeases`.
+    """
+    leases = _coalesce_leases(leases)
+    subnets = Subnet.objects.get_best_subnets_for_ips(
+        lease["ip"] for lease in leases
+    )
+    dynamic_ranges = defaultdict(list)
+    for iprange in IPRange.objects.filter(
+        subnet__in={subnet.id for subnet in subnets.values()},
+        type=IPRANGE_TYPE.DYNAMIC,
+    ):
+        dynamic_ranges[iprange.subnet_id].append(iprange.netaddr_iprange)
+    interfaces_by_mac = defaultdict(list)
+    for interface in Interface.objects.filter(
+        mac_address__in={lease["mac"] for lease in leases}
+    ):
+        interfaces_by_mac[EUI(str(interface.mac_address))].append(interface)
+
+    for lease in leases:
+        action, mac, ip = lease["action"], lease["mac"], lease["ip"]
+        lease_time, hostname = lease.get("lease_time"), lease.get("hostname")
+        subnet = subnets.get(ip)
+        try:
+            _check_action(action)
+            subnet_family = _check_subnet(lease["ip_family"], ip, subnet)
+        except LeaseUpdateError as error:
+            log.msg(
+                "Ignoring lease update for %s on %s: %s" % (ip, mac, error)
+            )
+            continue
+
+        created = datetime.fromtimestamp(lease["timestamp"])
+        _log_lease(action, mac, ip, created, lease_time, hostname)
+
+        address = IPAddress(ip)
+        if not any(
+            address in iprange for iprange in dynamic_ranges[subnet.id]
+        ):
+            continue
+
+        # Remember any interface created for an unknown MAC address, so
+        # that later leases for it find it.
+        interfaces_by_mac[EUI(mac)] = _apply_lease(
+            action,
+            mac,
+            ip,
+            subnet,
+            subnet_family,
+            interfaces_by_mac[EUI(mac)],
+            created,
+            lease_time,
+            hostname,
+        )
+    return {}
+
+
+def _apply_lease(
+    action,
+    mac,
+    ip,
+    subnet,
+    subnet_family,
+    interfaces,
+    created,
+    lease_time,
+    hostname,
+):
+    """Record the lease `action` for `ip` against `interfaces`.
+
+    :return: The interfaces for `mac`, including any that had to be created.
+    """
     if len(interfaces) == 0 and action == "commit":
         # A MAC address that is unknown to MAAS was given an IP address. Create
         # an unknown interface for this lease.
@@ -130,7 +276,7 @@ def update_lease(
         interfaces = [unknown_interface]
     elif len(interfaces) == 0:
         # No interfaces and not commit action so nothing needs to be done.
-        return {}
+        return interfaces
 
     sip = None
     # Delete all discovered IP addresses attached to all interfaces of the same
@@ -212,4 +358,4 @@ def update_lease(
             sip.save()
         for interface in interfaces:
             interface.ip_addresses.add(sip)
-    return {}
+    return interfaces
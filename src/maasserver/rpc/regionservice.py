@@ -33,14 +33,12 @@ from zope.interface import implementer
 
 from maasserver import eventloop
 from maasserver.bootresources import get_simplestream_endpoint
-from maasserver.dns.config import get_trusted_networks
-from maasserver.models.config import Config
 from maasserver.models.node import RackController
-from maasserver.models.subnet import Subnet
 from maasserver.rpc import (
     boot,
     configuration,
     events,
+    externalconfig,
     leases,
     nodes,
     packagerepository,
@@ -53,8 +51,11 @@ from maasserver.rpc.nodes import (
 )
 from maasserver.rpc.services import update_services
 from maasserver.security import get_shared_secret
-from maasserver.utils.orm import transactional
-from maasserver.utils.threads import deferToDatabase
+from maasserver.utils.threads import (
+    DATABASE_PRIORITY,
+    deferToDatabase,
+    deferToDatabaseWithPriority,
+)
 from provisioningserver.logger import LegacyLogger
 from provisioningserver.prometheus.metrics import (
     GLOBAL_LABELS,
@@ -161,6 +162,31 @@ class Region(RPCProtocol):
         # region recieves the message.
         return d
 
+    @region.UpdateLeases.responder
+    def update_leases(self, cluster_uuid, updates):
+        """update_leases(cluster_uuid, updates)
+
+        Implementation of
+        :py:class`~provisioningserver.rpc.region.UpdateLeases`.
+        """
+        dbtasks = eventloop.services.getServiceNamed("database-tasks")
+        d = dbtasks.deferTask(leases.update_leases, updates)
+
+        # Catch all errors except the NoSuchCluster failure. We want that to
+        # be sent back to the cluster.
+        def err_NoSuchCluster_passThrough(failure):
+            if failure.check(NoSuchCluster):
+                return failure
+            else:
+                log.err(failure, "Unhandled failure in updating leases.")
+                return {}
+
+        d.addErrback(err_NoSuchCluster_passThrough)
+
+        # Wait for the batch to be handled, so that the cluster sends the
+        # next batch only after this one, keeping the leases in order.
+        return d
+
     @amp.StartTLS.responder
     def get_tls_parameters(self):
         """get_tls_parameters()
@@ -194,7 +220,8 @@ class Region(RPCProtocol):
         Implementation of
         :py:class:`~provisioningserver.rpc.region.GetBootConfig`.
         """
-        return deferToDatabase(
+        return deferToDatabaseWithPriority(
+            DATABASE_PRIORITY.BOOT,
             boot.get_config,
             system_id,
             local_ip,
@@ -364,6 +391,23 @@ class Region(RPCProtocol):
         # Don't wait for the record to be written.
         return succeed({})
 
+    @region.SendEvents.responder
+    def send_events(self, events):
+        """send_events()
+
+        Implementation of
+        :py:class:`~provisioningserver.rpc.region.SendEvents`.
+        """
+        # Named `events` by the command, so this shadows the module.
+        from maasserver.rpc.events import send_events
+
+        dbtasks = eventloop.services.getServiceNamed("database-tasks")
+        d = dbtasks.deferTask(send_events, events)
+        # Wait for the events to be stored, and let any failure to store
+        # them through, so that the rack keeps them queued until they are.
+        d.addCallback(lambda _: {})
+        return d
+
     @region.ReportForeignDHCPServer.responder
     def report_foreign_dhcp_server(
         self, system_id, interface_name, dhcp_ip=None
@@ -544,11 +588,7 @@ class Region(RPCProtocol):
         Implementation of
         :py:class:`~provisioningserver.rpc.region.GetDNSConfiguration`.
         """
-        # For consistency `system_id` is passed, but at the moment it is not
-        # used to customise the DNS configuration.
-        d = deferToDatabase(get_trusted_networks)
-        d.addCallback(lambda networks: {"trusted_networks": networks})
-        return d
+        return deferToDatabase(externalconfig.get_dns_configuration, system_id)
 
     @region.GetProxyConfiguration.responder
     def get_proxy_configuration(self, system_id):
@@ -557,24 +597,9 @@ class Region(RPCProtocol):
         Implementation of
         :py:class:`~provisioningserver.rpc.region.GetProxyConfiguration`.
         """
-        # For consistency `system_id` is passed, but at the moment it is not
-        # used to customise the proxy configuration.
-
-        @transactional
-        def get_from_db():
-            allowed_subnets = Subnet.objects.filter(allow_proxy=True)
-            cidrs = [subnet.cidr for subnet in allowed_subnets]
-            configs = Config.objects.get_configs(
-                ["maas_proxy_port", "prefer_v4_proxy", "enable_http_proxy"]
-            )
-            return {
-                "enabled": configs["enable_http_proxy"],
-                "port": configs["maas_proxy_port"],
-                "allowed_cidrs": cidrs,
-                "prefer_v4_proxy": configs["prefer_v4_proxy"],
-            }
-
-        return deferToDatabase(get_from_db)
+        return deferToDatabase(
+            externalconfig.get_proxy_configuration, system_id
+        )
 
     @region.GetSyslogConfiguration.responder
     def get_syslog_configuration(self, system_id):
@@ -583,15 +608,20 @@ class Region(RPCProtocol):
         Implementation of
         :py:class:`~provisioningserver.rpc.region.GetSyslogConfiguration`.
         """
-        # For consistency `system_id` is passed, but at the moment it is not
-        # used to customise the syslog configuration.
+        return deferToDatabase(
+            externalconfig.get_syslog_configuration, system_id
+        )
 
-        @transactional
-        def get_from_db():
-            port = Config.objects.get_config("maas_syslog_port")
-            return {"port": port}
+    @region.GetConfigurationDigests.responder
+    def get_configuration_digests(self, system_id):
+        """Get a digest of each kind of configuration for the given rack.
 
-        return deferToDatabase(get_from_db)
+        Implementation of
+        :py:class:`~provisioningserver.rpc.region.GetConfigurationDigests`.
+        """
+        d = deferToDatabase(externalconfig.get_config_digests, system_id)
+        d.addCallback(lambda digests: {"digests": digests})
+        return d
 
 
 @inlineCallbacks
@@ -29,11 +29,16 @@ from maasserver.rpc import boot as boot_module
 from maasserver.rpc.boot import event_log_pxe_request, get_boot_filenames
 from maasserver.rpc.boot import get_config as orig_get_config
 from maasserver.rpc.boot import merge_kparams_with_extra
+from maasserver.rpc.bootcache import BootConfigCache, BootWriteBehind
 from maasserver.testing.architecture import make_usable_architecture
 from maasserver.testing.config import RegionConfigurationFixture
 from maasserver.testing.factory import factory
 from maasserver.testing.testcase import MAASServerTestCase
-from maasserver.utils.orm import post_commit_hooks, reload_object
+from maasserver.utils.orm import (
+    post_commit_hooks,
+    reload_object,
+    transactional,
+)
 from maasserver.utils.osystems import get_release_from_distro_info
 from maastesting.djangotestcase import count_queries
 from maastesting.matchers import MockCalledOnceWith
@@ -1390,6 +1395,145 @@ class TestGetConfig(MAASServerTestCase):
         self.assertEqual(commissioning_series, observed_config["release"])
 
 
+class TestGetConfigCache(MAASServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.useFixture(RegionConfigurationFixture())
+        self.cache = BootConfigCache()
+        self.cache.enabled = True
+        self.patch(boot_module, "boot_config_cache", self.cache)
+        self.write_behind = BootWriteBehind()
+        self.write_behind.enabled = True
+        self.patch(boot_module, "boot_write_behind", self.write_behind)
+
+    def tearDown(self):
+        post_commit_hooks.reset()
+        super().tearDown()
+
+    def make_node(self, **kwargs):
+        architecture = make_usable_architecture(self)
+        return factory.make_Node_with_Interface_on_Subnet(
+            architecture="%s/generic" % architecture.split("/")[0], **kwargs
+        )
+
+    def count_get_config_queries(self, *args, **kwargs):
+        """Count the queries `get_config` makes, besides savepoints."""
+        overhead, _ = count_queries(transactional(lambda: None))
+        count, result = count_queries(orig_get_config, *args, **kwargs)
+        return count - overhead, result
+
+    def test__repeated_request_for_machine_needs_one_query(self):
+        rack_controller = factory.make_RackController()
+        local_ip = factory.make_ip_address()
+        remote_ip = factory.make_ip_address()
+        node = self.make_node(status=NODE_STATUS.COMMISSIONING)
+        mac = node.get_boot_interface().mac_address
+        config = get_config(
+            rack_controller.system_id, local_ip, remote_ip, mac=mac
+        )
+        count, repeated_config = self.count_get_config_queries(
+            rack_controller.system_id, local_ip, remote_ip, mac=mac
+        )
+        self.assertEqual(1, count)
+        self.assertEqual(config, repeated_config)
+
+    def test__repeated_default_arch_request_needs_no_queries(self):
+        rack_controller = factory.make_RackController()
+        local_ip = factory.make_ip_address()
+        remote_ip = factory.make_ip_address()
+        make_usable_architecture(self)
+        config = get_config(rack_controller.system_id, local_ip, remote_ip)
+        count, repeated_config = self.count_get_config_queries(
+            rack_controller.system_id, local_ip, remote_ip
+        )
+        self.assertEqual(0, count)
+        self.assertEqual(config, repeated_config)
+
+    def test__repeated_request_for_unknown_mac_needs_one_query(self):
+        rack_controller = factory.make_RackController()
+        local_ip = factory.make_ip_address()
+        remote_ip = factory.make_ip_address()
+        arch = make_usable_architecture(self).split("/")[0]
+        mac = factory.make_mac_address()
+        config = get_config(
+            rack_controller.system_id, local_ip, remote_ip, arch=arch, mac=mac
+        )
+        count, repeated_config = self.count_get_config_queries(
+            rack_controller.system_id, local_ip, remote_ip, arch=arch, mac=mac
+        )
+        self.assertEqual(1, count)
+        self.assertEqual(config, repeated_config)
+
+    def test__writes_node_fields_and_events_behind(self):
+        rack_controller = factory.make_RackController()
+        local_ip = factory.make_ip_address()
+        remote_ip = factory.make_ip_address()
+        status = random.choice(MONITORED_STATUSES)
+        node = self.make_node(
+            status=status, status_expires=factory.make_date()
+        )
+        old_status_expires = node.status_expires
+        mac = node.get_boot_interface().mac_address
+        for _ in range(2):
+            get_config(
+                rack_controller.system_id,
+                local_ip,
+                remote_ip,
+                mac=mac,
+                bios_boot_method="pxe",
+            )
+        pxe_events = Event.objects.filter(
+            node=node,
+            type__name__in=[
+                EVENT_TYPES.NODE_PXE_REQUEST,
+                EVENT_TYPES.PERFORMING_PXE_BOOT,
+            ],
+        )
+        node = reload_object(node)
+        self.assertNotEqual(local_ip, node.boot_cluster_ip)
+        self.assertEqual(old_status_expires, node.status_expires)
+        self.assertEqual(0, pxe_events.count())
+        self.write_behind.flush()
+        node = reload_object(node)
+        self.assertEqual(local_ip, node.boot_cluster_ip)
+        self.assertEqual("pxe", node.bios_boot_method)
+        self.assertNotEqual(old_status_expires, node.status_expires)
+        self.assertItemsEqual(
+            [
+                EVENT_TYPES.NODE_PXE_REQUEST,
+                EVENT_TYPES.PERFORMING_PXE_BOOT,
+                EVENT_TYPES.NODE_PXE_REQUEST,
+                EVENT_TYPES.PERFORMING_PXE_BOOT,
+            ],
+            pxe_events.values_list("type__name", flat=True),
+        )
+
+    def test__cleared_cache_sees_config_changes(self):
+        rack_controller = factory.make_RackController()
+        local_ip = factory.make_ip_address()
+        remote_ip = factory.make_ip_address()
+        make_usable_architecture(self)
+        get_config(rack_controller.system_id, local_ip, remote_ip)
+        kernel_opts = factory.make_name("kernel_opts")
+        Config.objects.set_config("kernel_opts", kernel_opts)
+        self.cache.clear()
+        config = get_config(rack_controller.system_id, local_ip, remote_ip)
+        self.assertEqual(kernel_opts, config["extra_opts"])
+
+    def test__invalidated_node_is_recomputed(self):
+        rack_controller = factory.make_RackController()
+        local_ip = factory.make_ip_address()
+        remote_ip = factory.make_ip_address()
+        node = self.make_node(status=NODE_STATUS.COMMISSIONING)
+        mac = node.get_boot_interface().mac_address
+        get_config(rack_controller.system_id, local_ip, remote_ip, mac=mac)
+        self.cache.invalidate_node(node.system_id)
+        count, _ = self.count_get_config_queries(
+            rack_controller.system_id, local_ip, remote_ip, mac=mac
+        )
+        self.assertGreater(count, 1)
+
+
 class TestGetBootFilenames(MAASServerTestCase):
     def test_get_filenames(self):
         release = factory.make_default_ubuntu_release_bootable()
@@ -0,0 +1,198 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for the boot config cache and write-behind."""
+
+__all__ = []
+
+from datetime import timedelta
+
+from maasserver.enum import NODE_STATUS
+from maasserver.models import Event, Node
+from maasserver.models.timestampedmodel import now
+from maasserver.rpc.bootcache import BootConfigCache, BootWriteBehind
+from maasserver.testing.factory import factory
+from maasserver.testing.testcase import MAASServerTestCase
+from maasserver.utils.orm import reload_object
+from maastesting.testcase import MAASTestCase
+from provisioningserver.events import EVENT_TYPES
+
+
+class TestBootConfigCache(MAASTestCase):
+    def make_cache(self, **kwargs):
+        cache = BootConfigCache(**kwargs)
+        cache.enabled = True
+        return cache
+
+    def test_get_returns_stored_value(self):
+        cache = self.make_cache()
+        cache.set("kind", "key", "value", cache.token())
+        self.assertEqual("value", cache.get("kind", "key"))
+        self.assertIsNone(cache.get("other", "key"))
+
+    def test_disabled_cache_stores_nothing(self):
+        cache = BootConfigCache()
+        cache.set("kind", "key", "value", cache.token())
+        cache.enabled = True
+        self.assertIsNone(cache.get("kind", "key"))
+
+    def test_clear_drops_everything(self):
+        cache = self.make_cache()
+        cache.set("kind", "key", "value", cache.token())
+        cache.set("kind", "node", "value", cache.token(), system_id="abc")
+        cache.clear()
+        self.assertEqual(0, len(cache))
+
+    def test_set_ignored_after_clear(self):
+        cache = self.make_cache()
+        token = cache.token()
+        cache.clear()
+        cache.set("kind", "key", "value", token)
+        self.assertIsNone(cache.get("kind", "key"))
+
+    def test_invalidate_node_only_drops_that_node(self):
+        cache = self.make_cache()
+        token = cache.token()
+        cache.set("kind", "key", "value", token)
+        cache.set("kind", "abc", "abc-value", token, system_id="abc")
+        cache.set("kind", "def", "def-value", token, system_id="def")
+        cache.invalidate_node("abc")
+        self.assertEqual("value", cache.get("kind", "key"))
+        self.assertIsNone(cache.get("kind", "abc", system_id="abc"))
+        self.assertEqual(
+            "def-value", cache.get("kind", "def", system_id="def")
+        )
+
+    def test_set_ignored_after_invalidate_node(self):
+        cache = self.make_cache()
+        token = cache.token()
+        cache.invalidate_node("abc")
+        cache.set("kind", "abc", "value", token, system_id="abc")
+        cache.set("kind", "def", "value", token, system_id="def")
+        self.assertIsNone(cache.get("kind", "abc", system_id="abc"))
+        self.assertEqual("value", cache.get("kind", "def", system_id="def"))
+
+    def test_evicts_least_recently_used(self):
+        cache = self.make_cache(max_entries=2)
+        token = cache.token()
+        cache.set("kind", 1, "one", token)
+        cache.set("kind", 2, "two", token)
+        cache.get("kind", 1)
+        cache.set("kind", 3, "three", token)
+        self.assertEqual("one", cache.get("kind", 1))
+        self.assertIsNone(cache.get("kind", 2))
+        self.assertEqual("three", cache.get("kind", 3))
+
+    def test_get_or_compute_computes_once(self):
+        cache = self.make_cache()
+        calls = []
+
+        def compute():
+            calls.append(None)
+            return "value"
+
+        for _ in range(3):
+            self.assertEqual(
+                "value",
+                cache.get_or_compute("kind", "key", compute, cache.token()),
+            )
+        self.assertEqual(1, len(calls))
+
+
+class TestBootWriteBehind(MAASServerTestCase):
+    def test_flush_writes_node_fields(self):
+        node = factory.make_Node_with_Interface_on_Subnet()
+        interface = node.get_boot_interface()
+        node.boot_cluster_ip = factory.make_ip_address()
+        node.bios_boot_method = "uefi"
+        node.boot_interface = interface
+        write_behind = BootWriteBehind()
+        write_behind.update_node(node)
+        write_behind.flush()
+        self.assertEqual(0, len(write_behind))
+        reloaded = reload_object(node)
+        self.assertEqual(node.boot_cluster_ip, reloaded.boot_cluster_ip)
+        self.assertEqual("uefi", reloaded.bios_boot_method)
+        self.assertEqual(interface, reloaded.boot_interface)
+
+    def test_flush_writes_status_expires_if_status_unchanged(self):
+        node = factory.make_Node(
+            status=NODE_STATUS.COMMISSIONING, status_expires=now()
+        )
+        node.status_expires = now() + timedelta(minutes=30)
+        write_behind = BootWriteBehind()
+        write_behind.update_node(node)
+        write_behind.flush()
+        self.assertEqual(
+            node.status_expires, reload_object(node).status_expires
+        )
+
+    def test_flush_skips_status_expires_if_status_changed(self):
+        node = factory.make_Node(
+            status=NODE_STATUS.COMMISSIONING, status_expires=now()
+        )
+        status_expires = now() + timedelta(minutes=30)
+        node.status_expires = status_expires
+        write_behind = BootWriteBehind()
+        write_behind.update_node(node)
+        Node.objects.filter(id=node.id).update(status=NODE_STATUS.READY)
+        write_behind.flush()
+        self.assertNotEqual(status_expires, reload_object(node).status_expires)
+
+    def test_flush_skips_deleted_boot_interface(self):
+        node = factory.make_Node_with_Interface_on_Subnet()
+        old_interface = node.get_boot_interface()
+        interface = factory.make_Interface(node=node)
+        node.boot_interface = interface
+        node.boot_cluster_ip = factory.make_ip_address()
+        write_behind = BootWriteBehind()
+        write_behind.update_node(node)
+        interface.delete()
+        write_behind.flush()
+        reloaded = reload_object(node)
+        self.assertEqual(node.boot_cluster_ip, reloaded.boot_cluster_ip)
+        self.assertEqual(old_interface, reloaded.get_boot_interface())
+
+    def test_flush_skips_deleted_nodes(self):
+        node = factory.make_Node()
+        write_behind = BootWriteBehind()
+        write_behind.update_node(node)
+        write_behind.log_events(
+            node, [{"type_name": EVENT_TYPES.NODE_PXE_REQUEST}]
+        )
+        node.delete()
+        write_behind.flush()
+        self.assertFalse(
+            Event.objects.filter(
+                type__name=EVENT_TYPES.NODE_PXE_REQUEST
+            ).exists()
+        )
+
+    def test_flush_registers_events_in_order(self):
+        node = factory.make_Node()
+        write_behind = BootWriteBehind()
+        write_behind.log_events(
+            node,
+            [
+                {
+                    "type_name": EVENT_TYPES.NODE_PXE_REQUEST,
+                    "event_description": "commissioning",
+                },
+                {"type_name": EVENT_TYPES.PERFORMING_PXE_BOOT},
+            ],
+        )
+        write_behind.flush()
+        self.assertEqual(
+            [EVENT_TYPES.NODE_PXE_REQUEST, EVENT_TYPES.PERFORMING_PXE_BOOT],
+            list(
+                Event.objects.filter(
+                    node=node,
+                    type__name__in=[
+                        EVENT_TYPES.NODE_PXE_REQUEST,
+                        EVENT_TYPES.PERFORMING_PXE_BOOT,
+                    ],
+                )
+                .order_by("id")
+                .values_list("type__name", flat=True)
+            ),
+        )
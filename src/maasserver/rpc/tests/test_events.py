@@ -8,6 +8,9 @@ __all__ = []
 
 import datetime
 import logging
+import time
+
+from testtools.matchers import MatchesStructure
 
 from maasserver.enum import INTERFACE_TYPE
 from maasserver.models.event import Event
@@ -15,6 +18,8 @@ from maasserver.models.eventtype import EventType
 from maasserver.rpc import events
 from maasserver.testing.factory import factory
 from maasserver.testing.testcase import MAASServerTestCase
+from maastesting.djangotestcase import count_queries
+from provisioningserver.events import EVENT_DETAILS, EVENT_TYPES
 from provisioningserver.rpc.exceptions import NoSuchEventType
 
 
@@ -180,3 +185,131 @@ class TestSendEventIPAddress(MAASServerTestCase):
             description=description,
             created=timestamp,
         )
+
+
+class TestSendEvents(MAASServerTestCase):
+    def make_event(self, event_type, timestamp=None, **node):
+        if timestamp is None:
+            timestamp = time.time()
+        event = {
+            "type_name": event_type.name,
+            "description": factory.make_name("description"),
+            "timestamp": timestamp,
+            "system_id": None,
+            "mac_address": None,
+            "ip_address": None,
+        }
+        event.update(node)
+        return event
+
+    def get_events(self):
+        return list(
+            Event.objects.order_by("id").values_list(
+                "node__system_id", "description"
+            )
+        )
+
+    def test__creates_events_for_nodes(self):
+        event_type = factory.make_EventType()
+        by_id, by_mac, by_ip = [
+            factory.make_Node(interface=True) for _ in range(3)
+        ]
+        mac_address = by_mac.get_boot_interface().mac_address
+        ip = factory.make_StaticIPAddress(interface=by_ip.get_boot_interface())
+        batch = [
+            self.make_event(event_type, system_id=by_id.system_id),
+            self.make_event(event_type, mac_address=str(mac_address)),
+            self.make_event(event_type, ip_address=ip.ip),
+        ]
+        events.send_events(batch)
+        self.assertEqual(
+            [
+                (by_id.system_id, batch[0]["description"]),
+                (by_mac.system_id, batch[1]["description"]),
+                (by_ip.system_id, batch[2]["description"]),
+            ],
+            self.get_events(),
+        )
+        event = Event.objects.get(node=by_id)
+        self.assertEqual(event_type, event.type)
+        self.assertEqual(by_id.system_id, event.node_system_id)
+        self.assertEqual(by_id.hostname, event.node_hostname)
+        self.assertEqual(
+            datetime.datetime.fromtimestamp(batch[0]["timestamp"]),
+            event.created,
+        )
+
+    def test__keeps_events_in_order(self):
+        event_type = factory.make_EventType()
+        nodes = [factory.make_Node() for _ in range(3)]
+        batch = [
+            self.make_event(event_type, system_id=node.system_id)
+            for _ in range(3)
+            for node in nodes
+        ]
+        events.send_events(batch)
+        self.assertEqual(
+            [(event["system_id"], event["description"]) for event in batch],
+            self.get_events(),
+        )
+
+    def test__uses_constant_number_of_queries(self):
+        event_type = factory.make_EventType()
+
+        def make_batch():
+            batch = []
+            for _ in range(3):
+                node = factory.make_Node(interface=True)
+                ip = factory.make_StaticIPAddress(
+                    interface=node.get_boot_interface()
+                )
+                mac_address = node.get_boot_interface().mac_address
+                batch.append(
+                    self.make_event(event_type, system_id=node.system_id)
+                )
+                batch.append(
+                    self.make_event(event_type, mac_address=str(mac_address))
+                )
+                batch.append(self.make_event(event_type, ip_address=ip.ip))
+            return batch
+
+        count_one, _ = count_queries(events.send_events, make_batch()[:3])
+        count_many, _ = count_queries(events.send_events, make_batch())
+        self.assertEqual(count_one, count_many)
+
+    def test__skips_unknown_nodes(self):
+        event_type = factory.make_EventType()
+        node = factory.make_Node()
+        batch = [
+            self.make_event(event_type, system_id=factory.make_name("id")),
+            self.make_event(
+                event_type, mac_address=factory.make_mac_address()
+            ),
+            self.make_event(event_type, ip_address=factory.make_ip_address()),
+            self.make_event(event_type, ip_address="not-an-ip"),
+            self.make_event(event_type, system_id=node.system_id),
+        ]
+        events.send_events(batch)
+        self.assertEqual(
+            [(node.system_id, batch[-1]["description"])], self.get_events()
+        )
+
+    def test__registers_known_event_types(self):
+        node = factory.make_Node()
+        event_type = EventType(name=EVENT_TYPES.NODE_PXE_REQUEST)
+        unknown_type = EventType(name=factory.make_name("type"))
+        batch = [
+            self.make_event(event_type, system_id=node.system_id),
+            self.make_event(unknown_type, system_id=node.system_id),
+        ]
+        events.send_events(batch)
+        self.assertEqual(
+            [(node.system_id, batch[0]["description"])], self.get_events()
+        )
+        details = EVENT_DETAILS[EVENT_TYPES.NODE_PXE_REQUEST]
+        self.assertThat(
+            EventType.objects.get(name=EVENT_TYPES.NODE_PXE_REQUEST),
+            MatchesStructure.byEquality(
+                description=details.description, level=details.level
+            ),
+        )
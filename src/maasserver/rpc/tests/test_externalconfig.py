@@ -0,0 +1,147 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for the configuration of rack controllers' external services."""
+
+__all__ = []
+
+import random
+
+from netaddr import IPNetwork
+
+from maasserver.models import Config
+from maasserver.rpc import externalconfig
+from maasserver.rpc.externalconfig import (
+    ExternalConfigDigests,
+    get_config_digests,
+    get_digest,
+    get_dns_configuration,
+    get_proxy_configuration,
+    get_syslog_configuration,
+)
+from maasserver.testing.factory import factory
+from maasserver.testing.testcase import MAASServerTestCase
+from maastesting.testcase import MAASTestCase
+from provisioningserver.rpc.exceptions import NoSuchNode
+
+
+class TestGetDigest(MAASTestCase):
+    def test_same_config_has_same_digest(self):
+        config = {"port": random.randint(1, 65535), "enabled": True}
+        self.assertEqual(get_digest(config), get_digest(dict(config)))
+
+    def test_different_config_has_different_digest(self):
+        self.assertNotEqual(
+            get_digest({"port": 5247}), get_digest({"port": 5248})
+        )
+
+    def test_ignores_order_of_lists(self):
+        self.assertEqual(
+            get_digest({"peers": ["10.0.0.1", "10.0.0.2"]}),
+            get_digest({"peers": frozenset(["10.0.0.2", "10.0.0.1"])}),
+        )
+
+    def test_digests_addresses_as_strings(self):
+        self.assertEqual(
+            get_digest({"allowed_cidrs": [IPNetwork("10.0.0.0/24")]}),
+            get_digest({"allowed_cidrs": ["10.0.0.0/24"]}),
+        )
+
+
+class TestExternalConfigDigests(MAASTestCase):
+    def make_cache(self):
+        cache = ExternalConfigDigests()
+        cache.enabled = True
+        return cache
+
+    def test_computes_once(self):
+        cache = self.make_cache()
+        digests = {"dns": factory.make_name("digest")}
+        computed = []
+
+        def compute():
+            computed.append(None)
+            return digests
+
+        self.assertEqual(digests, cache.get_or_compute("abc", compute))
+        self.assertEqual(digests, cache.get_or_compute("abc", compute))
+        self.assertEqual(1, len(computed))
+
+    def test_disabled_cache_stores_nothing(self):
+        cache = ExternalConfigDigests()
+        cache.get_or_compute("abc", dict)
+        self.assertEqual(0, len(cache))
+
+    def test_clear_drops_everything(self):
+        cache = self.make_cache()
+        cache.get_or_compute("abc", dict)
+        cache.clear()
+        self.assertEqual(0, len(cache))
+
+    def test_does_not_store_digests_computed_before_clear(self):
+        cache = self.make_cache()
+
+        def compute():
+            cache.clear()
+            return {}
+
+        cache.get_or_compute("abc", compute)
+        self.assertEqual(0, len(cache))
+
+
+class TestConfigurations(MAASServerTestCase):
+    def test_get_dns_configuration(self):
+        subnet = factory.make_Subnet(allow_dns=True)
+        rack = factory.make_RackController()
+        self.assertIn(
+            str(subnet.cidr),
+            get_dns_configuration(rack.system_id)["trusted_networks"],
+        )
+
+    def test_get_proxy_configuration(self):
+        subnet = factory.make_Subnet(allow_proxy=True)
+        Config.objects.set_config("maas_proxy_port", 8001)
+        rack = factory.make_RackController()
+        config = get_proxy_configuration(rack.system_id)
+        self.assertIn(subnet.cidr, config["allowed_cidrs"])
+        self.assertEqual(8001, config["port"])
+
+    def test_get_syslog_configuration(self):
+        Config.objects.set_config("maas_syslog_port", 5248)
+        rack = factory.make_RackController()
+        self.assertEqual(
+            {"port": 5248}, get_syslog_configuration(rack.system_id)
+        )
+
+
+class TestGetConfigDigests(MAASServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = ExternalConfigDigests()
+        self.cache.enabled = True
+        self.patch(externalconfig, "external_config_digests", self.cache)
+
+    def test_returns_digest_of_each_kind(self):
+        rack = factory.make_RackController()
+        digests = get_config_digests(rack.system_id)
+        self.assertItemsEqual(
+            externalconfig.CONFIG_KINDS.keys(), digests.keys()
+        )
+        self.assertEqual(
+            get_digest(get_syslog_configuration(rack.system_id)),
+            digests["syslog"],
+        )
+
+    def test_digest_changes_with_config(self):
+        rack = factory.make_RackController()
+        before = get_config_digests(rack.system_id)
+        Config.objects.set_config("maas_syslog_port", 5249)
+        self.cache.clear()
+        after = get_config_digests(rack.system_id)
+        self.assertNotEqual(before["syslog"], after["syslog"])
+        self.assertEqual(before["dns"], after["dns"])
+
+    def test_raises_NoSuchNode(self):
+        self.assertRaises(
+            NoSuchNode, get_config_digests, factory.make_name("id")
+        )
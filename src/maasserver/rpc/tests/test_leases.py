@@ -9,6 +9,7 @@ from datetime import datetime
 import random
 import time
 
+from django.db import transaction
 from django.utils import timezone
 from netaddr import IPAddress
 from testtools.matchers import Contains, Equals, MatchesStructure, Not
@@ -17,10 +18,12 @@ from maasserver.enum import INTERFACE_TYPE, IPADDRESS_FAMILY, IPADDRESS_TYPE
 from maasserver.models import DNSResource
 from maasserver.models.interface import UnknownInterface
 from maasserver.models.staticipaddress import StaticIPAddress
-from maasserver.rpc.leases import LeaseUpdateError, update_lease
+from maasserver.rpc import leases as leases_module
+from maasserver.rpc.leases import LeaseUpdateError, update_lease, update_leases
 from maasserver.testing.factory import factory
 from maasserver.testing.testcase import MAASServerTestCase
 from maasserver.utils.orm import get_one, reload_object
+from maastesting.matchers import MockCalledOnce
 
 
 class TestUpdateLease(MAASServerTestCase):
@@ -508,3 +511,152 @@ class TestUpdateLease(MAASServerTestCase):
         self.assertEqual(1, ip_address2.interface_set.count())
         self.assertEqual(1, boot_interface1.ip_addresses.count())
         self.assertEqual(1, boot_interface2.ip_addresses.count())
+
+
+class TestUpdateLeases(MAASServerTestCase):
+
+    make_kwargs = TestUpdateLease.make_kwargs
+
+    def make_managed_subnet(self):
+        subnet = factory.make_ipv4_Subnet_with_IPRanges(
+            with_static_range=False, dhcp_on=True
+        )
+        return subnet, subnet.get_dynamic_ranges()[0]
+
+    def get_leased(self, interface):
+        return list(
+            interface.ip_addresses.filter(
+                alloc_type=IPADDRESS_TYPE.DISCOVERED, ip__isnull=False
+            ).values_list("ip", flat=True)
+        )
+
+    def test_updates_leases_in_order(self):
+        subnet, dynamic_range = self.make_managed_subnet()
+        node = factory.make_Node_with_Interface_on_Subnet(subnet=subnet)
+        boot_interface = node.get_boot_interface()
+        mac = str(boot_interface.mac_address)
+        ip1 = factory.pick_ip_in_IPRange(dynamic_range)
+        ip2 = factory.pick_ip_in_IPRange(dynamic_range, but_not=[ip1])
+        update_leases(
+            [
+                self.make_kwargs(action="commit", mac=mac, ip=ip1),
+                self.make_kwargs(action="commit", mac=mac, ip=ip2),
+            ]
+        )
+        self.assertEqual([ip2], self.get_leased(boot_interface))
+
+    def test_creates_one_unknown_interface_per_mac(self):
+        subnet, dynamic_range = self.make_managed_subnet()
+        mac = factory.make_mac_address()
+        ip1 = factory.pick_ip_in_IPRange(dynamic_range)
+        ip2 = factory.pick_ip_in_IPRange(dynamic_range, but_not=[ip1])
+        update_leases(
+            [
+                self.make_kwargs(action="commit", mac=mac, ip=ip1),
+                self.make_kwargs(action="commit", mac=mac, ip=ip2),
+            ]
+        )
+        [unknown_interface] = UnknownInterface.objects.filter(mac_address=mac)
+        self.assertEqual([ip2], self.get_leased(unknown_interface))
+
+    def test_coalesces_repeated_commits_for_the_same_mac_and_ip(self):
+        subnet, dynamic_range = self.make_managed_subnet()
+        node = factory.make_Node_with_Interface_on_Subnet(subnet=subnet)
+        boot_interface = node.get_boot_interface()
+        mac = str(boot_interface.mac_address)
+        ip = factory.pick_ip_in_IPRange(dynamic_range)
+        hostname = factory.make_name("host")
+        first = self.make_kwargs(
+            action="commit", mac=mac, ip=ip, hostname=hostname
+        )
+        second = self.make_kwargs(
+            action="commit", mac=mac, ip=ip, hostname="(none)"
+        )
+        apply_lease = self.patch(leases_module, "_apply_lease")
+        apply_lease.side_effect = lambda *args: args[5]
+        update_leases([first, second])
+        self.assertThat(apply_lease, MockCalledOnce())
+        self.assertEqual(
+            (second["lease_time"], hostname), apply_lease.call_args[0][7:]
+        )
+
+    def test_keeps_updates_with_different_actions_for_the_same_mac_and_ip(
+        self
+    ):
+        subnet, dynamic_range = self.make_managed_subnet()
+        node = factory.make_Node_with_Interface_on_Subnet(subnet=subnet)
+        boot_interface = node.get_boot_interface()
+        mac = str(boot_interface.mac_address)
+        ip = factory.pick_ip_in_IPRange(dynamic_range)
+        commit = self.make_kwargs(action="commit", mac=mac, ip=ip)
+        release = self.make_kwargs(action="release", mac=mac, ip=ip)
+        apply_lease = self.patch(leases_module, "_apply_lease")
+        apply_lease.side_effect = lambda *args: args[5]
+        update_leases([commit, release, commit, release])
+        self.assertEqual(
+            ["commit", "release", "commit", "release"],
+            [call[0][0] for call in apply_lease.call_args_list],
+        )
+
+    def test_has_same_outcome_as_update_lease(self):
+        subnet, dynamic_range = self.make_managed_subnet()
+        node = factory.make_Node_with_Interface_on_Subnet(subnet=subnet)
+        mac = str(node.get_boot_interface().mac_address)
+        ips = []
+        for _ in range(3):
+            ips.append(factory.pick_ip_in_IPRange(dynamic_range, but_not=ips))
+        hostname = factory.make_name("host").lower()
+        updates = [
+            self.make_kwargs(
+                action="commit", mac=mac, ip=ips[0], hostname=hostname
+            ),
+            self.make_kwargs(action="commit", mac=mac, ip=ips[1]),
+            self.make_kwargs(action="expiry", mac=mac, ip=ips[1]),
+            self.make_kwargs(action="commit", ip=ips[2]),
+        ]
+
+        def get_state():
+            return sorted(
+                StaticIPAddress.objects.filter(
+                    alloc_type=IPADDRESS_TYPE.DISCOVERED
+                ).values_list(
+                    "ip", "subnet_id", "lease_time", "interface__mac_address"
+                ),
+                key=str,
+            )
+
+        with transaction.atomic():
+            for update in updates:
+                update_lease(**update)
+            expected = get_state()
+            transaction.set_rollback(True)
+        update_leases(updates)
+        self.assertEqual(expected, get_state())
+
+    def test_skips_invalid_updates(self):
+        subnet, dynamic_range = self.make_managed_subnet()
+        ip = factory.pick_ip_in_IPRange(dynamic_range)
+        good = self.make_kwargs(action="commit", ip=ip)
+        unknown_action = self.make_kwargs(
+            action=factory.make_name("action"), ip=ip
+        )
+        no_subnet = self.make_kwargs(action="commit")
+        wrong_family = self.make_kwargs(action="commit", subnet=subnet)
+        wrong_family["ip_family"] = "ipv6"
+        update_leases([unknown_action, no_subnet, wrong_family, good])
+        [unknown_interface] = UnknownInterface.objects.all()
+        self.assertEqual(good["mac"], str(unknown_interface.mac_address))
+
+    def test_ignores_ips_outside_dynamic_range(self):
+        subnet, dynamic_range = self.make_managed_subnet()
+        # Dynamic ranges are in use, so this picks an IP outside them.
+        ip = factory.pick_ip_in_Subnet(subnet, but_not=[])
+        update_leases([self.make_kwargs(action="commit", ip=ip)])
+        self.assertFalse(UnknownInterface.objects.exists())
+
+    def test_accepts_updates_without_optional_fields(self):
+        subnet, dynamic_range = self.make_managed_subnet()
+        ip = factory.pick_ip_in_IPRange(dynamic_range)
+        kwargs = self.make_kwargs(action="expiry", ip=ip)
+        del kwargs["lease_time"], kwargs["hostname"]
+        update_leases([kwargs])
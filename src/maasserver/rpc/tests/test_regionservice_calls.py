@@ -26,13 +26,13 @@ from twisted.python.failure import Failure
 
 from maasserver import eventloop
 from maasserver.bootresources import get_simplestream_endpoint
-from maasserver.dns.config import get_trusted_networks
 from maasserver.enum import INTERFACE_TYPE, NODE_STATUS, POWER_STATE
 from maasserver.models import Config, Event, EventType, Node, PackageRepository
 from maasserver.models.interface import PhysicalInterface
 from maasserver.models.signals import bootsources
 from maasserver.models.signals.testing import SignalsDisabled
 from maasserver.rpc import events as events_module
+from maasserver.rpc import externalconfig
 from maasserver.rpc import leases as leases_module
 from maasserver.rpc import regionservice
 from maasserver.rpc.nodes import get_controller_type, get_time_configuration
@@ -62,6 +62,7 @@ from provisioningserver.rpc.region import (
     GetBootConfig,
     GetBootSources,
     GetBootSourcesV2,
+    GetConfigurationDigests,
     GetControllerType,
     GetDNSConfiguration,
     GetProxies,
@@ -79,8 +80,10 @@ from provisioningserver.rpc.region import (
     RequestRackRefresh,
     SendEvent,
     SendEventMACAddress,
+    SendEvents,
     UpdateInterfaces,
     UpdateLease,
+    UpdateLeases,
     UpdateNodePowerState,
     UpdateServices,
 )
@@ -278,6 +281,74 @@ class TestRegionProtocol_UpdateLease(MAASTransactionServerTestCase):
         # works as expected.
 
 
+class TestRegionProtocol_UpdateLeases(MAASTransactionServerTestCase):
+    def setUp(self):
+        super(TestRegionProtocol_UpdateLeases, self).setUp()
+        self.useFixture(RegionEventLoopFixture("database-tasks"))
+
+    def make_update(self):
+        return {
+            "action": "expiry",
+            "mac": factory.make_mac_address(),
+            "ip_family": "ipv4",
+            "ip": factory.make_ipv4_address(),
+            "timestamp": int(time.time()),
+            "lease_time": None,
+            "hostname": None,
+        }
+
+    def test_update_leases_is_registered(self):
+        protocol = Region()
+        responder = protocol.locateResponder(UpdateLeases.commandName)
+        self.assertIsNotNone(responder)
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test__calls_update_leases(self):
+        update_leases = self.patch(leases_module, "update_leases")
+        update_leases.return_value = {}
+        updates = [self.make_update() for _ in range(3)]
+
+        yield eventloop.start()
+        try:
+            yield call_responder(
+                Region(),
+                UpdateLeases,
+                {
+                    "cluster_uuid": factory.make_name("uuid"),
+                    "updates": updates,
+                },
+            )
+        finally:
+            yield eventloop.reset()
+
+        self.assertThat(update_leases, MockCalledOnceWith(updates))
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test__doesnt_raises_other_errors(self):
+        # Cause a random exception
+        self.patch(
+            leases_module, "update_leases"
+        ).side_effect = factory.make_exception()
+
+        yield eventloop.start()
+        try:
+            yield call_responder(
+                Region(),
+                UpdateLeases,
+                {
+                    "cluster_uuid": factory.make_name("uuid"),
+                    "updates": [self.make_update()],
+                },
+            )
+        finally:
+            yield eventloop.reset()
+
+        # Test is that no exceptions are raised. If this test passes then all
+        # works as expected.
+
+
 class TestRegionProtocol_GetBootConfig(MAASTransactionServerTestCase):
     def test_get_boot_config_is_registered(self):
         protocol = Region()
@@ -1048,6 +1119,79 @@ class TestRegionProtocol_SendEventMACAddress(MAASTransactionServerTestCase):
         )
 
 
+class TestRegionProtocol_SendEvents(MAASTransactionServerTestCase):
+    def setUp(self):
+        super(TestRegionProtocol_SendEvents, self).setUp()
+        self.useFixture(RegionEventLoopFixture("database-tasks"))
+
+    def test_send_events_is_registered(self):
+        protocol = Region()
+        responder = protocol.locateResponder(SendEvents.commandName)
+        self.assertIsNotNone(responder)
+
+    @transactional
+    def create_event_type(self):
+        return factory.make_EventType().name
+
+    @transactional
+    def create_node(self):
+        return factory.make_Node().system_id
+
+    @transactional
+    def get_descriptions(self, system_id):
+        return list(
+            Event.objects.filter(node__system_id=system_id)
+            .order_by("id")
+            .values_list("description", flat=True)
+        )
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_send_events_stores_events(self):
+        type_name = yield deferToDatabase(self.create_event_type)
+        system_id = yield deferToDatabase(self.create_node)
+        events = [
+            {
+                "type_name": type_name,
+                "description": factory.make_name("description"),
+                "timestamp": time.time(),
+                "system_id": system_id,
+            }
+            for _ in range(3)
+        ]
+
+        yield eventloop.start()
+        try:
+            response = yield call_responder(
+                Region(), SendEvents, {"events": events}
+            )
+        finally:
+            yield eventloop.reset()
+
+        self.assertEqual({}, response)
+        descriptions = yield deferToDatabase(self.get_descriptions, system_id)
+        self.assertEqual(
+            [event["description"] for event in events], descriptions
+        )
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_send_events_fails_when_events_are_not_stored(self):
+        # The rack keeps the events queued to send again.
+        self.patch(
+            events_module, "send_events"
+        ).side_effect = factory.make_exception()
+
+        yield eventloop.start()
+        try:
+            yield assert_fails_with(
+                call_responder(Region(), SendEvents, {"events": []}),
+                amp.UnknownRemoteError,
+            )
+        finally:
+            yield eventloop.reset()
+
+
 class TestRegionProtocol_UpdateServices(MAASTransactionServerTestCase):
     def setUp(self):
         super(TestRegionProtocol_UpdateServices, self).setUp()
@@ -1413,13 +1557,15 @@ class TestRegionProtocol_GetDNSConfiguration(MAASTransactionServerTestCase):
 
     @wait_for_reactor
     @inlineCallbacks
-    def test_calls_get_trusted_networks(self):
+    def test_calls_get_dns_configuration(self):
         example_networks = [
             factory.make_ipv4_address(),
             factory.make_ipv6_address(),
         ]
         deferToDatabase = self.patch(regionservice, "deferToDatabase")
-        deferToDatabase.return_value = succeed(example_networks)
+        deferToDatabase.return_value = succeed(
+            {"trusted_networks": example_networks}
+        )
         system_id = factory.make_name("id")
         response = yield call_responder(
             Region(), GetDNSConfiguration, {"system_id": system_id}
@@ -1428,7 +1574,10 @@ class TestRegionProtocol_GetDNSConfiguration(MAASTransactionServerTestCase):
             response, Equals({"trusted_networks": example_networks})
         )
         self.assertThat(
-            deferToDatabase, MockCalledOnceWith(get_trusted_networks)
+            deferToDatabase,
+            MockCalledOnceWith(
+                externalconfig.get_dns_configuration, system_id
+            ),
         )
 
 
@@ -1497,3 +1646,39 @@ class TestRegionProtocol_GetSyslogConfiguration(MAASTransactionServerTestCase):
             Region(), GetSyslogConfiguration, {"system_id": system_id}
         )
         self.assertThat(response, Equals({"port": port}))
+
+
+class TestRegionProtocol_GetConfigurationDigests(
+    MAASTransactionServerTestCase
+):
+    def test_get_configuration_digests_is_registered(self):
+        protocol = Region()
+        responder = protocol.locateResponder(
+            GetConfigurationDigests.commandName
+        )
+        self.assertIsNotNone(responder)
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_calls_get_config_digests(self):
+        digests = {
+            kind: factory.make_name("digest")
+            for kind in externalconfig.CONFIG_KINDS
+        }
+        deferToDatabase = self.patch(regionservice, "deferToDatabase")
+        deferToDatabase.return_value = succeed(digests)
+        system_id = factory.make_name("id")
+        response = yield call_responder(
+            Region(), GetConfigurationDigests, {"system_id": system_id}
+        )
+        self.assertThat(response, Equals({"digests": digests}))
+        self.assertThat(
+            deferToDatabase,
+            MockCalledOnceWith(externalconfig.get_config_digests, system_id),
+        )
+
+    @wait_for_reactor
+    def test_raises_NoSuchNode_when_node_does_not_exist(self):
+        arguments = {"system_id": factory.make_name("id")}
+        d = call_responder(Region(), GetConfigurationDigests, arguments)
+        return assert_fails_with(d, NoSuchNode)
@@ -6,200 +6,365 @@
 __all__ = ["mark_nodes_failed_after_expiring", "StatusMonitorService"]
 
 from datetime import timedelta
+import time
 
-from django.db.models import Prefetch
+from django.db.models import (
+    Case,
+    DateTimeField,
+    DurationField,
+    Exists,
+    ExpressionWrapper,
+    F,
+    OuterRef,
+    Q,
+    Subquery,
+    Value,
+    When,
+)
 from twisted.application.internet import TimerService
 
 from maasserver.enum import NODE_STATUS, NODE_STATUS_CHOICES_DICT
 from maasserver.models.config import Config
+from maasserver.models.event import Event
+from maasserver.models.eventtype import EventType
 from maasserver.models.node import Node
+from maasserver.models.signals.scriptresult import get_script_result_event_name
 from maasserver.models.timestampedmodel import now
 from maasserver.node_status import get_node_timeout, MONITORED_STATUSES
 from maasserver.utils.orm import transactional
 from maasserver.utils.threads import deferToDatabase
-from metadataserver.enum import SCRIPT_STATUS
-from metadataserver.models import Script, ScriptResult, ScriptSet
+from metadataserver.enum import SCRIPT_STATUS, SCRIPT_STATUS_RUNNING_OR_PENDING
+from metadataserver.models import ScriptResult, ScriptSet
+from provisioningserver.events import EVENT_DETAILS, EVENT_TYPES
 from provisioningserver.logger import get_maas_logger
+from provisioningserver.prometheus.metrics import PROMETHEUS_METRICS
 from provisioningserver.refresh.node_info_scripts import NODE_INFO_SCRIPTS
 from provisioningserver.utils.twisted import synchronous
 
 maaslog = get_maas_logger("node")
 
+# The script set that is being run by nodes in each status, for the statuses
+# where a heartbeat is expected from the node.
+HEARTBEAT_SCRIPT_SETS = {
+    NODE_STATUS.COMMISSIONING: "current_commissioning_script_set",
+    NODE_STATUS.TESTING: "current_testing_script_set",
+}
+
+
+def register_event_type(event_type):
+    """Register `event_type`, and return it."""
+    event_details = EVENT_DETAILS[event_type]
+    return EventType.objects.register(
+        event_type, event_details.description, event_details.level
+    )
+
+
+def mark_nodes_failed(failures, script_result_status, timed_out=()):
+    """Mark nodes as failed, as `Node.mark_failed` does.
+
+    The events are registered, and the running and pending script results
+    updated, with one query each for all the nodes. Nodes are still saved
+    one at a time, so that their status transitions are handled.
+
+    :param failures: A list of `(node, comment)` tuples.
+    :param script_result_status: The status to give the nodes' running and
+        pending script results.
+    :param timed_out: Script results to mark as timed out first, with the
+        event that saving each of them would register.
+    """
+    if len(failures) == 0:
+        return
+    current_time = now()
+    events = []
+    if len(timed_out) != 0:
+        ScriptResult.objects.filter(
+            id__in=[script_result.id for script_result in timed_out]
+        ).update(status=SCRIPT_STATUS.TIMEDOUT, updated=current_time)
+        event_type = register_event_type(EVENT_TYPES.SCRIPT_DID_NOT_COMPLETE)
+        events.extend(
+            Event(
+                type=event_type,
+                node=script_result.script_set.node,
+                node_system_id=script_result.script_set.node.system_id,
+                node_hostname=script_result.script_set.node.hostname,
+                description="%s timed out"
+                % get_script_result_event_name(script_result),
+                created=current_time,
+                updated=current_time,
+            )
+            for script_result in timed_out
+        )
+    event_type = register_event_type(
+        EVENT_TYPES.REQUEST_NODE_MARK_FAILED_SYSTEM
+    )
+    events.extend(
+        Event(
+            type=event_type,
+            node=node,
+            node_system_id=node.system_id,
+            node_hostname=node.hostname,
+            action="mark_failed",
+            description=comment,
+            created=current_time,
+            updated=current_time,
+        )
+        for node, comment in failures
+    )
+    Event.objects.bulk_create(events)
+    script_set_ids = {
+        script_set_id
+        for node, _ in failures
+        for script_set_id in (
+            node.current_commissioning_script_set_id,
+            node.current_testing_script_set_id,
+            node.current_installation_script_set_id,
+        )
+        if script_set_id is not None
+    }
+    ScriptResult.objects.filter(
+        script_set_id__in=script_set_ids,
+        status__in=SCRIPT_STATUS_RUNNING_OR_PENDING,
+    ).update(status=script_result_status, updated=current_time)
+    for node, comment in failures:
+        node.set_failed_status(comment=comment)
+
+
+def stop_nodes_without_ssh(nodes):
+    """Stop those of `nodes` that do not have SSH enabled."""
+    for node in nodes:
+        if not node.enable_ssh:
+            maaslog.info("%s: Stopped because SSH is disabled" % node.hostname)
+            node.stop(comment="Node stopped because SSH is disabled")
+
 
 def mark_nodes_failed_after_expiring(now, node_timeout):
     """Mark all nodes in that database as failed where the status did not
     transition in time. `status_expires` is checked on the node to see if the
     current time is newer than the expired time.
+
+    :return: The number of nodes examined.
     """
     expired_nodes = Node.objects.filter(
         status__in=MONITORED_STATUSES,
         status_expires__isnull=False,
         status_expires__lte=now,
-    )
+    ).order_by("id")
+    failures = []
     for node in expired_nodes:
         minutes = get_node_timeout(node.status, node_timeout)
         maaslog.info(
             "%s: Operation '%s' timed out after %s minutes."
             % (node.hostname, NODE_STATUS_CHOICES_DICT[node.status], minutes)
         )
-        node.mark_failed(
-            comment="Node operation '%s' timed out after %s minutes."
-            % (NODE_STATUS_CHOICES_DICT[node.status], minutes),
-            script_result_status=SCRIPT_STATUS.ABORTED,
+        failures.append(
+            (
+                node,
+                "Node operation '%s' timed out after %s minutes."
+                % (NODE_STATUS_CHOICES_DICT[node.status], minutes),
+            )
+        )
+    mark_nodes_failed(failures, SCRIPT_STATUS.ABORTED)
+    return len(failures)
+
+
+def get_script_timeout():
+    """Return an expression for the timeout of a script result.
+
+    This is the timeout of the builtin script of that name if there is one,
+    otherwise the timeout of the script, if it has one.
+    """
+    whens = [
+        When(
+            Q(script__name=name) | Q(script=None, script_name=name),
+            then=Value(script["timeout"], output_field=DurationField()),
         )
+        for name, script in NODE_INFO_SCRIPTS.items()
+        if "timeout" in script
+    ]
+    whens.append(
+        When(script__timeout__gt=timedelta(0), then=F("script__timeout"))
+    )
+    return Case(*whens, default=None, output_field=DurationField())
 
 
-def mark_nodes_failed_after_missing_script_timeout(now, node_timeout):
-    """Check on the status of commissioning or testing nodes.
+def mark_nodes_failed_after_missing_heartbeat(now, node_timeout):
+    """Check the heartbeat of commissioning or testing nodes.
 
-    For any node currently commissioning or testing check that a region is
-    still receiving its heartbeat and no running script has gone past its
-    run limit. If the node fails either condition its put into a failed status.
+    Nodes whose heartbeat has flatlined while running a script that may
+    reboot are assumed to be rebooting, and given the boot timeout to come
+    back. The others are marked failed.
+
+    :return: The number of nodes examined.
     """
     # maas-run-remote-scripts sends a heartbeat every two minutes. If we
     # haven't received a heartbeat within node_timeout(20 min by default)
     # it's dead.
     heartbeat_expired = now - timedelta(minutes=node_timeout)
-    # Get the list of nodes currently running testing. status_expires is used
-    # while the node is booting. Once MAAS receives the signal that testing
-    # has begun it resets status_expires and checks for the heartbeat instead.
-    qs = Node.objects.filter(
-        status__in=[NODE_STATUS.COMMISSIONING, NODE_STATUS.TESTING],
-        status_expires=None,
-    )
-    qs = qs.prefetch_related(
-        Prefetch(
-            "current_commissioning_script_set",
-            ScriptSet.objects.prefetch_related(
-                Prefetch(
-                    "scriptresult_set",
-                    ScriptResult.objects.defer(
-                        "output", "stdout", "stderr", "result"
-                    ).prefetch_related(
-                        Prefetch(
-                            "script",
-                            Script.objects.only(
-                                "script_type", "name", "may_reboot", "timeout"
-                            ),
-                        )
-                    ),
+    examined = 0
+    for status, script_set in HEARTBEAT_SCRIPT_SETS.items():
+        # status_expires is used while the node is booting. Once MAAS
+        # receives the signal that scripts have begun it resets
+        # status_expires and checks for the heartbeat instead.
+        flatlined = Node.objects.filter(
+            status=status,
+            status_expires=None,
+            **{script_set + "__last_ping__lt": heartbeat_expired}
+        )
+        flatlined = flatlined.annotate(
+            maybe_rebooting=Exists(
+                ScriptResult.objects.filter(
+                    script_set=OuterRef(script_set),
+                    status=SCRIPT_STATUS.RUNNING,
+                    script__may_reboot=True,
+                )
+            )
+        ).order_by("id")
+        rebooting = []
+        failures = []
+        for node in flatlined:
+            if node.maybe_rebooting:
+                rebooting.append(node.id)
+            else:
+                maaslog.info(
+                    "%s: Has not been heard from for the last %s minutes"
+                    % (node.hostname, node_timeout)
+                )
+                failures.append(
+                    (
+                        node,
+                        "Node has not been heard from for the last %s minutes"
+                        % node_timeout,
+                    )
                 )
-            ),
-        ),
-        Prefetch(
-            "current_testing_script_set",
-            ScriptSet.objects.prefetch_related(
-                Prefetch(
-                    "scriptresult_set",
-                    ScriptResult.objects.defer(
-                        "output", "stdout", "stderr", "result"
-                    ).prefetch_related(
-                        Prefetch(
-                            "script",
-                            Script.objects.only(
-                                "script_type", "name", "may_reboot", "timeout"
-                            ),
-                        )
+        if len(rebooting) != 0:
+            # If the script currently running may_reboot and the node's
+            # heartbeat has flatlined assume the node is rebooting. Set the
+            # node's status_expires to the boot timeout from the last ping.
+            last_ping = ScriptSet.objects.filter(
+                id=OuterRef(script_set)
+            ).values("last_ping")
+            minutes = get_node_timeout(status, node_timeout)
+            Node.objects.filter(id__in=rebooting).update(
+                status_expires=ExpressionWrapper(
+                    Subquery(last_ping)
+                    + Value(
+                        timedelta(minutes=minutes),
+                        output_field=DurationField(),
                     ),
+                    output_field=DateTimeField(),
                 )
-            ),
-        ),
-    )
-    for node in qs:
-        if node.status == NODE_STATUS.COMMISSIONING:
-            script_set = node.current_commissioning_script_set
-        elif node.status == NODE_STATUS.TESTING:
-            script_set = node.current_testing_script_set
-        script_results = [
-            script_result
-            for script_result in script_set
-            if script_result.status == SCRIPT_STATUS.RUNNING
-        ]
-        maybe_rebooting = False
-        for script_result in script_results:
-            if script_result.script and script_result.script.may_reboot:
-                maybe_rebooting = True
-                break
-        flatlined = (
-            script_set.last_ping is not None
-            and script_set.last_ping < heartbeat_expired
+            )
+        mark_nodes_failed(failures, SCRIPT_STATUS.TIMEDOUT)
+        stop_nodes_without_ssh(node for node, _ in failures)
+        examined += len(rebooting) + len(failures)
+    return examined
+
+
+def mark_nodes_failed_after_script_overrun(now, node_timeout):
+    """Check the running scripts of commissioning or testing nodes.
+
+    The node running the scripts checks if a script has run past its time
+    limit. The node will try to kill the script and move on by signaling the
+    region. If 5 minutes after the timeout the region hasn't received the
+    signal the script is marked timed out and the node failed.
+
+    :return: The number of nodes examined.
+    """
+    heartbeat_expired = now - timedelta(minutes=node_timeout)
+    running = Q()
+    for status, script_set in HEARTBEAT_SCRIPT_SETS.items():
+        running |= Q(
+            **{
+                "script_set__node__status": status,
+                "script_set__node__" + script_set: F("script_set"),
+            }
         )
-        if maybe_rebooting and flatlined:
-            # If the script currently running may_reboot and the nodes
-            # heartbeat has flatlined assume the node is rebooting. Set the
-            # node.status_expires time to the boot timeout minus what has
-            # already passed.
-            minutes = get_node_timeout(node.status, node_timeout)
-            node.status_expires = (
-                now - (now - script_set.last_ping) + timedelta(minutes=minutes)
+    overrun = (
+        ScriptResult.objects.filter(
+            running,
+            Q(script_set__last_ping=None)
+            | Q(script_set__last_ping__gte=heartbeat_expired),
+            status=SCRIPT_STATUS.RUNNING,
+            started__isnull=False,
+            script_set__node__status_expires=None,
+        )
+        .annotate(script_timeout=get_script_timeout())
+        .annotate(
+            script_expires=ExpressionWrapper(
+                F("started")
+                + F("script_timeout")
+                + Value(timedelta(minutes=5), output_field=DurationField()),
+                output_field=DateTimeField(),
             )
-            node.save(update_fields=["status_expires"])
+        )
+        .filter(script_expires__lt=now)
+        .select_related(
+            "script", "script_set__node", "physical_blockdevice", "interface"
+        )
+        .defer("output", "stdout", "stderr", "result")
+        .order_by("id")
+    )
+    examined = set()
+    timed_out = []
+    failures = []
+    for script_result in overrun:
+        node = script_result.script_set.node
+        if node.id in examined:
             continue
-        elif flatlined:
-            maaslog.info(
-                "%s: Has not been heard from for the last %s minutes"
-                % (node.hostname, node_timeout)
-            )
-            node.mark_failed(
-                comment=(
-                    "Node has not been heard from for the last %s minutes"
-                    % node_timeout
-                ),
-                script_result_status=SCRIPT_STATUS.TIMEDOUT,
-            )
-            if not node.enable_ssh:
-                maaslog.info(
-                    "%s: Stopped because SSH is disabled" % node.hostname
-                )
-                node.stop(comment="Node stopped because SSH is disabled")
+        if any(
+            param.get("type") == "runtime"
+            for param in script_result.parameters.values()
+        ):
+            # The node itself enforces a runtime given as a parameter.
             continue
-
-        # Check for scripts which have gone past their timeout.
-        for script_result in script_results:
-            timeout = None
-            for param in script_result.parameters.values():
-                if param.get("type") == "runtime":
-                    timeout = param.get("value")
-                    break
-            if (
-                timeout is None
-                and script_result.name in NODE_INFO_SCRIPTS
-                and "timeout" in NODE_INFO_SCRIPTS[script_result.name]
-            ):
-                timeout = NODE_INFO_SCRIPTS[script_result.name]["timeout"]
-            elif (
-                timeout is None
-                and script_result.script is not None
-                and script_result.script.timeout.seconds > 0
-            ):
-                timeout = script_result.script.timeout
-            else:
-                continue
-            # The node running the scripts checks if the script has run past
-            # its time limit. The node will try to kill the script and move on
-            # by signaling the region. If after 5 minutes past the timeout the
-            # region hasn't recieved the signal mark_failed and stop the node.
-            script_expires = (
-                script_result.started + timeout + timedelta(minutes=5)
+        examined.add(node.id)
+        timed_out.append(script_result)
+        timeout = script_result.script_timeout
+        maaslog.info(
+            "%s: %s has run past it's timeout(%s)"
+            % (node.hostname, script_result.name, str(timeout))
+        )
+        failures.append(
+            (
+                node,
+                "%s has run past it's timeout(%s)"
+                % (script_result.name, str(timeout)),
             )
-            if script_expires < now:
-                script_result.status = SCRIPT_STATUS.TIMEDOUT
-                script_result.save(update_fields=["status"])
-                maaslog.info(
-                    "%s: %s has run past it's timeout(%s)"
-                    % (node.hostname, script_result.name, str(timeout))
-                )
-                node.mark_failed(
-                    comment="%s has run past it's timeout(%s)"
-                    % (script_result.name, str(timeout)),
-                    script_result_status=SCRIPT_STATUS.ABORTED,
-                )
-                if not node.enable_ssh:
-                    maaslog.info(
-                        "%s: Stopped because SSH is disabled" % node.hostname
-                    )
-                    node.stop(comment="Node stopped because SSH is disabled")
-                break
+        )
+    mark_nodes_failed(failures, SCRIPT_STATUS.ABORTED, timed_out)
+    stop_nodes_without_ssh(node for node, _ in failures)
+    return len(failures)
+
+
+def mark_nodes_failed_after_missing_script_timeout(now, node_timeout):
+    """Check on the status of commissioning or testing nodes.
+
+    For any node currently commissioning or testing check that a region is
+    still receiving its heartbeat and no running script has gone past its
+    run limit. If the node fails either condition its put into a failed status.
+
+    :return: The number of nodes examined.
+    """
+    return mark_nodes_failed_after_missing_heartbeat(
+        now, node_timeout
+    ) + mark_nodes_failed_after_script_overrun(now, node_timeout)
+
+
+def record_sweep(sweep, started, examined):
+    """Record the duration of a sweep and the nodes it examined."""
+    labels = {"sweep": sweep}
+    PROMETHEUS_METRICS.update(
+        "maas_status_monitor_sweep_duration",
+        "observe",
+        value=time.monotonic() - started,
+        labels=labels,
+    )
+    PROMETHEUS_METRICS.update(
+        "maas_status_monitor_nodes_examined",
+        "inc",
+        value=examined,
+        labels=labels,
+    )
 
 
 @synchronous
@@ -208,8 +373,14 @@ def check_status():
     """Check the status_expires and script timeout on all nodes."""
     current_time = now()
     node_timeout = Config.objects.get_config("node_timeout")
-    mark_nodes_failed_after_expiring(current_time, node_timeout)
-    mark_nodes_failed_after_missing_script_timeout(current_time, node_timeout)
+    started = time.monotonic()
+    examined = mark_nodes_failed_after_expiring(current_time, node_timeout)
+    record_sweep("expiring", started, examined)
+    started = time.monotonic()
+    examined = mark_nodes_failed_after_missing_script_timeout(
+        current_time, node_timeout
+    )
+    record_sweep("script_timeout", started, examined)
 
 
 class StatusMonitorService(TimerService, object):
@@ -29,7 +29,13 @@ from maasserver import (
 )
 from maasserver.eventloop import DEFAULT_PORT, MAASServices
 from maasserver.prometheus.stats import PrometheusService
-from maasserver.regiondservices import ntp, service_monitor_service, syslog
+from maasserver.regiondservices import (
+    boot_config,
+    external_config,
+    ntp,
+    service_monitor_service,
+    syslog,
+)
 from maasserver.rpc import regionservice
 from maasserver.testing.eventloop import RegionEventLoopFixture
 from maasserver.testing.listener import FakePostgresListenerService
@@ -486,6 +492,46 @@ class TestFactories(MAASServerTestCase):
             eventloop.loop.factories["rack-controller"]["only_on_master"]
         )
 
+    def test_make_BootConfigService(self):
+        service = eventloop.make_BootConfigService(
+            FakePostgresListenerService()
+        )
+        self.assertThat(service, IsInstance(boot_config.BootConfigService))
+        # It is registered as a factory in RegionEventLoop.
+        self.assertIs(
+            eventloop.make_BootConfigService,
+            eventloop.loop.factories["boot-config"]["factory"],
+        )
+        # Has a dependency of postgres-listener.
+        self.assertEquals(
+            ["postgres-listener-worker"],
+            eventloop.loop.factories["boot-config"]["requires"],
+        )
+        self.assertFalse(
+            eventloop.loop.factories["boot-config"]["only_on_master"]
+        )
+
+    def test_make_ExternalConfigService(self):
+        service = eventloop.make_ExternalConfigService(
+            FakePostgresListenerService()
+        )
+        self.assertThat(
+            service, IsInstance(external_config.ExternalConfigService)
+        )
+        # It is registered as a factory in RegionEventLoop.
+        self.assertIs(
+            eventloop.make_ExternalConfigService,
+            eventloop.loop.factories["external-config"]["factory"],
+        )
+        # Has a dependency of postgres-listener.
+        self.assertEquals(
+            ["postgres-listener-worker"],
+            eventloop.loop.factories["external-config"]["requires"],
+        )
+        self.assertFalse(
+            eventloop.loop.factories["external-config"]["only_on_master"]
+        )
+
     def test_make_ServiceMonitorService(self):
         service = eventloop.make_ServiceMonitorService()
         self.assertThat(
@@ -28,11 +28,13 @@ from twisted.internet.defer import (
     DeferredQueue,
     inlineCallbacks,
 )
+from twisted.internet.task import Clock
 from twisted.logger import LogLevel
 from twisted.python.failure import Failure
 
 from maasserver import listener as listener_module
 from maasserver.listener import (
+    PendingNotifications,
     PostgresListenerNotifyError,
     PostgresListenerRegistrationError,
     PostgresListenerService,
@@ -49,6 +51,7 @@ from maastesting.matchers import (
     MockCallsMatch,
     MockNotCalled,
 )
+from maastesting.testcase import MAASTestCase
 from maastesting.twisted import TwistedLoggerFixture
 from provisioningserver.utils.twisted import DeferredValue
 
@@ -86,10 +89,10 @@ class TestPostgresListenerService(MAASServerTestCase):
     @inlineCallbacks
     def test__calls_system_handler_on_notification(self):
         listener = PostgresListenerService()
-        # Change notifications to a frozenset. This makes sure that
+        # Make adding to the notifications fail. This makes sure that
         # the system message does not go into the queue. Instead if should
         # call the handler directly in `doRead`.
-        listener.notifications = frozenset()
+        self.patch(listener.notifications, "add").side_effect = TypeError
         dv = DeferredValue()
         listener.register("sys_test", lambda *args: dv.set(args))
         yield listener.startService()
@@ -144,10 +147,10 @@ class TestPostgresListenerService(MAASServerTestCase):
                             notices.put(notice)
 
         listener = PostgresListenerServiceSpy()
-        # Change notifications to a frozenset. This makes sure that
+        # Make adding to the notifications fail. This makes sure that
         # the system message does not go into the queue. Instead if should
         # call the handler directly in `doRead`.
-        listener.notifications = frozenset()
+        self.patch(listener.notifications, "add").side_effect = TypeError
         yield listener.startService()
 
         # Use a randomised channel name even though LISTEN/NOTIFY is
@@ -175,10 +178,10 @@ class TestPostgresListenerService(MAASServerTestCase):
     @inlineCallbacks
     def test__handles_missing_notify_system_listener_on_notification(self):
         listener = PostgresListenerService()
-        # Change notifications to a frozenset. This makes sure that
+        # Make adding to the notifications fail. This makes sure that
         # the system message does not go into the queue. Instead if should
         # call the handler directly in `doRead`.
-        listener.notifications = frozenset()
+        self.patch(listener.notifications, "add").side_effect = TypeError
         yield listener.startService()
         yield deferToDatabase(listener.registerChannel, "sys_test")
         try:
@@ -652,3 +655,144 @@ class TestPostgresListenerService(MAASServerTestCase):
                 call("UNLISTEN %s_update;" % channel),
             ),
         )
+
+    def test_register_raises_error_for_batch_system_channel(self):
+        listener = PostgresListenerService()
+        channel = factory.make_name("sys_", sep="")
+        with ExpectedException(PostgresListenerRegistrationError):
+            listener.register(channel, lambda *args: None, batch=True)
+
+    def test_unregister_removes_batch_handler(self):
+        listener = PostgresListenerService()
+        channel = factory.make_name("channel", sep="_").lower()
+        listener.register(channel, sentinel.handler, batch=True)
+        self.assertEqual(
+            {(channel, sentinel.handler)}, listener.batchListeners
+        )
+        listener.unregister(channel, sentinel.handler)
+        self.assertEqual(set(), listener.batchListeners)
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_handleNotifies_coalesces_notifications(self):
+        listener = PostgresListenerService()
+        calls = []
+        listener.listeners["machine"].append(lambda *args: calls.append(args))
+        for _ in range(3):
+            listener.notifications.add(("machine_update", "abc"))
+        listener.notifications.add(("machine_update", "def"))
+        yield listener.handleNotifies(clock=Clock())
+        self.assertEqual([("update", "abc"), ("update", "def")], calls)
+        self.assertEqual(0, len(listener.notifications))
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_handleNotifies_calls_batch_handlers_once_per_action(self):
+        listener = PostgresListenerService()
+        calls = []
+        batch_calls = []
+        listener.listeners["machine"].append(lambda *args: calls.append(args))
+        listener.register(
+            "machine", lambda *args: batch_calls.append(args), batch=True
+        )
+        listener.notifications.add(("machine_update", "abc"))
+        listener.notifications.add(("machine_update", "def"))
+        listener.notifications.add(("machine_delete", "ghi"))
+        yield listener.handleNotifies(clock=Clock())
+        self.assertEqual(
+            [("update", "abc"), ("update", "def"), ("delete", "ghi")], calls
+        )
+        self.assertEqual(
+            [("update", ["abc", "def"]), ("delete", ["ghi"])], batch_calls
+        )
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_handleNotifies_holds_notifications_for_quiet_period(self):
+        listener = PostgresListenerService(quietPeriod=1)
+        calls = []
+        listener.listeners["machine"].append(lambda *args: calls.append(args))
+        clock = Clock()
+        listener.notifications.add(("machine_update", "abc"), clock.seconds())
+        yield listener.handleNotifies(clock=clock)
+        self.assertEqual([], calls)
+        clock.advance(1)
+        yield listener.handleNotifies(clock=clock)
+        self.assertEqual([("update", "abc")], calls)
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_handleNotifies_updates_metrics(self):
+        listener = PostgresListenerService()
+        mock_metrics = self.patch(listener_module.PROMETHEUS_METRICS, "update")
+        for _ in range(3):
+            listener.notifications.add(("machine_update", "abc"))
+        yield listener.handleNotifies(clock=Clock())
+        self.assertThat(
+            mock_metrics,
+            MockCallsMatch(
+                call("maas_listener_notify_queue_depth", "set", value=1),
+                call("maas_listener_notifies_received", "inc", value=3),
+                call("maas_listener_notifies_dispatched", "inc", value=1),
+            ),
+        )
+
+
+class TestPendingNotifications(MAASTestCase):
+    def test_add_coalesces_same_object(self):
+        notifications = PendingNotifications()
+        notifications.add(("machine_update", "abc"))
+        notifications.add(("machine_update", "abc"))
+        notifications.add(("device_update", "abc"))
+        self.assertEqual(
+            [("machine_update", "abc"), ("device_update", "abc")],
+            list(notifications),
+        )
+        self.assertEqual(3, notifications.received)
+
+    def test_delete_supersedes_update(self):
+        notifications = PendingNotifications()
+        notifications.add(("machine_update", "abc"))
+        notifications.add(("machine_delete", "abc"))
+        self.assertEqual([("machine_delete", "abc")], list(notifications))
+
+    def test_update_does_not_replace_create_or_delete(self):
+        notifications = PendingNotifications()
+        notifications.add(("machine_create", "abc"))
+        notifications.add(("machine_update", "abc"))
+        notifications.add(("machine_delete", "def"))
+        notifications.add(("machine_update", "def"))
+        self.assertEqual(
+            [("machine_create", "abc"), ("machine_delete", "def")],
+            list(notifications),
+        )
+
+    def test_pop_returns_all_without_quiet_period(self):
+        notifications = PendingNotifications()
+        notifications.add(("machine_update", "abc"), 10)
+        notifications.add(("machine_create", "def"), 10)
+        self.assertEqual(
+            [("machine_update", "abc"), ("machine_create", "def")],
+            notifications.pop(10),
+        )
+        self.assertEqual(0, len(notifications))
+
+    def test_pop_holds_recently_notified(self):
+        notifications = PendingNotifications()
+        notifications.add(("machine_update", "abc"), 0)
+        notifications.add(("machine_update", "def"), 0)
+        notifications.add(("machine_update", "def"), 1.5)
+        self.assertEqual(
+            [("machine_update", "abc")],
+            notifications.pop(2, quiet=1, max_delay=5),
+        )
+        self.assertEqual([("machine_update", "def")], list(notifications))
+
+    def test_pop_releases_after_max_delay(self):
+        notifications = PendingNotifications()
+        notifications.add(("machine_update", "abc"), 0)
+        notifications.add(("machine_update", "abc"), 5)
+        self.assertEqual(
+            [("machine_update", "abc")],
+            notifications.pop(5, quiet=1, max_delay=5),
+        )
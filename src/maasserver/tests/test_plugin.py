@@ -122,6 +122,8 @@ class TestRegionWorkerServiceMaker(TestServiceMaker):
             "database-tasks",
             "postgres-listener-worker",
             "rack-controller",
+            "boot-config",
+            "external-config",
             "rpc",
             "status-worker",
             "web",
@@ -159,6 +161,8 @@ class TestRegionWorkerServiceMaker(TestServiceMaker):
             "database-tasks",
             "postgres-listener-worker",
             "rack-controller",
+            "boot-config",
+            "external-config",
             "rpc",
             "status-worker",
             "web",
@@ -360,6 +364,8 @@ class TestRegionAllInOneServiceMaker(TestServiceMaker):
             "database-tasks",
             "postgres-listener-worker",
             "rack-controller",
+            "boot-config",
+            "external-config",
             "rpc",
             "service-monitor",
             "status-worker",
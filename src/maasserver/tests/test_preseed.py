@@ -11,6 +11,7 @@ import os
 from pipes import quote
 import random
 from textwrap import dedent
+import time
 from unittest.mock import ANY, sentinel
 from urllib.parse import urlparse
 
@@ -67,6 +68,7 @@ from maasserver.preseed import (
     get_preseed_type_for,
     load_preseed_template,
     PreseedTemplate,
+    PreseedTemplateCache,
     render_enlistment_preseed,
     render_preseed,
     split_subarch,
@@ -426,6 +428,33 @@ class TestLoadPreseedTemplate(MAASServerTestCase):
         template = load_preseed_template(node, prefix)
         self.assertEqual(master_content, template.substitute())
 
+    def test_load_preseed_template_looks_up_parents_for_each_node(self):
+        # Compiled templates are shared between nodes, but the templates
+        # they inherit from are still looked up for each node.
+        self.patch(
+            preseed_module, "preseed_template_cache", PreseedTemplateCache()
+        )
+        prefix = factory.make_string()
+        master_name = factory.make_string()
+        self.create_template(
+            self.location, prefix, '{{inherit "%s"}}' % master_name
+        )
+        self.create_template(self.location, master_name, "generic master")
+        node = factory.make_Node(hostname=factory.make_string())
+        self.create_template(
+            self.location,
+            next(get_preseed_filenames(node, master_name)),
+            "specific master",
+        )
+        other_node = factory.make_Node(hostname=factory.make_string())
+        self.assertEqual(
+            "specific master", load_preseed_template(node, prefix).substitute()
+        )
+        self.assertEqual(
+            "generic master",
+            load_preseed_template(other_node, prefix).substitute(),
+        )
+
     def test_load_preseed_template_parent_lookup_doesnt_include_default(self):
         # The lookup for parent templates does not include the default
         # 'generic' file.
@@ -442,6 +471,106 @@ class TestLoadPreseedTemplate(MAASServerTestCase):
         self.assertRaises(TemplateNotFoundError, template.substitute)
 
 
+class TestPreseedTemplateCache(MAASTestCase):
+    """Tests for `PreseedTemplateCache`."""
+
+    def setUp(self):
+        super().setUp()
+        self.cache = PreseedTemplateCache()
+        self.location = self.make_dir()
+
+    def make_old(self, path, age=10):
+        # Files modified within `racy_interval` are not trusted.
+        then = time.time() - age
+        os.utime(path, (then, then))
+
+    def create_template(self, name, content):
+        path = os.path.join(self.location, name)
+        with open(path, "w", encoding="utf-8") as stream:
+            stream.write(content)
+        self.make_old(path)
+        self.make_old(self.location)
+        return path
+
+    def test_find_returns_first_template_found(self):
+        other_location = self.make_dir()
+        self.create_template("b", "b content")
+        path = self.create_template("c", "c content")
+        self.assertEqual(
+            (path, "c content"),
+            self.cache.find([other_location, self.location], ["a", "c", "b"]),
+        )
+        self.assertEqual(
+            (None, None), self.cache.find([self.location], ["a", "d"])
+        )
+
+    def test_find_lists_unchanged_locations_once(self):
+        self.create_template("a", "content")
+        real_listdir = os.listdir
+        listdir = self.patch(preseed_module.os, "listdir")
+        listdir.side_effect = real_listdir
+        for _ in range(3):
+            self.cache.find([self.location], ["missing", "a"])
+            self.cache.find([self.location], ["missing"])
+        self.assertThat(listdir, MockCalledOnceWith(self.location))
+
+    def test_find_notices_added_templates(self):
+        self.assertEqual((None, None), self.cache.find([self.location], ["a"]))
+        path = self.create_template("a", "content")
+        self.make_old(self.location, age=5)
+        self.assertEqual(
+            (path, "content"), self.cache.find([self.location], ["a"])
+        )
+
+    def test_find_notices_changed_templates(self):
+        path = self.create_template("a", "content")
+        self.cache.find([self.location], ["a"])
+        with open(path, "w", encoding="utf-8") as stream:
+            stream.write("changed")
+        self.make_old(path, age=5)
+        self.assertEqual(
+            (path, "changed"), self.cache.find([self.location], ["a"])
+        )
+
+    def test_find_does_not_trust_recently_modified_locations(self):
+        self.cache.find([self.location], ["a"])
+        # The location's modification time may not change if it's modified
+        # again straight away, so it is listed again.
+        path = os.path.join(self.location, "a")
+        with open(path, "w", encoding="utf-8") as stream:
+            stream.write("content")
+        self.assertEqual(
+            (path, "content"), self.cache.find([self.location], ["a"])
+        )
+
+    def test_compile_reuses_template_with_callers_get_template(self):
+        path = self.create_template("a", "{{x}}")
+        first = self.cache.compile(path, "{{x}}", sentinel.first)
+        second = self.cache.compile(path, "{{x}}", sentinel.second)
+        self.assertIsInstance(second, PreseedTemplate)
+        self.assertIs(first._parsed, second._parsed)
+        self.assertIs(sentinel.first, first.get_template)
+        self.assertIs(sentinel.second, second.get_template)
+        self.assertEqual("1", second.substitute(x=1))
+
+    def test_compile_recompiles_changed_content(self):
+        first = self.cache.compile("a", "{{x}}", None)
+        second = self.cache.compile("a", "{{x}}!", None)
+        self.assertIsNot(first._parsed, second._parsed)
+        self.assertEqual("1!", second.substitute(x=1))
+
+    def test_disabled_cache_reads_and_compiles_every_time(self):
+        self.cache.enabled = False
+        path = self.create_template("a", "{{x}}")
+        listdir = self.patch(preseed_module.os, "listdir")
+        self.cache.find([self.location], ["a"])
+        self.cache.find([self.location], ["a"])
+        self.assertThat(listdir, MockNotCalled())
+        first = self.cache.compile(path, "{{x}}", None)
+        second = self.cache.compile(path, "{{x}}", None)
+        self.assertIsNot(first._parsed, second._parsed)
+
+
 class TestPreseedContext(MAASServerTestCase):
     """Tests for `get_preseed_context`."""
 
@@ -14,7 +14,7 @@ from twisted.internet.task import Clock
 
 from maasserver import status_monitor
 from maasserver.enum import NODE_STATUS
-from maasserver.models import Config, Node
+from maasserver.models import Config, Event, Node
 from maasserver.models.signals.testing import SignalsDisabled
 from maasserver.models.timestampedmodel import now
 from maasserver.node_status import (
@@ -22,6 +22,7 @@ from maasserver.node_status import (
     NODE_FAILURE_MONITORED_STATUS_TRANSITIONS,
 )
 from maasserver.status_monitor import (
+    mark_nodes_failed,
     mark_nodes_failed_after_expiring,
     mark_nodes_failed_after_missing_script_timeout,
     StatusMonitorService,
@@ -38,6 +39,7 @@ from maastesting.matchers import (
 )
 from metadataserver.enum import SCRIPT_STATUS, SCRIPT_TYPE
 from metadataserver.models import ScriptSet
+from provisioningserver.events import EVENT_TYPES
 from provisioningserver.refresh.node_info_scripts import NODE_INFO_SCRIPTS
 
 
@@ -269,6 +271,13 @@ class TestMarkNodesFailedAfterMissingScriptTimeout(MAASServerTestCase):
         self.assertEquals(
             SCRIPT_STATUS.TIMEDOUT, reload_object(running_script_result).status
         )
+        self.assertTrue(
+            Event.objects.filter(
+                node=node,
+                type__name=EVENT_TYPES.SCRIPT_DID_NOT_COMPLETE,
+                description="%s timed out" % running_script_result.name,
+            ).exists()
+        )
 
     def test_mark_nodes_failed_after_builtin_commiss_script_overrun(self):
         user = factory.make_admin()
@@ -381,8 +390,7 @@ class TestMarkNodesFailedAfterMissingScriptTimeout(MAASServerTestCase):
             SCRIPT_STATUS.RUNNING, reload_object(running_script_result).status
         )
 
-    def test_mark_nodes_failed_after_missing_timeout_prefetches(self):
-        self.patch(Node, "mark_failed")
+    def test_mark_nodes_failed_after_missing_timeout_constant_queries(self):
         current_time = now()
         node, script_set = self.make_node()
         script_set.last_ping = current_time
@@ -417,16 +425,161 @@ class TestMarkNodesFailedAfterMissingScriptTimeout(MAASServerTestCase):
         with counter_many:
             mark_nodes_failed_after_missing_script_timeout(current_time, 20)
 
-        # Lookup takes 7 queries no matter the amount of Nodes
-        # 1. Get all Nodes in commissioning or testing
-        # 2. Get all commissioning ScriptSets
-        # 3. Get all testing ScriptSets
-        # 4. Get all commissioning ScriptResults
-        # 5. Get all testing ScriptResults
-        # 6. Get all commissioning Scripts
-        # 7. Get all testing Scripts
-        self.assertEquals(7, counter_one.num_queries)
-        self.assertEquals(7, counter_many.num_queries)
+        # Lookup takes 3 queries no matter the amount of Nodes
+        # 1. Get flatlined commissioning Nodes
+        # 2. Get flatlined testing Nodes
+        # 3. Get overrun ScriptResults
+        self.assertEquals(3, counter_one.num_queries)
+        self.assertEquals(3, counter_many.num_queries)
+
+    def test_mark_nodes_failed_after_script_overrun_fails_many_nodes(self):
+        current_time = now()
+        nodes = []
+        for _ in range(3):
+            node, script_set = self.make_node()
+            script_set.last_ping = current_time
+            script_set.save()
+            script = factory.make_Script(timeout=timedelta(seconds=60))
+            factory.make_ScriptResult(
+                script_set=script_set,
+                status=SCRIPT_STATUS.RUNNING,
+                script=script,
+                started=current_time - timedelta(minutes=10),
+            )
+            nodes.append(node)
+
+        self.assertEqual(
+            3, mark_nodes_failed_after_missing_script_timeout(current_time, 20)
+        )
+        for node in nodes:
+            self.assertEquals(self.failed_status, reload_object(node).status)
+            self.assertTrue(
+                Event.objects.filter(
+                    node=node,
+                    type__name=EVENT_TYPES.REQUEST_NODE_MARK_FAILED_SYSTEM,
+                    action="mark_failed",
+                ).exists()
+            )
+
+
+class TestMarkNodesFailed(MAASServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.useFixture(SignalsDisabled("power"))
+
+    def test_marks_nodes_failed(self):
+        nodes = [
+            factory.make_Node(status=NODE_STATUS.DEPLOYING) for _ in range(3)
+        ]
+        comments = [factory.make_name("comment") for _ in nodes]
+        mark_nodes_failed(list(zip(nodes, comments)), SCRIPT_STATUS.ABORTED)
+        for node, comment in zip(nodes, comments):
+            node = reload_object(node)
+            self.assertEqual(NODE_STATUS.FAILED_DEPLOYMENT, node.status)
+            self.assertEqual(comment, node.error_description)
+            event = Event.objects.get(
+                node=node,
+                type__name=EVENT_TYPES.REQUEST_NODE_MARK_FAILED_SYSTEM,
+            )
+            self.assertEqual(
+                ("mark_failed", comment, node.hostname),
+                (event.action, event.description, event.node_hostname),
+            )
+
+    def test_updates_running_and_pending_script_results(self):
+        node = factory.make_Node(
+            status=NODE_STATUS.COMMISSIONING, with_empty_script_sets=True
+        )
+        script_set = node.current_commissioning_script_set
+        pending = factory.make_ScriptResult(
+            script_set=script_set, status=SCRIPT_STATUS.PENDING
+        )
+        running = factory.make_ScriptResult(
+            script_set=script_set, status=SCRIPT_STATUS.RUNNING
+        )
+        passed = factory.make_ScriptResult(
+            script_set=script_set, status=SCRIPT_STATUS.PASSED
+        )
+        mark_nodes_failed([(node, "")], SCRIPT_STATUS.TIMEDOUT)
+        self.assertEqual(
+            [
+                SCRIPT_STATUS.TIMEDOUT,
+                SCRIPT_STATUS.TIMEDOUT,
+                SCRIPT_STATUS.PASSED,
+            ],
+            [
+                reload_object(script_result).status
+                for script_result in (pending, running, passed)
+            ],
+        )
+
+    def test_marks_script_results_timed_out_with_events(self):
+        node = factory.make_Node(
+            status=NODE_STATUS.COMMISSIONING, with_empty_script_sets=True
+        )
+        block_device = factory.make_PhysicalBlockDevice(node=node)
+        script_result = factory.make_ScriptResult(
+            script_set=node.current_commissioning_script_set,
+            status=SCRIPT_STATUS.RUNNING,
+            physical_blockdevice=block_device,
+        )
+        mark_nodes_failed([(node, "")], SCRIPT_STATUS.ABORTED, [script_result])
+        self.assertEqual(
+            SCRIPT_STATUS.TIMEDOUT, reload_object(script_result).status
+        )
+        event = Event.objects.get(
+            node=node, type__name=EVENT_TYPES.SCRIPT_DID_NOT_COMPLETE
+        )
+        self.assertEqual(
+            "%s on %s timed out" % (script_result.name, block_device.name),
+            event.description,
+        )
+
+    def test_does_nothing_without_nodes(self):
+        counter = CountQueries()
+        with counter:
+            mark_nodes_failed([], SCRIPT_STATUS.ABORTED)
+        self.assertEqual(0, counter.num_queries)
+
+
+class TestCheckStatus(MAASServerTestCase):
+    def test_records_sweep_metrics(self):
+        self.useFixture(SignalsDisabled("power"))
+        mock_metrics = self.patch(status_monitor.PROMETHEUS_METRICS, "update")
+        factory.make_Node(
+            status=NODE_STATUS.DEPLOYING,
+            status_expires=now() - timedelta(minutes=1),
+        )
+        status_monitor.check_status()
+        calls = [
+            (args, kwargs)
+            for args, kwargs in mock_metrics.call_args_list
+            if args[0].startswith("maas_status_monitor_")
+        ]
+        self.assertEqual(
+            [
+                ("maas_status_monitor_sweep_duration", "observe", "expiring"),
+                ("maas_status_monitor_nodes_examined", "inc", "expiring"),
+                (
+                    "maas_status_monitor_sweep_duration",
+                    "observe",
+                    "script_timeout",
+                ),
+                (
+                    "maas_status_monitor_nodes_examined",
+                    "inc",
+                    "script_timeout",
+                ),
+            ],
+            [
+                (args[0], args[1], kwargs["labels"]["sweep"])
+                for args, kwargs in calls
+            ],
+        )
+        self.assertEqual(
+            [1, 0],
+            [kwargs["value"] for args, kwargs in calls if args[1] == "inc"],
+        )
 
 
 class TestStatusMonitorService(MAASServerTestCase):
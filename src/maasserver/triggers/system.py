@@ -1940,6 +1940,77 @@ def render_sys_proxy_procedure(proc_name, on_delete=False):
     )
 
 
+# Helper that bumps the generation of a subnet's free IP ranges, so that
+# region processes know to recalculate them. See `Subnet.get_free_ip_index`.
+SUBNET_GENERATION_BUMP = dedent(
+    """\
+    CREATE OR REPLACE FUNCTION sys_subnet_generation_bump(sid integer)
+    RETURNS void AS $$
+    BEGIN
+      IF sid IS NOT NULL THEN
+        INSERT INTO maasserver_subnetgeneration (
+          subnet_id, changes, generation)
+        VALUES (sid, 1, nextval('maasserver_subnetgeneration_seq'))
+        ON CONFLICT (subnet_id) DO UPDATE
+        SET changes = maasserver_subnetgeneration.changes + 1,
+          generation = EXCLUDED.generation;
+      END IF;
+    END;
+    $$ LANGUAGE plpgsql;
+    """
+)
+
+# Triggered when a subnet is deleted. Removes its free IP ranges generation.
+SUBNET_GENERATION_SUBNET_DELETE = dedent(
+    """\
+    CREATE OR REPLACE FUNCTION sys_subnet_generation_subnet_delete()
+    RETURNS trigger AS $$
+    BEGIN
+      DELETE FROM maasserver_subnetgeneration WHERE subnet_id = OLD.id;
+      RETURN OLD;
+    END;
+    $$ LANGUAGE plpgsql;
+    """
+)
+
+
+def render_sys_subnet_generation_procedure(proc_name, column, event):
+    """Render a database procedure with name `proc_name` that bumps the
+    generation of the subnet referenced by `column`.
+
+    :param proc_name: Name of the procedure.
+    :param column: Name of the column that references the subnet.
+    :param event: The event the procedure will be used for: "insert",
+        "update", or "delete".
+    """
+    if event == "insert":
+        body = "PERFORM sys_subnet_generation_bump(NEW.{column});"
+    elif event == "update":
+        body = dedent(
+            """\
+            PERFORM sys_subnet_generation_bump(OLD.{column});
+              IF NEW.{column} IS DISTINCT FROM OLD.{column} THEN
+                PERFORM sys_subnet_generation_bump(NEW.{column});
+              END IF;"""
+        )
+    else:
+        body = "PERFORM sys_subnet_generation_bump(OLD.{column});"
+    return dedent(
+        """\
+        CREATE OR REPLACE FUNCTION {proc_name}() RETURNS trigger AS $$
+        BEGIN
+          {body}
+          RETURN {row};
+        END;
+        $$ LANGUAGE plpgsql;
+        """
+    ).format(
+        proc_name=proc_name,
+        body=body.format(column=column),
+        row="OLD" if event == "delete" else "NEW",
+    )
+
+
 @transactional
 def register_system_triggers():
     """Register all system triggers into the database."""
@@ -2188,3 +2259,113 @@ def register_system_triggers():
     register_trigger("maasserver_config", "sys_rbac_config_insert", "insert")
     register_procedure(RBAC_CONFIG_UPDATE)
     register_trigger("maasserver_config", "sys_rbac_config_update", "update")
+
+    # Subnet free IP ranges
+    register_procedure(SUBNET_GENERATION_BUMP)
+
+    # - StaticIPAddress
+    register_procedure(
+        render_sys_subnet_generation_procedure(
+            "sys_subnet_generation_staticipaddress_insert",
+            "subnet_id",
+            "insert",
+        )
+    )
+    register_trigger(
+        "maasserver_staticipaddress",
+        "sys_subnet_generation_staticipaddress_insert",
+        "insert",
+    )
+    register_procedure(
+        render_sys_subnet_generation_procedure(
+            "sys_subnet_generation_staticipaddress_update",
+            "subnet_id",
+            "update",
+        )
+    )
+    register_trigger(
+        "maasserver_staticipaddress",
+        "sys_subnet_generation_staticipaddress_update",
+        "update",
+        fields=["ip", "subnet_id"],
+    )
+    register_procedure(
+        render_sys_subnet_generation_procedure(
+            "sys_subnet_generation_staticipaddress_delete",
+            "subnet_id",
+            "delete",
+        )
+    )
+    register_trigger(
+        "maasserver_staticipaddress",
+        "sys_subnet_generation_staticipaddress_delete",
+        "delete",
+    )
+
+    # - IPRange
+    register_procedure(
+        render_sys_subnet_generation_procedure(
+            "sys_subnet_generation_iprange_insert", "subnet_id", "insert"
+        )
+    )
+    register_trigger(
+        "maasserver_iprange", "sys_subnet_generation_iprange_insert", "insert"
+    )
+    register_procedure(
+        render_sys_subnet_generation_procedure(
+            "sys_subnet_generation_iprange_update", "subnet_id", "update"
+        )
+    )
+    register_trigger(
+        "maasserver_iprange",
+        "sys_subnet_generation_iprange_update",
+        "update",
+        fields=["start_ip", "end_ip", "type", "subnet_id"],
+    )
+    register_procedure(
+        render_sys_subnet_generation_procedure(
+            "sys_subnet_generation_iprange_delete", "subnet_id", "delete"
+        )
+    )
+    register_trigger(
+        "maasserver_iprange", "sys_subnet_generation_iprange_delete", "delete"
+    )
+
+    # - StaticRoute
+    register_procedure(
+        render_sys_subnet_generation_procedure(
+            "sys_subnet_generation_staticroute_insert", "source_id", "insert"
+        )
+    )
+    register_trigger(
+        "maasserver_staticroute",
+        "sys_subnet_generation_staticroute_insert",
+        "insert",
+    )
+    register_procedure(
+        render_sys_subnet_generation_procedure(
+            "sys_subnet_generation_staticroute_update", "source_id", "update"
+        )
+    )
+    register_trigger(
+        "maasserver_staticroute",
+        "sys_subnet_generation_staticroute_update",
+        "update",
+        fields=["gateway_ip", "source_id"],
+    )
+    register_procedure(
+        render_sys_subnet_generation_procedure(
+            "sys_subnet_generation_staticroute_delete", "source_id", "delete"
+        )
+    )
+    register_trigger(
+        "maasserver_staticroute",
+        "sys_subnet_generation_staticroute_delete",
+        "delete",
+    )
+
+    # - Subnet
+    register_procedure(SUBNET_GENERATION_SUBNET_DELETE)
+    register_trigger(
+        "maasserver_subnet", "sys_subnet_generation_subnet_delete", "delete"
+    )
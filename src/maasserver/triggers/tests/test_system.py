@@ -66,6 +66,16 @@ class TestTriggers(MAASServerTestCase):
             "resourcepool_sys_rbac_rpool_delete",
             "config_sys_rbac_config_insert",
             "config_sys_rbac_config_update",
+            "staticipaddress_sys_subnet_generation_staticipaddress_insert",
+            "staticipaddress_sys_subnet_generation_staticipaddress_update",
+            "staticipaddress_sys_subnet_generation_staticipaddress_delete",
+            "iprange_sys_subnet_generation_iprange_insert",
+            "iprange_sys_subnet_generation_iprange_update",
+            "iprange_sys_subnet_generation_iprange_delete",
+            "staticroute_sys_subnet_generation_staticroute_insert",
+            "staticroute_sys_subnet_generation_staticroute_update",
+            "staticroute_sys_subnet_generation_staticroute_delete",
+            "subnet_sys_subnet_generation_subnet_delete",
         ]
         sql, args = psql_array(triggers, sql_type="text")
         with closing(connection.cursor()) as cursor:
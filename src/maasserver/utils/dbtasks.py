@@ -14,7 +14,10 @@ from twisted.application.service import Service
 from twisted.internet.defer import Deferred, DeferredQueue
 from twisted.internet.task import cooperate
 
-from maasserver.utils.threads import deferToDatabase
+from maasserver.utils.threads import (
+    DATABASE_PRIORITY,
+    deferToDatabaseWithPriority,
+)
 from provisioningserver.logger import LegacyLogger
 from provisioningserver.utils.twisted import asynchronous, FOREVER
 
@@ -71,7 +74,9 @@ class DatabaseTasksService(Service, object):
         done = Deferred(cancel)
 
         def task():
-            d = deferToDatabase(func, *args, **kwargs)
+            d = deferToDatabaseWithPriority(
+                DATABASE_PRIORITY.BACKGROUND, func, *args, **kwargs
+            )
             d.chainDeferred(done)
             return d
 
@@ -6,7 +6,8 @@
 __all__ = []
 
 import random
-from unittest.mock import sentinel
+import threading
+from unittest.mock import ANY, call, sentinel
 
 from crochet import wait_for
 from django.db import connection
@@ -16,7 +17,9 @@ from twisted.internet.defer import DeferredSemaphore, inlineCallbacks
 
 from maasserver.testing.testcase import MAASServerTestCase
 from maasserver.utils import orm, threads
+from maasserver.utils.threads import DATABASE_PRIORITY, PriorityThreadPool
 from maastesting.testcase import MAASTestCase
+from provisioningserver.prometheus.metrics import PROMETHEUS_METRICS
 from provisioningserver.utils.twisted import ThreadPool, ThreadUnpool
 
 wait_for_reactor = wait_for(30)  # 30 seconds.
@@ -55,6 +58,18 @@ class TestMakeFunctions(MAASTestCase):
         self.assertThat(pool.max, Equals(maxthreads))
         self.assertThat(pool.min, Equals(0))
 
+    def test__make_database_pool_reserves_threads(self):
+        pool = threads.make_database_pool()
+        self.assertThat(pool, IsInstance(PriorityThreadPool))
+        self.assertThat(
+            pool.reserved, Equals(threads.reserved_threads_for_database_pool)
+        )
+
+    def test__make_database_pool_reserves_nothing_if_too_few_threads(self):
+        maxthreads = sum(threads.reserved_threads_for_database_pool.values())
+        pool = threads.make_database_pool(maxthreads)
+        self.assertThat(pool.reserved, Equals({}))
+
     def test__make_database_unpool_creates_unpool(self):
         pool = threads.make_database_unpool()
         self.assertThat(pool, IsInstance(ThreadUnpool))
@@ -114,6 +129,151 @@ class TestDeferToDatabase(MAASServerTestCase):
         )
 
 
+class TestDeferToDatabaseWithPriority(MAASServerTestCase):
+    @wait_for_reactor
+    @inlineCallbacks
+    def test__defers_to_database_threadpool(self):
+        @orm.transactional
+        def call_in_database_thread(a, b):
+            orm.validate_in_transaction(connection)
+            return sentinel.called, a, b
+
+        result = yield threads.deferToDatabaseWithPriority(
+            DATABASE_PRIORITY.INTERACTIVE,
+            call_in_database_thread,
+            sentinel.a,
+            b=sentinel.b,
+        )
+        self.assertThat(
+            result, Equals((sentinel.called, sentinel.a, sentinel.b))
+        )
+
+
+class TestPriorityThreadPool(MAASTestCase):
+    """Tests for `PriorityThreadPool`."""
+
+    def make_started_pool(self, maxthreads, reserved=None):
+        pool = PriorityThreadPool(0, maxthreads, reserved=reserved)
+        pool.start()
+        self.addCleanup(pool.stop)
+        return pool
+
+    def make_blocked_task(self, started, name):
+        release = threading.Event()
+
+        def task():
+            started.append(name)
+            release.wait(30)
+
+        return task, release
+
+    def wait_for(self, condition):
+        for _ in range(3000):
+            if condition():
+                return
+            threading.Event().wait(0.01)
+        self.fail("Timed out waiting for %r" % condition)
+
+    def test__rejects_reserving_every_thread(self):
+        error = self.assertRaises(
+            ValueError, PriorityThreadPool, 0, 3, reserved={"a": 2, "b": 1}
+        )
+        self.assertDocTestMatches(
+            "Cannot reserve 3 of 3 threads; ...", str(error)
+        )
+
+    def test__callInThread_uses_default_priority(self):
+        pool = PriorityThreadPool(0, 3)
+        pool.callInThread(lambda: None)
+        self.assertThat(pool.running, Equals({DATABASE_PRIORITY.DEFAULT: 1}))
+
+    def test__withPriority_calls_with_priority(self):
+        pool = PriorityThreadPool(0, 3)
+        pool.withPriority(DATABASE_PRIORITY.BOOT).callInThread(lambda: None)
+        self.assertThat(pool.running, Equals({DATABASE_PRIORITY.BOOT: 1}))
+
+    def test__holds_reserved_threads_back_from_other_work(self):
+        # The pool is not started so work never finishes.
+        pool = PriorityThreadPool(0, 4, reserved={"a": 1, "b": 1})
+        for _ in range(4):
+            pool.callInThreadWithPriority("c", None, lambda: None)
+        self.assertThat(pool.running, Equals({"c": 2}))
+        self.assertThat(len(pool.queues["c"]), Equals(2))
+        pool.callInThreadWithPriority("a", None, lambda: None)
+        pool.callInThreadWithPriority("a", None, lambda: None)
+        self.assertThat(pool.running, Equals({"a": 1, "c": 2}))
+        pool.callInThreadWithPriority("b", None, lambda: None)
+        self.assertThat(pool.running, Equals({"a": 1, "b": 1, "c": 2}))
+        self.assertThat(len(pool.queues["a"]), Equals(1))
+
+    def test__uses_reserved_threads_beyond_reservation(self):
+        pool = PriorityThreadPool(0, 4, reserved={"a": 1})
+        for _ in range(4):
+            pool.callInThreadWithPriority("a", None, lambda: None)
+        self.assertThat(pool.running, Equals({"a": 4}))
+
+    def test__shares_threads_fairly_between_priorities(self):
+        pool = self.make_started_pool(2)
+        started = []
+        first, release_first = self.make_blocked_task(started, "first")
+        second, release_second = self.make_blocked_task(started, "second")
+        pool.callInThreadWithPriority("busy", None, first)
+        pool.callInThreadWithPriority("busy", None, second)
+        self.wait_for(lambda: len(started) == 2)
+        more, release_more = self.make_blocked_task(started, "more")
+        other, release_other = self.make_blocked_task(started, "other")
+        pool.callInThreadWithPriority("busy", None, more)
+        pool.callInThreadWithPriority("quiet", None, other)
+        release_first.set()
+        # Although queued later, the quiet priority goes first.
+        self.wait_for(lambda: len(started) == 3)
+        self.assertThat(started[-1], Equals("other"))
+        release_second.set()
+        self.wait_for(lambda: len(started) == 4)
+        release_more.set()
+        release_other.set()
+        self.wait_for(lambda: sum(pool.running.values()) == 0)
+
+    def test__calls_onResult(self):
+        pool = self.make_started_pool(2)
+        results = []
+        done = threading.Event()
+
+        def onResult(success, result):
+            results.append((success, result))
+            done.set()
+
+        pool.callInThreadWithPriority("a", onResult, lambda: sentinel.result)
+        done.wait(30)
+        self.assertThat(results, Equals([(True, sentinel.result)]))
+
+    def test__records_queue_wait_and_duration(self):
+        update = self.patch(PROMETHEUS_METRICS, "update")
+        pool = self.make_started_pool(2)
+        done = threading.Event()
+        pool.callInThreadWithPriority("a", lambda *_: done.set(), lambda: None)
+        done.wait(30)
+        self.assertThat(
+            update.mock_calls,
+            Equals(
+                [
+                    call(
+                        "maas_database_task_queue_wait",
+                        "observe",
+                        value=ANY,
+                        labels={"priority": "a"},
+                    ),
+                    call(
+                        "maas_database_task_duration",
+                        "observe",
+                        value=ANY,
+                        labels={"priority": "a"},
+                    ),
+                ]
+            ),
+        )
+
+
 class TestCallOutToDatabase(MAASServerTestCase):
     @wait_for_reactor
     @inlineCallbacks
@@ -7,21 +7,34 @@ Threads in Python aren't great, but they're okay for what we need. However,
 Django's ORM closely weds database connections to threads, so we use specific
 pools to limit the number of connections each `regiond` process will consume.
 
+The database pool is shared by several classes of work, some of which can
+come in bursts. To keep those from starving the rest, work can be given a
+priority; see `PriorityThreadPool` and `deferToDatabaseWithPriority`.
+
 """
 
 __all__ = [
     "callOutToDatabase",
+    "DATABASE_PRIORITY",
     "deferToDatabase",
+    "deferToDatabaseWithPriority",
     "install_database_pool",
     "install_database_unpool",
     "install_default_pool",
     "make_database_pool",
     "make_default_pool",
+    "PriorityThreadPool",
 ]
 
+from collections import Counter, deque
+from itertools import count
+import threading
+import time
+
 from django.conf import settings
 from twisted.internet import reactor, threads
 from twisted.internet.defer import DeferredSemaphore
+from twisted.python import context
 
 from maasserver.utils.orm import (
     count_queries,
@@ -30,6 +43,7 @@ from maasserver.utils.orm import (
     TotallyDisconnected,
 )
 from provisioningserver.logger import LegacyLogger
+from provisioningserver.prometheus.metrics import PROMETHEUS_METRICS
 from provisioningserver.utils.twisted import (
     asynchronous,
     FOREVER,
@@ -51,6 +65,205 @@ max_threads_for_default_pool = 50
 max_threads_for_database_pool = 9
 
 
+class DATABASE_PRIORITY:
+    """Classes of work in the database pool."""
+
+    # The web UI, via the websocket.
+    INTERACTIVE = "interactive"
+    # Machines booting, via RPC from rack controllers.
+    BOOT = "boot"
+    # Status messages, leases, events, and periodic work.
+    BACKGROUND = "background"
+    # Everything else, including the web application and API.
+    DEFAULT = "default"
+
+
+# How many database threads are held for each class of work, so that it can
+# start immediately however busy the others are. Held threads are idle when
+# there's no such work, so this is kept small; sharing threads fairly does
+# most of the work.
+reserved_threads_for_database_pool = {
+    DATABASE_PRIORITY.INTERACTIVE: 1,
+    DATABASE_PRIORITY.BOOT: 1,
+}
+
+
+class PriorityThreadPool(ThreadPool):
+    """Thread-pool that shares its threads between classes of work.
+
+    Work is queued by priority, a class name, and is started in this pool
+    only when a thread is free for it. Work without a priority, including
+    all work that arrives via the standard `callInThread` and
+    `callInThreadWithCallback` methods, has the default priority.
+
+    A number of threads can be reserved for each priority. Work of a
+    priority running in fewer threads than reserved for it can always
+    start. Other work starts only while that leaves enough free threads
+    for every priority to use its reservation. When several priorities are
+    waiting for a thread, the one running in the fewest threads goes next,
+    or, if tied, the one that has been waiting longest.
+
+    How long work waits to start and how long it runs are recorded, for
+    each priority, in the ``maas_database_task_queue_wait`` and
+    ``maas_database_task_duration`` metrics.
+
+    :ivar reserved: A dict of the number of threads reserved for each
+        priority.
+    :ivar queues: A dict of the work waiting to start, by priority.
+    :ivar running: A `Counter` of the work started, by priority.
+    """
+
+    def __init__(
+        self,
+        minthreads=5,
+        maxthreads=20,
+        name=None,
+        contextFactory=None,
+        reserved=None,
+        default=DATABASE_PRIORITY.DEFAULT,
+    ):
+        super(PriorityThreadPool, self).__init__(
+            minthreads, maxthreads, name, contextFactory
+        )
+        self.reserved = {} if reserved is None else dict(reserved)
+        if sum(self.reserved.values()) >= maxthreads:
+            raise ValueError(
+                "Cannot reserve %d of %d threads; work without a "
+                "reservation would never run."
+                % (sum(self.reserved.values()), maxthreads)
+            )
+        self.default = default
+        self.queues = {}
+        self.running = Counter()
+        self._lock = threading.Lock()
+        self._order = count()
+
+    def withPriority(self, priority):
+        """Return a thread-pool that calls into this with `priority`."""
+        return PriorityThreadPoolLane(self, priority)
+
+    def callInThreadWithCallback(self, onResult, func, *args, **kwargs):
+        """See :class:`twisted.python.threadpool.ThreadPool`.
+
+        The work has the default priority.
+        """
+        self.callInThreadWithPriority(
+            self.default, onResult, func, *args, **kwargs
+        )
+
+    def callInThreadWithPriority(
+        self, priority, onResult, func, *args, **kwargs
+    ):
+        """Like `callInThreadWithCallback`, with the given `priority`."""
+        ctx = context.theContextTracker.currentContext().contexts[-1]
+        with self._lock:
+            queue = self.queues.setdefault(priority, deque())
+            queue.append(
+                (
+                    next(self._order),
+                    time.monotonic(),
+                    ctx,
+                    onResult,
+                    func,
+                    args,
+                    kwargs,
+                )
+            )
+            ready = self._takeReady()
+        self._startAll(ready)
+
+    def _takeReady(self):
+        """Take the work that can start now from the queues.
+
+        Must be called with the lock held.
+        """
+        ready = []
+        while sum(self.running.values()) < self.max:
+            free = self.max - sum(self.running.values())
+            held = sum(
+                max(0, reserved - self.running[priority])
+                for priority, reserved in self.reserved.items()
+            )
+            choices = []
+            for priority, queue in self.queues.items():
+                if len(queue) == 0:
+                    continue
+                running = self.running[priority]
+                reserved = running < self.reserved.get(priority, 0)
+                if reserved or free > held:
+                    order = queue[0][0]
+                    choices.append((not reserved, running, order, priority))
+            if len(choices) == 0:
+                break
+            priority = min(choices)[-1]
+            self.running[priority] += 1
+            ready.append((priority, self.queues[priority].popleft()))
+        return ready
+
+    def _startAll(self, ready):
+        for priority, work in ready:
+            self._start(priority, *work)
+
+    def _start(
+        self, priority, order, queued, ctx, onResult, func, args, kwargs
+    ):
+        labels = {"priority": priority}
+
+        def run():
+            started = time.monotonic()
+            PROMETHEUS_METRICS.update(
+                "maas_database_task_queue_wait",
+                "observe",
+                value=started - queued,
+                labels=labels,
+            )
+            try:
+                return context.call(ctx, func, *args, **kwargs)
+            finally:
+                PROMETHEUS_METRICS.update(
+                    "maas_database_task_duration",
+                    "observe",
+                    value=time.monotonic() - started,
+                    labels=labels,
+                )
+
+        def done(success, result):
+            try:
+                if onResult is not None:
+                    onResult(success, result)
+                elif not success:
+                    self.log.failure("Failure in database thread.", result)
+            finally:
+                with self._lock:
+                    self.running[priority] -= 1
+                    ready = self._takeReady()
+                self._startAll(ready)
+
+        super(PriorityThreadPool, self).callInThreadWithCallback(done, run)
+
+
+class PriorityThreadPoolLane:
+    """Calls into a `PriorityThreadPool` with a given priority.
+
+    This can be used wherever a thread-pool is expected.
+    """
+
+    def __init__(self, pool, priority):
+        super(PriorityThreadPoolLane, self).__init__()
+        self.pool = pool
+        self.priority = priority
+
+    def callInThread(self, func, *args, **kwargs):
+        """See :class:`twisted.python.threadpool.ThreadPool`."""
+        self.callInThreadWithCallback(None, func, *args, **kwargs)
+
+    def callInThreadWithCallback(self, onResult, func, *args, **kwargs):
+        """See :class:`twisted.python.threadpool.ThreadPool`."""
+        self.pool.callInThreadWithPriority(
+            self.priority, onResult, func, *args, **kwargs
+        )
+
+
 def make_default_pool(maxthreads=max_threads_for_default_pool):
     """Create a general thread-pool for non-database activity.
 
@@ -66,8 +279,16 @@ def make_database_pool(maxthreads=max_threads_for_database_pool):
     Its consumer are the old-school web application, i.e. the plain HTTP and
     HTTP API services, and the WebSocket service, for the responsive web UI.
     All threads are fully connected to the database.
+
+    Threads are reserved for priorities as in
+    `reserved_threads_for_database_pool`, unless there are too few.
     """
-    return ThreadPool(0, maxthreads, "database", FullyConnected)
+    reserved = reserved_threads_for_database_pool
+    if sum(reserved.values()) >= maxthreads:
+        reserved = None
+    return PriorityThreadPool(
+        0, maxthreads, "database", FullyConnected, reserved=reserved
+    )
 
 
 def make_database_unpool(maxthreads=max_threads_for_database_pool):
@@ -160,6 +381,21 @@ def deferToDatabase(func, *args, **kwargs):
     )
 
 
+def deferToDatabaseWithPriority(priority, func, *args, **kwargs):
+    """Call `func` in a database thread with the given `priority`.
+
+    :param priority: One of `DATABASE_PRIORITY`. It is ignored unless the
+        database pool is a `PriorityThreadPool`; the pool used in testing,
+        for example, is not.
+    """
+    if settings.DEBUG and getattr(settings, "DEBUG_QUERIES", False):
+        func = count_queries(log.debug)(func)
+    pool = reactor.threadpoolForDatabase
+    if isinstance(pool, PriorityThreadPool):
+        pool = pool.withPriority(priority)
+    return threads.deferToThreadPool(reactor, pool, func, *args, **kwargs)
+
+
 def callOutToDatabase(thing, func, *args, **kwargs):
     """Call out to the given `func` in a database thread, but return `thing`.
 
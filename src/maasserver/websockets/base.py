@@ -24,7 +24,10 @@ from maasserver.prometheus.middleware import wrap_query_counter_cursor
 from maasserver.rbac import rbac
 from maasserver.utils.forms import get_QueryDict
 from maasserver.utils.orm import transactional
-from maasserver.utils.threads import deferToDatabase
+from maasserver.utils.threads import (
+    DATABASE_PRIORITY,
+    deferToDatabaseWithPriority,
+)
 from provisioningserver.prometheus.metrics import PROMETHEUS_METRICS
 from provisioningserver.utils.twisted import asynchronous, IAsynchronous
 
@@ -96,6 +99,7 @@ class HandlerOptions(object):
     form = None
     form_requires_request = True
     listen_channels = []
+    cache_dehydrated = False
     batch_key = "id"
     create_permission = None
     view_permission = None
@@ -169,6 +173,11 @@ class Handler(metaclass=HandlerMetaclass):
         self.user = user
         self.cache = cache
         self.request = request
+        # Set by the protocol when notifications are fanned out so that
+        # handlers with `Meta.cache_dehydrated` can share dehydrated objects
+        # between clients.
+        self.dehydrated_cache = None
+        self._dehydrated_generation = None
         # Holds a set of all pks that the client has loaded and has on their
         # end of the connection. This is used to inform the client of the
         # correct notifications based on what items the client has.
@@ -384,7 +393,8 @@ class Handler(metaclass=HandlerMetaclass):
 
                     # Reload the user from the database.
                     d = concurrency.webapp.run(
-                        deferToDatabase,
+                        deferToDatabaseWithPriority,
+                        DATABASE_PRIORITY.INTERACTIVE,
                         transactional(self.user.refresh_from_db),
                     )
                     d.addCallback(lambda _: method(params))
@@ -415,7 +425,10 @@ class Handler(metaclass=HandlerMetaclass):
                     # This is going to block and hold a database connection so
                     # we limit its concurrency.
                     return concurrency.webapp.run(
-                        deferToDatabase, prep_user_execute, params
+                        deferToDatabaseWithPriority,
+                        DATABASE_PRIORITY.INTERACTIVE,
+                        prep_user_execute,
+                        params,
                     )
         else:
             raise HandlerNoSuchMethodError(method_name)
@@ -599,6 +612,12 @@ class Handler(metaclass=HandlerMetaclass):
                 return None
 
         self.user.refresh_from_db()
+        if self.dehydrated_cache is not None:
+            # Read before loading the object so a payload built from data
+            # older than a concurrent invalidation never gets cached.
+            self._dehydrated_generation = self.dehydrated_cache.generation(
+                self._meta.handler_name, pk
+            )
         try:
             obj = self.listen(channel, action, pk)
         except HandlerDoesNotExistError:
@@ -638,21 +657,61 @@ class Handler(metaclass=HandlerMetaclass):
     def on_listen_for_active_pk(self, action, pk, obj):
         """Return the correct data for `obj` depending on if its the
         active primary key."""
-        if "active_pk" in self.cache and pk == self.cache["active_pk"]:
-            # Active so send all the data for the object.
-            return (
-                self._meta.handler_name,
-                action,
-                self.full_dehydrate(obj, for_list=False),
-            )
-        else:
-            # Not active so only send the data like it was comming from
-            # the list call.
-            return (
-                self._meta.handler_name,
-                action,
-                self.full_dehydrate(obj, for_list=True),
+        # Active so send all the data for the object, otherwise only send
+        # the data like it was comming from the list call.
+        for_list = not (
+            "active_pk" in self.cache and pk == self.cache["active_pk"]
+        )
+        return (
+            self._meta.handler_name,
+            action,
+            self.dehydrate_for_notify(obj, pk, for_list),
+        )
+
+    def dehydrate_for_notify(self, obj, pk, for_list):
+        """Dehydrate `obj` for a notification.
+
+        When `Meta.cache_dehydrated` is set and the protocol provided a
+        shared cache, the dehydrated object is reused between clients whose
+        users have the same permission class for `obj`.
+        """
+        cache = self.dehydrated_cache
+        if cache is None or not self._meta.cache_dehydrated:
+            return self.full_dehydrate_for_notify(obj, for_list)
+        handler_name = self._meta.handler_name
+        permission_class = self.get_permission_class(obj)
+        data = cache.get(handler_name, pk, for_list, permission_class)
+        if data is None:
+            data = self.full_dehydrate_for_notify(obj, for_list)
+            cache.set(
+                handler_name,
+                pk,
+                for_list,
+                permission_class,
+                data,
+                self._dehydrated_generation,
             )
+        return data
+
+    def full_dehydrate_for_notify(self, obj, for_list):
+        """Dehydrate `obj` for a notification, bypassing the shared cache.
+
+        Override to load anything `full_dehydrate` needs for a single
+        object.
+        """
+        return self.full_dehydrate(obj, for_list=for_list)
+
+    def get_permission_class(self, obj):
+        """Return a hashable summary of what the user can do with `obj`.
+
+        Users with the same permission class get the same dehydrated data
+        for `obj`. Override when `dehydrate` depends on more than the
+        `edit_permission` and `delete_permission` of the handler.
+        """
+        return (
+            self.user.is_superuser,
+            tuple(self._add_permissions(obj, {}).get("permissions", ())),
+        )
 
     def listen(self, channel, action, pk):
         """Called when the handler listens for events on channels with
@@ -0,0 +1,116 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Shared cache of dehydrated objects for websocket notifications.
+
+When a row changes, the same object is sent to every connected client that
+has it loaded. Dehydrating it is by far the most expensive part of that
+fan-out, and the result only depends on the handler, the object, whether
+the client wants the list or the detail form, and what the client's user is
+allowed to do with the object. This cache lets each regiond process
+dehydrate an object once per combination of those and reuse the result for
+every other client.
+"""
+
+__all__ = ["DehydratedObjectCache"]
+
+from collections import OrderedDict
+import threading
+
+from provisioningserver.prometheus.metrics import PROMETHEUS_METRICS
+
+
+class DehydratedObjectCache:
+    """Per-process cache of dehydrated handler payloads.
+
+    Entries are keyed by ``(handler_name, pk, for_list, permission_class)``
+    and are dropped for a ``(handler_name, pk)`` pair whenever a
+    notification for it arrives. A generation per pair guards against a
+    payload computed from data read before an invalidation being stored
+    after it. Generations come from one counter for the whole cache, and
+    only the most recently invalidated pairs keep theirs; the others share
+    the newest generation forgotten, so a payload read before a forgotten
+    invalidation is still never stored.
+
+    Cached payloads are shared between clients, so callers must treat them
+    as read-only.
+
+    The cache is read and written from database threads and invalidated
+    from the reactor, so all access is serialised with a lock.
+    """
+
+    def __init__(self, max_entries=10000, max_generations=10000):
+        self.max_entries = max_entries
+        self.max_generations = max_generations
+        self._entries = OrderedDict()
+        self._generations = OrderedDict()
+        # The last generation handed out, and the newest one forgotten.
+        self._counter = 0
+        self._forgotten = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def generation(self, handler_name, pk):
+        """Return the current generation for `handler_name` and `pk`.
+
+        This must be read before the object is loaded from the database and
+        passed back to `set`.
+        """
+        with self._lock:
+            return self._generations.get((handler_name, pk), self._forgotten)
+
+    def invalidate(self, handler_name, pk):
+        """Drop every cached payload for `handler_name` and `pk`."""
+        with self._lock:
+            obj_key = (handler_name, pk)
+            self._counter += 1
+            self._generations[obj_key] = self._counter
+            self._generations.move_to_end(obj_key)
+            while len(self._generations) > self.max_generations:
+                _, self._forgotten = self._generations.popitem(last=False)
+            stale = [
+                key for key in self._entries if (key[0], key[1]) == obj_key
+            ]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        """Drop every cached payload."""
+        with self._lock:
+            self._entries.clear()
+            self._generations.clear()
+            self._counter += 1
+            self._forgotten = self._counter
+
+    def get(self, handler_name, pk, for_list, permission_class):
+        """Return the cached payload or `None` if there is none."""
+        key = (handler_name, pk, for_list, permission_class)
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+        PROMETHEUS_METRICS.update(
+            "maas_websocket_dehydrate_cache_requests",
+            "inc",
+            labels={
+                "handler": handler_name,
+                "result": "miss" if data is None else "hit",
+            },
+        )
+        return data
+
+    def set(self, handler_name, pk, for_list, permission_class, data, gen):
+        """Store `data` unless the object was invalidated since `gen`."""
+        key = (handler_name, pk, for_list, permission_class)
+        with self._lock:
+            current = self._generations.get(
+                (handler_name, pk), self._forgotten
+            )
+            if current != gen:
+                return
+            self._entries[key] = data
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -94,6 +94,7 @@ class NodeHandler(TimestampedModelHandler):
         abstract = True
         pk = "system_id"
         pk_type = str
+        cache_dehydrated = True
 
     def __init__(self, user, cache, request):
         super().__init__(user, cache, request)
@@ -475,9 +476,20 @@ class NodeHandler(TimestampedModelHandler):
         super()._cache_pks(nodes)
         self._cache_script_results(nodes)
 
-    def on_listen_for_active_pk(self, action, pk, obj):
+    def full_dehydrate_for_notify(self, obj, for_list):
         self._cache_script_results([obj])
-        return super().on_listen_for_active_pk(action, pk, obj)
+        return super().full_dehydrate_for_notify(obj, for_list)
+
+    def get_permission_class(self, obj):
+        """Node actions depend on every node permission the user holds.
+
+        Some actions, such as marking a node broken, also need the user to
+        own the node.
+        """
+        return (self.user.is_superuser, obj.owner_id == self.user.id) + tuple(
+            self.user.has_perm(permission, obj)
+            for permission in NodePermission
+        )
 
     def dehydrate_blockdevice(self, blockdevice, obj):
         """Return `BlockDevice` formatted for JSON encoding."""
@@ -97,6 +97,7 @@ from maasserver.websockets.base import (
     HandlerPermissionError,
     HandlerValidationError,
 )
+from maasserver.websockets.cache import DehydratedObjectCache
 from maasserver.websockets.handlers import machine as machine_module
 from maasserver.websockets.handlers import node as node_module
 from maasserver.websockets.handlers.event import dehydrate_event_type_level
@@ -708,6 +709,23 @@ class TestMachineHandler(MAASServerTestCase):
         self.assertEquals(ret["commissioning_status"]["passed"], 10)
         self.assertEquals(ret["testing_status"]["passed"], 10)
 
+    def test_on_listen_dehydrated_cache_keyed_on_ownership(self):
+        owner = factory.make_admin()
+        other_admin = factory.make_admin()
+        node = factory.make_Node(owner=owner, status=NODE_STATUS.DEPLOYED)
+        dehydrated_cache = DehydratedObjectCache()
+        actions = {}
+        for user in (owner, other_admin):
+            handler = MachineHandler(user, {}, None)
+            handler.cache["loaded_pks"].add(node.system_id)
+            handler.dehydrated_cache = dehydrated_cache
+            _, _, data = handler.on_listen(
+                "machine", "update", node.system_id
+            )
+            actions[user] = data["actions"]
+        self.assertIn("mark-broken", actions[owner])
+        self.assertNotIn("mark-broken", actions[other_admin])
+
     def test_cache_clears_on_reload(self):
         owner = factory.make_User()
         node = factory.make_Node(owner=owner)
@@ -25,10 +25,15 @@ from twisted.web.server import NOT_DONE_YET
 
 from maasserver.eventloop import services
 from maasserver.utils.orm import transactional
-from maasserver.utils.threads import deferToDatabase
+from maasserver.utils.threads import (
+    DATABASE_PRIORITY,
+    deferToDatabaseWithPriority,
+)
 from maasserver.websockets import handlers
+from maasserver.websockets.cache import DehydratedObjectCache
 from maasserver.websockets.websockets import STATUSES
 from provisioningserver.logger import LegacyLogger
+from provisioningserver.prometheus.metrics import PROMETHEUS_METRICS
 from provisioningserver.utils import typed
 from provisioningserver.utils.twisted import deferred, synchronous
 from provisioningserver.utils.url import splithost
@@ -233,7 +238,11 @@ class WebSocketProtocol(Protocol):
             )
             return None
 
-        d = deferToDatabase(self.getUserFromSessionId, session_id)
+        d = deferToDatabaseWithPriority(
+            DATABASE_PRIORITY.INTERACTIVE,
+            self.getUserFromSessionId,
+            session_id,
+        )
         d.addCallbacks(got_user, got_user_error)
 
         return d
@@ -409,6 +418,7 @@ class WebSocketFactory(Factory):
         self.handlers = {}
         self.clients = []
         self.listener = listener
+        self.dehydrated_cache = DehydratedObjectCache()
         self.cacheHandlers()
         self.registerNotifiers()
 
@@ -463,14 +473,35 @@ class WebSocketFactory(Factory):
 
     @inlineCallbacks
     def onNotify(self, handler_class, channel, action, obj_id):
+        handler_name = handler_class._meta.handler_name
+        if handler_class._meta.cache_dehydrated:
+            # The object changed, so whatever was dehydrated for it before
+            # is stale for every client.
+            self.dehydrated_cache.invalidate(
+                handler_name, handler_class._meta.pk_type(obj_id)
+            )
+        sent = 0
         for client in self.clients:
             handler = client.buildHandler(handler_class)
-            data = yield deferToDatabase(
-                self.processNotify, handler, channel, action, obj_id
+            handler.dehydrated_cache = self.dehydrated_cache
+            data = yield deferToDatabaseWithPriority(
+                DATABASE_PRIORITY.INTERACTIVE,
+                self.processNotify,
+                handler,
+                channel,
+                action,
+                obj_id,
             )
             if data is not None:
                 (name, client_action, data) = data
                 client.sendNotify(name, client_action, data)
+                sent += 1
+        PROMETHEUS_METRICS.update(
+            "maas_websocket_notify_fanout",
+            "observe",
+            value=sent,
+            labels={"handler": handler_name},
+        )
 
     @transactional
     def processNotify(self, handler, channel, action, obj_id):
@@ -25,6 +25,7 @@ from maasserver.testing.testcase import (
     MAASTransactionServerTestCase,
 )
 from maasserver.utils.orm import reload_object
+from maasserver.utils.threads import DATABASE_PRIORITY
 from maasserver.websockets import base
 from maasserver.websockets.base import (
     Handler,
@@ -33,6 +34,7 @@ from maasserver.websockets.base import (
     HandlerPermissionError,
     HandlerValidationError,
 )
+from maasserver.websockets.cache import DehydratedObjectCache
 from maastesting.matchers import MockCalledOnceWith, MockNotCalled
 from maastesting.testcase import MAASTestCase
 from provisioningserver.prometheus.metrics import PROMETHEUS_METRICS
@@ -432,17 +434,24 @@ class TestHandler(MAASServerTestCase, FakeNodesHandlerMixin):
         # thread that originates from a specific threadpool.
         handler = self.make_nodes_handler()
         params = {"system_id": factory.make_name("system_id")}
-        self.patch(base, "deferToDatabase").return_value = sentinel.thing
+        self.patch(
+            base, "deferToDatabaseWithPriority"
+        ).return_value = sentinel.thing
         result = handler.execute("get", params).wait(30)
         self.assertThat(result, Is(sentinel.thing))
-        self.assertThat(base.deferToDatabase, MockCalledOnceWith(ANY, params))
+        self.assertThat(
+            base.deferToDatabaseWithPriority,
+            MockCalledOnceWith(DATABASE_PRIORITY.INTERACTIVE, ANY, params),
+        )
 
     def test_execute_track_latency(self):
         mock_metrics = self.patch(PROMETHEUS_METRICS, "update")
 
         handler = self.make_nodes_handler()
         params = {"system_id": factory.make_name("system_id")}
-        self.patch(base, "deferToDatabase").return_value = sentinel.thing
+        self.patch(
+            base, "deferToDatabaseWithPriority"
+        ).return_value = sentinel.thing
         result = handler.execute("get", params).wait(30)
         self.assertIs(result, sentinel.thing)
         mock_metrics.assert_called_with(
@@ -854,6 +863,62 @@ class TestHandler(MAASServerTestCase, FakeNodesHandlerMixin):
             mock_dehydrate, MockCalledOnceWith(node, for_list=False)
         )
 
+    def test_on_listen_shares_dehydrated_cache_between_handlers(self):
+        node = factory.make_Node()
+        dehydrated_cache = DehydratedObjectCache()
+        handlers = [
+            self.make_nodes_handler(fields=["hostname"], cache_dehydrated=True)
+            for _ in range(2)
+        ]
+        for handler in handlers:
+            handler.user = handlers[0].user
+            handler.cache["loaded_pks"].add(node.system_id)
+            handler.dehydrated_cache = dehydrated_cache
+        mock_dehydrate = self.patch(handlers[1], "full_dehydrate")
+        expected = (
+            handlers[0]._meta.handler_name,
+            "update",
+            {"hostname": node.hostname},
+        )
+        for handler in handlers:
+            self.assertEqual(
+                expected,
+                handler.on_listen(sentinel.channel, "update", node.system_id),
+            )
+        self.assertThat(mock_dehydrate, MockNotCalled())
+
+    def test_on_listen_ignores_dehydrated_cache_unless_enabled(self):
+        node = factory.make_Node()
+        handler = self.make_nodes_handler(fields=["hostname"])
+        handler.cache["loaded_pks"].add(node.system_id)
+        handler.dehydrated_cache = DehydratedObjectCache()
+        handler.on_listen(sentinel.channel, "update", node.system_id)
+        self.assertEqual(0, len(handler.dehydrated_cache))
+
+    def test_on_listen_dehydrated_cache_keyed_on_permission_class(self):
+        node = factory.make_Node()
+        dehydrated_cache = DehydratedObjectCache()
+        handler = self.make_nodes_handler(
+            fields=["hostname"], cache_dehydrated=True
+        )
+        handler.cache["loaded_pks"].add(node.system_id)
+        handler.dehydrated_cache = dehydrated_cache
+        handler.on_listen(sentinel.channel, "update", node.system_id)
+        admin_handler = self.make_nodes_handler(
+            fields=["hostname"], cache_dehydrated=True
+        )
+        admin_handler.user = factory.make_admin()
+        admin_handler.cache["loaded_pks"].add(node.system_id)
+        admin_handler.dehydrated_cache = dehydrated_cache
+        mock_dehydrate = self.patch(admin_handler, "full_dehydrate")
+        mock_dehydrate.return_value = sentinel.data
+        self.assertEqual(
+            (admin_handler._meta.handler_name, "update", sentinel.data),
+            admin_handler.on_listen(
+                sentinel.channel, "update", node.system_id
+            ),
+        )
+
     def test_listen_calls_get_object_with_pk_on_other_actions(self):
         handler = self.make_nodes_handler()
         mock_get_object = self.patch(handler, "get_object")
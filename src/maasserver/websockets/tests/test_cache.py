@@ -0,0 +1,114 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for `maasserver.websockets.cache`"""
+
+__all__ = []
+
+from maasserver.websockets.cache import DehydratedObjectCache
+from maastesting.factory import factory
+from maastesting.testcase import MAASTestCase
+from provisioningserver.prometheus.metrics import PROMETHEUS_METRICS
+
+
+class TestDehydratedObjectCache(MAASTestCase):
+    def test_get_returns_None_when_empty(self):
+        cache = DehydratedObjectCache()
+        self.assertIsNone(cache.get("machine", "abc", True, ()))
+
+    def test_set_then_get(self):
+        cache = DehydratedObjectCache()
+        data = {"system_id": "abc"}
+        gen = cache.generation("machine", "abc")
+        cache.set("machine", "abc", True, (True,), data, gen)
+        self.assertIs(data, cache.get("machine", "abc", True, (True,)))
+
+    def test_get_is_keyed_on_mode_and_permission_class(self):
+        cache = DehydratedObjectCache()
+        gen = cache.generation("machine", "abc")
+        cache.set("machine", "abc", True, (True,), {}, gen)
+        self.assertIsNone(cache.get("machine", "abc", False, (True,)))
+        self.assertIsNone(cache.get("machine", "abc", True, (False,)))
+        self.assertIsNone(cache.get("device", "abc", True, (True,)))
+
+    def test_invalidate_drops_all_entries_for_object(self):
+        cache = DehydratedObjectCache()
+        gen = cache.generation("machine", "abc")
+        cache.set("machine", "abc", True, (True,), {}, gen)
+        cache.set("machine", "abc", False, (False,), {}, gen)
+        other_gen = cache.generation("machine", "def")
+        cache.set("machine", "def", True, (True,), {}, other_gen)
+        cache.invalidate("machine", "abc")
+        self.assertIsNone(cache.get("machine", "abc", True, (True,)))
+        self.assertIsNone(cache.get("machine", "abc", False, (False,)))
+        self.assertIsNotNone(cache.get("machine", "def", True, (True,)))
+
+    def test_set_ignored_after_invalidation(self):
+        cache = DehydratedObjectCache()
+        gen = cache.generation("machine", "abc")
+        cache.invalidate("machine", "abc")
+        cache.set("machine", "abc", True, (), {}, gen)
+        self.assertIsNone(cache.get("machine", "abc", True, ()))
+        self.assertEqual(0, len(cache))
+
+    def test_invalidate_forgets_oldest_generations(self):
+        cache = DehydratedObjectCache(max_generations=2)
+        for pk in ("a", "b", "c"):
+            cache.invalidate("machine", pk)
+        self.assertEqual(2, len(cache._generations))
+        self.assertNotIn(("machine", "a"), cache._generations)
+
+    def test_set_ignored_after_generation_forgotten(self):
+        cache = DehydratedObjectCache(max_generations=1)
+        gen = cache.generation("machine", "abc")
+        cache.invalidate("machine", "abc")
+        cache.invalidate("machine", "def")
+        cache.set("machine", "abc", True, (), {}, gen)
+        self.assertIsNone(cache.get("machine", "abc", True, ()))
+
+    def test_set_after_generation_forgotten(self):
+        cache = DehydratedObjectCache(max_generations=1)
+        cache.invalidate("machine", "abc")
+        cache.invalidate("machine", "def")
+        gen = cache.generation("machine", "abc")
+        cache.set("machine", "abc", True, (), {}, gen)
+        self.assertIsNotNone(cache.get("machine", "abc", True, ()))
+
+    def test_set_evicts_least_recently_used(self):
+        cache = DehydratedObjectCache(max_entries=2)
+        for pk in ("a", "b"):
+            cache.set("machine", pk, True, (), {"pk": pk}, 0)
+        # Touch "a" so "b" becomes the oldest entry.
+        cache.get("machine", "a", True, ())
+        cache.set("machine", "c", True, (), {"pk": "c"}, 0)
+        self.assertEqual(2, len(cache))
+        self.assertIsNone(cache.get("machine", "b", True, ()))
+        self.assertIsNotNone(cache.get("machine", "a", True, ()))
+
+    def test_clear(self):
+        cache = DehydratedObjectCache()
+        cache.set("machine", "abc", True, (), {}, 0)
+        cache.clear()
+        self.assertEqual(0, len(cache))
+
+    def test_set_ignored_after_clear(self):
+        cache = DehydratedObjectCache()
+        gen = cache.generation("machine", "abc")
+        cache.clear()
+        cache.set("machine", "abc", True, (), {}, gen)
+        self.assertEqual(0, len(cache))
+
+    def test_get_records_hits_and_misses(self):
+        mock_metrics = self.patch(PROMETHEUS_METRICS, "update")
+        cache = DehydratedObjectCache()
+        handler_name = factory.make_name("handler")
+        cache.get(handler_name, "abc", True, ())
+        cache.set(handler_name, "abc", True, (), {}, 0)
+        cache.get(handler_name, "abc", True, ())
+        self.assertEqual(
+            [
+                {"handler": handler_name, "result": "miss"},
+                {"handler": handler_name, "result": "hit"},
+            ],
+            [call[1]["labels"] for call in mock_metrics.call_args_list],
+        )
@@ -979,6 +979,59 @@ class TestWebSocketFactoryTransactional(
         )
         self.assertThat(mock_sendNotify, MockCalledWith(name, action, data))
 
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_onNotify_passes_dehydrated_cache_to_handler(self):
+        user = yield deferToDatabase(self.make_user)
+        protocol, factory = self.make_protocol_with_factory(user=user)
+        mock_class = MagicMock()
+        mock_class.return_value.on_listen.return_value = None
+        yield factory.onNotify(
+            mock_class, sentinel.channel, sentinel.action, sentinel.obj_id
+        )
+        self.assertIs(
+            factory.dehydrated_cache, mock_class.return_value.dehydrated_cache
+        )
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_onNotify_invalidates_dehydrated_cache(self):
+        user = yield deferToDatabase(self.make_user)
+        protocol, factory = self.make_protocol_with_factory(user=user)
+        mock_invalidate = self.patch(factory.dehydrated_cache, "invalidate")
+        system_id = maas_factory.make_name("system_id")
+        yield factory.onNotify(MachineHandler, "machine", "update", system_id)
+        self.assertThat(
+            mock_invalidate, MockCalledOnceWith("machine", system_id)
+        )
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test_onNotify_records_fanout(self):
+        user = yield deferToDatabase(self.make_user)
+        protocol, factory = self.make_protocol_with_factory(user=user)
+        mock_class = MagicMock()
+        mock_class._meta.handler_name = "machine"
+        mock_class.return_value.on_listen.return_value = (
+            "machine",
+            "update",
+            {},
+        )
+        self.patch(protocol, "sendNotify")
+        mock_metrics = self.patch(protocol_module.PROMETHEUS_METRICS, "update")
+        yield factory.onNotify(
+            mock_class, sentinel.channel, "update", sentinel.obj_id
+        )
+        self.assertThat(
+            mock_metrics,
+            MockCalledOnceWith(
+                "maas_websocket_notify_fanout",
+                "observe",
+                value=1,
+                labels={"handler": "machine"},
+            ),
+        )
+
     @wait_for_reactor
     @inlineCallbacks
     def test_updateRackController_calls_onNotify_for_controller_update(self):
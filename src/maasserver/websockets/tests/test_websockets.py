@@ -14,6 +14,9 @@ HyBi-07 (http://tools.ietf.org/html/draft-ietf-hybi-thewebsocketprotocol-07),
 which are drafts of RFC 6455.
 """
 
+import os
+import zlib
+
 from testtools.matchers import StartsWith
 from twisted.internet.address import IPv6Address
 from twisted.internet.protocol import Factory, Protocol
@@ -35,6 +38,7 @@ from maasserver.websockets.websockets import (
     _makeFrame,
     _mask,
     _parseFrames,
+    _PerMessageDeflate,
     _WSException,
     CONTROLS,
     IWebSocketsFrameReceiver,
@@ -49,6 +53,20 @@ from maastesting.testcase import MAASTestCase
 from maastesting.twisted import TwistedLoggerFixture
 
 
+def compressMessage(data):
+    """Compress `data` as a client using permessage-deflate would."""
+    compressor = zlib.compressobj(
+        zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15
+    )
+    data = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    return data[:-4]
+
+
+def decompressMessage(data):
+    """Decompress a message sent with permessage-deflate."""
+    return zlib.decompressobj(-15).decompress(data + b"\x00\x00\xff\xff")
+
+
 class DummyRequest(DummyRequestBase):
 
     content = None
@@ -99,6 +117,22 @@ class TestFrameHelpers(MAASTestCase):
         key = b"\x37\xfa\x21\x3d"
         self.assertEqual(_mask(b"Hello", key), b"\x7f\x9f\x4d\x51\x58")
 
+    def test_maskLong(self):
+        """
+        L{_mask} masks buffers which aren't a multiple of the key length.
+        """
+        key = os.urandom(4)
+        buf = os.urandom(1001)
+        expected = bytes(b ^ key[i % 4] for i, b in enumerate(buf))
+        self.assertEqual(expected, _mask(buf, key))
+        self.assertEqual(buf, _mask(expected, key))
+
+    def test_maskEmpty(self):
+        """
+        L{_mask} masks an empty buffer.
+        """
+        self.assertEqual(b"", _mask(b"", b"abcd"))
+
     def test_parseUnmaskedText(self):
         """
         A sample unmasked frame of "Hello" from HyBi-10, 4.7.
@@ -283,6 +317,87 @@ class TestFrameHelpers(MAASTestCase):
         error = self.assertRaises(_WSException, list, _parseFrames(frame))
         self.assertEqual("Reserved flag in frame (114)", str(error))
 
+    def test_parseCompressedText(self):
+        """
+        L{_parseFrames} decompresses frames when permessage-deflate has been
+        negotiated.
+        """
+        frame = [
+            _makeFrame(
+                compressMessage(b"Hello"),
+                CONTROLS.TEXT,
+                True,
+                mask=b"abcd",
+                compressed=True,
+            )
+        ]
+        frames = list(_parseFrames(frame, deflate=_PerMessageDeflate()))
+        self.assertEqual([(CONTROLS.TEXT, b"Hello", True)], frames)
+
+    def test_parseCompressedTextFragments(self):
+        """
+        L{_parseFrames} decompresses continuation frames of a compressed
+        message.
+        """
+        data = compressMessage(b"Hello World")
+        frame = [
+            _makeFrame(data[:4], CONTROLS.TEXT, False, compressed=True),
+            _makeFrame(data[4:], CONTROLS.CONTINUE, True),
+        ]
+        frames = list(
+            _parseFrames(frame, needMask=False, deflate=_PerMessageDeflate())
+        )
+        self.assertEqual(
+            b"Hello World", b"".join(data for _, data, _ in frames)
+        )
+        self.assertEqual([False, True], [fin for _, _, fin in frames])
+
+    def test_parseUncompressedTextWithDeflate(self):
+        """
+        L{_parseFrames} passes frames which aren't compressed through when
+        permessage-deflate has been negotiated.
+        """
+        frame = [_makeFrame(b"Hello", CONTROLS.TEXT, True, mask=b"abcd")]
+        frames = list(_parseFrames(frame, deflate=_PerMessageDeflate()))
+        self.assertEqual([(CONTROLS.TEXT, b"Hello", True)], frames)
+
+    def test_parseCompressedWithoutDeflate(self):
+        """
+        L{_parseFrames} raises a L{_WSException} error for compressed frames
+        when permessage-deflate hasn't been negotiated.
+        """
+        frame = [_makeFrame(b"Hello", CONTROLS.TEXT, True, compressed=True)]
+        error = self.assertRaises(
+            _WSException, list, _parseFrames(frame, needMask=False)
+        )
+        self.assertEqual("Reserved flag in frame (193)", str(error))
+
+    def test_parseCompressedControlFrame(self):
+        """
+        L{_parseFrames} raises a L{_WSException} error for compressed control
+        frames.
+        """
+        frame = [_makeFrame(b"Hello", CONTROLS.PING, True, compressed=True)]
+        error = self.assertRaises(
+            _WSException,
+            list,
+            _parseFrames(frame, needMask=False, deflate=_PerMessageDeflate()),
+        )
+        self.assertEqual("Compressed PING frame", str(error))
+
+    def test_parseInvalidCompressedData(self):
+        """
+        L{_parseFrames} raises a L{_WSException} error for compressed frames
+        which can't be decompressed.
+        """
+        frame = [_makeFrame(b"\xff" * 8, CONTROLS.TEXT, True, compressed=True)]
+        error = self.assertRaises(
+            _WSException,
+            list,
+            _parseFrames(frame, needMask=False, deflate=_PerMessageDeflate()),
+        )
+        self.assertThat(str(error), StartsWith("Invalid compressed data"))
+
     def test_parseUnknownOpcode(self):
         """
         L{_parseFrames} raises a L{_WSException} error when the error uses an
@@ -334,6 +449,166 @@ class TestFrameHelpers(MAASTestCase):
         buf = _makeFrame(b"Hello", CONTROLS.TEXT, True, mask=b"7\xfa!=")
         self.assertEqual(frame, buf)
 
+    def test_makeCompressedFrame(self):
+        """
+        L{_makeFrame} sets the first reserved flag on compressed frames.
+        """
+        frame = b"\xc1\x05Hello"
+        buf = _makeFrame(b"Hello", CONTROLS.TEXT, True, compressed=True)
+        self.assertEqual(frame, buf)
+
+
+class PerMessageDeflateTest(MAASTestCase):
+    """
+    Tests for L{_PerMessageDeflate}.
+    """
+
+    def test_negotiateDefault(self):
+        """
+        L{_PerMessageDeflate.negotiate} accepts an offer without parameters,
+        keeping the compression context between messages.
+        """
+        deflate, response = _PerMessageDeflate.negotiate(
+            [b"permessage-deflate"]
+        )
+        self.assertEqual(b"permessage-deflate", response)
+        self.assertFalse(deflate.serverNoContextTakeover)
+        self.assertFalse(deflate.clientNoContextTakeover)
+        self.assertEqual(15, deflate.serverMaxWindowBits)
+
+    def test_negotiateParameters(self):
+        """
+        L{_PerMessageDeflate.negotiate} accepts the context takeover and
+        window size parameters, and confirms them in the response.
+        """
+        deflate, response = _PerMessageDeflate.negotiate(
+            [
+                b"permessage-deflate; server_no_context_takeover; "
+                b"client_no_context_takeover; server_max_window_bits=10; "
+                b'client_max_window_bits="12"'
+            ]
+        )
+        self.assertEqual(
+            b"permessage-deflate; server_no_context_takeover; "
+            b"client_no_context_takeover; server_max_window_bits=10",
+            response,
+        )
+        self.assertTrue(deflate.serverNoContextTakeover)
+        self.assertTrue(deflate.clientNoContextTakeover)
+        self.assertEqual(10, deflate.serverMaxWindowBits)
+
+    def test_negotiateSkipsInvalidOffers(self):
+        """
+        L{_PerMessageDeflate.negotiate} declines offers with unknown, repeated
+        or invalid parameters, and other extensions, and accepts the first
+        valid offer.
+        """
+        deflate, response = _PerMessageDeflate.negotiate(
+            [
+                b"x-webkit-deflate-frame, permessage-deflate; unknown",
+                b"permessage-deflate; server_max_window_bits=8, "
+                b"permessage-deflate; client_max_window_bits; "
+                b"client_max_window_bits",
+                b"permessage-deflate; client_max_window_bits",
+            ]
+        )
+        self.assertEqual(b"permessage-deflate", response)
+        self.assertIsInstance(deflate, _PerMessageDeflate)
+
+    def test_negotiateNothingAcceptable(self):
+        """
+        L{_PerMessageDeflate.negotiate} returns C{(None, None)} when there's
+        no valid permessage-deflate offer.
+        """
+        self.assertEqual(
+            (None, None),
+            _PerMessageDeflate.negotiate(
+                [b"x-webkit-deflate-frame", b"permessage-deflate; foo=1"]
+            ),
+        )
+
+    def test_compressKeepsContext(self):
+        """
+        L{_PerMessageDeflate.compress} compresses each message using the
+        context from the previous message.
+        """
+        deflate = _PerMessageDeflate()
+        first, compressed = deflate.compress(
+            CONTROLS.TEXT, b"Hello" * 10, True
+        )
+        self.assertTrue(compressed)
+        self.assertEqual(b"Hello" * 10, decompressMessage(first))
+        second, _ = deflate.compress(CONTROLS.TEXT, b"Hello" * 10, True)
+        self.assertLess(len(second), len(first))
+        decompressor = zlib.decompressobj(-15)
+        self.assertEqual(
+            [b"Hello" * 10, b"Hello" * 10],
+            [
+                decompressor.decompress(data + b"\x00\x00\xff\xff")
+                for data in (first, second)
+            ],
+        )
+
+    def test_compressNoContextTakeover(self):
+        """
+        L{_PerMessageDeflate.compress} compresses each message on its own if
+        the client asked for no server context takeover.
+        """
+        deflate = _PerMessageDeflate(serverNoContextTakeover=True)
+        first, _ = deflate.compress(CONTROLS.TEXT, b"Hello" * 10, True)
+        second, _ = deflate.compress(CONTROLS.TEXT, b"Hello" * 10, True)
+        self.assertEqual(first, second)
+        self.assertEqual(b"Hello" * 10, decompressMessage(second))
+
+    def test_compressFragments(self):
+        """
+        L{_PerMessageDeflate.compress} only marks the first frame of a message
+        as compressed.
+        """
+        deflate = _PerMessageDeflate()
+        first, firstCompressed = deflate.compress(CONTROLS.TEXT, b"Hel", False)
+        second, secondCompressed = deflate.compress(
+            CONTROLS.CONTINUE, b"lo", True
+        )
+        self.assertEqual([True, False], [firstCompressed, secondCompressed])
+        self.assertEqual(b"Hello", decompressMessage(first + second))
+
+    def test_compressControlFrame(self):
+        """
+        L{_PerMessageDeflate.compress} never compresses control frames.
+        """
+        deflate = _PerMessageDeflate()
+        self.assertEqual(
+            (b"Hello", False), deflate.compress(CONTROLS.PING, b"Hello", True)
+        )
+
+    def test_decompressKeepsContext(self):
+        """
+        L{_PerMessageDeflate.decompress} decompresses messages which use the
+        context from the previous message.
+        """
+        compressor = _PerMessageDeflate()
+        deflate = _PerMessageDeflate()
+        for _ in range(3):
+            data, _ = compressor.compress(CONTROLS.TEXT, b"Hello", True)
+            self.assertEqual(
+                b"Hello", deflate.decompress(CONTROLS.TEXT, data, True, True)
+            )
+
+    def test_decompressNoContextTakeover(self):
+        """
+        L{_PerMessageDeflate.decompress} decompresses messages which are each
+        compressed on their own.
+        """
+        deflate = _PerMessageDeflate(clientNoContextTakeover=True)
+        for _ in range(3):
+            self.assertEqual(
+                b"Hello",
+                deflate.decompress(
+                    CONTROLS.TEXT, compressMessage(b"Hello"), True, True
+                ),
+            )
+
 
 @implementer(IWebSocketsFrameReceiver)
 class SavingEchoReceiver(object):
@@ -413,6 +688,31 @@ class WebSocketsProtocolTest(MAASTestCase):
         self.protocol.dataReceived(b"\x72\x05")
         self.assertFalse(self.transport.connected)
 
+    def test_compressedFrameReceived(self):
+        """
+        With permessage-deflate negotiated, L{WebSocketsProtocol} decompresses
+        frames received and compresses frames sent.
+        """
+        receiver = SavingEchoReceiver()
+        protocol = WebSocketsProtocol(receiver)
+        protocol._deflate = _PerMessageDeflate()
+        transport = StringTransportWithDisconnection()
+        protocol.makeConnection(transport)
+        transport.protocol = protocol
+        protocol.dataReceived(
+            _makeFrame(
+                compressMessage(b"Hello"),
+                CONTROLS.TEXT,
+                True,
+                mask=b"abcd",
+                compressed=True,
+            )
+        )
+        self.assertEqual([(CONTROLS.TEXT, b"Hello", True)], receiver.received)
+        frame = transport.value()
+        self.assertEqual(b"\xc1", frame[:1])
+        self.assertEqual(b"Hello", decompressMessage(frame[2:]))
+
 
 class WebSocketsTransportTest(MAASTestCase):
     """
@@ -697,6 +997,61 @@ class WebSocketsResourceTest(MAASTestCase):
         self.assertEqual([b""], request.written)
         self.assertEqual(101, request.responseCode)
 
+    def make_upgrade_request(self, extensions):
+        request = DummyRequest(b"/")
+        request.requestHeaders = Headers(
+            {
+                b"user-agent": [b"user-agent"],
+                b"host": [b"host"],
+                b"sec-websocket-extensions": extensions,
+            }
+        )
+        transport = StringTransportWithDisconnection()
+        transport.protocol = Protocol()
+        request.transport = transport
+        self.update_headers(
+            request,
+            headers={
+                b"upgrade": b"Websocket",
+                b"connection": b"Upgrade",
+                b"sec-websocket-key": b"secure",
+                b"sec-websocket-version": b"13",
+            },
+        )
+        return request
+
+    def test_renderDeflate(self):
+        """
+        If the client offers the permessage-deflate extension,
+        L{WebSocketsResource} accepts it and the protocol compresses frames.
+        """
+        request = self.make_upgrade_request(
+            [b"permessage-deflate; client_max_window_bits"]
+        )
+        result = self.resource.render(request)
+        self.assertEqual(NOT_DONE_YET, result)
+        self.assertEqual(
+            [b"permessage-deflate"],
+            request.responseHeaders.getRawHeaders(b"sec-websocket-extensions"),
+        )
+        self.assertIsInstance(self.echoProtocol._deflate, _PerMessageDeflate)
+
+    def test_renderDeflateDisabled(self):
+        """
+        L{WebSocketsResource} declines the permessage-deflate extension if
+        compression is disabled.
+        """
+        self.resource = WebSocketsResource(
+            lookupProtocolForFactory(Factory.forProtocol(Protocol)),
+            compression=False,
+        )
+        request = self.make_upgrade_request([b"permessage-deflate"])
+        result = self.resource.render(request)
+        self.assertEqual(NOT_DONE_YET, result)
+        self.assertFalse(
+            request.responseHeaders.hasHeader(b"sec-websocket-extensions")
+        )
+
     def test_renderWrongUpgrade(self):
         """
         If the C{Upgrade} header contains an invalid value,
@@ -25,9 +25,9 @@ __all__ = [
 
 import base64
 from hashlib import sha1
-from itertools import cycle
 from struct import pack, unpack
 from typing import List, Sequence
+import zlib
 
 from twisted.internet.protocol import Protocol
 from twisted.protocols.tls import TLSMemoryBIOProtocol
@@ -117,11 +117,213 @@ def _mask(buf: bytes, key: bytes) -> bytes:
     @rtype: C{str}
     @return: A masked buffer of bytes.
     """
-    return bytes((b ^ k) for b, k in zip(buf, cycle(key)))
+    # XOR the whole buffer at once as a single integer, rather than byte by
+    # byte, since unmasking large frames is otherwise slow.
+    length = len(buf)
+    key = (key * (length // 4 + 1))[:length]
+    masked = int.from_bytes(buf, "big") ^ int.from_bytes(key, "big")
+    return masked.to_bytes(length, "big")
+
+
+# The name of the permessage-deflate extension, from RFC 7692.
+_DEFLATE_EXTENSION = b"permessage-deflate"
+
+# The empty block that ends each compressed message, which isn't sent.
+_DEFLATE_TRAILER = b"\x00\x00\xff\xff"
+
+
+class _PerMessageDeflate(object):
+    """
+    The permessage-deflate extension (RFC 7692) for one connection.
+
+    Data messages sent are compressed, and compressed data messages received
+    are decompressed. Unless a side asks for no context takeover, the
+    compression context is kept from one message to the next, so repeated
+    content in later messages compresses well.
+
+    @ivar serverNoContextTakeover: Whether each message sent is compressed
+        with a new context.
+    @type serverNoContextTakeover: C{bool}
+
+    @ivar clientNoContextTakeover: Whether each message received is
+        compressed with a new context.
+    @type clientNoContextTakeover: C{bool}
+
+    @ivar serverMaxWindowBits: The base-two logarithm of the window size for
+        messages sent.
+    @type serverMaxWindowBits: C{int}
+    """
+
+    def __init__(
+        self,
+        serverNoContextTakeover=False,
+        clientNoContextTakeover=False,
+        serverMaxWindowBits=zlib.MAX_WBITS,
+    ):
+        self.serverNoContextTakeover = serverNoContextTakeover
+        self.clientNoContextTakeover = clientNoContextTakeover
+        self.serverMaxWindowBits = serverMaxWindowBits
+        self._compressor = None
+        self._decompressor = None
+        self._decompressing = False
+
+    @classmethod
+    def negotiate(cls, offers):
+        """
+        Accept the first valid permessage-deflate offer from a client.
+
+        @type offers: C{list} of C{bytes}
+        @param offers: The values of the I{Sec-WebSocket-Extensions} headers.
+
+        @return: A tuple of the extension and the I{Sec-WebSocket-Extensions}
+            response header, or C{(None, None)} if nothing was acceptable.
+        """
+        for offer in b",".join(offers).split(b","):
+            name, *params = [part.strip() for part in offer.split(b";")]
+            if name != _DEFLATE_EXTENSION:
+                continue
+            try:
+                return cls._accept(params)
+            except ValueError:
+                # Parameters that are unknown, repeated or have invalid
+                # values mean the offer must be declined.
+                continue
+        return None, None
+
+    @classmethod
+    def _accept(cls, params):
+        """
+        Accept an offer with C{params}, or raise C{ValueError}.
+        """
+        seen = {}
+        for param in params:
+            key, _, value = param.partition(b"=")
+            key, value = key.strip(), value.strip().strip(b'"')
+            if key in seen:
+                raise ValueError(key)
+            elif key in (
+                b"server_no_context_takeover",
+                b"client_no_context_takeover",
+            ):
+                if value:
+                    raise ValueError(key)
+            elif key == b"server_max_window_bits":
+                # zlib can't compress with a window of 2^8 bytes.
+                if not value.isdigit() or not 9 <= int(value) <= 15:
+                    raise ValueError(key)
+            elif key == b"client_max_window_bits":
+                # Decompressing with the largest window works for any
+                # window the client uses.
+                if value and (
+                    not value.isdigit() or not 8 <= int(value) <= 15
+                ):
+                    raise ValueError(key)
+            else:
+                raise ValueError(key)
+            seen[key] = value
+
+        deflate = cls(
+            serverNoContextTakeover=b"server_no_context_takeover" in seen,
+            clientNoContextTakeover=b"client_no_context_takeover" in seen,
+            serverMaxWindowBits=int(
+                seen.get(b"server_max_window_bits", zlib.MAX_WBITS)
+            ),
+        )
+        response = [_DEFLATE_EXTENSION]
+        if deflate.serverNoContextTakeover:
+            response.append(b"server_no_context_takeover")
+        if deflate.clientNoContextTakeover:
+            response.append(b"client_no_context_takeover")
+        if b"server_max_window_bits" in seen:
+            response.append(
+                b"server_max_window_bits=%d" % deflate.serverMaxWindowBits
+            )
+        return deflate, b"; ".join(response)
+
+    @typed
+    def compress(self, opcode, data: bytes, fin: bool):
+        """
+        Compress the content of a frame to send.
+
+        @type opcode: C{CONTROLS}
+        @param opcode: The type of the frame.
+
+        @type data: C{bytes}
+        @param data: The content of the frame.
+
+        @type fin: C{bool}
+        @param fin: Whether or not this is the final frame of the message.
+
+        @return: A tuple of the content to send and whether the frame should
+            be marked as compressed.
+        """
+        if opcode.value & 0x8:
+            # Control frames are never compressed.
+            return data, False
+        if self._compressor is None:
+            self._compressor = zlib.compressobj(
+                zlib.Z_DEFAULT_COMPRESSION,
+                zlib.DEFLATED,
+                -self.serverMaxWindowBits,
+            )
+        data = self._compressor.compress(data) + self._compressor.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+        if fin:
+            data = data[: -len(_DEFLATE_TRAILER)]
+            if self.serverNoContextTakeover:
+                self._compressor = None
+        # Only the first frame of a message is marked as compressed.
+        return data, opcode != CONTROLS.CONTINUE
+
+    @typed
+    def decompress(
+        self, opcode, data: bytes, compressed: bool, fin: bool
+    ) -> bytes:
+        """
+        Decompress the content of a frame received.
+
+        @type opcode: C{CONTROLS}
+        @param opcode: The type of the frame.
+
+        @type data: C{bytes}
+        @param data: The content of the frame.
+
+        @type compressed: C{bool}
+        @param compressed: Whether the frame is marked as compressed.
+
+        @type fin: C{bool}
+        @param fin: Whether or not this is the final frame of the message.
+
+        @rtype: C{bytes}
+        @return: The decompressed content.
+        """
+        if opcode.value & 0x8 or opcode == CONTROLS.CONTINUE:
+            if compressed:
+                raise _WSException("Compressed %s frame" % opcode.name)
+            if opcode == CONTROLS.CONTINUE:
+                compressed = self._decompressing
+        else:
+            self._decompressing = compressed
+        if not compressed:
+            return data
+        if self._decompressor is None:
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        try:
+            data = self._decompressor.decompress(data)
+            if fin:
+                data += self._decompressor.decompress(_DEFLATE_TRAILER)
+        except zlib.error as error:
+            raise _WSException("Invalid compressed data (%s)" % error)
+        if fin and self.clientNoContextTakeover:
+            self._decompressor = None
+        return data
 
 
 @typed
-def _makeFrame(buf: bytes, opcode, fin: bool, mask: bytes = None) -> bytes:
+def _makeFrame(
+    buf: bytes, opcode, fin: bool, mask: bytes = None, compressed: bool = False
+) -> bytes:
     """
     Make a frame.
 
@@ -140,6 +342,10 @@ def _makeFrame(buf: bytes, opcode, fin: bool, mask: bytes = None) -> bytes:
     @type mask: C{bytes} or C{NoneType}
     @param mask: If specified, the masking key to apply on the created frame.
 
+    @type compressed: C{bool}
+    @param compressed: Whether to mark the frame as compressed with the
+        permessage-deflate extension.
+
     @rtype: C{bytes}
     @return: A packed frame.
     """
@@ -167,6 +373,9 @@ def _makeFrame(buf: bytes, opcode, fin: bool, mask: bytes = None) -> bytes:
     else:
         header = 0x01
 
+    if compressed:
+        header |= 0x40
+
     header = bytes([header | opcode.value])
     if mask is not None:
         buf = b"%s%s" % (mask, _mask(buf, mask))
@@ -175,7 +384,9 @@ def _makeFrame(buf: bytes, opcode, fin: bool, mask: bytes = None) -> bytes:
 
 
 @typed
-def _parseFrames(frameBuffer: List[bytes], needMask: bool = True):
+def _parseFrames(
+    frameBuffer: List[bytes], needMask: bool = True, deflate=None
+):
     """
     Parse frames in a highly compliant manner. It modifies C{frameBuffer}
     removing the parsed content from it.
@@ -185,6 +396,10 @@ def _parseFrames(frameBuffer: List[bytes], needMask: bool = True):
 
     @param needMask: If C{True}, refuse any frame which is not masked.
     @type needMask: C{bool}
+
+    @param deflate: If specified, the negotiated permessage-deflate extension
+        used to decompress compressed frames.
+    @type deflate: L{_PerMessageDeflate} or C{NoneType}
     """
     start = 0
     payload = b"".join(frameBuffer)
@@ -196,7 +411,11 @@ def _parseFrames(frameBuffer: List[bytes], needMask: bool = True):
 
         # Grab the header. This single byte holds some flags and an opcode
         header = payload[start]
-        if header & 0x70:
+        reserved = header & 0x70
+        if deflate is not None:
+            # The first reserved flag marks compressed frames.
+            reserved &= ~0x40
+        if reserved:
             # At least one of the reserved flags is set. Pork chop sandwiches!
             raise _WSException("Reserved flag in frame (%d)" % (header,))
 
@@ -260,6 +479,11 @@ def _parseFrames(frameBuffer: List[bytes], needMask: bool = True):
         if masked:
             data = _mask(data, key)
 
+        if deflate is not None:
+            data = deflate.decompress(
+                opcode, data, bool(header & 0x40), bool(fin)
+            )
+
         if opcode == CONTROLS.CLOSE:
             if len(data) >= 2:
                 # Gotta unpack the opcode and return usable data here.
@@ -315,13 +539,17 @@ class WebSocketsTransport(object):
 
     @ivar _transport: A reference to the real transport.
 
+    @ivar _deflate: The negotiated permessage-deflate extension, if any.
+    @type _deflate: L{_PerMessageDeflate} or C{NoneType}
+
     @since: 13.2
     """
 
     _disconnecting = False
 
-    def __init__(self, transport):
+    def __init__(self, transport, deflate=None):
         self._transport = transport
+        self._deflate = deflate
 
     @typed
     def sendFrame(self, opcode, data: bytes, fin: bool):
@@ -337,7 +565,10 @@ class WebSocketsTransport(object):
         @type fin: C{bool}
         @param fin: Whether or not we're sending a final frame.
         """
-        packet = _makeFrame(data, opcode, fin)
+        compressed = False
+        if self._deflate is not None:
+            data, compressed = self._deflate.compress(opcode, data, fin)
+        packet = _makeFrame(data, opcode, fin, compressed=compressed)
         self._transport.write(packet)
 
     @typed
@@ -381,10 +612,14 @@ class WebSocketsProtocol(Protocol):
     @ivar _buffer: The pending list of frames not processed yet.
     @type _buffer: C{list}
 
+    @ivar _deflate: The negotiated permessage-deflate extension, if any.
+    @type _deflate: L{_PerMessageDeflate} or C{NoneType}
+
     @since: 13.2
     """
 
     _buffer = None
+    _deflate = None
 
     def __init__(self, receiver):
         self._receiver = receiver
@@ -396,13 +631,17 @@ class WebSocketsProtocol(Protocol):
         peer = self.transport.getPeer()
         log.debug("Opening connection with {peer}", peer=peer)
         self._buffer = []
-        self._receiver.makeConnection(WebSocketsTransport(self.transport))
+        self._receiver.makeConnection(
+            WebSocketsTransport(self.transport, self._deflate)
+        )
 
     def _parseFrames(self):
         """
         Find frames in incoming data and pass them to the underlying protocol.
         """
-        for opcode, data, fin in _parseFrames(self._buffer):
+        for opcode, data, fin in _parseFrames(
+            self._buffer, deflate=self._deflate
+        ):
             self._receiver.frameReceived(opcode, data, fin)
             if opcode == CONTROLS.CLOSE:
                 # The other side wants us to close.
@@ -590,13 +829,18 @@ class WebSocketsResource(object):
         L{lookupProtocolForFactory}.
     @type lookupProtocol: C{callable}.
 
+    @param compression: Whether to accept the permessage-deflate extension
+        when the client offers it.
+    @type compression: C{bool}
+
     @since: 13.2
     """
 
     isLeaf = True
 
-    def __init__(self, lookupProtocol):
+    def __init__(self, lookupProtocol, compression=True):
         self._lookupProtocol = lookupProtocol
+        self._compression = compression
 
     def getChildWithDefault(self, name, request):
         """
@@ -699,6 +943,16 @@ class WebSocketsResource(object):
         # 4.2.2.5.5 Optional codec declaration
         if protocolName:
             request.setHeader(b"Sec-WebSocket-Protocol", protocolName)
+        # 4.2.2.5.6 Optional extensions, of which only permessage-deflate is
+        # supported.
+        deflate = None
+        offers = request.requestHeaders.getRawHeaders(
+            b"Sec-WebSocket-Extensions"
+        )
+        if self._compression and offers:
+            deflate, extensions = _PerMessageDeflate.negotiate(offers)
+            if deflate is not None:
+                request.setHeader(b"Sec-WebSocket-Extensions", extensions)
 
         # Provoke request into flushing headers and finishing the handshake.
         request.write(b"")
@@ -730,6 +984,7 @@ class WebSocketsResource(object):
 
         if not isinstance(protocol, WebSocketsProtocol):
             protocol = WebSocketsProtocolWrapper(protocol)
+        protocol._deflate = deflate
 
         # Connect the transport to our factory, and make things go. We need to
         # do some stupid stuff here; see #3204, which could fix it.
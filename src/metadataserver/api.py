@@ -16,8 +16,10 @@ __all__ = [
 ]
 
 import base64
+from collections import OrderedDict
 from datetime import datetime
 from functools import partial
+import hashlib
 import http.client
 from io import BytesIO
 from itertools import chain
@@ -25,12 +27,15 @@ import json
 from operator import itemgetter
 import os
 import tarfile
+import threading
 import time
 
 from django.conf import settings
 from django.core.exceptions import PermissionDenied
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from formencode.validators import Int, String
 from piston3.utils import rc
 import yaml
@@ -56,6 +61,7 @@ from maasserver.models import (
     NodeMetadata,
     SSHKey,
     SSLKey,
+    VersionedTextFile,
 )
 from maasserver.models.event import Event
 from maasserver.models.tag import Tag
@@ -103,6 +109,7 @@ from provisioningserver.events import (
     EVENT_TYPES,
 )
 from provisioningserver.logger import LegacyLogger
+from provisioningserver.prometheus.metrics import PROMETHEUS_METRICS
 
 log = LegacyLogger()
 
@@ -111,6 +118,9 @@ log = LegacyLogger()
 # ../ is added to keep config outside of the scripts directory.
 NETPLAN_TAR_PATH = "../config/netplan.yaml"
 
+# The most script versions to keep the content of in memory.
+SCRIPT_CACHE_SIZE = 500
+
 
 class UnknownMetadataVersion(MAASAPINotFound):
     """Not a known metadata version."""
@@ -191,10 +201,14 @@ def check_version(version):
         raise UnknownMetadataVersion("Unknown metadata version: %s" % version)
 
 
-def add_event_to_node_event_log(
+def get_node_event_log_events(
     node, origin, action, description, event_type, result=None, created=None
 ):
-    """Add an entry to the node's event log."""
+    """Return the events to add to the node's event log for a message.
+
+    Each event is a dict of keyword arguments for
+    `EventManager.register_event_and_event_type`, without the node.
+    """
     if node.status == NODE_STATUS.COMMISSIONING:
         if result in ["SUCCESS", None]:
             type_name = EVENT_TYPES.NODE_COMMISSIONING_EVENT
@@ -220,28 +234,44 @@ def add_event_to_node_event_log(
     else:
         type_name = EVENT_TYPES.NODE_STATUS_EVENT
 
+    events = []
     # Create an extra event for the machine status messages.
     if action in EVENT_STATUS_MESSAGES and event_type == "start":
-        Event.objects.register_event_and_event_type(
-            EVENT_STATUS_MESSAGES[action],
-            type_level=EVENT_DETAILS[EVENT_STATUS_MESSAGES[action]].level,
-            type_description=EVENT_DETAILS[
-                EVENT_STATUS_MESSAGES[action]
-            ].description,
+        status_type_name = EVENT_STATUS_MESSAGES[action]
+        events.append(
+            dict(
+                type_name=status_type_name,
+                type_level=EVENT_DETAILS[status_type_name].level,
+                type_description=EVENT_DETAILS[status_type_name].description,
+                event_action=action,
+                created=created,
+            )
+        )
+    events.append(
+        dict(
+            type_name=type_name,
+            type_level=EVENT_DETAILS[type_name].level,
+            type_description=EVENT_DETAILS[type_name].description,
             event_action=action,
-            system_id=node.system_id,
+            event_description="'%s' %s" % (origin, description),
             created=created,
         )
+    )
+    return events
 
-    return Event.objects.register_event_and_event_type(
-        type_name,
-        type_level=EVENT_DETAILS[type_name].level,
-        type_description=EVENT_DETAILS[type_name].description,
-        event_action=action,
-        event_description="'%s' %s" % (origin, description),
-        system_id=node.system_id,
-        created=created,
+
+def add_event_to_node_event_log(
+    node, origin, action, description, event_type, result=None, created=None
+):
+    """Add an entry to the node's event log."""
+    events = get_node_event_log_events(
+        node, origin, action, description, event_type, result, created
     )
+    for event in events:
+        registered = Event.objects.register_event_and_event_type(
+            system_id=node.system_id, **event
+        )
+    return registered
 
 
 def process_file(
@@ -1026,6 +1056,122 @@ def add_file_to_tar(tar, path, content, mtime, permission=0o755):
     tar.addfile(tarinfo, BytesIO(content))
 
 
+def get_files_etag(files):
+    """Return an ETag for a tar of `files`.
+
+    The ETag only depends on the path, permissions and content of each file,
+    not on when the tar is made.
+
+    :param files: An `OrderedDict` of (content, permission) tuples by path.
+    """
+    digest = hashlib.sha256()
+    for path, (content, permission) in files.items():
+        digest.update(
+            ("%s\0%o\0%d\0" % (path, permission, len(content))).encode()
+        )
+        digest.update(content)
+    return digest.hexdigest()
+
+
+def make_tar_response(request, etag, get_content, content_type):
+    """Return a response for a tar with `etag`.
+
+    If the client already has the tar a 304 is returned, and the tar isn't
+    produced at all. Otherwise `get_content()` is called for its content.
+    """
+    etag = quote_etag(etag)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(get_content(), content_type=content_type)
+    response["ETag"] = etag
+    return response
+
+
+class ScriptCache:
+    """Process-wide cache of the content of scripts sent to nodes.
+
+    Every node that commissions or tests downloads the same scripts. Script
+    versions are never modified, so their content is cached by version id
+    and only versions that haven't been seen before are loaded from the
+    database. The deprecated commissioning scripts archive is the same for
+    every node, so it's only built again when the commissioning scripts
+    change.
+
+    Scripts are sent to nodes from database threads, so all access to the
+    cache is serialised with a lock.
+    """
+
+    def __init__(self, max_entries=SCRIPT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._contents = OrderedDict()
+        self._archive = None
+        self._lock = threading.Lock()
+
+    def clear(self):
+        """Forget everything that has been cached."""
+        with self._lock:
+            self._contents.clear()
+            self._archive = None
+
+    def get_contents(self, version_ids):
+        """Return the encoded content of script versions, by version id."""
+        version_ids = set(version_ids)
+        contents = {}
+        with self._lock:
+            for version_id in version_ids:
+                content = self._contents.get(version_id)
+                if content is not None:
+                    self._contents.move_to_end(version_id)
+                    contents[version_id] = content
+        self._count("script", "hit", len(contents))
+        missing = version_ids.difference(contents)
+        self._count("script", "miss", len(missing))
+        if missing:
+            loaded = {
+                version_id: data.encode()
+                for version_id, data in VersionedTextFile.objects.filter(
+                    id__in=missing
+                ).values_list("id", "data")
+            }
+            with self._lock:
+                self._contents.update(loaded)
+                while len(self._contents) > self.max_entries:
+                    self._contents.popitem(last=False)
+            contents.update(loaded)
+        return contents
+
+    def get_archive(self, key, build):
+        """Return the ETag and content of the archive for `key`.
+
+        :param key: Identifies everything that goes into the archive.
+        :param build: Called to build the archive if `key` has changed since
+            it was last built.
+        """
+        with self._lock:
+            archive = self._archive
+        if archive is not None and archive[0] == key:
+            self._count("archive", "hit")
+            return archive[1:]
+        self._count("archive", "miss")
+        content = build()
+        etag = hashlib.sha256(content).hexdigest()
+        with self._lock:
+            self._archive = key, etag, content
+        return etag, content
+
+    def _count(self, kind, result, value=1):
+        if value > 0:
+            PROMETHEUS_METRICS.update(
+                "maas_script_cache_requests",
+                "inc",
+                value=value,
+                labels={"kind": kind, "result": result},
+            )
+
+
+script_cache = ScriptCache()
+
+
 class CommissioningScriptsHandler(MetadataViewHandler):
     """Return a tar archive containing the commissioning scripts.
 
@@ -1039,7 +1185,7 @@ class CommissioningScriptsHandler(MetadataViewHandler):
     def _iter_user_scripts(self):
         for script in Script.objects.filter(
             script_type=SCRIPT_TYPE.COMMISSIONING
-        ):
+        ).select_related("script"):
             try:
                 # Check if the script is a base64 encoded binary.
                 content = base64.b64decode(script.script.data)
@@ -1064,19 +1210,43 @@ class CommissioningScriptsHandler(MetadataViewHandler):
                 add_script(os.path.join("commissioning.d", name), content)
         return binary.getvalue()
 
+    def _get_archive_key(self):
+        """Return what the archive is built from.
+
+        Builtin scripts only change when MAAS is upgraded, and user scripts
+        are identified by their name and current version.
+        """
+        return tuple(
+            sorted(
+                Script.objects.filter(
+                    script_type=SCRIPT_TYPE.COMMISSIONING
+                ).values_list("name", "script_id")
+            )
+        )
+
     def read(self, request, version, mac=None):
         check_version(version)
-        return HttpResponse(
-            self._get_archive(), content_type="application/tar"
+        etag, content = script_cache.get_archive(
+            self._get_archive_key(), self._get_archive
+        )
+        return make_tar_response(
+            request, etag, lambda: content, "application/tar"
         )
 
 
 class MAASScriptsHandler(OperationsHandler):
-    def _add_script_set_to_tar(self, script_set, tar, prefix, mtime):
-        if script_set is None:
-            return []
+    def _add_script_set(self, script_results, contents, files, prefix):
+        """Add the scripts still to run from a script set to `files`.
+
+        :param script_results: The results in the script set.
+        :param contents: The content of user scripts, by version id.
+        :param files: An `OrderedDict` of (content, permission) tuples by
+            path to add the scripts, their results so far and any network
+            configuration they need to.
+        :return: The meta data for each script added.
+        """
         meta_data = []
-        for script_result in script_set:
+        for script_result in script_results:
             # Don't rerun Scripts which have already run.
             if script_result.status not in SCRIPT_STATUS_RUNNING_OR_PENDING:
                 continue
@@ -1088,7 +1258,7 @@ class MAASScriptsHandler(OperationsHandler):
                 # data from the source.
                 if script_result.name in NODE_INFO_SCRIPTS:
                     script = NODE_INFO_SCRIPTS[script_result.name]
-                    add_file_to_tar(tar, path, script["content"], mtime)
+                    files[path] = script["content"], 0o755
                     md_item = {
                         "name": script_result.name,
                         "path": path,
@@ -1112,13 +1282,12 @@ class MAASScriptsHandler(OperationsHandler):
                     script_result.delete()
                     continue
             else:
-                content = script_result.script.script.data.encode()
-                add_file_to_tar(tar, path, content, mtime)
+                files[path] = contents[script_result.script.script_id], 0o755
                 md_item = {
                     "name": script_result.name,
                     "path": path,
                     "script_result_id": script_result.id,
-                    "script_version_id": script_result.script.script.id,
+                    "script_version_id": script_result.script.script_id,
                     "timeout_seconds": script_result.script.timeout.seconds,
                     "parallel": script_result.script.parallel,
                     "hardware_type": script_result.script.hardware_type,
@@ -1139,22 +1308,16 @@ class MAASScriptsHandler(OperationsHandler):
                 out_path = os.path.join(
                     "out", "%s.%s" % (script_result.name, script_result.id)
                 )
-                add_file_to_tar(tar, out_path, script_result.output, mtime)
-                add_file_to_tar(
-                    tar, "%s.out" % out_path, script_result.stdout, mtime
-                )
-                add_file_to_tar(
-                    tar, "%s.err" % out_path, script_result.stderr, mtime
-                )
-                add_file_to_tar(
-                    tar, "%s.yaml" % out_path, script_result.result, mtime
-                )
+                files[out_path] = script_result.output, 0o755
+                files["%s.out" % out_path] = script_result.stdout, 0o755
+                files["%s.err" % out_path] = script_result.stderr, 0o755
+                files["%s.yaml" % out_path] = script_result.result, 0o755
 
             # Only generate and add network configuration if the Script needs
             # it and it hasn't already been added.
             if (
                 md_item["apply_configured_networking"]
-                and NETPLAN_TAR_PATH not in tar.getnames()
+                and NETPLAN_TAR_PATH not in files
             ):
                 node = script_result.script_set.node
                 # Testing is always done in the commissioning environment.
@@ -1173,18 +1336,33 @@ class MAASScriptsHandler(OperationsHandler):
                 network_config_yaml = yaml.safe_dump(
                     network_config.config, default_flow_style=False
                 )
-                add_file_to_tar(
-                    tar,
-                    NETPLAN_TAR_PATH,
-                    network_config_yaml.encode(),
-                    mtime,
-                    0o644,
-                )
+                files[NETPLAN_TAR_PATH] = network_config_yaml.encode(), 0o644
 
             meta_data.append(md_item)
 
         return meta_data
 
+    def _get_script_results(self, script_set):
+        """Return the results in `script_set`, with their scripts.
+
+        The content of the scripts isn't loaded; it comes from `script_cache`
+        instead.
+        """
+        qs = script_set.scriptresult_set.select_related(
+            "script_set__node", "script", "script__script"
+        )
+        qs = qs.defer("script__script__data").order_by("id")
+        return list(qs)
+
+    def _get_contents(self, *script_results):
+        """Return the content of the user scripts in `script_results`."""
+        return script_cache.get_contents(
+            script_result.script.script_id
+            for script_result in chain(*script_results)
+            if script_result.script is not None
+            and script_result.status in SCRIPT_STATUS_RUNNING_OR_PENDING
+        )
+
     def read(self, request, version, mac=None):
         """Returns a tar containing user and status selected scripts.
 
@@ -1194,79 +1372,88 @@ class MAASScriptsHandler(OperationsHandler):
         so auto-decompress is suggested. If the node returns a script status
         and calls this request again only the scripts which havn't been run
         will be returned.
+
+        The response has an ETag, derived from the content of the tar. If
+        the node asks for the tar again when nothing has changed it gets
+        a 304.
         """
         node = get_queried_node(request)
-        binary = BytesIO()
-        mtime = time.time()
-        tar_meta_data = {}
-        # Responses are currently gzip compressed using
-        # django.middleware.gzip.GZipMiddleware.
-        with tarfile.open(mode="w", fileobj=binary) as tar:
-            # Commissioning scripts should only be run during commissioning or
-            # in rescue mode.
-            if (
-                node.status
-                in (
-                    NODE_STATUS.COMMISSIONING,
-                    NODE_STATUS.ENTERING_RESCUE_MODE,
-                    NODE_STATUS.RESCUE_MODE,
-                )
-                and node.current_commissioning_script_set is not None
+        commissioning_results = testing_results = []
+        # Commissioning scripts should only be run during commissioning or
+        # in rescue mode.
+        if (
+            node.status
+            in (
+                NODE_STATUS.COMMISSIONING,
+                NODE_STATUS.ENTERING_RESCUE_MODE,
+                NODE_STATUS.RESCUE_MODE,
+            )
+            and node.current_commissioning_script_set is not None
+        ):
+            script_set = node.current_commissioning_script_set
+            commissioning_results = self._get_script_results(script_set)
+            # After the script runner finishes sending all commissioning
+            # results it redownloads the script tar. It does this in-case
+            # a commissioning script discovers hardware associated with
+            # hardware identified in the for_hardware field of a script.
+            # select_for_hardware_scripts() processes the output of the
+            # builtin commissioning scripts and adds any associated script.
+            # This does not need to happen the first time the script runner
+            # downloads the tar as the region has not yet received new
+            # data.
+            if any(
+                script_result.status != SCRIPT_STATUS.PENDING
+                for script_result in commissioning_results
             ):
-                # Prefetch all the data we need.
-                qs = node.current_commissioning_script_set.scriptresult_set
-                qs = qs.select_related("script", "script__script")
-                # After the script runner finishes sending all commissioning
-                # results it redownloads the script tar. It does this in-case
-                # a commissioning script discovers hardware associated with
-                # hardware identified in the for_hardware field of a script.
-                # select_for_hardware_scripts() processes the output of the
-                # builtin commissioning scripts and adds any associated script.
-                # This does not need to happen the first time the script runner
-                # downloads the tar as the region has not yet received new
-                # data.
-                for script_result in qs:
-                    if script_result.status != SCRIPT_STATUS.PENDING:
-                        script_set = node.current_commissioning_script_set
-                        script_set.select_for_hardware_scripts()
-                        break
-                meta_data = self._add_script_set_to_tar(
-                    node.current_commissioning_script_set,
-                    tar,
-                    "commissioning",
-                    mtime,
-                )
-                if meta_data != []:
-                    tar_meta_data["commissioning_scripts"] = sorted(
-                        meta_data, key=itemgetter("name", "script_result_id")
-                    )
-
-            # Always send testing scripts.
-            if node.current_testing_script_set is not None:
-                # prefetch all the data we need
-                qs = node.current_testing_script_set.scriptresult_set
-                qs = qs.select_related("script", "script__script")
-                meta_data = self._add_script_set_to_tar(
-                    qs, tar, "testing", mtime
-                )
-                if meta_data != []:
-                    tar_meta_data["testing_scripts"] = sorted(
-                        meta_data, key=itemgetter("name", "script_result_id")
-                    )
+                script_set.select_for_hardware_scripts()
+                commissioning_results = self._get_script_results(script_set)
 
-            if not tar_meta_data:
-                return HttpResponse(status=int(http.client.NO_CONTENT))
+        # Always send testing scripts.
+        if node.current_testing_script_set is not None:
+            testing_results = self._get_script_results(
+                node.current_testing_script_set
+            )
 
-            add_file_to_tar(
-                tar,
-                "index.json",
-                json.dumps({"1.0": tar_meta_data}).encode(),
-                mtime,
-                0o644,
+        # Shared script content comes from the cache, only the results and
+        # meta data are specific to this node.
+        contents = self._get_contents(commissioning_results, testing_results)
+        files = OrderedDict()
+        tar_meta_data = {}
+        meta_data = self._add_script_set(
+            commissioning_results, contents, files, "commissioning"
+        )
+        if meta_data != []:
+            tar_meta_data["commissioning_scripts"] = sorted(
+                meta_data, key=itemgetter("name", "script_result_id")
+            )
+        meta_data = self._add_script_set(
+            testing_results, contents, files, "testing"
+        )
+        if meta_data != []:
+            tar_meta_data["testing_scripts"] = sorted(
+                meta_data, key=itemgetter("name", "script_result_id")
             )
 
-        return HttpResponse(
-            binary.getvalue(), content_type="application/x-tar"
+        if not tar_meta_data:
+            return HttpResponse(status=int(http.client.NO_CONTENT))
+
+        files["index.json"] = (
+            json.dumps({"1.0": tar_meta_data}).encode(),
+            0o644,
+        )
+
+        def get_content():
+            binary = BytesIO()
+            mtime = time.time()
+            # Responses are currently gzip compressed using
+            # django.middleware.gzip.GZipMiddleware.
+            with tarfile.open(mode="w", fileobj=binary) as tar:
+                for path, (content, permission) in files.items():
+                    add_file_to_tar(tar, path, content, mtime, permission)
+            return binary.getvalue()
+
+        return make_tar_response(
+            request, get_files_etag(files), get_content, "application/x-tar"
         )
 
 
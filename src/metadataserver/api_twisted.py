@@ -18,16 +18,23 @@ from twisted.web.server import NOT_DONE_YET
 from maasserver.api.utils import extract_oauth_key_from_auth_header
 from maasserver.enum import NODE_STATUS, NODE_TYPE
 from maasserver.forms.pods import PodForm
-from maasserver.models import Node, NodeMetadata
+from maasserver.models import Event, Node, NodeMetadata
 from maasserver.preseed import CURTIN_INSTALL_LOG
 from maasserver.utils.orm import (
     in_transaction,
     transactional,
     TransactionManagementError,
 )
-from maasserver.utils.threads import deferToDatabase
+from maasserver.utils.threads import (
+    DATABASE_PRIORITY,
+    deferToDatabaseWithPriority,
+)
 from metadataserver import logger
-from metadataserver.api import add_event_to_node_event_log, process_file
+from metadataserver.api import (
+    add_event_to_node_event_log,
+    get_node_event_log_events,
+    process_file,
+)
 from metadataserver.enum import SCRIPT_STATUS
 from metadataserver.models import NodeKey
 from provisioningserver.events import EVENT_STATUS_MESSAGES
@@ -228,23 +235,38 @@ def _create_pod_for_deployment(node):
 
 
 class StatusWorkerService(TimerService, object):
-    """Service to update nodes from recieved status messages."""
+    """Service to update nodes from recieved status messages.
 
-    check_interval = 60  # Every second.
+    :ivar batch_size: when non-zero, a node's queued messages are processed
+        in transactions of up to this many messages, with the events they
+        log written together. When zero every message gets its own
+        transaction.
+    """
 
-    def __init__(self, dbtasks, clock=reactor):
-        # Call self._tryUpdateNodes() every self.check_interval.
+    check_interval = 60  # Every second.
+    batch_size = 0
+
+    def __init__(
+        self, dbtasks, clock=reactor, batch_size=None, flush_interval=None
+    ):
+        if flush_interval is None:
+            flush_interval = self.check_interval
+        # Call self._tryUpdateNodes() every flush_interval.
         super(StatusWorkerService, self).__init__(
-            self.check_interval, self._tryUpdateNodes
+            flush_interval, self._tryUpdateNodes
         )
         self.dbtasks = dbtasks
         self.clock = clock
+        if batch_size is not None:
+            self.batch_size = batch_size
         self.queue = defaultdict(list)
 
     def _tryUpdateNodes(self):
         if len(self.queue) != 0:
             queue, self.queue = self.queue, defaultdict(list)
-            d = deferToDatabase(self._preProcessQueue, queue)
+            d = deferToDatabaseWithPriority(
+                DATABASE_PRIORITY.BACKGROUND, self._preProcessQueue, queue
+            )
             d.addCallback(self._processMessagesLater)
             d.addErrback(log.err, "Failed to process node status messages.")
             return d
@@ -278,21 +300,115 @@ class StatusWorkerService(TimerService, object):
                 "_processMessages must be called from "
                 "outside of a transaction."
             )
-        else:
+        elif self.batch_size > 0:
             # Here we're in a database thread, with a database connection.
-            for idx, message in enumerate(messages):
+            for start in range(0, len(messages), self.batch_size):
+                batch = messages[start : start + self.batch_size]
                 try:
-                    exists = self._processMessage(node, message)
-                    if not exists:
-                        # Node has been deleted no reason to continue saving
-                        # the events for this node.
-                        break
+                    exists = self._processMessageBatch(node, batch)
                 except Exception:
                     log.err(
                         None,
-                        "Failed to process message "
+                        "Failed to process message batch "
                         "for node: %s" % node.hostname,
                     )
+                    # The batch has been rolled back; process its messages
+                    # one at a time so one bad message doesn't lose them all.
+                    exists = self._processMessagesSingly(node, batch)
+                if not exists:
+                    break
+        else:
+            # Here we're in a database thread, with a database connection.
+            self._processMessagesSingly(node, messages)
+
+    def _processMessagesSingly(self, node, messages):
+        """Process each message in its own transaction.
+
+        Return False if the node was deleted.
+        """
+        for idx, message in enumerate(messages):
+            try:
+                exists = self._processMessage(node, message)
+                if not exists:
+                    # Node has been deleted no reason to continue saving
+                    # the events for this node.
+                    return False
+            except Exception:
+                log.err(
+                    None,
+                    "Failed to process message "
+                    "for node: %s" % node.hostname,
+                )
+        return True
+
+    @transactional
+    def _processMessageBatch(self, node, messages):
+        """Process `messages` for `node` in a single transaction.
+
+        Messages that only add to the node's event log or store script
+        results have their events written together and their script results
+        stored together. Any other message is processed in full, after first
+        writing what has been collected so far, so events keep the order of
+        the messages and each message sees the node status the previous
+        messages left it in. When a later message sends a script result
+        again, what has been collected is stored first, so results are
+        stored in the order they were sent.
+
+        Return False if the node was deleted.
+        """
+        try:
+            node = Node.objects.get(id=node.id)
+        except Node.DoesNotExist:
+            return False
+
+        events = []
+        results = {}
+
+        def flush():
+            if events:
+                Event.objects.register_node_events(node, events)
+                del events[:]
+            for script_result, args in results.items():
+                script_result.store_result(**args)
+            results.clear()
+
+        for message in messages:
+            if self._is_batchable(message):
+                failed = message.get("result", None) in ["FAIL", "FAILURE"]
+                if message["event_type"] == "start" or failed:
+                    events.extend(
+                        get_node_event_log_events(
+                            node,
+                            message["origin"],
+                            message["name"],
+                            message["description"],
+                            message["event_type"],
+                            message.get("result", None),
+                            message["timestamp"],
+                        )
+                    )
+                message_results = self._getMessageResults(node, message)
+                if not results.keys().isdisjoint(message_results):
+                    # Store the earlier results first, then collect this
+                    # message's again so they're read after that.
+                    flush()
+                    message_results = self._getMessageResults(node, message)
+                results.update(message_results)
+            else:
+                flush()
+                self._processMessageForNode(node, message)
+        flush()
+        return True
+
+    def _is_batchable(self, message):
+        """Return True if `message` can do no more than log events and
+        store script results."""
+        activity_name = message["name"]
+        return not self._is_top_level(activity_name) and not (
+            message["origin"] == "curtin"
+            and activity_name
+            in ["cmd-install/stage-early", "cmd-install/stage-late"]
+        )
 
     @transactional
     def _processMessage(self, node, message):
@@ -301,17 +417,16 @@ class StatusWorkerService(TimerService, object):
             node = Node.objects.get(id=node.id)
         except Node.DoesNotExist:
             return False
+        self._processMessageForNode(node, message)
+        return True
 
+    def _processMessageForNode(self, node, message):
         event_type = message["event_type"]
         origin = message["origin"]
         activity_name = message["name"]
         description = message["description"]
         result = message.get("result", None)
-        # LP:1701352 - If no exit code is given by the client default to
-        # 0(pass) unless the signal is fail then set to 1(failure). This allows
-        # a Curtin failure to cause the ScriptResult to fail.
         failed = result in ["FAIL", "FAILURE"]
-        default_exit_status = 1 if failed else 0
 
         # Add this event to the node event log if 'start' or a 'failure'.
         if event_type == "start" or failed:
@@ -325,55 +440,7 @@ class StatusWorkerService(TimerService, object):
                 message["timestamp"],
             )
 
-        # Group files together with the ScriptResult they belong.
-        results = {}
-        for sent_file in message.get("files", []):
-            # Set the result type according to the node's status.
-            if node.status in (
-                NODE_STATUS.TESTING,
-                NODE_STATUS.FAILED_TESTING,
-            ):
-                script_set = node.current_testing_script_set
-            elif (
-                node.status
-                in (
-                    NODE_STATUS.COMMISSIONING,
-                    NODE_STATUS.FAILED_COMMISSIONING,
-                )
-                or node.node_type != NODE_TYPE.MACHINE
-            ):
-                script_set = node.current_commissioning_script_set
-            elif node.status in (
-                NODE_STATUS.DEPLOYING,
-                NODE_STATUS.DEPLOYED,
-                NODE_STATUS.FAILED_DEPLOYMENT,
-            ):
-                script_set = node.current_installation_script_set
-            else:
-                raise ValueError(
-                    "Invalid status for saving files: %d" % node.status
-                )
-
-            script_name = sent_file["path"]
-            encoding = sent_file.get("encoding")
-            content = sent_file.get("content")
-            compression = sent_file.get("compression")
-            # Only capture files which has sent content. This occurs when
-            # Curtin is instructed to post the error_tarfile and no error
-            # has occured(LP:1772118). Empty files are still captured as
-            # they are sent as the empty string
-            if content is not None:
-                content = self._retrieve_content(
-                    compression, encoding, content
-                )
-                process_file(
-                    results,
-                    script_set,
-                    script_name,
-                    content,
-                    sent_file,
-                    default_exit_status,
-                )
+        results = self._getMessageResults(node, message)
 
         # Commit results to the database.
         for script_result, args in results.items():
@@ -472,7 +539,66 @@ class StatusWorkerService(TimerService, object):
 
         if save_node:
             node.save()
-        return True
+
+    def _getMessageResults(self, node, message):
+        """Group the files sent in `message` with the ScriptResult they
+        belong to, returning the arguments for each `store_result`."""
+        # LP:1701352 - If no exit code is given by the client default to
+        # 0(pass) unless the signal is fail then set to 1(failure). This allows
+        # a Curtin failure to cause the ScriptResult to fail.
+        failed = message.get("result", None) in ["FAIL", "FAILURE"]
+        default_exit_status = 1 if failed else 0
+
+        # Group files together with the ScriptResult they belong.
+        results = {}
+        for sent_file in message.get("files", []):
+            # Set the result type according to the node's status.
+            if node.status in (
+                NODE_STATUS.TESTING,
+                NODE_STATUS.FAILED_TESTING,
+            ):
+                script_set = node.current_testing_script_set
+            elif (
+                node.status
+                in (
+                    NODE_STATUS.COMMISSIONING,
+                    NODE_STATUS.FAILED_COMMISSIONING,
+                )
+                or node.node_type != NODE_TYPE.MACHINE
+            ):
+                script_set = node.current_commissioning_script_set
+            elif node.status in (
+                NODE_STATUS.DEPLOYING,
+                NODE_STATUS.DEPLOYED,
+                NODE_STATUS.FAILED_DEPLOYMENT,
+            ):
+                script_set = node.current_installation_script_set
+            else:
+                raise ValueError(
+                    "Invalid status for saving files: %d" % node.status
+                )
+
+            script_name = sent_file["path"]
+            encoding = sent_file.get("encoding")
+            content = sent_file.get("content")
+            compression = sent_file.get("compression")
+            # Only capture files which has sent content. This occurs when
+            # Curtin is instructed to post the error_tarfile and no error
+            # has occured(LP:1772118). Empty files are still captured as
+            # they are sent as the empty string
+            if content is not None:
+                content = self._retrieve_content(
+                    compression, encoding, content
+                )
+                process_file(
+                    results,
+                    script_set,
+                    script_name,
+                    content,
+                    sent_file,
+                    default_exit_status,
+                )
+        return results
 
     def _retrieve_content(self, compression, encoding, content):
         """Extract the content of the sent file."""
@@ -563,8 +689,11 @@ class StatusWorkerService(TimerService, object):
             or is_curtin_early_late
             or is_status_message_event
         ):
-            d = deferToDatabase(
-                self._processMessageNow, authorization, message
+            d = deferToDatabaseWithPriority(
+                DATABASE_PRIORITY.BACKGROUND,
+                self._processMessageNow,
+                authorization,
+                message,
             )
             d.addErrback(
                 log.err, "Failed to process status message instantly."
@@ -1376,6 +1376,10 @@ class TestInstallingAPI(MAASServerTestCase):
 
 
 class TestMAASScripts(MAASServerTestCase):
+    def setUp(self):
+        super().setUp()
+        self.patch(api, "script_cache", api.ScriptCache())
+
     def extract_and_validate_file(
         self, tar, path, start_time, end_time, content, mode=0o755
     ):
@@ -2025,11 +2029,85 @@ class TestMAASScripts(MAASServerTestCase):
             % (response.status_code, response.content),
         )
 
+    def test__returns_not_modified_for_same_etag(self):
+        node = factory.make_Node(
+            status=NODE_STATUS.TESTING, with_empty_script_sets=True
+        )
+        client = make_node_client(node=node)
+        url = reverse("maas-scripts", args=["latest"])
+        response = client.get(url)
+        self.assertThat(response, HasStatusCode(http.client.OK))
+        etag = response["ETag"]
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertThat(response, HasStatusCode(http.client.NOT_MODIFIED))
+        self.assertEqual(etag, response["ETag"])
+        self.assertEqual(b"", response.content)
+
+    def test__etag_changes_when_results_change(self):
+        node = factory.make_Node(
+            status=NODE_STATUS.TESTING, with_empty_script_sets=True
+        )
+        script_result = factory.make_ScriptResult(
+            script_set=node.current_testing_script_set,
+            status=SCRIPT_STATUS.PENDING,
+        )
+        client = make_node_client(node=node)
+        url = reverse("maas-scripts", args=["latest"])
+        etag = client.get(url)["ETag"]
+        script_result.status = SCRIPT_STATUS.RUNNING
+        script_result.save()
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertThat(response, HasStatusCode(http.client.OK))
+        self.assertNotEqual(etag, response["ETag"])
+
+    def test__reuses_script_content(self):
+        node = factory.make_Node(
+            status=NODE_STATUS.TESTING, with_empty_script_sets=True
+        )
+        script_result = factory.make_ScriptResult(
+            script_set=node.current_testing_script_set,
+            status=SCRIPT_STATUS.PENDING,
+        )
+        version = script_result.script.script
+        client = make_node_client(node=node)
+        url = reverse("maas-scripts", args=["latest"])
+        client.get(url)
+        # Script versions are never changed, so the content isn't loaded
+        # from the database again.
+        VersionedTextFile.objects.filter(id=version.id).update(
+            data=factory.make_string()
+        )
+        response = client.get(url)
+        tar = tarfile.open(mode="r", fileobj=BytesIO(response.content))
+        path = os.path.join("testing", script_result.name)
+        self.assertEqual(version.data.encode(), tar.extractfile(path).read())
+
+
+class TestScriptCache(MAASServerTestCase):
+    def test_get_contents_loads_missing_versions(self):
+        version = factory.make_Script().script
+        cache = api.ScriptCache()
+        self.assertEqual(
+            {version.id: version.data.encode()},
+            cache.get_contents(iter([version.id])),
+        )
+
+    def test_get_contents_reuses_cached_versions(self):
+        version = factory.make_Script().script
+        cache = api.ScriptCache()
+        cache.get_contents([version.id])
+        VersionedTextFile.objects.filter(id=version.id).delete()
+        self.assertEqual(
+            {version.id: version.data.encode()},
+            cache.get_contents([version.id]),
+        )
+
 
 class TestCommissioningAPI(MAASServerTestCase):
     def setUp(self):
         super(TestCommissioningAPI, self).setUp()
         self.useFixture(SignalsDisabled("power"))
+        self.patch(api, "script_cache", api.ScriptCache())
 
     def test_commissioning_scripts(self):
         start_time = floor(time.time())
@@ -2097,6 +2175,40 @@ class TestCommissioningAPI(MAASServerTestCase):
             archive.extractfile(path).read().decode("utf-8"),
         )
 
+    def test_commissioning_scripts_not_modified_for_same_etag(self):
+        client = make_node_client()
+        url = reverse("commissioning-scripts", args=["latest"])
+        response = client.get(url)
+        self.assertThat(response, HasStatusCode(http.client.OK))
+        etag = response["ETag"]
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertThat(response, HasStatusCode(http.client.NOT_MODIFIED))
+        self.assertEqual(etag, response["ETag"])
+
+    def test_commissioning_scripts_archive_is_reused(self):
+        client = make_node_client()
+        url = reverse("commissioning-scripts", args=["latest"])
+        get_archive = self.patch(
+            api.CommissioningScriptsHandler, "_get_archive"
+        )
+        get_archive.return_value = b"archive"
+        self.assertEqual(b"archive", client.get(url).content)
+        self.assertEqual(b"archive", client.get(url).content)
+        self.assertThat(get_archive, MockCalledOnceWith())
+
+    def test_commissioning_scripts_archive_rebuilt_for_new_script(self):
+        client = make_node_client()
+        url = reverse("commissioning-scripts", args=["latest"])
+        etag = client.get(url)["ETag"]
+        script = factory.make_Script(script_type=SCRIPT_TYPE.COMMISSIONING)
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertThat(response, HasStatusCode(http.client.OK))
+        self.assertNotEqual(etag, response["ETag"])
+        archive = tarfile.open(fileobj=BytesIO(response.content))
+        self.assertIn(
+            os.path.join("commissioning.d", script.name), archive.getnames()
+        )
+
     def test_other_user_than_node_cannot_signal_commissioning_result(self):
         node = factory.make_Node(status=NODE_STATUS.COMMISSIONING)
         client = MAASSensibleOAuthClient(factory.make_User())
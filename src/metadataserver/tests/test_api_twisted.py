@@ -276,6 +276,72 @@ class TestStatusWorkerServiceTransactional(MAASTransactionServerTestCase):
             ),
         )
 
+    def test__init__with_batching(self):
+        worker = StatusWorkerService(
+            sentinel.dbtasks, batch_size=10, flush_interval=5
+        )
+        self.assertEqual(10, worker.batch_size)
+        self.assertEqual(5, worker.step)
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test__processMessages_batches_when_batch_size_set(self):
+        worker = StatusWorkerService(sentinel.dbtasks, batch_size=2)
+        mock_processMessage = self.patch(worker, "_processMessage")
+        mock_processMessageBatch = self.patch(worker, "_processMessageBatch")
+        mock_processMessageBatch.return_value = True
+        yield deferToDatabase(
+            worker._processMessages,
+            sentinel.node,
+            [sentinel.message1, sentinel.message2, sentinel.message3],
+        )
+        self.assertThat(
+            mock_processMessageBatch,
+            MockCallsMatch(
+                call(sentinel.node, [sentinel.message1, sentinel.message2]),
+                call(sentinel.node, [sentinel.message3]),
+            ),
+        )
+        self.assertThat(mock_processMessage, MockNotCalled())
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test__processMessages_batch_stops_when_node_deleted(self):
+        worker = StatusWorkerService(sentinel.dbtasks, batch_size=1)
+        mock_processMessageBatch = self.patch(worker, "_processMessageBatch")
+        mock_processMessageBatch.return_value = False
+        yield deferToDatabase(
+            worker._processMessages,
+            sentinel.node,
+            [sentinel.message1, sentinel.message2],
+        )
+        self.assertThat(
+            mock_processMessageBatch,
+            MockCalledOnceWith(sentinel.node, [sentinel.message1]),
+        )
+
+    @wait_for_reactor
+    @inlineCallbacks
+    def test__processMessages_batch_falls_back_to_single_on_error(self):
+        worker = StatusWorkerService(sentinel.dbtasks, batch_size=2)
+        mock_processMessage = self.patch(worker, "_processMessage")
+        mock_processMessage.return_value = True
+        mock_processMessageBatch = self.patch(worker, "_processMessageBatch")
+        mock_processMessageBatch.side_effect = factory.make_exception()
+        # The failure is logged with the node's hostname.
+        node = Mock(hostname=factory.make_name("hostname"))
+        yield deferToDatabase(
+            worker._processMessages,
+            node,
+            [sentinel.message1, sentinel.message2],
+        )
+        self.assertThat(
+            mock_processMessage,
+            MockCallsMatch(
+                call(node, sentinel.message1), call(node, sentinel.message2)
+            ),
+        )
+
     @wait_for_reactor
     @inlineCallbacks
     def test_queueMessages_processes_top_level_message_instantly(self):
@@ -381,6 +447,122 @@ class TestStatusWorkerService(MAASServerTestCase):
             CURTIN_INSTALL_LOG + " changed status from 'Pending' to 'Running'",
         )
 
+    def test_process_message_batch_logs_events_in_order(self):
+        node = factory.make_Node(status=NODE_STATUS.DEPLOYING)
+        messages = [
+            {
+                "event_type": "start",
+                "origin": "cloudinit",
+                "name": factory.make_name("name"),
+                "description": "Event %d" % i,
+                "timestamp": datetime.utcnow(),
+            }
+            for i in range(3)
+        ]
+        worker = StatusWorkerService(sentinel.dbtasks)
+        self.assertTrue(worker._processMessageBatch(node, messages))
+        self.assertEqual(
+            ["'cloudinit' Event %d" % i for i in range(3)],
+            [
+                event.description
+                for event in Event.objects.filter(node=node).order_by("id")
+            ],
+        )
+
+    def test_process_message_batch_handles_top_level_message(self):
+        node = factory.make_Node(interface=True, status=NODE_STATUS.DEPLOYING)
+        messages = [
+            {
+                "event_type": "start",
+                "origin": "cloudinit",
+                "name": factory.make_name("name"),
+                "description": "Starting",
+                "timestamp": datetime.utcnow(),
+            },
+            {
+                "event_type": "finish",
+                "result": "FAILURE",
+                "origin": "curtin",
+                "name": "cmd-install",
+                "description": "Command Install",
+                "timestamp": datetime.utcnow(),
+            },
+        ]
+        worker = StatusWorkerService(sentinel.dbtasks)
+        worker._processMessageBatch(node, messages)
+        self.assertEqual(
+            NODE_STATUS.FAILED_DEPLOYMENT, reload_object(node).status
+        )
+        self.assertEqual(
+            "'cloudinit' Starting",
+            Event.objects.filter(node=node).order_by("id").first().description,
+        )
+
+    def test_process_message_batch_stores_script_results_together(self):
+        node = factory.make_Node(
+            interface=True,
+            status=NODE_STATUS.COMMISSIONING,
+            with_empty_script_sets=True,
+        )
+        script_set = node.current_commissioning_script_set
+        script_results = [
+            factory.make_ScriptResult(
+                script_set=script_set, status=SCRIPT_STATUS.RUNNING
+            )
+            for _ in range(3)
+        ]
+        messages = [
+            {
+                "event_type": "finish",
+                "result": "SUCCESS",
+                "origin": "cloudinit",
+                "name": "modules-final/%s" % script_result.name,
+                "description": "Finished",
+                "timestamp": datetime.utcnow(),
+                "files": [
+                    {
+                        "path": script_result.name,
+                        "encoding": "base64",
+                        "content": encode_as_base64(
+                            script_result.name.encode("ascii")
+                        ),
+                    }
+                ],
+            }
+            for script_result in script_results
+        ]
+        worker = StatusWorkerService(sentinel.dbtasks)
+        mock_processMessageForNode = self.patch(
+            worker, "_processMessageForNode"
+        )
+        self.assertTrue(worker._processMessageBatch(node, messages))
+        self.assertThat(mock_processMessageForNode, MockNotCalled())
+        for script_result in script_results:
+            script_result = reload_object(script_result)
+            self.assertEqual(SCRIPT_STATUS.PASSED, script_result.status)
+            self.assertEqual(
+                script_result.name.encode("ascii"), script_result.output
+            )
+
+    def test_process_message_batch_returns_false_when_node_deleted(self):
+        node = factory.make_Node(status=NODE_STATUS.DEPLOYING)
+        node.delete()
+        worker = StatusWorkerService(sentinel.dbtasks)
+        self.assertFalse(
+            worker._processMessageBatch(
+                node,
+                [
+                    {
+                        "event_type": "start",
+                        "origin": "curtin",
+                        "name": "cmd-install",
+                        "description": "Command Install",
+                        "timestamp": datetime.utcnow(),
+                    }
+                ],
+            )
+        )
+
     def test_process_message_returns_false_when_node_deleted(self):
         node1 = factory.make_Node(status=NODE_STATUS.DEPLOYING)
         node1.delete()
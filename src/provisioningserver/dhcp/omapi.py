@@ -0,0 +1,529 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Native client for the OMAPI of the ISC DHCP server.
+
+`Omshell` forks a new `omshell` for every host map it changes, and each of
+those connects and authenticates to the DHCP server again. `OmapiClient`
+has the same interface, but keeps one authenticated connection open and
+sends the changes to many host maps together, without waiting for the
+reply to one request before sending the next.
+"""
+
+__all__ = [
+    "HostMapFailure",
+    "OmapiClient",
+    "OmapiConnectionError",
+    "OmapiError",
+]
+
+import base64
+from collections import namedtuple
+import hmac
+from itertools import count
+import random
+import socket
+import struct
+
+from netaddr import EUI, IPAddress
+
+from provisioningserver.logger import LegacyLogger
+from provisioningserver.utils import typed
+
+log = LegacyLogger()
+
+
+OMAPI_PROTOCOL_VERSION = 100
+OMAPI_HEADER_SIZE = 24
+
+OMAPI_OP_OPEN = 1
+OMAPI_OP_UPDATE = 3
+OMAPI_OP_STATUS = 5
+OMAPI_OP_DELETE = 6
+
+# Result codes used by the DHCP server; from ISC's isc/result.h.
+ISC_R_SUCCESS = 0
+ISC_R_NOPERM = 6
+ISC_R_EXISTS = 18
+ISC_R_NOTFOUND = 23
+ISC_R_FAILURE = 25
+ISC_R_IOERROR = 26
+
+HMAC_MD5_ALGORITHM = b"hmac-md5.SIG-ALG.REG.INT."
+HMAC_MD5_SIZE = 16
+
+# The number of requests sent before waiting for their replies. This is
+# kept small enough that neither side can fill its socket buffers and
+# block while the other is waiting for it.
+PIPELINE_DEPTH = 100
+
+
+class OmapiError(Exception):
+    """Raised when the DHCP server refuses an OMAPI request."""
+
+
+class OmapiConnectionError(OmapiError):
+    """Raised when the DHCP server cannot be reached over the OMAPI."""
+
+
+# A host map that could not be changed. `action` is "remove", "create" or
+# "modify", `host` is the host dict passed in and `error` an `OmapiError`.
+HostMapFailure = namedtuple("HostMapFailure", ["action", "host", "error"])
+
+
+def pack_uint32(value):
+    return struct.pack("!I", value)
+
+
+def pack_host_name(mac_address):
+    # The "name" is not a host name; it's an identifier used within the DHCP
+    # server. See `Omshell.create` for why the MAC address is used.
+    return mac_address.replace(":", "-").encode("ascii")
+
+
+def _pack_values(values):
+    packed = []
+    for name, value in values:
+        packed.append(struct.pack("!H", len(name)))
+        packed.append(name)
+        packed.append(pack_uint32(len(value)))
+        packed.append(value)
+    packed.append(struct.pack("!H", 0))
+    return b"".join(packed)
+
+
+def _read_values(recv, data):
+    values = []
+    while True:
+        chunk = recv(2)
+        data.append(chunk)
+        (name_size,) = struct.unpack("!H", chunk)
+        if name_size == 0:
+            return values
+        name = recv(name_size)
+        chunk = recv(4)
+        (value_size,) = struct.unpack("!I", chunk)
+        value = recv(value_size)
+        data.extend((name, chunk, value))
+        values.append((name, value))
+
+
+def sign(key, data):
+    return hmac.new(key, data, "md5").digest()
+
+
+class OmapiMessage:
+    """A message sent to or received from an OMAPI server.
+
+    `message` and `obj` are lists of ``(name, value)`` pairs of bytes: the
+    first describes the request, the second the object it acts on.
+    """
+
+    def __init__(self, opcode, handle=0, tid=0, rid=0, message=None, obj=None):
+        self.opcode = opcode
+        self.handle = handle
+        self.tid = tid
+        self.rid = rid
+        self.message = list(message or [])
+        self.obj = list(obj or [])
+        self.authid = 0
+        self.signature = b""
+        self.signed_data = b""
+
+    def __repr__(self):
+        return "<OmapiMessage opcode=%d handle=%d tid=%d rid=%d>" % (
+            self.opcode,
+            self.handle,
+            self.tid,
+            self.rid,
+        )
+
+    def pack(self, authid=0, key=None):
+        """Return the message as sent over the wire, signed with `key`."""
+        data = b"".join(
+            [
+                struct.pack(
+                    "!5I",
+                    0 if key is None else HMAC_MD5_SIZE,
+                    self.opcode,
+                    self.handle,
+                    self.tid,
+                    self.rid,
+                ),
+                _pack_values(self.message),
+                _pack_values(self.obj),
+            ]
+        )
+        signature = b"" if key is None else sign(key, data)
+        return pack_uint32(authid) + data + signature
+
+    @classmethod
+    def read(cls, recv):
+        """Read a message using `recv`, which returns exactly n bytes."""
+        header = recv(OMAPI_HEADER_SIZE)
+        authid, authlen, opcode, handle, tid, rid = struct.unpack(
+            "!6I", header
+        )
+        data = [header[4:]]
+        message = _read_values(recv, data)
+        obj = _read_values(recv, data)
+        msg = cls(opcode, handle, tid, rid, message, obj)
+        msg.authid = authid
+        msg.signature = recv(authlen)
+        msg.signed_data = b"".join(data)
+        return msg
+
+    def verify(self, key):
+        """Check that the message was signed with `key`."""
+        return hmac.compare_digest(self.signature, sign(key, self.signed_data))
+
+    def get(self, name, default=None):
+        """Return the value of `name` in the message or the object."""
+        for values in (self.message, self.obj):
+            for value_name, value in values:
+                if value_name == name:
+                    return value
+        return default
+
+    @property
+    def result(self):
+        """The result code of a status message, or `None`."""
+        result = self.get(b"result")
+        return None if result is None else struct.unpack("!I", result)[0]
+
+    def error(self):
+        """Return an `OmapiError` describing why a request failed."""
+        if self.opcode != OMAPI_OP_STATUS:
+            return OmapiError("Unexpected OMAPI reply: %r" % self)
+        message = self.get(b"message")
+        if message:
+            return OmapiError(message.decode("utf-8", "replace"))
+        return OmapiError("OMAPI request failed with result %s" % self.result)
+
+
+def make_open(type_name, obj, create=False):
+    message = [(b"type", type_name)]
+    if create:
+        message.append((b"create", pack_uint32(1)))
+        message.append((b"exclusive", pack_uint32(1)))
+    return OmapiMessage(OMAPI_OP_OPEN, message=message, obj=obj)
+
+
+class OmapiClient:
+    """Change objects inside the DHCP server over the OMAPI.
+
+    The connection is made when first needed and kept open until `close` is
+    called; the client can also be used as a context manager.
+
+    :param server_address: The address for the DHCP server (ip or hostname)
+    :param shared_key: The base64 encoded HMAC-MD5 key that the DHCP server
+        knows as ``omapi_key``. See `Omshell`.
+    """
+
+    def __init__(
+        self,
+        server_address,
+        shared_key,
+        ipv6=False,
+        server_port=None,
+        key_name="omapi_key",
+        timeout=30,
+    ):
+        self.server_address = server_address
+        self.shared_key = shared_key
+        self.ipv6 = ipv6
+        if server_port is not None:
+            self.server_port = server_port
+        elif ipv6 is True:
+            self.server_port = 7912
+        else:
+            self.server_port = 7911
+        self.key_name = key_name
+        self.timeout = timeout
+        self._socket = None
+        self._buffer = bytearray()
+        self._authid = 0
+        self._key = None
+        self._tids = count(random.randint(1, 2 ** 30))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def connect(self, authenticate=True):
+        """Connect to the DHCP server, and authenticate if `authenticate`."""
+        self.close()
+        try:
+            self._socket = socket.create_connection(
+                (self.server_address, self.server_port), self.timeout
+            )
+            self._socket.sendall(
+                struct.pack("!II", OMAPI_PROTOCOL_VERSION, OMAPI_HEADER_SIZE)
+            )
+            version, header_size = struct.unpack("!II", self._recv(8))
+        except OSError as error:
+            self.close()
+            raise OmapiConnectionError(
+                "Could not connect to the DHCP server: %s" % error
+            ) from error
+        if (version, header_size) != (
+            OMAPI_PROTOCOL_VERSION,
+            OMAPI_HEADER_SIZE,
+        ):
+            self.close()
+            raise OmapiError(
+                "Unsupported OMAPI protocol version %d." % version
+            )
+        if authenticate:
+            self._authenticate()
+
+    def close(self):
+        """Close the connection to the DHCP server, if open."""
+        if self._socket is not None:
+            self._socket.close()
+        self._socket = None
+        self._buffer = bytearray()
+        self._authid = 0
+        self._key = None
+
+    def _authenticate(self):
+        (reply,) = self._request(
+            [
+                make_open(
+                    b"authenticator",
+                    [
+                        (b"name", self.key_name.encode("ascii")),
+                        (b"algorithm", HMAC_MD5_ALGORITHM),
+                    ],
+                )
+            ]
+        )
+        if reply.opcode != OMAPI_OP_UPDATE or reply.handle == 0:
+            error = reply.error()
+            self.close()
+            raise OmapiError("Could not authenticate: %s" % error)
+        self._authid = reply.handle
+        self._key = base64.b64decode(self.shared_key)
+
+    def _recv(self, size):
+        while len(self._buffer) < size:
+            try:
+                chunk = self._socket.recv(max(size, 65536))
+            except OSError as error:
+                raise OmapiConnectionError(
+                    "Lost connection to the DHCP server: %s" % error
+                ) from error
+            if len(chunk) == 0:
+                raise OmapiConnectionError(
+                    "The DHCP server closed the connection."
+                )
+            self._buffer.extend(chunk)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    def _request(self, messages):
+        """Send `messages` and return their replies, in the same order.
+
+        At most `PIPELINE_DEPTH` requests are in flight at once.
+        """
+        if len(messages) == 0:
+            return []
+        elif self._socket is None:
+            self.connect()
+        replies = []
+        for start in range(0, len(messages), PIPELINE_DEPTH):
+            batch = messages[start : start + PIPELINE_DEPTH]
+            for msg in batch:
+                msg.tid = next(self._tids)
+            try:
+                self._socket.sendall(
+                    b"".join(
+                        msg.pack(self._authid, self._key) for msg in batch
+                    )
+                )
+            except OSError as error:
+                self.close()
+                raise OmapiConnectionError(
+                    "Lost connection to the DHCP server: %s" % error
+                ) from error
+            received = {}
+            try:
+                while len(received) < len(batch):
+                    reply = OmapiMessage.read(self._recv)
+                    if self._key is not None and not reply.verify(self._key):
+                        raise OmapiError("Bad signature on OMAPI reply.")
+                    received[reply.rid] = reply
+                replies.extend(received[msg.tid] for msg in batch)
+            except (OmapiError, KeyError):
+                # The replies can no longer be matched to the requests.
+                self.close()
+                raise
+        return replies
+
+    def try_connection(self):
+        """Return whether the DHCP server accepts OMAPI connections."""
+        try:
+            self.connect(authenticate=False)
+        except OmapiError:
+            return False
+        else:
+            return True
+        finally:
+            self.close()
+
+    def update_hosts(self, remove=(), add=(), modify=()):
+        """Change many host maps together.
+
+        Host maps are removed first, then created, then modified, in the
+        order given. Every host map is attempted even when others fail.
+
+        :param remove: Host dicts, with a "mac", to remove.
+        :param add: Host dicts, with a "mac" and an "ip", to create.
+        :param modify: Host dicts, with a "mac" and an "ip", to modify.
+        :return: A list of `HostMapFailure` for the host maps that could
+            not be changed.
+        :raise OmapiError: If the DHCP server cannot be reached, or the
+            connection cannot be authenticated.
+        """
+        failures = []
+        failures.extend(self._remove_hosts(list(remove)))
+        failures.extend(self._create_hosts(list(add)))
+        failures.extend(self._modify_hosts(list(modify)))
+        return failures
+
+    def _open_hosts(self, hosts):
+        return self._request(
+            [
+                make_open(b"host", [(b"name", pack_host_name(host["mac"]))])
+                for host in hosts
+            ]
+        )
+
+    def _remove_hosts(self, hosts):
+        opened = []
+        for host, reply in zip(hosts, self._open_hosts(hosts)):
+            if reply.opcode == OMAPI_OP_UPDATE:
+                opened.append((host, reply.handle))
+            elif reply.result != ISC_R_NOTFOUND:
+                yield HostMapFailure("remove", host, reply.error())
+            # Otherwise it was already removed. Consider success.
+        replies = self._request(
+            [
+                OmapiMessage(OMAPI_OP_DELETE, handle=handle)
+                for _, handle in opened
+            ]
+        )
+        for (host, _), reply in zip(opened, replies):
+            if (
+                reply.opcode != OMAPI_OP_STATUS
+                or reply.result != ISC_R_SUCCESS
+            ):
+                yield HostMapFailure("remove", host, reply.error())
+
+    def _pack_host(self, host):
+        return [
+            (b"ip-address", IPAddress(host["ip"]).packed),
+            (b"hardware-address", EUI(host["mac"]).packed),
+            (b"hardware-type", pack_uint32(1)),
+        ]
+
+    def _create_hosts(self, hosts):
+        replies = self._request(
+            [
+                make_open(
+                    b"host",
+                    [(b"name", pack_host_name(host["mac"]))]
+                    + self._pack_host(host),
+                    create=True,
+                )
+                for host in hosts
+            ]
+        )
+        for host, reply in zip(hosts, replies):
+            if reply.opcode == OMAPI_OP_UPDATE:
+                continue
+            elif reply.result in (ISC_R_EXISTS, ISC_R_IOERROR):
+                # Host map already existed. Treat as success, as `omshell`
+                # reports this as an I/O error.
+                continue
+            else:
+                yield HostMapFailure("create", host, reply.error())
+
+    def _modify_hosts(self, hosts):
+        opened = []
+        for host, reply in zip(hosts, self._open_hosts(hosts)):
+            if reply.opcode == OMAPI_OP_UPDATE:
+                opened.append((host, reply.handle))
+            else:
+                yield HostMapFailure("modify", host, reply.error())
+        replies = self._request(
+            [
+                OmapiMessage(
+                    OMAPI_OP_UPDATE, handle=handle, obj=self._pack_host(host)
+                )
+                for host, handle in opened
+            ]
+        )
+        for (host, _), reply in zip(opened, replies):
+            if reply.opcode != OMAPI_OP_UPDATE:
+                yield HostMapFailure("modify", host, reply.error())
+
+    def _update_host(self, action, host):
+        failures = self.update_hosts(**{action: [host]})
+        if len(failures) > 0:
+            raise failures[0].error
+
+    @typed
+    def create(self, ip_address: str, mac_address: str):
+        log.debug(
+            "Creating host mapping {mac}->{ip}", mac=mac_address, ip=ip_address
+        )
+        self._update_host("add", {"ip": ip_address, "mac": mac_address})
+
+    @typed
+    def modify(self, ip_address: str, mac_address: str):
+        log.debug(
+            "Modifying host mapping {mac}->{ip}",
+            mac=mac_address,
+            ip=ip_address,
+        )
+        self._update_host("modify", {"ip": ip_address, "mac": mac_address})
+
+    @typed
+    def remove(self, mac_address: str):
+        log.debug("Removing host mapping key={mac}", mac=mac_address)
+        self._update_host("remove", {"mac": mac_address})
+
+    @typed
+    def nullify_lease(self, ip_address: str):
+        """Reset an existing lease so it's no longer valid.
+
+        Leases can't be deleted, so the expiry timestamp is set to the epoch
+        instead.
+        """
+        (reply,) = self._request(
+            [
+                make_open(
+                    b"lease", [(b"ip-address", IPAddress(ip_address).packed)]
+                )
+            ]
+        )
+        if reply.result == ISC_R_NOTFOUND:
+            # Consider nonexistent leases a success.
+            return None
+        elif reply.opcode != OMAPI_OP_UPDATE:
+            raise reply.error()
+        (reply,) = self._request(
+            [
+                OmapiMessage(
+                    OMAPI_OP_UPDATE,
+                    handle=reply.handle,
+                    obj=[(b"ends", pack_uint32(0))],
+                )
+            ]
+        )
+        if reply.opcode != OMAPI_OP_UPDATE:
+            raise reply.error()
@@ -0,0 +1,177 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""A fake OMAPI server to test `OmapiClient` against."""
+
+__all__ = ["FakeOmapiServer"]
+
+import base64
+from itertools import count
+import os
+import socketserver
+import threading
+
+from fixtures import Fixture
+
+from provisioningserver.dhcp.omapi import (
+    HMAC_MD5_ALGORITHM,
+    ISC_R_EXISTS,
+    ISC_R_FAILURE,
+    ISC_R_NOPERM,
+    ISC_R_NOTFOUND,
+    ISC_R_SUCCESS,
+    OMAPI_HEADER_SIZE,
+    OMAPI_OP_DELETE,
+    OMAPI_OP_OPEN,
+    OMAPI_OP_STATUS,
+    OMAPI_OP_UPDATE,
+    OMAPI_PROTOCOL_VERSION,
+    OmapiMessage,
+    pack_uint32,
+)
+
+AUTHID = 1
+
+
+class _OmapiHandler(socketserver.StreamRequestHandler):
+    def recv(self, size):
+        data = self.rfile.read(size)
+        if len(data) != size:
+            raise EOFError()
+        return data
+
+    def handle(self):
+        fake = self.server.fake
+        with fake.lock:
+            fake.connections += 1
+        try:
+            self.recv(8)
+            self.wfile.write(
+                pack_uint32(OMAPI_PROTOCOL_VERSION)
+                + pack_uint32(OMAPI_HEADER_SIZE)
+            )
+            authenticated = False
+            while True:
+                request = OmapiMessage.read(self.recv)
+                if request.authid == AUTHID:
+                    authenticated = request.verify(fake.key)
+                with fake.lock:
+                    fake.requests.append(request)
+                    reply = fake.reply(request, authenticated)
+                reply.rid = request.tid
+                if request.authid == AUTHID:
+                    data = reply.pack(AUTHID, fake.key)
+                else:
+                    data = reply.pack()
+                self.wfile.write(data)
+        except EOFError:
+            pass
+
+
+class FakeOmapiServer(Fixture):
+    """An OMAPI server that keeps host maps and leases in memory.
+
+    It listens on an unused port on 127.0.0.1. It only knows about host
+    and lease objects, and only the operations that `OmapiClient` uses.
+
+    :ivar hosts: Host objects by name, each a dict of their values.
+    :ivar leases: Lease objects by their packed IP address.
+    :ivar refuse: Host names to refuse any operation for.
+    :ivar connections: The number of connections made to the server.
+    :ivar requests: Every request received.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.key = os.urandom(64)
+        self.shared_key = base64.b64encode(self.key).decode("ascii")
+        self.hosts = {}
+        self.leases = {}
+        self.refuse = set()
+        self.connections = 0
+        self.requests = []
+        self.lock = threading.Lock()
+        self._handles = {}
+        self._next_handle = count(AUTHID + 1)
+        self._tids = count(1)
+
+    def _setUp(self):
+        self.server = socketserver.ThreadingTCPServer(
+            ("127.0.0.1", 0), _OmapiHandler
+        )
+        self.server.daemon_threads = True
+        self.server.fake = self
+        self.port = self.server.server_address[1]
+        thread = threading.Thread(
+            target=self.server.serve_forever, kwargs={"poll_interval": 0.01}
+        )
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def _status(self, result, message=""):
+        return OmapiMessage(
+            OMAPI_OP_STATUS,
+            tid=next(self._tids),
+            message=[
+                (b"result", pack_uint32(result)),
+                (b"message", message.encode("ascii")),
+            ],
+        )
+
+    def _update(self, handle, values):
+        return OmapiMessage(
+            OMAPI_OP_UPDATE,
+            handle=handle,
+            tid=next(self._tids),
+            obj=sorted(values.items()),
+        )
+
+    def _open_handle(self, objects, key):
+        handle = next(self._next_handle)
+        self._handles[handle] = (objects, key)
+        return self._update(handle, objects[key])
+
+    def reply(self, request, authenticated):
+        type_name = request.get(b"type")
+        if request.opcode == OMAPI_OP_OPEN and type_name == b"authenticator":
+            if request.get(b"name") != b"omapi_key" or (
+                request.get(b"algorithm") != HMAC_MD5_ALGORITHM
+            ):
+                return self._status(ISC_R_NOTFOUND, "no key")
+            return OmapiMessage(
+                OMAPI_OP_UPDATE, handle=AUTHID, tid=next(self._tids)
+            )
+        elif not authenticated:
+            return self._status(ISC_R_NOPERM, "permission denied")
+        elif request.opcode == OMAPI_OP_OPEN and type_name == b"host":
+            name = request.get(b"name")
+            if name in self.refuse:
+                return self._status(ISC_R_FAILURE, "failure")
+            elif request.get(b"create") is not None:
+                if name in self.hosts:
+                    return self._status(ISC_R_EXISTS, "already exists")
+                self.hosts[name] = dict(request.obj)
+            elif name not in self.hosts:
+                return self._status(ISC_R_NOTFOUND, "not found")
+            return self._open_handle(self.hosts, name)
+        elif request.opcode == OMAPI_OP_OPEN and type_name == b"lease":
+            ip_address = request.get(b"ip-address")
+            if ip_address not in self.leases:
+                return self._status(ISC_R_NOTFOUND, "not found")
+            return self._open_handle(self.leases, ip_address)
+        elif request.opcode in (OMAPI_OP_UPDATE, OMAPI_OP_DELETE):
+            if request.handle not in self._handles:
+                return self._status(ISC_R_NOTFOUND, "not found")
+            objects, key = self._handles[request.handle]
+            if key not in objects:
+                return self._status(ISC_R_NOTFOUND, "not found")
+            elif request.opcode == OMAPI_OP_DELETE:
+                del objects[key]
+                return self._status(ISC_R_SUCCESS)
+            else:
+                objects[key].update(request.obj)
+                return self._update(request.handle, objects[key])
+        else:
+            return self._status(ISC_R_FAILURE, "not implemented")
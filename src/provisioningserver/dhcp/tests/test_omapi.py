@@ -0,0 +1,231 @@
+# Copyright 2020 Canonical Ltd.  This software is licensed under the
+# GNU Affero General Public License version 3 (see the file LICENSE).
+
+"""Tests for the native OMAPI client."""
+
+__all__ = []
+
+import base64
+import os
+import socket
+
+from netaddr import EUI, IPAddress
+from testtools.matchers import MatchesStructure
+
+from maastesting.factory import factory
+from maastesting.testcase import MAASTestCase
+from provisioningserver.dhcp import omapi
+from provisioningserver.dhcp.omapi import (
+    HostMapFailure,
+    OMAPI_OP_OPEN,
+    OmapiClient,
+    OmapiConnectionError,
+    OmapiError,
+    OmapiMessage,
+    pack_host_name,
+    pack_uint32,
+)
+from provisioningserver.dhcp.testing.omapi import FakeOmapiServer
+
+
+def make_host():
+    return {
+        "mac": factory.make_mac_address(),
+        "ip": factory.make_ipv4_address(),
+    }
+
+
+class TestOmapiMessage(MAASTestCase):
+    def test_pack_and_read_round_trip(self):
+        key = os.urandom(16)
+        msg = OmapiMessage(
+            OMAPI_OP_OPEN,
+            handle=1,
+            tid=2,
+            rid=3,
+            message=[(b"type", b"host")],
+            obj=[(b"name", b"foo"), (b"hardware-type", pack_uint32(1))],
+        )
+        data = bytearray(msg.pack(authid=4, key=key))
+
+        def recv(size):
+            chunk = bytes(data[:size])
+            del data[:size]
+            return chunk
+
+        read = OmapiMessage.read(recv)
+        self.assertEqual(b"", data)
+        self.assertThat(
+            read,
+            MatchesStructure.byEquality(
+                authid=4,
+                opcode=OMAPI_OP_OPEN,
+                handle=1,
+                tid=2,
+                rid=3,
+                message=msg.message,
+                obj=msg.obj,
+            ),
+        )
+        self.assertTrue(read.verify(key))
+        self.assertFalse(read.verify(os.urandom(16)))
+
+
+class TestOmapiClient(MAASTestCase):
+    def setUp(self):
+        super().setUp()
+        self.server = self.useFixture(FakeOmapiServer())
+
+    def make_client(self, **kwargs):
+        client = OmapiClient(
+            "127.0.0.1",
+            kwargs.pop("shared_key", self.server.shared_key),
+            server_port=self.server.port,
+            **kwargs
+        )
+        self.addCleanup(client.close)
+        return client
+
+    def assertHost(self, host):
+        values = self.server.hosts[pack_host_name(host["mac"])]
+        self.assertEqual(IPAddress(host["ip"]).packed, values[b"ip-address"])
+        self.assertEqual(EUI(host["mac"]).packed, values[b"hardware-address"])
+
+    def test_default_ports(self):
+        self.assertEqual(7911, OmapiClient("127.0.0.1", "").server_port)
+        self.assertEqual(
+            7912, OmapiClient("127.0.0.1", "", ipv6=True).server_port
+        )
+
+    def test_try_connection(self):
+        self.assertTrue(self.make_client().try_connection())
+
+    def test_try_connection_returns_false_when_not_listening(self):
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        client = OmapiClient("127.0.0.1", "", server_port=port)
+        self.assertFalse(client.try_connection())
+
+    def test_raises_connection_error_when_not_listening(self):
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        client = OmapiClient(
+            "127.0.0.1", self.server.shared_key, server_port=port
+        )
+        self.assertRaises(
+            OmapiConnectionError,
+            client.create,
+            "10.0.0.1",
+            "00:11:22:33:44:55",
+        )
+
+    def test_wrong_key_is_refused(self):
+        shared_key = base64.b64encode(os.urandom(64)).decode("ascii")
+        client = self.make_client(shared_key=shared_key)
+        host = make_host()
+        self.assertRaises(OmapiError, client.create, host["ip"], host["mac"])
+        self.assertEqual({}, self.server.hosts)
+
+    def test_update_hosts_raises_error_when_key_is_wrong(self):
+        shared_key = base64.b64encode(os.urandom(64)).decode("ascii")
+        client = self.make_client(shared_key=shared_key)
+        self.assertRaises(
+            OmapiError, client.update_hosts, add=[make_host(), make_host()]
+        )
+        self.assertEqual({}, self.server.hosts)
+
+    def test_create(self):
+        host = make_host()
+        self.make_client().create(host["ip"], host["mac"])
+        self.assertHost(host)
+
+    def test_create_existing_host_succeeds(self):
+        host = make_host()
+        client = self.make_client()
+        client.create(host["ip"], host["mac"])
+        client.create(host["ip"], host["mac"])
+        self.assertHost(host)
+
+    def test_create_raises_error_when_refused(self):
+        host = make_host()
+        self.server.refuse.add(pack_host_name(host["mac"]))
+        self.assertRaises(
+            OmapiError, self.make_client().create, host["ip"], host["mac"]
+        )
+
+    def test_modify(self):
+        host = make_host()
+        client = self.make_client()
+        client.create(host["ip"], host["mac"])
+        host["ip"] = factory.make_ipv4_address()
+        client.modify(host["ip"], host["mac"])
+        self.assertHost(host)
+
+    def test_modify_raises_error_for_missing_host(self):
+        host = make_host()
+        self.assertRaises(
+            OmapiError, self.make_client().modify, host["ip"], host["mac"]
+        )
+
+    def test_remove(self):
+        host = make_host()
+        client = self.make_client()
+        client.create(host["ip"], host["mac"])
+        client.remove(host["mac"])
+        self.assertEqual({}, self.server.hosts)
+
+    def test_remove_missing_host_succeeds(self):
+        self.make_client().remove(factory.make_mac_address())
+
+    def test_nullify_lease(self):
+        ip = factory.make_ipv4_address()
+        ip_packed = IPAddress(ip).packed
+        self.server.leases[ip_packed] = {b"ends": pack_uint32(1000)}
+        self.make_client().nullify_lease(ip)
+        self.assertEqual(
+            pack_uint32(0), self.server.leases[ip_packed][b"ends"]
+        )
+
+    def test_nullify_missing_lease_succeeds(self):
+        self.make_client().nullify_lease(factory.make_ipv4_address())
+
+    def test_update_hosts_uses_one_connection(self):
+        self.patch(omapi, "PIPELINE_DEPTH", 7)
+        client = self.make_client()
+        existing = [make_host() for _ in range(20)]
+        client.update_hosts(add=existing)
+        remove, modify = existing[:10], existing[10:]
+        for host in modify:
+            host["ip"] = factory.make_ipv4_address()
+        add = [make_host() for _ in range(30)]
+        self.assertEqual(
+            [], client.update_hosts(remove=remove, add=add, modify=modify)
+        )
+        for host in add + modify:
+            self.assertHost(host)
+        self.assertEqual(40, len(self.server.hosts))
+        self.assertEqual(1, self.server.connections)
+
+    def test_update_hosts_reports_each_failure(self):
+        client = self.make_client()
+        remove = make_host()
+        client.create(remove["ip"], remove["mac"])
+        add = [make_host() for _ in range(3)]
+        modify = make_host()
+        self.server.refuse.add(pack_host_name(remove["mac"]))
+        self.server.refuse.add(pack_host_name(add[1]["mac"]))
+        failures = client.update_hosts(
+            remove=[remove], add=add, modify=[modify]
+        )
+        self.assertEqual(
+            [("remove", remove), ("create", add[1]), ("modify", modify)],
+            [(failure.action, failure.host) for failure in failures],
+        )
+        self.assertIsInstance(failures[0], HostMapFailure)
+        self.assertIsInstance(failures[0].error, OmapiError)
+        self.assertHost(add[0])
+        self.assertHost(add[2])
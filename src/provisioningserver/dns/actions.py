@@ -80,11 +80,12 @@ def bind_reload_with_retries(attempts=10, interval=2, timeout=2):
             sleep(interval)
 
 
-def bind_reload_zones(zone_list):
+def bind_reload_zones(zone_list, timeout=None):
     """Ask BIND to reload the zone file for the given zone.
 
     :param zone_list: A list of zone names to reload, or a single name as a
         string.
+    :param timeout: The time in seconds to wait for each reload.
     :return: True if success, False otherwise.
     """
     ret = True
@@ -92,12 +93,19 @@ def bind_reload_zones(zone_list):
         zone_list = [zone_list]
     for name in zone_list:
         try:
-            execute_rndc_command(("reload", name))
+            execute_rndc_command(("reload", name), timeout=timeout)
         except CalledProcessError as exc:
             maaslog.error(
                 "Reloading BIND zone %r failed (is it running?): %s", name, exc
             )
             ret = False
+        except TimeoutExpired as exc:
+            maaslog.error(
+                "Reloading BIND zone %r timed out (is it locked?): %s",
+                name,
+                exc,
+            )
+            ret = False
     return ret
 
 
@@ -136,11 +144,13 @@ def bind_write_options(upstream_dns, dnssec_validation):
     )
 
 
-def bind_write_zones(zones):
+def bind_write_zones(zones, zone_names=None):
     """Write out DNS zones.
 
     :param zones: Those zones to write.
     :type zones: Sequence of :py:class:`DomainData`.
+    :param zone_names: Only write the zones with these names. All zones are
+        written if this is `None`.
     """
     for zone in zones:
-        zone.write_config()
+        zone.write_config(zone_names=zone_names)
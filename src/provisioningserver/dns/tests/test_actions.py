@@ -9,13 +9,19 @@ import os
 from os.path import join
 import random
 from random import randint
-from subprocess import CalledProcessError
+from subprocess import CalledProcessError, TimeoutExpired
 from textwrap import dedent
 from unittest.mock import call, sentinel
 
 from fixtures import FakeLogger
 from netaddr import IPNetwork
-from testtools.matchers import AllMatch, Contains, FileContains, FileExists
+from testtools.matchers import (
+    AllMatch,
+    Contains,
+    FileContains,
+    FileExists,
+    Not,
+)
 
 from maastesting.factory import factory
 from maastesting.matchers import MockCalledOnceWith, MockCallsMatch
@@ -133,7 +139,17 @@ class TestReloadZone(MAASTestCase):
         self.assertTrue(actions.bind_reload_zones(sentinel.zone))
         self.assertThat(
             actions.execute_rndc_command,
-            MockCalledOnceWith(("reload", sentinel.zone)),
+            MockCalledOnceWith(("reload", sentinel.zone), timeout=None),
+        )
+
+    def test__passes_timeout(self):
+        self.patch_autospec(actions, "execute_rndc_command")
+        actions.bind_reload_zones([sentinel.zone], timeout=sentinel.timeout)
+        self.assertThat(
+            actions.execute_rndc_command,
+            MockCalledOnceWith(
+                ("reload", sentinel.zone), timeout=sentinel.timeout
+            ),
         )
 
     def test__logs_subprocess_error(self):
@@ -152,6 +168,16 @@ class TestReloadZone(MAASTestCase):
         erc.side_effect = factory.make_CalledProcessError()
         self.assertFalse(actions.bind_reload_zones(sentinel.zone))
 
+    def test__false_on_timeout(self):
+        erc = self.patch_autospec(actions, "execute_rndc_command")
+        erc.side_effect = TimeoutExpired("rndc", 1)
+        with FakeLogger("maas") as logger:
+            self.assertFalse(actions.bind_reload_zones(sentinel.zone))
+        self.assertDocTestMatches(
+            "Reloading BIND zone ... timed out (is it locked?): ...",
+            logger.output,
+        )
+
 
 class TestConfiguration(MAASTestCase):
     """Tests for the `bind_write_*` functions."""
@@ -235,6 +261,26 @@ class TestConfiguration(MAASTestCase):
         ]
         self.assertThat(expected_files, AllMatch(FileExists()))
 
+    def test_bind_write_zones_writes_only_named_zones(self):
+        domain = factory.make_string()
+        network = IPNetwork("192.168.0.3/24")
+        forward_zone = DNSForwardZoneConfig(
+            domain, serial=random.randint(1, 100)
+        )
+        reverse_zone = DNSReverseZoneConfig(
+            domain, serial=random.randint(1, 100), network=network
+        )
+        actions.bind_write_zones(
+            zones=[forward_zone, reverse_zone], zone_names=[domain]
+        )
+        self.assertThat(
+            join(self.dns_conf_dir, "zone.%s" % domain), FileExists()
+        )
+        self.assertThat(
+            join(self.dns_conf_dir, "zone.0.168.192.in-addr.arpa"),
+            Not(FileExists()),
+        )
+
     def test_bind_write_options_sets_up_config(self):
         # bind_write_configuration_and_zones writes the config file, writes
         # the zone files, and reloads the dns service.
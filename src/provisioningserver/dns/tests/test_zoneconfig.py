@@ -28,6 +28,7 @@ from provisioningserver.dns.testing import patch_dns_config_path
 from provisioningserver.dns.zoneconfig import (
     DNSForwardZoneConfig,
     DNSReverseZoneConfig,
+    DomainConfigBase,
     DomainInfo,
 )
 
@@ -73,6 +74,15 @@ class HostnameRRsetMapping:
         return self.__dict__ == other.__dict__
 
 
+class TestDomainConfigBase(MAASTestCase):
+    """Tests for DomainConfigBase."""
+
+    def test_requires_get_zone_parameters(self):
+        self.assertRaises(
+            TypeError, DomainConfigBase, factory.make_string(), zone_info=[]
+        )
+
+
 class TestDNSForwardZoneConfig(MAASTestCase):
     """Tests for DNSForwardZoneConfig."""
 
@@ -323,6 +333,54 @@ class TestDNSForwardZoneConfig(MAASTestCase):
         filepath = FilePath(dns_zone_config.zone_info[0].target_path)
         self.assertTrue(filepath.getPermissions().other.read)
 
+    def test_write_config_skips_zones_not_named(self):
+        patch_dns_config_path(self)
+        dns_zone_config = DNSForwardZoneConfig(
+            factory.make_string(), serial=random.randint(1, 100)
+        )
+        dns_zone_config.write_config(zone_names=[factory.make_name("zone")])
+        self.assertFalse(
+            os.path.exists(dns_zone_config.zone_info[0].target_path)
+        )
+
+    def test_get_zone_fingerprints_ignores_serial_and_record_order(self):
+        domain = factory.make_string()
+        network = factory.make_ipv4_network()
+        ips = [factory.pick_ip_in_network(network) for _ in range(3)]
+        mapping = {
+            factory.make_name("host"): HostnameIPMapping(None, 30, {ip})
+            for ip in ips
+        }
+        reordered = dict(reversed(list(mapping.items())))
+        fingerprints = DNSForwardZoneConfig(
+            domain, serial=random.randint(1, 100), mapping=mapping
+        ).get_zone_fingerprints()
+        self.assertEqual([domain], list(fingerprints))
+        self.assertEqual(
+            fingerprints,
+            DNSForwardZoneConfig(
+                domain, serial=random.randint(101, 200), mapping=reordered
+            ).get_zone_fingerprints(),
+        )
+
+    def test_get_zone_fingerprints_changes_with_records(self):
+        domain = factory.make_string()
+        network = factory.make_ipv4_network()
+        hostname = factory.make_name("host")
+        fingerprints = [
+            DNSForwardZoneConfig(
+                domain,
+                serial=1,
+                mapping={
+                    hostname: HostnameIPMapping(
+                        None, 30, {factory.pick_ip_in_network(network)}
+                    )
+                },
+            ).get_zone_fingerprints()
+            for _ in range(2)
+        ]
+        self.assertNotEqual(fingerprints[0], fingerprints[1])
+
 
 class TestDNSReverseZoneConfig(MAASTestCase):
     """Tests for DNSReverseZoneConfig."""
@@ -667,6 +725,39 @@ class TestDNSReverseZoneConfig(MAASTestCase):
             filepath = FilePath(tgt)
             self.assertTrue(filepath.getPermissions().other.read)
 
+    def test_get_zone_fingerprints_has_entry_per_zone(self):
+        dns_zone_config = DNSReverseZoneConfig(
+            factory.make_string(),
+            serial=random.randint(1, 100),
+            network=IPNetwork("10.0.0.0/22"),
+        )
+        self.assertItemsEqual(
+            [zi.zone_name for zi in dns_zone_config.zone_info],
+            list(dns_zone_config.get_zone_fingerprints()),
+        )
+
+    def test_get_zone_fingerprints_only_changes_for_affected_zone(self):
+        domain = factory.make_string()
+        network = IPNetwork("10.0.0.0/23")
+        hostname = factory.make_name("host")
+
+        def get_fingerprints(ip):
+            return DNSReverseZoneConfig(
+                domain,
+                serial=1,
+                network=network,
+                mapping={hostname: HostnameIPMapping(None, 30, {ip})},
+            ).get_zone_fingerprints()
+
+        before = get_fingerprints("10.0.0.1")
+        after = get_fingerprints("10.0.0.2")
+        self.assertNotEqual(
+            before["0.0.10.in-addr.arpa"], after["0.0.10.in-addr.arpa"]
+        )
+        self.assertEqual(
+            before["1.0.10.in-addr.arpa"], after["1.0.10.in-addr.arpa"]
+        )
+
 
 class TestDNSReverseZoneConfig_GetGenerateDirectives(MAASTestCase):
     """Tests for `DNSReverseZoneConfig.get_GENERATE_directives()`."""
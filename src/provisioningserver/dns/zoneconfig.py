@@ -5,7 +5,9 @@
 
 __all__ = ["DNSForwardZoneConfig", "DNSReverseZoneConfig", "DomainInfo"]
 
+from abc import ABCMeta, abstractmethod
 from datetime import datetime
+from hashlib import sha256
 from itertools import chain
 
 from netaddr import IPAddress, IPNetwork, spanning_cidr
@@ -103,6 +105,22 @@ def get_details_for_ip_range(ip_range):
     return intersecting_subnets, prefix, rdns_suffix
 
 
+def _canonicalise(parameters):
+    """Return `parameters` with every list of records sorted.
+
+    Records are produced in whatever order the database returns them, so
+    this makes equal zones compare equal.
+    """
+    if isinstance(parameters, dict):
+        return sorted(
+            (key, _canonicalise(value)) for key, value in parameters.items()
+        )
+    elif isinstance(parameters, (list, tuple, set)):
+        return sorted(repr(item) for item in parameters)
+    else:
+        return parameters
+
+
 class DomainInfo:
     """Information about a DNS zone"""
 
@@ -121,7 +139,7 @@ class DomainInfo:
             self.target_path = target_path
 
 
-class DomainConfigBase:
+class DomainConfigBase(metaclass=ABCMeta):
     """Base class for zone writers."""
 
     template_file_name = "zone.template"
@@ -156,6 +174,49 @@ class DomainConfigBase:
             "ns_host_name": self.ns_host_name,
         }
 
+    @abstractmethod
+    def get_zone_parameters(self):
+        """Return the template parameters specific to each zone.
+
+        :return: A list of `(DomainInfo, parameters)` tuples, one for each
+            zone file this config writes.
+        """
+
+    def get_zone_fingerprints(self):
+        """Return a fingerprint of the content of each zone.
+
+        The serial and modification time are left out, so a zone's
+        fingerprint only changes when its records change.
+
+        :return: A dict mapping zone names to fingerprints.
+        """
+        common = (
+            self.domain,
+            self.ns_host_name,
+            self.default_ttl,
+            self.ns_ttl,
+        )
+        return {
+            zi.zone_name: sha256(
+                repr(
+                    (common, zi.target_path, _canonicalise(parameters))
+                ).encode("utf-8")
+            ).hexdigest()
+            for zi, parameters in self.get_zone_parameters()
+        }
+
+    def write_config(self, zone_names=None):
+        """Write the zone files.
+
+        :param zone_names: Only write the zones with these names. All zones
+            are written if this is `None`.
+        """
+        for zi, parameters in self.get_zone_parameters():
+            if zone_names is None or zi.zone_name in zone_names:
+                self.write_zone_file(
+                    zi.target_path, self.make_parameters(), parameters
+                )
+
     @classmethod
     def write_zone_file(cls, output_file, *parameters):
         """Write a zone file based on the zone file template.
@@ -283,8 +344,9 @@ class DNSForwardZoneConfig(DomainConfigBase):
 
         return sorted(generate_directives, key=lambda directive: directive[2])
 
-    def write_config(self):
-        """Write the zone file."""
+    def get_zone_parameters(self):
+        """See `DomainConfigBase.get_zone_parameters`."""
+        zone_parameters = []
         # Create GENERATE directives for IPv4 ranges.
         for zi in self.zone_info:
             generate_directives = list(
@@ -294,22 +356,30 @@ class DNSForwardZoneConfig(DomainConfigBase):
                     if dynamic_range.version == 4
                 )
             )
-            self.write_zone_file(
-                zi.target_path,
-                self.make_parameters(),
-                {
-                    "mappings": {
-                        "A": self.get_A_mapping(self._mapping, self._ipv4_ttl),
-                        "AAAA": self.get_AAAA_mapping(
-                            self._mapping, self._ipv6_ttl
+            zone_parameters.append(
+                (
+                    zi,
+                    {
+                        "mappings": {
+                            "A": list(
+                                self.get_A_mapping(
+                                    self._mapping, self._ipv4_ttl
+                                )
+                            ),
+                            "AAAA": list(
+                                self.get_AAAA_mapping(
+                                    self._mapping, self._ipv6_ttl
+                                )
+                            ),
+                        },
+                        "other_mapping": list(
+                            enumerate_rrset_mapping(self._other_mapping)
                         ),
+                        "generate_directives": {"A": generate_directives},
                     },
-                    "other_mapping": enumerate_rrset_mapping(
-                        self._other_mapping
-                    ),
-                    "generate_directives": {"A": generate_directives},
-                },
+                )
             )
+        return zone_parameters
 
 
 class DNSReverseZoneConfig(DomainConfigBase):
@@ -537,8 +607,9 @@ class DNSReverseZoneConfig(DomainConfigBase):
                 generate_directives.add((iterator, "${0,1,x}", hostname))
         return sorted(generate_directives)
 
-    def write_config(self):
-        """Write the zone file."""
+    def get_zone_parameters(self):
+        """See `DomainConfigBase.get_zone_parameters`."""
+        zone_parameters = []
         # Create GENERATE directives for IPv4 ranges.
         for zi in self.zone_info:
             generate_directives = list(
@@ -550,21 +621,27 @@ class DNSReverseZoneConfig(DomainConfigBase):
                     if dynamic_range.version == 4
                 )
             )
-            self.write_zone_file(
-                zi.target_path,
-                self.make_parameters(),
-                {
-                    "mappings": {
-                        "PTR": self.get_PTR_mapping(
-                            self._mapping, zi.subnetwork
-                        )
+            zone_parameters.append(
+                (
+                    zi,
+                    {
+                        "mappings": {
+                            "PTR": list(
+                                self.get_PTR_mapping(
+                                    self._mapping, zi.subnetwork
+                                )
+                            )
+                        },
+                        "other_mapping": [],
+                        "generate_directives": {
+                            "PTR": generate_directives,
+                            "CNAME": self.get_rfc2317_GENERATE_directives(
+                                zi.subnetwork,
+                                self._rfc2317_ranges,
+                                self.domain,
+                            ),
+                        },
                     },
-                    "other_mapping": [],
-                    "generate_directives": {
-                        "PTR": generate_directives,
-                        "CNAME": self.get_rfc2317_GENERATE_directives(
-                            zi.subnetwork, self._rfc2317_ranges, self.domain
-                        ),
-                    },
-                },
+                )
             )
+        return zone_parameters
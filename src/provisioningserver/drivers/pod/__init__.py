@@ -11,17 +11,21 @@ __all__ = [
     "PodDriverBase",
     "PodError",
     "PodFatalError",
+    "PowerStateListings",
 ]
 
 from abc import abstractmethod
 
 import attr
+from twisted.internet import reactor
+from twisted.internet.defer import maybeDeferred, succeed
 
 from provisioningserver.drivers import (
     IP_EXTRACTOR_SCHEMA,
     SETTING_PARAMETER_FIELD_SCHEMA,
 )
 from provisioningserver.drivers.power import PowerDriver, PowerDriverBase
+from provisioningserver.utils.twisted import callOut, DeferredValue
 
 # JSON schema for what a pod driver definition should look like.
 JSON_POD_DRIVER_SCHEMA = {
@@ -450,6 +454,54 @@ def get_error_message(err):
         return "Failed talking to pod: %s" % err
 
 
+class PowerStateListings:
+    """Power states of all of a pod's machines, listed at once and kept.
+
+    This lets power queries for many machines on one pod be answered from
+    a single request. `fetch` is called with a key identifying the pod and
+    any extra arguments given to `get`; it returns the state of each
+    machine by name, or `None` if they could not be listed.
+
+    A listing is kept for `max_age` seconds. Queries made while a listing
+    is being fetched wait for it rather than fetching another.
+    """
+
+    max_age = 10
+
+    def __init__(self, fetch, clock=reactor):
+        super().__init__()
+        self.fetch = fetch
+        self.clock = clock
+        # Listed states, with the time they were fetched, by key.
+        self.listings = {}
+        self.pending = {}
+
+    def get(self, key, *args, **kwargs):
+        """Return a `Deferred` firing with the listing for `key`."""
+        listing = self.listings.get(key)
+        if listing is not None:
+            fetched, states = listing
+            if self.clock.seconds() - fetched < self.max_age:
+                return succeed(states)
+        dvalue = self.pending.get(key)
+        if dvalue is None:
+            dvalue = self.pending[key] = DeferredValue()
+            d = maybeDeferred(self.fetch, key, *args, **kwargs)
+            d.addCallback(self._fetched, key)
+            d.addBoth(callOut, self.pending.pop, key, None)
+            dvalue.capture(d)
+        return dvalue.get()
+
+    def invalidate(self, key):
+        """Forget the listing for `key`, if there is one."""
+        self.listings.pop(key, None)
+
+    def _fetched(self, states, key):
+        if states is not None:
+            self.listings[key] = self.clock.seconds(), states
+        return states
+
+
 class PodDriver(PowerDriver, PodDriverBase):
     """Default pod driver."""
 
@@ -10,7 +10,8 @@ from urllib.parse import urlparse
 
 from pylxd import Client
 from pylxd.exceptions import ClientConnectionFailed, NotFound
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet import reactor
+from twisted.internet.defer import inlineCallbacks, succeed
 from twisted.internet.threads import deferToThread
 
 from provisioningserver.drivers import (
@@ -28,10 +29,12 @@ from provisioningserver.drivers.pod import (
     DiscoveredPodHints,
     DiscoveredPodStoragePool,
     PodDriver,
+    PowerStateListings,
     RequestedMachine,
 )
 from provisioningserver.logger import get_maas_logger
 from provisioningserver.maas_certificates import (
+    get_certificate_fingerprint,
     MAAS_CERTIFICATE,
     MAAS_PRIVATE_KEY,
 )
@@ -92,6 +95,79 @@ class LXDPodError(Exception):
     """Failure communicating to LXD. """
 
 
+class LXDClientCache:
+    """Authenticated LXD clients, kept to be used again.
+
+    Clients are kept by URL and the fingerprint of MAAS's certificate. A
+    client that hasn't been handed out for `health_interval` seconds is
+    checked by fetching the server's details before it is handed out
+    again; a client that fails the check, or that isn't handed out for
+    `idle_timeout` seconds, is dropped.
+    """
+
+    health_interval = 30
+    idle_timeout = 300
+
+    def __init__(self, clock=reactor):
+        super().__init__()
+        self.clock = clock
+        # Clients, with the time they were last handed out, by key.
+        self.clients = {}
+
+    def get(self, key):
+        """Return a `Deferred` firing with the client for `key`, or `None`.
+
+        Clients that have been idle for a while are checked first.
+        """
+        now = self.clock.seconds()
+        for other, (client, used) in list(self.clients.items()):
+            if now - used >= self.idle_timeout:
+                del self.clients[other]
+        if key not in self.clients:
+            return succeed(None)
+        client, used = self.clients[key]
+        self.clients[key] = client, now
+        if now - used < self.health_interval:
+            return succeed(client)
+        d = deferToThread(self._check, client)
+        d.addCallback(self._checked, client)
+        return d
+
+    def add(self, key, client):
+        """Keep `client` to be handed out for `key`."""
+        self.clients[key] = client, self.clock.seconds()
+
+    def discard(self, client):
+        """Drop `client`, so it isn't handed out again."""
+        for key, (other, _) in list(self.clients.items()):
+            if other is client:
+                del self.clients[key]
+
+    def _check(self, client):
+        try:
+            response = client.api.get()
+            client.host_info = response.json()["metadata"]
+            return client.trusted
+        except Exception:
+            return False
+
+    def _checked(self, healthy, client):
+        if healthy:
+            return client
+        self.discard(client)
+        return None
+
+
+def get_client_key(endpoint):
+    """Return the `LXDClientCache` key for a client of `endpoint`."""
+    try:
+        fingerprint = get_certificate_fingerprint()
+    except OSError:
+        # Without a certificate the client will fail to connect anyway.
+        fingerprint = None
+    return endpoint, fingerprint
+
+
 class LXDPodDriver(PodDriver):
 
     name = "lxd"
@@ -116,6 +192,11 @@ class LXDPodDriver(PodDriver):
         "power_address", IP_EXTRACTOR_PATTERNS.URL
     )
 
+    def __init__(self, clock=reactor):
+        super().__init__(clock)
+        self.clients = LXDClientCache(clock)
+        self.power_states = PowerStateListings(self._list_power_states, clock)
+
     def detect_missing_packages(self):
         # python3-pylxd is a required package
         # for maas and is installed by default.
@@ -145,6 +226,10 @@ class LXDPodDriver(PodDriver):
         """Connect pylxd client."""
         endpoint = self.get_url(context)
         password = context.get("password")
+        key = yield deferToThread(get_client_key, endpoint)
+        client = yield self.clients.get(key)
+        if client is not None:
+            return client
         try:
             client = yield deferToThread(
                 Client,
@@ -163,6 +248,7 @@ class LXDPodDriver(PodDriver):
             raise LXDPodError(
                 f"Pod {pod_id}: Failed to connect to the LXD REST API."
             )
+        self.clients.add(key, client)
         return client
 
     @typed
@@ -315,6 +401,7 @@ class LXDPodDriver(PodDriver):
         machine = yield self.get_machine(pod_id, context)
         if LXD_VM_POWER_STATE[machine.status_code] == "off":
             yield deferToThread(machine.start)
+            self.power_states.invalidate(self.get_url(context))
 
     @typed
     @asynchronous
@@ -324,14 +411,25 @@ class LXDPodDriver(PodDriver):
         machine = yield self.get_machine(pod_id, context)
         if LXD_VM_POWER_STATE[machine.status_code] == "on":
             yield deferToThread(machine.stop)
+            self.power_states.invalidate(self.get_url(context))
 
     @typed
     @asynchronous
     @inlineCallbacks
     def power_query(self, pod_id: str, context: dict):
-        """Power query LXD VM."""
-        machine = yield self.get_machine(pod_id, context)
-        state = machine.status_code
+        """Power query LXD VM.
+
+        The states of all the VMs on the LXD host are listed at once, and
+        the listing is shared by the queries for the host's other VMs.
+        """
+        states = yield self.power_states.get(
+            self.get_url(context), pod_id, context
+        )
+        state = states.get(context.get("instance_name"))
+        if state is None:
+            # Perhaps the VM is newer than the listing.
+            machine = yield self.get_machine(pod_id, context)
+            state = machine.status_code
         try:
             return LXD_VM_POWER_STATE[state]
         except KeyError:
@@ -339,6 +437,23 @@ class LXDPodDriver(PodDriver):
                 f"Pod {pod_id}: Unknown power status code: {state}"
             )
 
+    @inlineCallbacks
+    def _list_power_states(self, endpoint, pod_id, context):
+        """Return the status code of every VM on the LXD host, by name."""
+        client = yield self.get_client(pod_id, context)
+        try:
+            response = yield deferToThread(
+                client.api.virtual_machines.get, params={"recursion": 1}
+            )
+        except Exception:
+            # The client may be broken; don't hand it out again.
+            self.clients.discard(client)
+            raise
+        return {
+            machine["name"]: machine["status_code"]
+            for machine in response.json()["metadata"]
+        }
+
     @inlineCallbacks
     def discover(self, pod_id, context):
         """Discover all Pod host resources."""
@@ -6,7 +6,7 @@
 __all__ = []
 
 import random
-from unittest.mock import sentinel
+from unittest.mock import Mock, sentinel
 
 from jsonschema import validate
 from testtools.matchers import (
@@ -18,9 +18,12 @@ from testtools.matchers import (
     MatchesListwise,
     MatchesStructure,
 )
+from twisted.internet.defer import Deferred, fail, succeed
+from twisted.internet.task import Clock
 
 from maastesting.factory import factory
 from maastesting.testcase import MAASTestCase
+from maastesting.twisted import extract_result
 from provisioningserver.drivers import make_setting_field
 from provisioningserver.drivers.pod import (
     BlockDeviceType,
@@ -38,6 +41,7 @@ from provisioningserver.drivers.pod import (
     PodConnError,
     PodDriverBase,
     PodError,
+    PowerStateListings,
     RequestedMachine,
     RequestedMachineBlockDevice,
     RequestedMachineInterface,
@@ -1065,3 +1069,54 @@ class TestGetErrorMessage(MAASTestCase):
 
     def test_return_msg(self):
         self.assertEqual(self.message, get_error_message(self.exception))
+
+
+class TestPowerStateListings(MAASTestCase):
+    def test_fetches_and_keeps_listing(self):
+        clock = Clock()
+        fetch = Mock(return_value=succeed({"machine": "on"}))
+        listings = PowerStateListings(fetch, clock)
+        for _ in range(2):
+            d = listings.get("key", sentinel.arg)
+            self.assertEqual({"machine": "on"}, extract_result(d))
+        fetch.assert_called_once_with("key", sentinel.arg)
+        clock.advance(listings.max_age)
+        listings.get("key", sentinel.arg)
+        self.assertEqual(2, fetch.call_count)
+
+    def test_concurrent_gets_share_fetch(self):
+        fetching = Deferred()
+        fetch = Mock(return_value=fetching)
+        listings = PowerStateListings(fetch, Clock())
+        queries = [listings.get("key") for _ in range(3)]
+        fetching.callback({"machine": "off"})
+        for query in queries:
+            self.assertEqual({"machine": "off"}, extract_result(query))
+        fetch.assert_called_once_with("key")
+        self.assertEqual({}, listings.pending)
+
+    def test_cancelling_one_get_leaves_fetch_running(self):
+        fetching = Deferred()
+        listings = PowerStateListings(Mock(return_value=fetching), Clock())
+        listings.get("key").cancel()
+        query = listings.get("key")
+        fetching.callback({})
+        self.assertEqual({}, extract_result(query))
+
+    def test_does_not_keep_failed_listings(self):
+        fetch = Mock(side_effect=[None, fail(ZeroDivisionError())])
+        listings = PowerStateListings(fetch, Clock())
+        self.assertIsNone(extract_result(listings.get("key")))
+        self.assertRaises(
+            ZeroDivisionError, extract_result, listings.get("key")
+        )
+        self.assertEqual({}, listings.listings)
+        self.assertEqual({}, listings.pending)
+
+    def test_invalidate_forgets_listing(self):
+        fetch = Mock(return_value=succeed({}))
+        listings = PowerStateListings(fetch, Clock())
+        listings.get("key")
+        listings.invalidate("key")
+        listings.get("key")
+        self.assertEqual(2, fetch.call_count)
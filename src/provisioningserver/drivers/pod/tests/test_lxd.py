@@ -5,16 +5,22 @@
 
 __all__ = []
 
+import json
 from os.path import join
 import random
-from unittest.mock import Mock, PropertyMock, sentinel
+from unittest.mock import ANY, Mock, PropertyMock, sentinel
 
 from testtools.matchers import Equals, IsInstance, MatchesAll, MatchesStructure
 from testtools.testcase import ExpectedException
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, DeferredList, inlineCallbacks
+from twisted.internet.task import Clock
+from twisted.protocols import policies
+from twisted.web import resource
+from twisted.web.server import Site
 
 from maastesting.factory import factory
-from maastesting.matchers import MockCalledOnceWith
+from maastesting.matchers import MockCalledOnceWith, MockNotCalled
 from maastesting.testcase import MAASTestCase, MAASTwistedRunTest
 from provisioningserver.drivers.pod import (
     RequestedMachine,
@@ -70,6 +76,215 @@ class TestLXDByteSuffixes(MAASTestCase):
         self.assertSequenceEqual(expected_results, actual_results)
 
 
+class TestLXDClientCache(MAASTestCase):
+
+    run_tests_with = MAASTwistedRunTest.make_factory(timeout=5)
+
+    def setUp(self):
+        super().setUp()
+        self.clock = Clock()
+        self.cache = lxd_module.LXDClientCache(self.clock)
+
+    def make_client(self, trusted=True):
+        client = Mock(trusted=trusted)
+        client.api.get.return_value.json.return_value = {
+            "metadata": sentinel.host_info
+        }
+        return client
+
+    @inlineCallbacks
+    def test_get_returns_none_for_unknown_key(self):
+        client = yield self.cache.get("key")
+        self.assertIsNone(client)
+
+    @inlineCallbacks
+    def test_get_returns_recent_client_without_checking(self):
+        client = self.make_client()
+        self.cache.add("key", client)
+        self.clock.advance(self.cache.health_interval - 1)
+        cached = yield self.cache.get("key")
+        self.assertIs(client, cached)
+        self.assertThat(client.api.get, MockNotCalled())
+
+    @inlineCallbacks
+    def test_get_checks_client_idle_for_health_interval(self):
+        client = self.make_client()
+        self.cache.add("key", client)
+        self.clock.advance(self.cache.health_interval)
+        cached = yield self.cache.get("key")
+        self.assertIs(client, cached)
+        self.assertThat(client.api.get, MockCalledOnceWith())
+        self.assertIs(sentinel.host_info, client.host_info)
+
+    @inlineCallbacks
+    def test_get_drops_client_that_fails_check(self):
+        client = self.make_client()
+        client.api.get.side_effect = ZeroDivisionError()
+        self.cache.add("key", client)
+        self.clock.advance(self.cache.health_interval)
+        cached = yield self.cache.get("key")
+        self.assertIsNone(cached)
+        self.assertEqual({}, self.cache.clients)
+
+    @inlineCallbacks
+    def test_get_drops_client_no_longer_trusted(self):
+        client = self.make_client(trusted=False)
+        self.cache.add("key", client)
+        self.clock.advance(self.cache.health_interval)
+        cached = yield self.cache.get("key")
+        self.assertIsNone(cached)
+
+    @inlineCallbacks
+    def test_get_evicts_idle_clients(self):
+        self.cache.add("idle", self.make_client())
+        self.clock.advance(self.cache.idle_timeout)
+        client = self.make_client()
+        self.cache.add("key", client)
+        yield self.cache.get("key")
+        self.assertEqual(["key"], list(self.cache.clients))
+
+    def test_discard_drops_client(self):
+        client = self.make_client()
+        self.cache.add("key", client)
+        self.cache.add("other", self.make_client())
+        self.cache.discard(client)
+        self.assertEqual(["other"], list(self.cache.clients))
+
+
+class FakeLXDResource(resource.Resource):
+    """Just enough of the LXD REST API to query VMs' power states."""
+
+    isLeaf = True
+
+    def __init__(self, machines):
+        super().__init__()
+        self.machines = machines
+        self.requests = []
+
+    def respond(self, request, metadata, code=200):
+        request.setResponseCode(code)
+        request.setHeader(b"Content-Type", b"application/json")
+        if code == 200:
+            body = {"type": "sync", "status_code": 200, "metadata": metadata}
+        else:
+            body = {"type": "error", "error_code": code, "error": metadata}
+        return json.dumps(body).encode("utf-8")
+
+    def render_GET(self, request):
+        path = request.path.decode("utf-8")
+        self.requests.append(request.uri.decode("utf-8"))
+        if path == "/1.0":
+            return self.respond(
+                request,
+                {
+                    "auth": "trusted",
+                    "api_extensions": ["virtual-machines"],
+                    "environment": {},
+                },
+            )
+        elif path == "/1.0/virtual-machines":
+            if request.args.get(b"recursion") == [b"1"]:
+                return self.respond(
+                    request,
+                    [
+                        {"name": name, "status_code": status_code}
+                        for name, status_code in self.machines.items()
+                    ],
+                )
+            return self.respond(
+                request,
+                ["/1.0/virtual-machines/%s" % name for name in self.machines],
+            )
+        elif path.startswith("/1.0/virtual-machines/"):
+            name = path.rsplit("/", 1)[1]
+            if name in self.machines:
+                return self.respond(
+                    request, {"name": name, "status_code": self.machines[name]}
+                )
+        return self.respond(request, "not found", 404)
+
+
+class KeepAliveConnection(policies.ProtocolWrapper):
+    def connectionLost(self, reason):
+        super().connectionLost(reason)
+        self.factory.lost.pop(self).callback(None)
+
+
+class FakeLXDSite(policies.WrappingFactory):
+    """Serve a fake LXD API, dropping the connections pylxd keeps alive."""
+
+    protocol = KeepAliveConnection
+
+    def __init__(self, resource):
+        super().__init__(Site(resource))
+        self.lost = {}
+
+    def registerProtocol(self, connection):
+        super().registerProtocol(connection)
+        self.lost[connection] = Deferred()
+
+    def disconnect(self):
+        lost = DeferredList(list(self.lost.values()))
+        for connection in list(self.protocols):
+            connection.transport.abortConnection()
+        return lost
+
+
+class TestLXDPodDriverWithFakeLXD(MAASTestCase):
+    """Tests for `LXDPodDriver` against a fake LXD REST API."""
+
+    run_tests_with = MAASTwistedRunTest.make_factory(timeout=10)
+
+    def setUp(self):
+        super().setUp()
+        # The client certificate isn't used over HTTP, but must exist.
+        self.patch(lxd_module, "MAAS_CERTIFICATE", self.make_file())
+        self.patch(lxd_module, "MAAS_PRIVATE_KEY", self.make_file())
+        self.lxd = FakeLXDResource({"vm-1": 103, "vm-2": 102, "vm-3": 103})
+        site = FakeLXDSite(self.lxd)
+        port = reactor.listenTCP(0, site, interface="127.0.0.1")
+        self.addCleanup(site.disconnect)
+        self.addCleanup(port.stopListening)
+        self.context = {
+            "power_address": "http://127.0.0.1:%d" % port.getHost().port
+        }
+
+    @inlineCallbacks
+    def test_power_queries_share_client_and_listing(self):
+        driver = lxd_module.LXDPodDriver()
+        states = []
+        for name in ("vm-1", "vm-2", "vm-3"):
+            state = yield driver.power_query(
+                None, dict(self.context, instance_name=name)
+            )
+            states.append(state)
+        self.assertEqual(["on", "off", "on"], states)
+        self.assertEqual(
+            ["/1.0", "/1.0/virtual-machines?recursion=1"], self.lxd.requests
+        )
+
+    @inlineCallbacks
+    def test_power_query_gets_machine_added_since_listing(self):
+        driver = lxd_module.LXDPodDriver()
+        yield driver.power_query(
+            None, dict(self.context, instance_name="vm-1")
+        )
+        self.lxd.machines["vm-4"] = 102
+        state = yield driver.power_query(
+            None, dict(self.context, instance_name="vm-4")
+        )
+        self.assertEqual("off", state)
+        self.assertEqual("/1.0/virtual-machines/vm-4", self.lxd.requests[-1])
+
+    @inlineCallbacks
+    def test_power_query_for_missing_machine(self):
+        driver = lxd_module.LXDPodDriver()
+        with ExpectedException(lxd_module.LXDPodError, ".* not found"):
+            yield driver.power_query(
+                "pod", dict(self.context, instance_name="vm-5")
+            )
+
+
 class TestLXDPodDriver(MAASTestCase):
 
     run_tests_with = MAASTwistedRunTest.make_factory(timeout=5)
@@ -149,6 +364,32 @@ class TestLXDPodDriver(MAASTestCase):
         )
         self.assertEquals(client, returned_client)
 
+    @inlineCallbacks
+    def test_get_client_reuses_client(self):
+        context = self.make_parameters_context()
+        Client = self.patch(lxd_module, "Client")
+        Client.return_value.trusted = True
+        driver = lxd_module.LXDPodDriver()
+        first = yield driver.get_client(None, context)
+        second = yield driver.get_client(None, context)
+        self.assertIs(first, second)
+        self.assertThat(
+            Client, MockCalledOnceWith(endpoint=ANY, cert=ANY, verify=False)
+        )
+
+    @inlineCallbacks
+    def test_get_client_keys_clients_by_certificate_fingerprint(self):
+        context = self.make_parameters_context()
+        Client = self.patch(lxd_module, "Client")
+        Client.side_effect = lambda **kwargs: Mock(trusted=True)
+        fingerprint = self.patch(lxd_module, "get_certificate_fingerprint")
+        fingerprint.return_value = "AA:BB"
+        driver = lxd_module.LXDPodDriver()
+        first = yield driver.get_client(None, context)
+        fingerprint.return_value = "CC:DD"
+        second = yield driver.get_client(None, context)
+        self.assertIsNot(first, second)
+
     @inlineCallbacks
     def test_get_client_raises_error_when_not_trusted_and_no_password(self):
         context = self.make_parameters_context()
@@ -216,26 +457,93 @@ class TestLXDPodDriver(MAASTestCase):
         yield driver.power_off(None, context)
         self.assertThat(mock_machine.stop, MockCalledOnceWith())
 
+    @inlineCallbacks
+    def test__power_on_forgets_listed_states(self):
+        context = self.make_parameters_context()
+        driver = lxd_module.LXDPodDriver()
+        mock_machine = self.patch(driver, "get_machine").return_value
+        mock_machine.status_code = 110
+        invalidate = self.patch(driver.power_states, "invalidate")
+        yield driver.power_on(None, context)
+        self.assertThat(
+            invalidate, MockCalledOnceWith(driver.get_url(context))
+        )
+
+    def patch_listing(self, driver, *machines):
+        client = self.patch(driver, "get_client").return_value
+        response = client.api.virtual_machines.get.return_value
+        response.json.return_value = {
+            "type": "sync",
+            "metadata": [
+                {"name": name, "status_code": status_code}
+                for name, status_code in machines
+            ],
+        }
+        return client
+
     @inlineCallbacks
     def test__power_query(self):
         context = self.make_parameters_context()
         driver = lxd_module.LXDPodDriver()
+        client = self.patch_listing(
+            driver, (context["instance_name"], 103), ("other", 102)
+        )
+        state = yield driver.power_query(None, context)
+        self.assertThat(state, Equals("on"))
+        self.assertThat(
+            client.api.virtual_machines.get,
+            MockCalledOnceWith(params={"recursion": 1}),
+        )
+
+    @inlineCallbacks
+    def test_power_query_shares_listing_between_machines(self):
+        context = self.make_parameters_context()
+        driver = lxd_module.LXDPodDriver()
+        client = self.patch_listing(
+            driver, (context["instance_name"], 103), ("other", 102)
+        )
+        first = yield driver.power_query(None, context)
+        second = yield driver.power_query(
+            None, dict(context, instance_name="other")
+        )
+        self.assertEqual(("on", "off"), (first, second))
+        self.assertThat(
+            client.api.virtual_machines.get,
+            MockCalledOnceWith(params={"recursion": 1}),
+        )
+
+    @inlineCallbacks
+    def test_power_query_gets_machine_missing_from_listing(self):
+        context = self.make_parameters_context()
+        driver = lxd_module.LXDPodDriver()
+        self.patch_listing(driver, ("other", 102))
         mock_machine = self.patch(driver, "get_machine").return_value
         mock_machine.status_code = 103
         state = yield driver.power_query(None, context)
         self.assertThat(state, Equals("on"))
+        self.assertThat(driver.get_machine, MockCalledOnceWith(None, context))
 
     @inlineCallbacks
     def test_power_query_raises_error_on_unknown_state(self):
         context = self.make_parameters_context()
         pod_id = factory.make_name("pod_id")
         driver = lxd_module.LXDPodDriver()
-        mock_machine = self.patch(driver, "get_machine").return_value
-        mock_machine.status_code = 106
-        error_msg = f"Pod {pod_id}: Unknown power status code: {mock_machine.status_code}"
+        self.patch_listing(driver, (context["instance_name"], 106))
+        error_msg = f"Pod {pod_id}: Unknown power status code: 106"
         with ExpectedException(lxd_module.LXDPodError, error_msg):
             yield driver.power_query(pod_id, context)
 
+    @inlineCallbacks
+    def test_power_query_discards_client_when_listing_fails(self):
+        context = self.make_parameters_context()
+        driver = lxd_module.LXDPodDriver()
+        client = self.patch_listing(driver)
+        client.api.virtual_machines.get.side_effect = ZeroDivisionError()
+        discard = self.patch(driver.clients, "discard")
+        with ExpectedException(ZeroDivisionError):
+            yield driver.power_query(None, context)
+        self.assertThat(discard, MockCalledOnceWith(client))
+
     @inlineCallbacks
     def test_discover_requires_client_to_have_vm_support(self):
         context = self.make_parameters_context()
@@ -9,14 +9,15 @@ from math import floor
 import os
 import random
 from textwrap import dedent
-from unittest.mock import ANY, call, MagicMock, sentinel
+from unittest.mock import ANY, call, MagicMock, Mock, sentinel
 from uuid import uuid4
 
 from lxml import etree
 import pexpect
 from testtools.matchers import Contains, Equals
 from testtools.testcase import ExpectedException
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import DeferredList, inlineCallbacks
+from twisted.internet.task import Clock
 from twisted.internet.threads import deferToThread
 
 from maastesting.factory import factory
@@ -166,6 +167,48 @@ SAMPLE_IFLIST = dedent(
     """
 )
 
+SAMPLE_LIST_ALL = dedent(
+    """
+     Id    Name                           State
+    ----------------------------------------------------
+     1     machine-1                      running
+     -     machine-2                      shut off
+     3     machine-3                      in shutdown
+    """
+)
+
+# A stand-in for `virsh --connect ...` that knows about a few machines. It
+# records each time it is started, and every command it is given, in the
+# file named by the first argument.
+FAKE_VIRSH = dedent(
+    """\
+    #!/bin/sh
+    echo connect >> "$1"
+    printf "virsh # "
+    while read -r line; do
+        echo "$line" >> "$1"
+        case "$line" in
+            "list --all")
+                echo " Id    Name           State"
+                echo "-----------------------------------"
+                echo " 1     machine-1      running"
+                echo " -     machine-2      shut off"
+                ;;
+            "domstate machine-4")
+                echo "running"
+                ;;
+            domstate*)
+                echo "error: failed to get domain"
+                ;;
+            quit)
+                exit 0
+                ;;
+        esac
+        printf "virsh # "
+    done
+    """
+)
+
 SAMPLE_NETWORK_DUMPXML = dedent(
     """
     <network>
@@ -742,6 +785,21 @@ class TestVirshSSH(MAASTestCase):
         expected = conn.get_machine_state("")
         self.assertEqual(None, expected)
 
+    def test_get_machine_states(self):
+        conn = self.configure_virshssh(SAMPLE_LIST_ALL)
+        self.assertEqual(
+            {
+                "machine-1": virsh.VirshVMState.ON,
+                "machine-2": virsh.VirshVMState.OFF,
+                "machine-3": virsh.VirshVMState.IN_SHUTDOWN,
+            },
+            conn.get_machine_states(),
+        )
+
+    def test_get_machine_states_error(self):
+        conn = self.configure_virshssh("error:")
+        self.assertIsNone(conn.get_machine_states())
+
     def test_machine_mac_addresses_returns_list(self):
         macs = [factory.make_mac_address() for _ in range(2)]
         output = SAMPLE_IFLIST % (macs[0], macs[1])
@@ -2627,6 +2685,246 @@ class TestVirsh(MAASTestCase):
             )
 
 
+class TestVirshSessionPool(MAASTestCase):
+
+    run_tests_with = MAASTwistedRunTest.make_factory(timeout=5)
+
+    def setUp(self):
+        super().setUp()
+        self.clock = Clock()
+        self.pool = virsh.VirshSessionPool(self.clock)
+        self.login = self.patch(virsh.VirshSSH, "login")
+        self.login.return_value = True
+        self.patch(virsh.VirshSSH, "is_connected").return_value = True
+        self.logout = self.patch(virsh.VirshSSH, "logout")
+
+    @inlineCallbacks
+    def test_acquire_logs_in(self):
+        conn = yield self.pool.acquire("address", "password")
+        self.assertIsInstance(conn, virsh.VirshSSH)
+        self.assertThat(self.login, MockCalledOnceWith("address", "password"))
+
+    @inlineCallbacks
+    def test_acquire_raises_error_on_failed_login(self):
+        self.login.return_value = False
+        with ExpectedException(virsh.VirshError):
+            yield self.pool.acquire("address", "password")
+
+    @inlineCallbacks
+    def test_acquire_reuses_released_session(self):
+        conn = yield self.pool.acquire("address", "password")
+        conn.xml["machine"] = sentinel.xml
+        self.pool.release("address", "password", conn)
+        reused = yield self.pool.acquire("address", "password")
+        self.assertIs(conn, reused)
+        self.assertEqual({}, reused.xml)
+        self.assertThat(self.login, MockCalledOnceWith("address", "password"))
+
+    @inlineCallbacks
+    def test_acquire_does_not_share_sessions_between_credentials(self):
+        conn = yield self.pool.acquire("address", "password")
+        self.pool.release("address", "password", conn)
+        other = yield self.pool.acquire("address", "other")
+        self.assertIsNot(conn, other)
+
+    @inlineCallbacks
+    def test_acquire_skips_disconnected_sessions(self):
+        conn = yield self.pool.acquire("address", None)
+        self.pool.release("address", None, conn)
+        discard = self.patch(self.pool, "discard")
+        virsh.VirshSSH.is_connected.return_value = False
+        other = yield self.pool.acquire("address", None)
+        self.assertIsNot(conn, other)
+        self.assertThat(discard, MockCalledOnceWith(conn))
+
+    @inlineCallbacks
+    def test_logs_out_of_idle_sessions(self):
+        first = yield self.pool.acquire("address", None)
+        second = yield self.pool.acquire("address", None)
+        self.pool.release("address", None, first)
+        self.clock.advance(self.pool.idle_timeout / 2)
+        self.pool.release("address", None, second)
+        self.clock.advance(self.pool.idle_timeout / 2)
+        yield deferToThread(lambda: None)
+        self.assertThat(self.logout, MockCalledOnceWith())
+        self.assertEqual(
+            [second], [conn for conn, _ in self.pool.idle["address", None]]
+        )
+        self.clock.advance(self.pool.idle_timeout / 2)
+        yield deferToThread(lambda: None)
+        self.assertEqual(2, self.logout.call_count)
+        self.assertEqual({}, self.pool.idle)
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    @inlineCallbacks
+    def test_call_releases_session(self):
+        func = Mock(return_value=sentinel.result)
+        result = yield self.pool.call("address", None, func, sentinel.arg)
+        self.assertIs(sentinel.result, result)
+        [(conn, _)] = self.pool.idle["address", None]
+        self.assertThat(func, MockCalledOnceWith(conn, sentinel.arg))
+        yield self.pool.close()
+
+    @inlineCallbacks
+    def test_call_releases_session_after_virsh_error(self):
+        func = Mock(side_effect=virsh.VirshError())
+        with ExpectedException(virsh.VirshError):
+            yield self.pool.call("address", None, func)
+        self.assertEqual(1, len(self.pool.idle["address", None]))
+        yield self.pool.close()
+
+    @inlineCallbacks
+    def test_call_discards_session_after_other_errors(self):
+        discard = self.patch(self.pool, "discard")
+        func = Mock(side_effect=pexpect.EOF("gone"))
+        with ExpectedException(pexpect.EOF):
+            yield self.pool.call("address", None, func)
+        self.assertEqual({}, self.pool.idle)
+        self.assertThat(discard, MockCalledOnceWith(ANY))
+
+
+class TestVirshPowerStates(MAASTestCase):
+
+    run_tests_with = MAASTwistedRunTest.make_factory(timeout=5)
+
+    def setUp(self):
+        super().setUp()
+        self.clock = Clock()
+        self.sessions = virsh.VirshSessionPool(self.clock)
+        self.patch(virsh.VirshSSH, "login").return_value = True
+        self.patch(virsh.VirshSSH, "is_connected").return_value = True
+        self.patch(virsh.VirshSSH, "logout")
+        self.get_machine_states = self.patch(
+            virsh.VirshSSH, "get_machine_states"
+        )
+        self.get_machine_states.return_value = {
+            "machine-1": virsh.VirshVMState.ON,
+            "machine-2": virsh.VirshVMState.OFF,
+        }
+        self.get_machine_state = self.patch(
+            virsh.VirshSSH, "get_machine_state"
+        )
+        self.get_machine_state.return_value = None
+        self.states = virsh.VirshPowerStates(self.sessions, self.clock)
+        self.addCleanup(self.sessions.close)
+
+    @inlineCallbacks
+    def test_concurrent_queries_share_one_listing(self):
+        states = yield DeferredList(
+            [
+                self.states.get_state("address", None, machine)
+                for machine in ("machine-1", "machine-2", "machine-1")
+            ],
+            fireOnOneErrback=True,
+        )
+        self.assertEqual(
+            [
+                virsh.VirshVMState.ON,
+                virsh.VirshVMState.OFF,
+                virsh.VirshVMState.ON,
+            ],
+            [state for _, state in states],
+        )
+        self.assertThat(self.get_machine_states, MockCalledOnceWith())
+        self.assertEqual({}, self.states.listings.pending)
+
+    @inlineCallbacks
+    def test_listing_is_kept_for_max_age(self):
+        yield self.states.get_state("address", None, "machine-1")
+        self.clock.advance(self.states.listings.max_age - 1)
+        yield self.states.get_state("address", None, "machine-2")
+        self.assertThat(self.get_machine_states, MockCalledOnceWith())
+        self.clock.advance(1)
+        yield self.states.get_state("address", None, "machine-2")
+        self.assertEqual(2, self.get_machine_states.call_count)
+
+    @inlineCallbacks
+    def test_invalidate_forgets_listing(self):
+        yield self.states.get_state("address", None, "machine-1")
+        self.states.invalidate("address", None)
+        yield self.states.get_state("address", None, "machine-1")
+        self.assertEqual(2, self.get_machine_states.call_count)
+
+    @inlineCallbacks
+    def test_queries_machines_missing_from_listing(self):
+        self.get_machine_state.return_value = virsh.VirshVMState.ON
+        state = yield self.states.get_state("address", None, "machine-3")
+        self.assertEqual(virsh.VirshVMState.ON, state)
+        self.assertThat(
+            self.get_machine_state, MockCalledOnceWith("machine-3")
+        )
+
+    @inlineCallbacks
+    def test_queries_machines_individually_if_listing_fails(self):
+        self.get_machine_states.return_value = None
+        yield self.states.get_state("address", None, "machine-1")
+        yield self.states.get_state("address", None, "machine-1")
+        self.assertEqual(2, self.get_machine_states.call_count)
+        self.assertEqual(2, self.get_machine_state.call_count)
+
+    @inlineCallbacks
+    def test_failed_listing_fails_waiting_queries(self):
+        self.get_machine_states.side_effect = pexpect.EOF("gone")
+        queries = [
+            self.states.get_state("address", None, machine)
+            for machine in ("machine-1", "machine-2")
+        ]
+        for query in queries:
+            with ExpectedException(pexpect.EOF):
+                yield query
+        self.assertEqual({}, self.states.listings.pending)
+
+
+class TestVirshPodDriverWithFakeVirsh(MAASTestCase):
+    """Tests for `VirshPodDriver` against a fake virsh shell."""
+
+    run_tests_with = MAASTwistedRunTest.make_factory(timeout=10)
+
+    def setUp(self):
+        super().setUp()
+        self.log = os.path.join(self.make_dir(), "virsh.log")
+        script = self.make_file(contents=FAKE_VIRSH)
+        os.chmod(script, 0o755)
+
+        def execute(conn, poweraddr):
+            conn._spawn(script, [self.log])
+
+        self.patch(virsh.VirshSSH, "_execute", execute)
+        self.driver = VirshPodDriver()
+        self.addCleanup(self.driver.sessions.close)
+
+    def get_log(self):
+        with open(self.log) as fd:
+            return fd.read().splitlines()
+
+    @inlineCallbacks
+    def test_power_queries_share_session_and_listing(self):
+        context = {"power_address": "qemu+ssh://ubuntu@10.0.0.2/system"}
+        states = []
+        for machine in ("machine-1", "machine-2", "machine-1", "machine-4"):
+            state = yield self.driver.power_query(
+                None, dict(context, power_id=machine)
+            )
+            states.append(state)
+        self.assertEqual(["on", "off", "on", "on"], states)
+        self.assertEqual(
+            ["connect", "list --all", "domstate machine-4"], self.get_log()
+        )
+
+    @inlineCallbacks
+    def test_power_query_bad_domain(self):
+        context = {
+            "power_address": "qemu+ssh://ubuntu@10.0.0.2/system",
+            "power_id": "machine-5",
+        }
+        with ExpectedException(virsh.VirshError):
+            yield self.driver.power_query(None, context)
+        yield self.driver.power_query(
+            None, dict(context, power_id="machine-1")
+        )
+        self.assertEqual(1, self.get_log().count("connect"))
+
+
 class TestVirshPodDriver(MAASTestCase):
 
     run_tests_with = MAASTwistedRunTest.make_factory(timeout=5)
@@ -2780,11 +3078,11 @@ class TestVirshPodDriver(MAASTestCase):
         driver = VirshPodDriver()
         mock_login = self.patch(virsh.VirshSSH, "login")
         mock_login.return_value = True
-        mock_state = self.patch(virsh.VirshSSH, "get_machine_state")
-        mock_state.return_value = virsh.VirshVMState.ON
+        power_id = factory.make_name("power_id")
+        mock_states = self.patch(virsh.VirshSSH, "get_machine_states")
+        mock_states.return_value = {power_id: virsh.VirshVMState.ON}
 
         power_address = factory.make_name("power_address")
-        power_id = factory.make_name("power_id")
         state = yield driver.power_state_virsh(power_address, power_id)
         self.assertEqual("on", state)
 
@@ -2793,19 +3091,35 @@ class TestVirshPodDriver(MAASTestCase):
         driver = VirshPodDriver()
         mock_login = self.patch(virsh.VirshSSH, "login")
         mock_login.return_value = True
+        power_id = factory.make_name("power_id")
+        mock_states = self.patch(virsh.VirshSSH, "get_machine_states")
+        mock_states.return_value = {power_id: virsh.VirshVMState.OFF}
+
+        power_address = factory.make_name("power_address")
+        state = yield driver.power_state_virsh(power_address, power_id)
+        self.assertEqual("off", state)
+
+    @inlineCallbacks
+    def test_power_state_queries_domain_missing_from_listing(self):
+        driver = VirshPodDriver()
+        mock_login = self.patch(virsh.VirshSSH, "login")
+        mock_login.return_value = True
+        self.patch(virsh.VirshSSH, "get_machine_states").return_value = {}
         mock_state = self.patch(virsh.VirshSSH, "get_machine_state")
-        mock_state.return_value = virsh.VirshVMState.OFF
+        mock_state.return_value = virsh.VirshVMState.ON
 
         power_address = factory.make_name("power_address")
         power_id = factory.make_name("power_id")
         state = yield driver.power_state_virsh(power_address, power_id)
-        self.assertEqual("off", state)
+        self.assertEqual("on", state)
+        self.assertThat(mock_state, MockCalledOnceWith(power_id))
 
     @inlineCallbacks
     def test_power_state_bad_domain(self):
         driver = VirshPodDriver()
         mock_login = self.patch(virsh.VirshSSH, "login")
         mock_login.return_value = True
+        self.patch(virsh.VirshSSH, "get_machine_states").return_value = {}
         mock_state = self.patch(virsh.VirshSSH, "get_machine_state")
         mock_state.return_value = None
 
@@ -2819,11 +3133,11 @@ class TestVirshPodDriver(MAASTestCase):
         driver = VirshPodDriver()
         mock_login = self.patch(virsh.VirshSSH, "login")
         mock_login.return_value = True
-        mock_state = self.patch(virsh.VirshSSH, "get_machine_state")
-        mock_state.return_value = "unknown"
+        power_id = factory.make_name("power_id")
+        mock_states = self.patch(virsh.VirshSSH, "get_machine_states")
+        mock_states.return_value = {power_id: "unknown"}
 
         power_address = factory.make_name("power_address")
-        power_id = factory.make_name("power_id")
         with ExpectedException(virsh.VirshError):
             yield driver.power_state_virsh(power_address, power_id)
 
@@ -5,8 +5,9 @@
 
 __all__ = ["probe_virsh_and_enlist", "VirshPodDriver"]
 
-from collections import namedtuple
+from collections import defaultdict, namedtuple
 from math import floor
+from operator import methodcaller
 import os
 import string
 from tempfile import NamedTemporaryFile
@@ -16,7 +17,8 @@ from uuid import uuid4
 
 from lxml import etree
 import pexpect
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet import reactor
+from twisted.internet.defer import DeferredList, inlineCallbacks
 from twisted.internet.threads import deferToThread
 
 from provisioningserver.drivers import (
@@ -35,9 +37,10 @@ from provisioningserver.drivers.pod import (
     DiscoveredPodStoragePool,
     InterfaceAttachType,
     PodDriver,
+    PowerStateListings,
 )
 from provisioningserver.enum import LIBVIRT_NETWORK
-from provisioningserver.logger import get_maas_logger
+from provisioningserver.logger import get_maas_logger, LegacyLogger
 from provisioningserver.path import get_path
 from provisioningserver.rpc.exceptions import PodInvalidResources
 from provisioningserver.rpc.utils import commission_node, create_node
@@ -52,6 +55,7 @@ from provisioningserver.utils.shell import get_env_with_locale
 from provisioningserver.utils.twisted import asynchronous, synchronous
 
 maaslog = get_maas_logger("drivers.pod.virsh")
+log = LegacyLogger()
 
 ADD_DEFAULT_NETWORK = dedent(
     """
@@ -382,6 +386,10 @@ class VirshSSH(pexpect.spawn):
         self.sendline("quit")
         self.close()
 
+    def is_connected(self):
+        """Whether the virsh session is still running."""
+        return self.child_fd != -1 and self.isalive()
+
     def prompt(self, timeout=None):
         """Waits for virsh prompt."""
         if timeout is None:
@@ -482,6 +490,28 @@ class VirshSSH(pexpect.spawn):
             return None
         return state
 
+    def get_machine_states(self):
+        """Gets the state of every VM, by name, from one listing."""
+        output = self.run(["list", "--all"]).strip()
+        if output.startswith("error:"):
+            return None
+        # Parse the `virsh list --all` output, which will look something
+        # like the following:
+        #
+        #  Id    Name                           State
+        # ----------------------------------------------------
+        #  1     machine-1                      running
+        #  -     machine-2                      shut off
+        #
+        # That is, skip the two lines of header; the state is everything
+        # after the name.
+        states = {}
+        for line in output.splitlines()[2:]:
+            columns = line.split(None, 2)
+            if len(columns) == 3:
+                states[columns[1]] = columns[2].strip()
+        return states
+
     def get_machine_interface_info(self, machine):
         """Gets list of mac addressess assigned to the VM."""
         output = self.run(["domiflist", machine]).strip()
@@ -1289,6 +1319,180 @@ class VirshSSH(pexpect.spawn):
         )
 
 
+def _power_control(conn, power_id, power_change):
+    """Power a VM on or off, if it isn't already, using a virsh session."""
+    state = conn.get_machine_state(power_id)
+    if state is None:
+        raise VirshError("%s: Failed to get power state" % power_id)
+
+    if state == VirshVMState.OFF:
+        if power_change == "on":
+            if conn.poweron(power_id) is False:
+                raise VirshError("%s: Failed to power on VM" % power_id)
+    elif state == VirshVMState.ON:
+        if power_change == "off":
+            if conn.poweroff(power_id) is False:
+                raise VirshError("%s: Failed to power off VM" % power_id)
+
+
+class VirshSessionPool:
+    """Logged in virsh sessions, kept to be used again.
+
+    Sessions are kept by power address and password. Each is used by one
+    caller at a time, and is logged out once it has been idle for
+    `idle_timeout` seconds.
+    """
+
+    idle_timeout = 60
+
+    def __init__(self, clock=reactor):
+        super().__init__()
+        self.clock = clock
+        # Idle sessions, with the time they were released, by key.
+        self.idle = defaultdict(list)
+        self._expire = None
+
+    @inlineCallbacks
+    def acquire(self, power_address, power_pass=None):
+        """Return a logged in `VirshSSH`, reusing an idle one if possible.
+
+        The session must be given back with `release` or `discard`.
+        """
+        idle = self.idle.get((power_address, power_pass))
+        while idle:
+            conn, _ = idle.pop()
+            if conn.is_connected():
+                return conn
+            self.discard(conn)
+        conn = VirshSSH()
+        logged_in = yield deferToThread(conn.login, power_address, power_pass)
+        if not logged_in:
+            raise VirshError("Failed to login to virsh console.")
+        return conn
+
+    def release(self, power_address, power_pass, conn):
+        """Give back a session that can be used again."""
+        if not conn.is_connected():
+            self.discard(conn)
+            return
+        # Domain XML is only cached for the life of one task.
+        conn.xml.clear()
+        self.idle[power_address, power_pass].append(
+            (conn, self.clock.seconds())
+        )
+        if self._expire is None:
+            self._expire = self.clock.callLater(
+                self.idle_timeout, self._expireIdle
+            )
+
+    def discard(self, conn):
+        """Close a session that must not be used again."""
+        if conn.child_fd != -1:
+            d = deferToThread(conn.close)
+            d.addErrback(log.err, "Failed to close virsh session.")
+
+    def close(self):
+        """Log out of all idle sessions.
+
+        :return: A `DeferredList` that fires once they are logged out.
+        """
+        if self._expire is not None:
+            if self._expire.active():
+                self._expire.cancel()
+            self._expire = None
+        idle, self.idle = self.idle, defaultdict(list)
+        return DeferredList(
+            [
+                self._logout(conn)
+                for sessions in idle.values()
+                for conn, _ in sessions
+            ]
+        )
+
+    @inlineCallbacks
+    def call(self, power_address, power_pass, func, *args, **kwargs):
+        """Call `func` in a thread with a session as its first argument.
+
+        The session is given back afterwards, unless `func` failed with
+        something other than a `VirshError`, or was cancelled.
+        """
+        conn = yield self.acquire(power_address, power_pass)
+        try:
+            result = yield deferToThread(func, conn, *args, **kwargs)
+        except VirshError:
+            self.release(power_address, power_pass, conn)
+            raise
+        except BaseException:
+            self.discard(conn)
+            raise
+        else:
+            self.release(power_address, power_pass, conn)
+            return result
+
+    def _logout(self, conn):
+        d = deferToThread(conn.logout)
+        d.addErrback(log.err, "Failed to log out of virsh session.")
+        return d
+
+    def _expireIdle(self):
+        self._expire = None
+        expire_before = self.clock.seconds() - self.idle_timeout
+        oldest = None
+        for key, sessions in list(self.idle.items()):
+            keep = []
+            for conn, released in sessions:
+                if released <= expire_before:
+                    self._logout(conn)
+                else:
+                    keep.append((conn, released))
+                    if oldest is None or released < oldest:
+                        oldest = released
+            if keep:
+                self.idle[key] = keep
+            else:
+                del self.idle[key]
+        if oldest is not None:
+            self._expire = self.clock.callLater(
+                oldest + self.idle_timeout - self.clock.seconds(),
+                self._expireIdle,
+            )
+
+
+class VirshPowerStates:
+    """Answer power queries for the VMs on a virsh host from one listing.
+
+    The states come from `virsh list --all`, kept by `PowerStateListings`.
+    VMs that aren't in the listing, perhaps because they are newer, are
+    queried individually.
+    """
+
+    def __init__(self, sessions, clock=reactor):
+        super().__init__()
+        self.sessions = sessions
+        self.listings = PowerStateListings(self._list, clock)
+
+    def get_state(self, power_address, power_pass, power_id):
+        """Return the state of a VM, or `None` if there is no such VM."""
+        key = power_address, power_pass
+        d = self.listings.get(key)
+        d.addCallback(self._getState, key, power_id)
+        return d
+
+    def invalidate(self, power_address, power_pass):
+        """Forget the states listed for a host."""
+        self.listings.invalidate((power_address, power_pass))
+
+    def _list(self, key):
+        return self.sessions.call(*key, methodcaller("get_machine_states"))
+
+    def _getState(self, states, key, power_id):
+        if states is not None and power_id in states:
+            return states[power_id]
+        return self.sessions.call(
+            *key, methodcaller("get_machine_state", power_id)
+        )
+
+
 class VirshPodDriver(PodDriver):
 
     name = "virsh"
@@ -1309,6 +1513,11 @@ class VirshPodDriver(PodDriver):
         "power_address", IP_EXTRACTOR_PATTERNS.URL
     )
 
+    def __init__(self, clock=reactor):
+        super().__init__(clock)
+        self.sessions = VirshSessionPool(clock)
+        self.power_states = VirshPowerStates(self.sessions, clock)
+
     def detect_missing_packages(self):
         missing_packages = set()
         for binary, package in REQUIRED_PACKAGES:
@@ -1327,25 +1536,17 @@ class VirshPodDriver(PodDriver):
         if power_pass == "":
             power_pass = None
 
-        conn = VirshSSH()
-        logged_in = yield deferToThread(conn.login, power_address, power_pass)
-        if not logged_in:
-            raise VirshError("Failed to login to virsh console.")
-
-        state = yield deferToThread(conn.get_machine_state, power_id)
-        if state is None:
-            raise VirshError("%s: Failed to get power state" % power_id)
-
-        if state == VirshVMState.OFF:
-            if power_change == "on":
-                powered_on = yield deferToThread(conn.poweron, power_id)
-                if powered_on is False:
-                    raise VirshError("%s: Failed to power on VM" % power_id)
-        elif state == VirshVMState.ON:
-            if power_change == "off":
-                powered_off = yield deferToThread(conn.poweroff, power_id)
-                if powered_off is False:
-                    raise VirshError("%s: Failed to power off VM" % power_id)
+        try:
+            yield self.sessions.call(
+                power_address,
+                power_pass,
+                _power_control,
+                power_id,
+                power_change,
+            )
+        finally:
+            # The listed states for this host may now be out of date.
+            self.power_states.invalidate(power_address, power_pass)
 
     @inlineCallbacks
     def power_state_virsh(
@@ -1358,12 +1559,9 @@ class VirshPodDriver(PodDriver):
         if power_pass == "":
             power_pass = None
 
-        conn = VirshSSH()
-        logged_in = yield deferToThread(conn.login, power_address, power_pass)
-        if not logged_in:
-            raise VirshError("Failed to login to virsh console.")
-
-        state = yield deferToThread(conn.get_machine_state, power_id)
+        state = yield self.power_states.get_state(
+            power_address, power_pass, power_id
+        )
         if state is None:
             raise VirshError("Failed to get domain: %s" % power_id)
 
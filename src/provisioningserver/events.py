@@ -12,19 +12,36 @@ __all__ = [
     "send_rack_event",
 ]
 
-from collections import namedtuple
+from collections import deque, namedtuple
 from logging import DEBUG, ERROR, INFO, WARN
 
-from twisted.internet.defer import maybeDeferred, succeed
+from twisted.internet import reactor
+from twisted.internet.defer import (
+    CancelledError,
+    inlineCallbacks,
+    maybeDeferred,
+    succeed,
+)
+from twisted.internet.error import ConnectionClosed
+from twisted.protocols.amp import (
+    MAX_VALUE_LENGTH,
+    UnhandledCommand,
+    UnknownRemoteError,
+)
 
 from provisioningserver.logger import get_maas_logger, LegacyLogger
 from provisioningserver.rpc import getRegionClient
-from provisioningserver.rpc.exceptions import NoSuchEventType, NoSuchNode
+from provisioningserver.rpc.exceptions import (
+    NoConnectionsAvailable,
+    NoSuchEventType,
+    NoSuchNode,
+)
 from provisioningserver.rpc.region import (
     RegisterEventType,
     SendEvent,
     SendEventIPAddress,
     SendEventMACAddress,
+    SendEvents,
 )
 from provisioningserver.utils.env import get_maas_id
 from provisioningserver.utils.twisted import (
@@ -429,17 +446,59 @@ EVENT_DETAILS = {
 }
 
 
+# Failures after which queued events are kept to send again later: the
+# region can't be reached.
+RETRY_FAILURES = (NoConnectionsAvailable, ConnectionClosed, CancelledError)
+
+
+def get_event_size(event):
+    """Return the size of `event` once serialised for `SendEvents`."""
+    [(_, events)] = SendEvents.arguments
+    return len(events.toStringProto([event], None))
+
+
 class NodeEventHub:
     """Singleton for sending node events to the region.
 
     This automatically ensures that the event type is registered before
     sending logs to the region.
+
+    Events can also be queued, to be sent to the region in batches with
+    `SendEvents`. Queued events are kept, in order, until the region has
+    stored them, so they survive the region being unavailable for a while.
     """
 
-    def __init__(self):
+    # The most events to send to the region in one `SendEvents` call. The
+    # events sent together must also fit in one AMP value.
+    batch_size = 100
+    max_batch_bytes = MAX_VALUE_LENGTH
+
+    # How long to wait for more events before sending a batch, in seconds.
+    flush_interval = 0.5
+
+    # How long to wait before trying again when the region can't be reached.
+    retry_interval = 5.0
+
+    # The most events to keep queued. The oldest are dropped beyond this.
+    max_queued = 10000
+
+    # How many times to try to send an event the region fails to store,
+    # before dropping it.
+    max_attempts = 3
+
+    def __init__(self, clock=reactor):
         super(NodeEventHub, self).__init__()
         self._types_registering = dict()
         self._types_registered = set()
+        self.clock = clock
+        self.queue = deque()
+        self.dropped = 0
+        self._flushing = None
+        self._flushCall = None
+        self._retrying = False
+        # The event the region last failed to store, and how many times.
+        self._failing = None
+        self._failingAttempts = 0
 
     @asynchronous
     def registerEventType(self, event_type):
@@ -613,6 +672,223 @@ class NodeEventHub:
 
         return d
 
+    @asynchronous
+    def queueByID(self, event_type, system_id, description=""):
+        """Queue the given node event to be sent to the region in a batch.
+
+        The node is specified by its ID.
+
+        :return: :class:`Deferred` that fires once the event is queued.
+        """
+        return self._queue(event_type, description, system_id=system_id)
+
+    @asynchronous
+    def queueByMAC(self, event_type, mac_address, description=""):
+        """Queue the given node event to be sent to the region in a batch.
+
+        The node is specified by its MAC address.
+
+        :return: :class:`Deferred` that fires once the event is queued.
+        """
+        return self._queue(event_type, description, mac_address=mac_address)
+
+    @asynchronous
+    def queueByIP(self, event_type, ip_address, description=""):
+        """Queue the given node event to be sent to the region in a batch.
+
+        The node is specified by its IP address.
+
+        :return: :class:`Deferred` that fires once the event is queued.
+        """
+        return self._queue(event_type, description, ip_address=ip_address)
+
+    def _queue(self, event_type, description, **node):
+        event = dict(
+            node,
+            type_name=event_type,
+            description=description,
+            timestamp=self.clock.seconds(),
+        )
+        self.queue.append(event)
+        self._trimQueue()
+        if len(self.queue) >= self.batch_size:
+            self._scheduleFlush(0)
+        else:
+            self._scheduleFlush(self.flush_interval)
+        return succeed(None)
+
+    def _trimQueue(self):
+        while len(self.queue) > self.max_queued:
+            self.queue.popleft()
+            self.dropped += 1
+
+    def _scheduleFlush(self, delay):
+        if self._flushing is not None:
+            # The running flush sends everything queued before it finishes.
+            return
+        elif self._flushCall is None:
+            self._flushCall = self.clock.callLater(delay, self.flush)
+        elif delay == 0 and not self._retrying:
+            self._flushCall.reset(0)
+
+    @asynchronous
+    def flush(self):
+        """Send all queued events to the region now, in batches.
+
+        If the region can't be reached, the events that weren't sent stay
+        queued and another flush is scheduled after `retry_interval`.
+
+        :return: :class:`Deferred` that fires when this flush is done.
+        """
+        if self._flushCall is not None:
+            if self._flushCall.active():
+                self._flushCall.cancel()
+            self._flushCall = None
+        if self._flushing is None:
+            self._retrying = False
+            self._flushing = flushing = DeferredValue()
+            d = self._sendQueued()
+            d.addErrback(log.err, "Failed to send node events.")
+            d.addCallback(self._flushed)
+            flushing.capture(d)
+            return flushing.get()
+        else:
+            return self._flushing.get()
+
+    @inlineCallbacks
+    def _sendQueued(self):
+        """Send queued events until none remain.
+
+        An event the region fails to store is tried again later, up to
+        `max_attempts` times, and then dropped so that it doesn't hold up
+        the events queued behind it.
+
+        :return: True if sending stopped because the region can't be
+            reached or failed to store an event, or False if everything
+            queued has been dealt with.
+        """
+        while len(self.queue) != 0:
+            if self.dropped != 0:
+                log.msg(
+                    "Dropped %d node events; too many were queued."
+                    % self.dropped
+                )
+                self.dropped = 0
+            batch = self._takeBatch()
+            size = len(batch)
+            try:
+                yield self._sendBatch(batch)
+            except RETRY_FAILURES:
+                # Put back what wasn't sent, ahead of anything queued since.
+                self.queue.extendleft(reversed(batch))
+                self._trimQueue()
+                return True
+            except UnknownRemoteError:
+                # Everything ahead of the first event left in the batch has
+                # been stored; that event is the one the region fails on.
+                if batch[0] is self._failing:
+                    self._failingAttempts += 1
+                else:
+                    self._failing, self._failingAttempts = batch[0], 1
+                if self._failingAttempts >= self.max_attempts:
+                    log.err(
+                        None,
+                        "Failed to send node event %d times; dropping it."
+                        % self._failingAttempts,
+                    )
+                    batch.popleft()
+                    self._failing = None
+                    self.queue.extendleft(reversed(batch))
+                else:
+                    self.queue.extendleft(reversed(batch))
+                    self._trimQueue()
+                    return True
+            except Exception:
+                # Sending them again would fail the same way.
+                log.err(None, "Failed to send %d node events." % size)
+        return False
+
+    def _takeBatch(self):
+        """Take the next batch of events to send from the queue.
+
+        A batch holds at most `batch_size` events, and at most
+        `max_batch_bytes` of them once serialised. An event too big to
+        send even on its own is dropped.
+        """
+        batch = deque()
+        batch_bytes = 0
+        while len(self.queue) != 0 and len(batch) < self.batch_size:
+            event_bytes = get_event_size(self.queue[0])
+            if event_bytes > self.max_batch_bytes:
+                event = self.queue.popleft()
+                log.msg(
+                    "Dropped %s node event; it is too big to send."
+                    % event["type_name"]
+                )
+            elif batch_bytes + event_bytes > self.max_batch_bytes:
+                break
+            else:
+                batch.append(self.queue.popleft())
+                batch_bytes += event_bytes
+        return batch
+
+    @inlineCallbacks
+    def _sendBatch(self, batch):
+        """Send `batch` to the region, removing events once they're sent.
+
+        When the region fails to store a batch, its halves are sent
+        separately, so that all the events ahead of one that the region
+        keeps failing on are still stored.
+        """
+        if len(batch) == 0:
+            return
+        client = getRegionClient()
+        try:
+            yield client(SendEvents, events=list(batch))
+        except UnhandledCommand:
+            # The region has not been upgraded to support batches, so send
+            # the events one at a time instead.
+            while len(batch) != 0:
+                try:
+                    yield self._sendEvent(batch[0])
+                except RETRY_FAILURES:
+                    raise
+                except Exception:
+                    log.err(None, "Failed to send node event.")
+                batch.popleft()
+        except UnknownRemoteError:
+            if len(batch) == 1:
+                raise
+            first = deque(batch.popleft() for _ in range(len(batch) // 2))
+            try:
+                yield self._sendBatch(first)
+            finally:
+                # Put back what wasn't sent.
+                batch.extendleft(reversed(first))
+            yield self._sendBatch(batch)
+        else:
+            batch.clear()
+
+    def _sendEvent(self, event):
+        methods = {
+            "system_id": self.logByID,
+            "mac_address": self.logByMAC,
+            "ip_address": self.logByIP,
+        }
+        for key, method in methods.items():
+            if key in event:
+                return method(
+                    event["type_name"], event[key], event["description"]
+                )
+
+    def _flushed(self, retry):
+        self._flushing = None
+        if retry:
+            self._retrying = True
+            self._flushCall = self.clock.callLater(
+                self.retry_interval, self.flush
+            )
+
 
 # Singleton.
 nodeEventHub = NodeEventHub()
@@ -637,6 +913,8 @@ def send_node_event(event_type, system_id, hostname, description=""):
 def send_node_event_mac_address(event_type, mac_address, description=""):
     """Send the given node event to the region for the given mac address.
 
+    The event is queued and sent to the region in a batch.
+
     :param event_type: The type of the event.
     :type event_type: unicode
     :param mac_address: The MAC Address of the node of the event.
@@ -644,13 +922,15 @@ def send_node_event_mac_address(event_type, mac_address, description=""):
     :param description: An optional description of the event.
     :type description: unicode
     """
-    return nodeEventHub.logByMAC(event_type, mac_address, description)
+    return nodeEventHub.queueByMAC(event_type, mac_address, description)
 
 
 @asynchronous
 def send_node_event_ip_address(event_type, ip_address, description=""):
     """Send the given node event to the region for the given IP address.
 
+    The event is queued and sent to the region in a batch.
+
     :param event_type: The type of the event.
     :type event_type: unicode
     :param ip_address: The IP Address of the node of the event.
@@ -658,7 +938,7 @@ def send_node_event_ip_address(event_type, ip_address, description=""):
     :param description: An optional description of the event.
     :type description: unicode
     """
-    return nodeEventHub.logByIP(event_type, ip_address, description)
+    return nodeEventHub.queueByIP(event_type, ip_address, description)
 
 
 @asynchronous
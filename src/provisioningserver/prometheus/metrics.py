@@ -31,6 +31,19 @@ METRICS_DEFINITIONS = [
         "Latency of TFTP file downloads",
         ["filename"],
     ),
+    MetricDefinition(
+        "Histogram",
+        "maas_power_query_latency",
+        "Latency of power state queries",
+        ["power_type"],
+        buckets=[0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120],
+    ),
+    MetricDefinition(
+        "Histogram",
+        "maas_power_query_cycle_duration",
+        "Duration of a rack power polling cycle",
+        buckets=[1, 5, 10, 15, 30, 60, 120, 300, 600],
+    ),
     # regiond metrics
     MetricDefinition(
         "Histogram",
@@ -83,6 +96,84 @@ METRICS_DEFINITIONS = [
         "HTTP request query latency",
         _WEBSOCKET_CALL_LABELS,
     ),
+    MetricDefinition(
+        "Gauge",
+        "maas_listener_notify_queue_depth",
+        "Number of pending database notifications",
+    ),
+    MetricDefinition(
+        "Counter",
+        "maas_listener_notifies_received",
+        "Database notifications received before coalescing",
+    ),
+    MetricDefinition(
+        "Counter",
+        "maas_listener_notifies_dispatched",
+        "Database notifications dispatched after coalescing",
+    ),
+    MetricDefinition(
+        "Counter",
+        "maas_boot_config_cache_requests",
+        "Lookups in the region boot config cache",
+        ["kind", "result"],
+    ),
+    MetricDefinition(
+        "Counter",
+        "maas_external_config_cache_requests",
+        "Lookups in the region external services config digest cache",
+        ["result"],
+    ),
+    MetricDefinition(
+        "Counter",
+        "maas_preseed_template_cache_requests",
+        "Lookups in the region preseed template cache",
+        ["kind", "result"],
+    ),
+    MetricDefinition(
+        "Counter",
+        "maas_script_cache_requests",
+        "Lookups in the region cache of scripts sent to nodes",
+        ["kind", "result"],
+    ),
+    MetricDefinition(
+        "Counter",
+        "maas_websocket_dehydrate_cache_requests",
+        "Lookups in the shared websocket dehydration cache",
+        ["handler", "result"],
+    ),
+    MetricDefinition(
+        "Histogram",
+        "maas_websocket_notify_fanout",
+        "Number of clients a websocket notification was sent to",
+        ["handler"],
+        buckets=[1, 5, 10, 25, 50, 100, 250, 500],
+    ),
+    MetricDefinition(
+        "Histogram",
+        "maas_status_monitor_sweep_duration",
+        "Duration of a node status monitor sweep",
+        ["sweep"],
+        buckets=[0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60],
+    ),
+    MetricDefinition(
+        "Counter",
+        "maas_status_monitor_nodes_examined",
+        "Nodes examined by the node status monitor sweeps",
+        ["sweep"],
+    ),
+    MetricDefinition(
+        "Histogram",
+        "maas_database_task_queue_wait",
+        "Time work waited for a database thread",
+        ["priority"],
+        buckets=[0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10],
+    ),
+    MetricDefinition(
+        "Histogram",
+        "maas_database_task_duration",
+        "Time work ran in a database thread",
+        ["priority"],
+    ),
     # Common metrics
     *node_metrics_definitions(),
 ]
@@ -15,8 +15,15 @@ from datetime import timedelta
 import attr
 from netaddr import IPAddress
 from twisted.application.internet import TimerService
-from twisted.internet.defer import DeferredList, inlineCallbacks, maybeDeferred
+from twisted.internet.defer import (
+    DeferredList,
+    DeferredLock,
+    inlineCallbacks,
+    maybeDeferred,
+    succeed,
+)
 from twisted.internet.threads import deferToThread
+from twisted.protocols.amp import UnhandledCommand
 
 from provisioningserver.dns.actions import (
     bind_reload_with_retries,
@@ -28,6 +35,7 @@ from provisioningserver.ntp.config import configure_rack
 from provisioningserver.proxy import config as proxy_config
 from provisioningserver.rpc import exceptions
 from provisioningserver.rpc.region import (
+    GetConfigurationDigests,
     GetControllerType,
     GetDNSConfiguration,
     GetProxyConfiguration,
@@ -402,6 +410,22 @@ class RackExternalService(TimerService):
     # DNS requests.
     INTERVAL_HIGH = timedelta(seconds=30).total_seconds()
 
+    # The region tells the rack controller when its configuration changes
+    # (see `refresh`), so between those pushes the configuration fetched
+    # last is applied again. Only this often is the region asked whether
+    # anything changed, in case a push was missed.
+    INTERVAL_FETCH = timedelta(minutes=5).total_seconds()
+
+    # The kinds of configuration the region publishes digests for, and the
+    # command to get each.
+    CONFIG_COMMANDS = (
+        ("controller_type", GetControllerType),
+        ("time", GetTimeConfiguration),
+        ("dns", GetDNSConfiguration),
+        ("proxy", GetProxyConfiguration),
+        ("syslog", GetSyslogConfiguration),
+    )
+
     _rpc_service = None
     _services = None
 
@@ -417,6 +441,11 @@ class RackExternalService(TimerService):
                 ("proxy", RackProxy()),
                 ("syslog", RackSyslog()),
             ]
+        # The last answer to each kind of configuration command, with the
+        # digest the region published for it, if any.
+        self._answers = {}
+        self._fetched = None
+        self._lock = DeferredLock()
 
     def _update_interval(self, config):
         """Change the update interval."""
@@ -425,38 +454,77 @@ class RackExternalService(TimerService):
         else:
             self._loop.interval = self.step = self.INTERVAL_HIGH
 
+    def _isFresh(self):
+        """Can the configuration fetched last be applied again?
+
+        Only when the region published a digest for every kind, so it will
+        push any change, and the region was asked recently.
+        """
+        return (
+            len(self._rpc_service.connections) != 0
+            and self._fetched is not None
+            and self.clock.seconds() - self._fetched < self.INTERVAL_FETCH
+            and all(
+                self._answers.get(kind, (None,))[0] is not None
+                for kind, _ in self.CONFIG_COMMANDS
+            )
+        )
+
     @inlineCallbacks
-    def _getConfiguration(self):
+    def _fetchConfiguration(self, digests=None):
+        """Fetch the kinds of configuration whose digest has changed.
+
+        :param digests: The region's digests, if it has sent them already.
+        """
         client = yield self._rpc_service.getClientNow()
-        controller_type = yield client(
-            GetControllerType, system_id=client.localIdent
-        )
-        time_configuration = yield client(
-            GetTimeConfiguration, system_id=client.localIdent
-        )
-        dns_configuration = yield client(
-            GetDNSConfiguration, system_id=client.localIdent
-        )
-        proxy_configuration = yield client(
-            GetProxyConfiguration, system_id=client.localIdent
-        )
-        syslog_configuration = yield client(
-            GetSyslogConfiguration, system_id=client.localIdent
-        )
+        if digests is None:
+            digests = yield self._fetchDigests(client)
+        for kind, command in self.CONFIG_COMMANDS:
+            digest = digests.get(kind)
+            if digest is None or self._answers.get(kind, (None,))[0] != digest:
+                answer = yield client(command, system_id=client.localIdent)
+                self._answers[kind] = (digest, answer)
+        self._fetched = self.clock.seconds()
+
+    @inlineCallbacks
+    def _fetchDigests(self, client):
+        try:
+            response = yield client(
+                GetConfigurationDigests, system_id=client.localIdent
+            )
+        except UnhandledCommand:
+            # The region is older and doesn't publish digests, so fetch
+            # every kind of configuration every time.
+            return {}
+        else:
+            return response["digests"]
+
+    @inlineCallbacks
+    def _getConfiguration(self, force=False, digests=None):
+        if force or not self._isFresh():
+            yield self._fetchConfiguration(digests)
+        answers = {kind: answer for kind, (_, answer) in self._answers.items()}
         return _Configuration(
-            controller_type=controller_type,
-            time_configuration=time_configuration,
-            dns_configuration=dns_configuration,
-            proxy_configuration=proxy_configuration,
-            syslog_configuration=syslog_configuration,
+            controller_type=answers["controller_type"],
+            time_configuration=answers["time"],
+            dns_configuration=answers["dns"],
+            proxy_configuration=answers["proxy"],
+            syslog_configuration=answers["syslog"],
             connections=self._rpc_service.connections,
         )
 
+    def _tryUpdate(self, force=False):
+        """Update the external services running on this host.
+
+        :param force: Ask the region for its configuration digests even if
+            the configuration fetched last could be applied again.
+        """
+        return self._lock.run(self._update, force)
+
     @inlineCallbacks
-    def _tryUpdate(self):
-        """Update the NTP server running on this host."""
+    def _update(self, force, digests=None):
         try:
-            config = yield self._getConfiguration()
+            config = yield self._getConfiguration(force, digests)
         except exceptions.NoSuchNode:
             # This node is not yet recognised by the region.
             self._update_interval(None)
@@ -478,6 +546,26 @@ class RackExternalService(TimerService):
         yield DeferredList(defers)
         self._update_interval(config)
 
+    def refresh(self, digests):
+        """Update the external services for configuration the region pushed.
+
+        :param digests: The region's digest for each kind of configuration.
+            Nothing is fetched when they all match those of the
+            configuration fetched last.
+        """
+        return self._lock.run(self._refresh, digests)
+
+    def _refresh(self, digests):
+        # Every region worker pushes the same change, so by the time the
+        # lock is acquired it may have been fetched already.
+        if all(
+            digests.get(kind) is not None
+            and self._answers.get(kind, (None,))[0] == digests.get(kind)
+            for kind, _ in self.CONFIG_COMMANDS
+        ):
+            return succeed(None)
+        return self._update(True, digests)
+
 
 @attr.s
 class _Configuration:
@@ -5,23 +5,26 @@
 
 __all__ = ["HTTPResource", "RackHTTPService"]
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from datetime import timedelta
 import os
 import sys
 
 import attr
 from netaddr import IPAddress
+from tftp.backend import FilesystemReader
 from tftp.errors import AccessViolation, FileNotFound
 from twisted.application.internet import TimerService
-from twisted.internet import reactor
+from twisted.internet import abstract, reactor
 from twisted.internet.defer import maybeDeferred
-from twisted.internet.task import deferLater
+from twisted.internet.interfaces import IPullProducer
 from twisted.internet.threads import deferToThread
 from twisted.python import context
 from twisted.web import resource
+from twisted.web.http import CACHED, datetimeToString
 from twisted.web.server import NOT_DONE_YET
-from twisted.web.static import NoRangeStaticProducer
+from twisted.web.static import NoRangeStaticProducer, SingleRangeStaticProducer
+from zope.interface import implementer
 
 from provisioningserver import services
 from provisioningserver.events import EVENT_TYPES, send_node_event_ip_address
@@ -203,21 +206,254 @@ class _Configuration:
     upstream_http = attr.ib(converter=frozenset)
 
 
+class HTTPRequestEventLog:
+    """Aggregate node events for HTTP requests before sending them.
+
+    A booting node asks for the same files over and over again, and for
+    large files often in several ranges. Rather than calling the region
+    for every request, identical events seen within `interval` seconds
+    are sent once.
+    """
+
+    interval = 1.0
+
+    def __init__(self, clock=reactor):
+        super().__init__()
+        self.clock = clock
+        self.pending = OrderedDict()
+        self._call = None
+
+    def record(self, event_type, ip_address, description=None):
+        """Record an event to be sent to the region."""
+        self.pending[event_type, ip_address, description] = None
+        if self._call is None:
+            self._call = self.clock.callLater(self.interval, self.flush)
+
+    def flush(self):
+        """Send every pending event to the region, in order."""
+        if self._call is not None:
+            if self._call.active():
+                self._call.cancel()
+            self._call = None
+        pending, self.pending = self.pending, OrderedDict()
+        for event_type, ip_address, description in pending:
+            kwargs = {"event_type": event_type, "ip_address": ip_address}
+            if description is not None:
+                kwargs["description"] = description
+            d = maybeDeferred(send_node_event_ip_address, **kwargs)
+            d.addErrback(log.err, "Logging HTTP request failed.")
+
+
+class UnsatisfiableRange(Exception):
+    """Raised when a `Range` header selects nothing from a file."""
+
+
+def parse_byte_range(header, size):
+    """Parse the `Range` header of a request for a file of `size` bytes.
+
+    Only a single byte range is supported; a header asking for more than
+    one range, or one that cannot be parsed, is ignored as RFC 7233 allows.
+
+    :return: The first and last positions selected, or `None` when the
+        header should be ignored.
+    :raise UnsatisfiableRange: When the range lies beyond the file.
+    """
+    unit, _, spec = header.partition(b"=")
+    if unit.strip().lower() != b"bytes" or b"," in spec:
+        return None
+    first, sep, last = spec.strip().partition(b"-")
+    if sep != b"-" or not (first or last):
+        return None
+    elif (first and not first.isdigit()) or (last and not last.isdigit()):
+        return None
+    elif first:
+        start, end = int(first), int(last or size - 1)
+        if last and end < start:
+            return None
+        elif start >= size:
+            raise UnsatisfiableRange()
+        return start, min(end, size - 1)
+    else:
+        # A suffix range, for the last bytes of the file.
+        length = int(last)
+        if length == 0 or size == 0:
+            raise UnsatisfiableRange()
+        return max(size - length, 0), size - 1
+
+
+@implementer(IPullProducer)
+class SendfileProducer:
+    """Send part of a file directly to the request's socket.
+
+    This uses `os.sendfile` so the file's contents never pass through
+    Python. While sending, this replaces the HTTP channel as the producer
+    of the transport, and puts it back when done; the channel has nothing
+    to write in the meantime. The transport asks for more only once its
+    buffer is empty, so the data always follows the response headers.
+
+    Like the producers in `twisted.web.static` this closes the file and
+    finishes the request when done.
+    """
+
+    # The most to send for each time the socket is writable.
+    chunkSize = 2 ** 20
+
+    def __init__(self, request, fileObject, offset, size):
+        self.request = request
+        self.fileObject = fileObject
+        self.offset = offset
+        self.remaining = size
+        self.transport = request.channel.transport
+        self._channel = None
+        self._started = False
+
+    @staticmethod
+    def supports(request):
+        """Whether the request's transport is a socket to send to."""
+        transport = getattr(request.channel, "transport", None)
+        return (
+            hasattr(os, "sendfile")
+            and isinstance(transport, abstract.FileDescriptor)
+            and hasattr(transport, "fileno")
+        )
+
+    def start(self):
+        # Buffer the headers in the transport.
+        self.request.write(b"")
+        self._channel = (
+            self.transport.producer,
+            self.transport.streamingProducer,
+        )
+        if self._channel[0] is not None:
+            self.transport.unregisterProducer()
+        self.transport.registerProducer(self, False)
+
+    def resumeProducing(self):
+        if self.request is None:
+            return
+        elif not self._started:
+            # Called as this is registered; wait for the headers to be
+            # written before sending the file.
+            self._started = True
+            self.transport.startWriting()
+            return
+        try:
+            sent = os.sendfile(
+                self.transport.fileno(),
+                self.fileObject.fileno(),
+                self.offset,
+                min(self.remaining, self.chunkSize),
+            )
+        except BlockingIOError:
+            self.transport.startWriting()
+            return
+        except OSError:
+            log.err(None, "Failed to send boot file.")
+            self._stop()
+            return
+        if sent == 0:
+            # The file has shrunk since the response started.
+            log.msg("Boot file was truncated while being sent.")
+            self._stop()
+            return
+        self.offset += sent
+        self.remaining -= sent
+        if self.remaining > 0:
+            self.transport.startWriting()
+        else:
+            request = self.request
+            self._restore()
+            request.finish()
+
+    def stopProducing(self):
+        # The connection has been lost.
+        if self.request is not None:
+            self.fileObject.close()
+            self.request = None
+
+    def _restore(self):
+        self.transport.unregisterProducer()
+        producer, streaming = self._channel
+        if producer is not None:
+            self.transport.registerProducer(producer, streaming)
+        self.fileObject.close()
+        self.request = None
+
+    def _stop(self):
+        # Not all the promised data can be sent, so the response cannot be
+        # completed; drop the connection.
+        self._restore()
+        self.transport.loseConnection()
+
+
+def render_file(request, reader):
+    """Respond with the file opened by a `FilesystemReader`.
+
+    This honours `If-None-Match`, `If-Modified-Since`, `Range` and
+    `If-Range`, and uses `SendfileProducer` when it can.
+    """
+    fileObject = reader.file_obj
+    stat = os.fstat(fileObject.fileno())
+    size, mtime = stat.st_size, int(stat.st_mtime)
+    etag = b'"%x-%x"' % (mtime, size)
+    lastModified = datetimeToString(mtime)
+    request.setHeader(b"Accept-Ranges", b"bytes")
+    if request.getHeader(b"If-None-Match") is None:
+        request.setETag(etag)
+        cached = request.setLastModified(mtime)
+    else:
+        # The entity tag takes precedence over the modification time.
+        request.setHeader(b"Last-Modified", lastModified)
+        cached = request.setETag(etag)
+    if cached is CACHED:
+        reader.finish()
+        request.finish()
+        return
+
+    offset, length = 0, size
+    byteRange = request.getHeader(b"Range")
+    ifRange = request.getHeader(b"If-Range")
+    if byteRange is not None and ifRange in (None, etag, lastModified):
+        try:
+            selected = parse_byte_range(byteRange, size)
+        except UnsatisfiableRange:
+            request.setResponseCode(416)
+            request.setHeader(b"Content-Range", b"bytes */%d" % size)
+            request.setHeader(b"Content-Length", b"0")
+            reader.finish()
+            request.finish()
+            return
+        if selected is not None:
+            start, end = selected
+            offset, length = start, end - start + 1
+            request.setResponseCode(206)
+            request.setHeader(
+                b"Content-Range", b"bytes %d-%d/%d" % (start, end, size)
+            )
+    request.setHeader(b"Content-Length", b"%d" % length)
+
+    if request.method == b"HEAD" or length == 0:
+        reader.finish()
+        request.write(b"")
+        request.finish()
+    elif SendfileProducer.supports(request):
+        SendfileProducer(request, fileObject, offset, length).start()
+    else:
+        SingleRangeStaticProducer(request, fileObject, offset, length).start()
+
+
 class HTTPLogResource(resource.Resource):
     isLeaf = True
 
+    def __init__(self, events=None):
+        super().__init__()
+        self.events = HTTPRequestEventLog() if events is None else events
+
     def render_GET(self, request):
         # Extract the original path and original IP of the request.
         path = request.getHeader("X-Original-URI")
         remote_host = request.getHeader("X-Original-Remote-IP")
 
-        def log_event_ephemeral_loading(result):
-            if "squashfs" in path:
-                send_node_event_ip_address(
-                    event_type=EVENT_TYPES.LOADING_EPHEMERAL,
-                    ip_address=remote_host,
-                )
-
         # Log the HTTP request to rackd.log and push that event to the
         # region controller.
         log.info(
@@ -225,16 +461,9 @@ class HTTPLogResource(resource.Resource):
             path=path,
             remote_host=remote_host,
         )
-        d = deferLater(
-            reactor,
-            0,
-            send_node_event_ip_address,
-            event_type=EVENT_TYPES.NODE_HTTP_REQUEST,
-            ip_address=remote_host,
-            description=path,
-        )
-        d.addCallback(log_event_ephemeral_loading)
-        d.addErrback(log.err, "Logging HTTP request failed.")
+        self.events.record(EVENT_TYPES.NODE_HTTP_REQUEST, remote_host, path)
+        if "squashfs" in path:
+            self.events.record(EVENT_TYPES.LOADING_EPHEMERAL, remote_host)
         # Respond empty to nginx.
         return b""
 
@@ -242,6 +471,10 @@ class HTTPLogResource(resource.Resource):
 class HTTPBootResource(resource.Resource):
     isLeaf = True
 
+    def __init__(self, events=None):
+        super().__init__()
+        self.events = HTTPRequestEventLog() if events is None else events
+
     def render_GET(self, request):
         # Be sure that the TFTP endpoint is running.
         try:
@@ -284,6 +517,13 @@ class HTTPBootResource(resource.Resource):
             request.finish()
 
         def writeResponse(reader):
+            # Files from the boot resources are sent straight from disk.
+            # Everything else, such as generated configuration, is produced
+            # by reading through the reader.
+            if isinstance(reader, FilesystemReader):
+                render_file(request, reader)
+                return
+
             # Some readers from `tftp` do not provide a way to get the size
             # of the generated content. Only set `Content-Length` when size
             # can be determined for the response.
@@ -322,15 +562,7 @@ class HTTPBootResource(resource.Resource):
             path=log_path,
             remoteHost=remoteHost,
         )
-        d = deferLater(
-            reactor,
-            0,
-            send_node_event_ip_address,
-            event_type=EVENT_TYPES.NODE_HTTP_REQUEST,
-            ip_address=remoteHost,
-            description=log_path,
-        )
-        d.addErrback(log.err, "Logging HTTP request failed.")
+        self.events.record(EVENT_TYPES.NODE_HTTP_REQUEST, remoteHost, log_path)
 
         # Response is handled in the defer.
         return NOT_DONE_YET
@@ -341,8 +573,9 @@ class HTTPResource(resource.Resource):
 
     def __init__(self):
         super().__init__()
-        self.putChild(b"boot", HTTPBootResource())
-        self.putChild(b"log", HTTPLogResource())
+        events = HTTPRequestEventLog()
+        self.putChild(b"boot", HTTPBootResource(events))
+        self.putChild(b"log", HTTPLogResource(events))
         self.putChild(
             b"metrics", PrometheusMetricsResource(PROMETHEUS_METRICS)
         )
@@ -13,11 +13,12 @@ from twisted.application.service import Service
 from twisted.internet import reactor, task
 from twisted.internet.defer import inlineCallbacks
 from twisted.internet.protocol import DatagramProtocol
+from twisted.protocols.amp import UnhandledCommand
 
 from provisioningserver.logger import get_maas_logger
 from provisioningserver.path import get_data_path
 from provisioningserver.rpc.exceptions import NoConnectionsAvailable
-from provisioningserver.rpc.region import UpdateLease
+from provisioningserver.rpc.region import UpdateLease, UpdateLeases
 from provisioningserver.utils.twisted import pause, retries
 
 maaslog = get_maas_logger("lease_socket_service")
@@ -34,6 +35,9 @@ class LeaseSocketService(Service, DatagramProtocol):
     # None, or a Deferred that will fire when the processor exits.
     done = None
 
+    # The most notifications to send to the region in one `UpdateLeases`.
+    batch_size = 100
+
     def __init__(self, client_service, reactor):
         self.client_service = client_service
         self.reactor = reactor
@@ -85,27 +89,28 @@ class LeaseSocketService(Service, DatagramProtocol):
         self.notifications.append(notification)
 
     def processNotifications(self, clock=reactor):
-        """Process all notifications."""
+        """Process all notifications, in batches of up to `batch_size`."""
 
-        def gen_notifications(notifications):
+        def gen_batches(notifications):
             while len(notifications) != 0:
-                yield notifications.popleft()
+                size = min(self.batch_size, len(notifications))
+                yield [notifications.popleft() for _ in range(size)]
 
         return task.coiterate(
-            self.processNotification(notification, clock=clock)
-            for notification in gen_notifications(self.notifications)
+            self.processNotificationBatch(batch, clock=clock)
+            for batch in gen_batches(self.notifications)
         )
 
     @inlineCallbacks
-    def processNotification(self, notification, clock=reactor):
-        """Send a notification to the region."""
+    def processNotificationBatch(self, notifications, clock=reactor):
+        """Send a batch of notifications to the region."""
         client = None
         for elapsed, remaining, wait in retries(30, 10, clock):
             try:
                 client = yield self.client_service.getClientNow()
                 break
             except NoConnectionsAvailable:
-                yield pause(wait, self.clock)
+                yield pause(wait, clock)
         else:
             maaslog.error(
                 "Can't send DHCP lease information, no RPC "
@@ -113,8 +118,16 @@ class LeaseSocketService(Service, DatagramProtocol):
             )
             return
 
-        # Notification contains all the required data except for the cluster
-        # UUID. Add that into the notification and send the information to
-        # the region for processing.
-        notification["cluster_uuid"] = client.localIdent
-        yield client(UpdateLease, **notification)
+        try:
+            yield client(
+                UpdateLeases,
+                cluster_uuid=client.localIdent,
+                updates=notifications,
+            )
+        except UnhandledCommand:
+            # The region has not been upgraded to support batches, so send
+            # the notifications one at a time instead. Each contains all the
+            # required data except for the cluster UUID.
+            for notification in notifications:
+                notification["cluster_uuid"] = client.localIdent
+                yield client(UpdateLease, **notification)
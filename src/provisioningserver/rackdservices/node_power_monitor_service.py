@@ -18,7 +18,7 @@ from provisioningserver.rpc.exceptions import (
     NoConnectionsAvailable,
     NoSuchCluster,
 )
-from provisioningserver.rpc.power import query_all_nodes
+from provisioningserver.rpc.power import PowerQueryScheduler, query_all_nodes
 from provisioningserver.rpc.region import ListNodePowerParameters
 
 maaslog = get_maas_logger("power_monitor_service")
@@ -29,7 +29,9 @@ class NodePowerMonitorService(TimerService, object):
     """Service to monitor the power status of all nodes in this cluster."""
 
     check_interval = timedelta(seconds=15).total_seconds()
-    max_nodes_at_once = 5
+    max_nodes_at_once = 25
+    # Spread each cycle's queries over most of the interval.
+    query_spread = timedelta(seconds=10).total_seconds()
 
     def __init__(self, clock=None):
         # Call self.query_nodes() every self.check_interval.
@@ -37,6 +39,7 @@ class NodePowerMonitorService(TimerService, object):
             self.check_interval, self.try_query_nodes
         )
         self.clock = clock
+        self.scheduler = None
 
     def try_query_nodes(self):
         """Attempt to query nodes' power states.
@@ -58,20 +61,29 @@ class NodePowerMonitorService(TimerService, object):
     @inlineCallbacks
     def query_nodes(self, client):
         # Get the nodes' power parameters from the region. Keep getting more
-        # power parameters until the region returns an empty list.
+        # power parameters until the region returns an empty list, then
+        # query them all in one go so the scheduler can spread them out.
+        power_parameters = []
         while True:
             response = yield client(
                 ListNodePowerParameters, uuid=client.localIdent
             )
-            power_parameters = response["nodes"]
-            if len(power_parameters) > 0:
-                yield query_all_nodes(
-                    power_parameters,
-                    max_concurrency=self.max_nodes_at_once,
-                    clock=self.clock,
-                )
+            if len(response["nodes"]) > 0:
+                power_parameters.extend(response["nodes"])
             else:
                 break
+        if len(power_parameters) > 0:
+            # The scheduler learns about each BMC as it goes, so keep it
+            # between cycles.
+            if self.scheduler is None:
+                self.scheduler = PowerQueryScheduler(
+                    max_concurrency=self.max_nodes_at_once, clock=self.clock
+                )
+            yield query_all_nodes(
+                power_parameters,
+                scheduler=self.scheduler,
+                spread=self.query_spread,
+            )
 
     def query_nodes_failed(self, failure, localIdent):
         if failure.check(NoSuchCluster):
@@ -11,7 +11,8 @@ from unittest.mock import Mock
 import attr
 from testtools.matchers import Equals, Is, IsInstance, MatchesStructure
 from twisted.internet import reactor
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import inlineCallbacks, succeed
+from twisted.internet.task import Clock
 
 from maastesting.factory import factory
 from maastesting.fixtures import MAASRootFixture
@@ -42,24 +43,33 @@ def prepareRegion(
     proxy_port=8000,
     proxy_allowed_cidrs=None,
     proxy_prefer_v4_proxy=False,
-    syslog_port=5247
+    syslog_port=5247,
+    digests=None
 ):
     """Set up a mock region controller.
 
     It responds to `GetControllerType`, `GetTimeConfiguration`,
     `GetDNSConfiguration`, `GetProxyConfiguration`, and
-    `GetSyslogConfiguration`.
+    `GetSyslogConfiguration`. When `digests` are given it also responds to
+    `GetConfigurationDigests` with them.
 
     :return: The running RPC service, and the protocol instance.
     """
-    fixture = test.useFixture(MockLiveClusterToRegionRPCFixture())
-    protocol, connecting = fixture.makeEventLoop(
+    commands = [
         region.GetControllerType,
         region.GetTimeConfiguration,
         region.GetDNSConfiguration,
         region.GetProxyConfiguration,
         region.GetSyslogConfiguration,
-    )
+    ]
+    if digests is not None:
+        commands.append(region.GetConfigurationDigests)
+    fixture = test.useFixture(MockLiveClusterToRegionRPCFixture())
+    protocol, connecting = fixture.makeEventLoop(*commands)
+    if digests is not None:
+        protocol.GetConfigurationDigests.side_effect = lambda *args, **kwargs: succeed(
+            {"digests": dict(digests)}
+        )
     protocol.RegisterRackController.side_effect = always_succeed_with(
         {"system_id": factory.make_name("maas-id")}
     )
@@ -336,6 +346,120 @@ class TestRackNTP(MAASTestCase):
         self.assertThat(logger.output, Equals(""))
 
 
+def make_digests():
+    return {
+        kind: factory.make_name("digest")
+        for kind, _ in external.RackExternalService.CONFIG_COMMANDS
+    }
+
+
+class TestRackExternalServiceDigests(MAASTestCase):
+    """Tests for how `RackExternalService` uses configuration digests."""
+
+    run_tests_with = MAASTwistedRunTest.make_factory(timeout=5000)
+
+    def assertFetched(self, protocol, count):
+        for _, command in external.RackExternalService.CONFIG_COMMANDS:
+            self.assertEqual(
+                count,
+                getattr(protocol, command.__name__).call_count,
+                command.__name__,
+            )
+
+    @inlineCallbacks
+    def startService(self, rpc_service, services=None):
+        service = make_startable_RackExternalService(
+            self, rpc_service, Clock(), [] if services is None else services
+        )
+        yield service.startService()
+        self.addCleanup((yield service.stopService))
+        return service
+
+    @inlineCallbacks
+    def test_fetches_every_kind_from_older_region(self):
+        rpc_service, protocol = yield prepareRegion(self)
+        service = yield self.startService(rpc_service)
+
+        yield service._orig_tryUpdate()
+        yield service._orig_tryUpdate()
+
+        self.assertFetched(protocol, 2)
+
+    @inlineCallbacks
+    def test_fetches_only_kinds_whose_digest_changed(self):
+        digests = make_digests()
+        rpc_service, protocol = yield prepareRegion(self, digests=digests)
+        service = yield self.startService(rpc_service)
+
+        yield service._orig_tryUpdate(force=True)
+        digests["dns"] = factory.make_name("digest")
+        yield service._orig_tryUpdate(force=True)
+
+        self.assertEqual(2, protocol.GetConfigurationDigests.call_count)
+        self.assertEqual(2, protocol.GetDNSConfiguration.call_count)
+        self.assertEqual(1, protocol.GetTimeConfiguration.call_count)
+        self.assertEqual(1, protocol.GetSyslogConfiguration.call_count)
+
+    @inlineCallbacks
+    def test_applies_fetched_configuration_again_between_fetches(self):
+        rpc_service, protocol = yield prepareRegion(
+            self, digests=make_digests()
+        )
+        ntp = external.RackNTP()
+        self.patch_autospec(ntp, "_tryUpdate")
+        service = yield self.startService(rpc_service, [("NTP", ntp)])
+
+        yield service._orig_tryUpdate()
+        yield service._orig_tryUpdate()
+
+        self.assertEqual(1, protocol.GetConfigurationDigests.call_count)
+        self.assertFetched(protocol, 1)
+        self.assertEqual(2, ntp._tryUpdate.call_count)
+        first, second = ntp._tryUpdate.call_args_list
+        self.assertEqual(first, second)
+
+    @inlineCallbacks
+    def test_asks_for_digests_again_after_fetch_interval(self):
+        rpc_service, protocol = yield prepareRegion(
+            self, digests=make_digests()
+        )
+        service = yield self.startService(rpc_service)
+
+        yield service._orig_tryUpdate()
+        service.clock.advance(service.INTERVAL_FETCH)
+        yield service._orig_tryUpdate()
+
+        self.assertEqual(2, protocol.GetConfigurationDigests.call_count)
+        self.assertFetched(protocol, 1)
+
+    @inlineCallbacks
+    def test_refresh_does_nothing_when_digests_match(self):
+        digests = make_digests()
+        rpc_service, protocol = yield prepareRegion(self, digests=digests)
+        service = yield self.startService(rpc_service)
+
+        yield service._orig_tryUpdate()
+        yield service.refresh(digests)
+
+        self.assertEqual(1, protocol.GetConfigurationDigests.call_count)
+        self.assertFetched(protocol, 1)
+
+    @inlineCallbacks
+    def test_refresh_fetches_kinds_whose_digest_changed(self):
+        digests = make_digests()
+        rpc_service, protocol = yield prepareRegion(self, digests=digests)
+        service = yield self.startService(rpc_service)
+
+        yield service._orig_tryUpdate()
+        digests["proxy"] = factory.make_name("digest")
+        yield service.refresh(digests)
+
+        # The pushed digests are used; they're not asked for again.
+        self.assertEqual(1, protocol.GetConfigurationDigests.call_count)
+        self.assertEqual(2, protocol.GetProxyConfiguration.call_count)
+        self.assertEqual(1, protocol.GetDNSConfiguration.call_count)
+
+
 class TestRackNetworkTimeProtocolService_Errors(MAASTestCase):
     """Tests for error handing in `RackExternalService`."""
 
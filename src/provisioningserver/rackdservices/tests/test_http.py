@@ -5,28 +5,41 @@
 
 __all__ = []
 
+import os
 import random
-from unittest.mock import ANY, Mock
+from unittest.mock import call, Mock
 
 import attr
 from testtools.matchers import (
     Contains,
     Equals,
     FileContains,
+    GreaterThan,
     IsInstance,
     MatchesStructure,
 )
+from tftp.backend import FilesystemReader
 from tftp.errors import AccessViolation, FileNotFound
 from twisted.application.service import Service
 from twisted.internet import reactor
 from twisted.internet.defer import fail, inlineCallbacks, succeed
+from twisted.internet.task import Clock
+from twisted.python.filepath import FilePath
+from twisted.web import resource
+from twisted.web.client import Agent, HTTPConnectionPool, readBody
+from twisted.web.http import datetimeToString
 from twisted.web.http_headers import Headers
-from twisted.web.server import NOT_DONE_YET, Request
+from twisted.web.server import NOT_DONE_YET, Request, Site
 from twisted.web.test.test_web import DummyChannel, DummyRequest
 
 from maastesting.factory import factory
 from maastesting.fixtures import MAASRootFixture
-from maastesting.matchers import DocTestMatches, MockCalledOnceWith
+from maastesting.matchers import (
+    DocTestMatches,
+    MockCalledOnceWith,
+    MockCallsMatch,
+    MockNotCalled,
+)
 from maastesting.testcase import MAASTestCase, MAASTwistedRunTest
 from maastesting.twisted import always_succeed_with, TwistedLoggerFixture
 from provisioningserver import services
@@ -288,10 +301,8 @@ class TestHTTPLogResource(MAASTestCase):
         )
 
         log_info = self.patch(http.log, "info")
-        mock_deferLater = self.patch(http, "deferLater")
-        mock_deferLater.side_effect = always_succeed_with(None)
-
-        resource = http.HTTPLogResource()
+        events = http.HTTPRequestEventLog(Clock())
+        resource = http.HTTPLogResource(events)
         resource.render_GET(request)
 
         self.assertThat(
@@ -300,16 +311,8 @@ class TestHTTPLogResource(MAASTestCase):
                 "{path} requested by {remote_host}", path=path, remote_host=ip
             ),
         )
-        self.assertThat(
-            mock_deferLater,
-            MockCalledOnceWith(
-                ANY,
-                0,
-                http.send_node_event_ip_address,
-                event_type=EVENT_TYPES.NODE_HTTP_REQUEST,
-                ip_address=ip,
-                description=path,
-            ),
+        self.assertEqual(
+            [(EVENT_TYPES.NODE_HTTP_REQUEST, ip, path)], list(events.pending)
         )
 
     def test_render_GET_logs_node_event_status_message(self):
@@ -320,32 +323,282 @@ class TestHTTPLogResource(MAASTestCase):
             {"X-Original-URI": [path], "X-Original-Remote-IP": [ip]}
         )
 
-        mock_deferLater = self.patch(http, "deferLater")
-        mock_deferLater.side_effect = always_succeed_with(None)
-        mock_send_node_event_ip_address = self.patch(
-            http, "send_node_event_ip_address"
+        events = http.HTTPRequestEventLog(Clock())
+        resource = http.HTTPLogResource(events)
+        resource.render_GET(request)
+
+        self.assertEqual(
+            [
+                (EVENT_TYPES.NODE_HTTP_REQUEST, ip, path),
+                (EVENT_TYPES.LOADING_EPHEMERAL, ip, None),
+            ],
+            list(events.pending),
         )
 
-        resource = http.HTTPLogResource()
-        resource.render_GET(request)
 
+class TestHTTPRequestEventLog(MAASTestCase):
+    def test_record_sends_events_after_interval(self):
+        clock = Clock()
+        send_event = self.patch(http, "send_node_event_ip_address")
+        events = http.HTTPRequestEventLog(clock)
+        ip = factory.make_ip_address()
+        events.record(EVENT_TYPES.NODE_HTTP_REQUEST, ip, "path")
+        self.assertThat(send_event, MockNotCalled())
+        clock.advance(events.interval)
         self.assertThat(
-            mock_deferLater,
+            send_event,
             MockCalledOnceWith(
-                ANY,
-                0,
-                http.send_node_event_ip_address,
                 event_type=EVENT_TYPES.NODE_HTTP_REQUEST,
                 ip_address=ip,
-                description=path,
+                description="path",
             ),
         )
+        self.assertEqual({}, events.pending)
+
+    def test_record_aggregates_identical_events(self):
+        clock = Clock()
+        send_event = self.patch(http, "send_node_event_ip_address")
+        events = http.HTTPRequestEventLog(clock)
+        ip = factory.make_ip_address()
+        for _ in range(3):
+            events.record(EVENT_TYPES.NODE_HTTP_REQUEST, ip, "path")
+            events.record(EVENT_TYPES.NODE_HTTP_REQUEST, ip, "other")
+            events.record(EVENT_TYPES.LOADING_EPHEMERAL, ip)
+        clock.advance(events.interval)
         self.assertThat(
-            mock_send_node_event_ip_address,
-            MockCalledOnceWith(
-                event_type=EVENT_TYPES.LOADING_EPHEMERAL, ip_address=ip
+            send_event,
+            MockCallsMatch(
+                call(
+                    event_type=EVENT_TYPES.NODE_HTTP_REQUEST,
+                    ip_address=ip,
+                    description="path",
+                ),
+                call(
+                    event_type=EVENT_TYPES.NODE_HTTP_REQUEST,
+                    ip_address=ip,
+                    description="other",
+                ),
+                call(event_type=EVENT_TYPES.LOADING_EPHEMERAL, ip_address=ip),
             ),
         )
+        self.assertEqual([], clock.getDelayedCalls())
+
+    def test_flush_logs_failures(self):
+        send_event = self.patch(http, "send_node_event_ip_address")
+        send_event.side_effect = factory.make_exception()
+        events = http.HTTPRequestEventLog(Clock())
+        events.record(EVENT_TYPES.NODE_HTTP_REQUEST, "10.0.0.1", "path")
+        with TwistedLoggerFixture() as logger:
+            events.flush()
+        self.assertThat(
+            logger.output, Contains("Logging HTTP request failed.")
+        )
+
+
+class TestParseByteRange(MAASTestCase):
+
+    scenarios = (
+        ("first-last", {"header": b"bytes=10-19", "expected": (10, 19)}),
+        ("first", {"header": b"bytes=90-", "expected": (90, 99)}),
+        ("suffix", {"header": b"bytes=-10", "expected": (90, 99)}),
+        ("long-suffix", {"header": b"bytes=-200", "expected": (0, 99)}),
+        ("past-end", {"header": b"bytes=50-200", "expected": (50, 99)}),
+        ("other-unit", {"header": b"items=0-10", "expected": None}),
+        ("multiple", {"header": b"bytes=0-1,5-6", "expected": None}),
+        ("backwards", {"header": b"bytes=20-10", "expected": None}),
+        ("no-numbers", {"header": b"bytes=-", "expected": None}),
+        ("garbage", {"header": b"bytes=a-b", "expected": None}),
+        (
+            "beyond",
+            {"header": b"bytes=100-", "expected": http.UnsatisfiableRange},
+        ),
+        (
+            "empty-suffix",
+            {"header": b"bytes=-0", "expected": http.UnsatisfiableRange},
+        ),
+    )
+
+    def test_parse_byte_range(self):
+        if self.expected is http.UnsatisfiableRange:
+            self.assertRaises(
+                self.expected,
+                http.parse_byte_range,
+                self.header,
+                100,
+            )
+        else:
+            self.assertEqual(
+                self.expected, http.parse_byte_range(self.header, 100)
+            )
+
+
+class TestRenderFile(MAASTestCase):
+    def make_request(self, method=b"GET", **headers):
+        request = Request(DummyChannel(), False)
+        request.method = method
+        request.clientproto = b"HTTP/1.1"
+        request.requestHeaders = Headers(
+            {
+                name.replace("_", "-"): [value]
+                for name, value in headers.items()
+            }
+        )
+        return request
+
+    def make_reader(self, size=1000):
+        self.content = os.urandom(size)
+        path = self.make_file(contents=self.content)
+        return FilesystemReader(FilePath(path))
+
+    def render(self, request, reader):
+        transport = request.channel.transport
+        http.render_file(request, reader)
+        for producer, _ in transport.producers:
+            while not request.finished:
+                producer.resumeProducing()
+        self.assertTrue(request.finished)
+        written = transport.written.getvalue()
+        return written.split(b"\r\n\r\n", 1)[1]
+
+    def test_sends_whole_file(self):
+        request = self.make_request()
+        reader = self.make_reader()
+        body = self.render(request, reader)
+        self.assertEqual(200, request.code)
+        self.assertEqual(self.content, body)
+        self.assertEqual(
+            [b"1000"], request.responseHeaders.getRawHeaders(b"Content-Length")
+        )
+        self.assertEqual(
+            [b"bytes"], request.responseHeaders.getRawHeaders(b"Accept-Ranges")
+        )
+        self.assertTrue(reader.file_obj.closed)
+
+    def test_sends_range(self):
+        request = self.make_request(Range=b"bytes=100-199")
+        body = self.render(request, self.make_reader())
+        self.assertEqual(206, request.code)
+        self.assertEqual(self.content[100:200], body)
+        self.assertEqual(
+            [b"bytes 100-199/1000"],
+            request.responseHeaders.getRawHeaders(b"Content-Range"),
+        )
+
+    def test_unsatisfiable_range(self):
+        request = self.make_request(Range=b"bytes=1000-")
+        reader = self.make_reader()
+        self.assertEqual(b"", self.render(request, reader))
+        self.assertEqual(416, request.code)
+        self.assertEqual(
+            [b"bytes */1000"],
+            request.responseHeaders.getRawHeaders(b"Content-Range"),
+        )
+        self.assertTrue(reader.file_obj.closed)
+
+    def test_ignores_range_when_if_range_does_not_match(self):
+        request = self.make_request(
+            Range=b"bytes=100-199", If_Range=b'"stale"'
+        )
+        body = self.render(request, self.make_reader())
+        self.assertEqual(200, request.code)
+        self.assertEqual(self.content, body)
+
+    def test_not_modified_for_matching_etag(self):
+        reader = self.make_reader()
+        stat = os.stat(reader.file_path.path)
+        etag = b'"%x-%x"' % (int(stat.st_mtime), stat.st_size)
+        request = self.make_request(If_None_Match=etag)
+        self.assertEqual(b"", self.render(request, reader))
+        self.assertEqual(304, request.code)
+        self.assertEqual(
+            [etag], request.responseHeaders.getRawHeaders(b"ETag")
+        )
+
+    def test_not_modified_since(self):
+        reader = self.make_reader()
+        mtime = os.stat(reader.file_path.path).st_mtime
+        request = self.make_request(
+            If_Modified_Since=datetimeToString(mtime + 10)
+        )
+        self.assertEqual(b"", self.render(request, reader))
+        self.assertEqual(304, request.code)
+
+    def test_etag_takes_precedence_over_modified_since(self):
+        reader = self.make_reader()
+        mtime = os.stat(reader.file_path.path).st_mtime
+        request = self.make_request(
+            If_None_Match=b'"stale"',
+            If_Modified_Since=datetimeToString(mtime + 10),
+        )
+        self.assertEqual(self.content, self.render(request, reader))
+        self.assertEqual(200, request.code)
+
+    def test_head_sends_no_body(self):
+        request = self.make_request(method=b"HEAD")
+        self.assertEqual(b"", self.render(request, self.make_reader()))
+        self.assertEqual(
+            [b"1000"], request.responseHeaders.getRawHeaders(b"Content-Length")
+        )
+
+
+class FileResource(resource.Resource):
+    isLeaf = True
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+
+    def render_GET(self, request):
+        http.render_file(request, FilesystemReader(FilePath(self.path)))
+        return NOT_DONE_YET
+
+
+class TestSendfileProducer(MAASTestCase):
+
+    run_tests_with = MAASTwistedRunTest.make_factory(timeout=5)
+
+    @inlineCallbacks
+    def fetch(self, path, headers=None):
+        port = reactor.listenTCP(
+            0, Site(FileResource(path)), interface="127.0.0.1"
+        )
+        self.addCleanup(port.stopListening)
+        pool = HTTPConnectionPool(reactor)
+        self.addCleanup(pool.closeCachedConnections)
+        agent = Agent(reactor, pool=pool)
+        url = "http://127.0.0.1:%d/" % port.getHost().port
+        response = yield agent.request(
+            b"GET", url.encode("ascii"), Headers(headers or {})
+        )
+        body = yield readBody(response)
+        return response, body
+
+    @inlineCallbacks
+    def test_sends_file_with_sendfile(self):
+        self.patch(http.SendfileProducer, "chunkSize", 4096)
+        sendfile = self.patch(os, "sendfile", Mock(side_effect=os.sendfile))
+        content = os.urandom(100000)
+        response, body = yield self.fetch(self.make_file(contents=content))
+        self.assertEqual(200, response.code)
+        self.assertEqual(content, body)
+        self.assertThat(sendfile.call_count, GreaterThan(1))
+
+    @inlineCallbacks
+    def test_sends_range_with_sendfile(self):
+        content = os.urandom(100000)
+        response, body = yield self.fetch(
+            self.make_file(contents=content), {"Range": ["bytes=5000-"]}
+        )
+        self.assertEqual(206, response.code)
+        self.assertEqual(content[5000:], body)
+
+    @inlineCallbacks
+    def test_channel_handles_next_request(self):
+        content = os.urandom(10000)
+        path = self.make_file(contents=content)
+        for _ in range(2):
+            response, body = yield self.fetch(path)
+            self.assertEqual(content, body)
 
 
 class TestHTTPBootResource(MAASTestCase):
@@ -359,6 +612,7 @@ class TestHTTPBootResource(MAASTestCase):
         self.tftp.backend = Mock()
         self.tftp.backend.get_reader = Mock()
         self.tftp.setServiceParent(services)
+        self.events = http.HTTPRequestEventLog(Clock())
 
         def teardown():
             if self.tftp:
@@ -400,10 +654,7 @@ class TestHTTPBootResource(MAASTestCase):
         )
 
         self.patch(http.log, "info")
-        mock_deferLater = self.patch(http, "deferLater")
-        mock_deferLater.side_effect = always_succeed_with(None)
-
-        resource = http.HTTPBootResource()
+        resource = http.HTTPBootResource(self.events)
         yield self.render_GET(resource, request)
 
         self.assertEquals(503, request.responseCode)
@@ -424,10 +675,7 @@ class TestHTTPBootResource(MAASTestCase):
         )
 
         self.patch(http.log, "info")
-        mock_deferLater = self.patch(http, "deferLater")
-        mock_deferLater.side_effect = always_succeed_with(None)
-
-        resource = http.HTTPBootResource()
+        resource = http.HTTPBootResource(self.events)
         yield self.render_GET(resource, request)
 
         self.assertEquals(400, request.responseCode)
@@ -445,10 +693,7 @@ class TestHTTPBootResource(MAASTestCase):
         )
 
         self.patch(http.log, "info")
-        mock_deferLater = self.patch(http, "deferLater")
-        mock_deferLater.side_effect = always_succeed_with(None)
-
-        resource = http.HTTPBootResource()
+        resource = http.HTTPBootResource(self.events)
         yield self.render_GET(resource, request)
 
         self.assertEquals(400, request.responseCode)
@@ -472,12 +717,9 @@ class TestHTTPBootResource(MAASTestCase):
         )
 
         self.patch(http.log, "info")
-        mock_deferLater = self.patch(http, "deferLater")
-        mock_deferLater.side_effect = always_succeed_with(None)
-
         self.tftp.backend.get_reader.return_value = fail(AccessViolation())
 
-        resource = http.HTTPBootResource()
+        resource = http.HTTPBootResource(self.events)
         yield self.render_GET(resource, request)
 
         self.assertEquals(403, request.responseCode)
@@ -498,12 +740,9 @@ class TestHTTPBootResource(MAASTestCase):
         )
 
         self.patch(http.log, "info")
-        mock_deferLater = self.patch(http, "deferLater")
-        mock_deferLater.side_effect = always_succeed_with(None)
-
         self.tftp.backend.get_reader.return_value = fail(FileNotFound(path))
 
-        resource = http.HTTPBootResource()
+        resource = http.HTTPBootResource(self.events)
         yield self.render_GET(resource, request)
 
         self.assertEquals(404, request.responseCode)
@@ -524,13 +763,10 @@ class TestHTTPBootResource(MAASTestCase):
         )
 
         self.patch(http.log, "info")
-        mock_deferLater = self.patch(http, "deferLater")
-        mock_deferLater.side_effect = always_succeed_with(None)
-
         exc = factory.make_exception("internal error")
         self.tftp.backend.get_reader.return_value = fail(exc)
 
-        resource = http.HTTPBootResource()
+        resource = http.HTTPBootResource(self.events)
         yield self.render_GET(resource, request)
 
         self.assertEquals(500, request.responseCode)
@@ -551,14 +787,11 @@ class TestHTTPBootResource(MAASTestCase):
         )
 
         self.patch(http.log, "info")
-        mock_deferLater = self.patch(http, "deferLater")
-        mock_deferLater.side_effect = always_succeed_with(None)
-
         content = factory.make_string(size=100).encode("utf-8")
         reader = BytesReader(content)
         self.tftp.backend.get_reader.return_value = succeed(reader)
 
-        resource = http.HTTPBootResource()
+        resource = http.HTTPBootResource(self.events)
         yield self.render_GET(resource, request)
 
         self.assertEquals(
@@ -566,6 +799,26 @@ class TestHTTPBootResource(MAASTestCase):
         )
         self.assertEquals(content, b"".join(request.written))
 
+    def test_render_GET_sends_files_from_disk(self):
+        path = factory.make_name("path")
+        ip = factory.make_ip_address()
+        request = DummyRequest([path.encode("utf-8")])
+        request.requestHeaders = Headers(
+            {"X-Server-Addr": ["192.168.1.1"], "X-Forwarded-For": [ip]}
+        )
+
+        self.patch(http.log, "info")
+        render_file = self.patch(http, "render_file")
+
+        reader = FilesystemReader(FilePath(self.make_file()))
+        self.addCleanup(reader.finish)
+        self.tftp.backend.get_reader.return_value = succeed(reader)
+
+        resource = http.HTTPBootResource(self.events)
+        resource.render_GET(request)
+
+        self.assertThat(render_file, MockCalledOnceWith(request, reader))
+
     @inlineCallbacks
     def test_render_GET_logs_node_event_with_original_path_ip(self):
         path = factory.make_name("path")
@@ -581,12 +834,9 @@ class TestHTTPBootResource(MAASTestCase):
         )
 
         log_info = self.patch(http.log, "info")
-        mock_deferLater = self.patch(http, "deferLater")
-        mock_deferLater.side_effect = always_succeed_with(None)
-
         self.tftp.backend.get_reader.return_value = fail(AccessViolation())
 
-        resource = http.HTTPBootResource()
+        resource = http.HTTPBootResource(self.events)
         yield self.render_GET(resource, request)
 
         self.assertThat(
@@ -595,14 +845,7 @@ class TestHTTPBootResource(MAASTestCase):
                 "{path} requested by {remoteHost}", path=path, remoteHost=ip
             ),
         )
-        self.assertThat(
-            mock_deferLater,
-            MockCalledOnceWith(
-                ANY,
-                0,
-                http.send_node_event_ip_address,
-                event_type=EVENT_TYPES.NODE_HTTP_REQUEST,
-                ip_address=ip,
-                description=path,
-            ),
+        self.assertEqual(
+            [(EVENT_TYPES.NODE_HTTP_REQUEST, ip, path)],
+            list(self.events.pending),
         )
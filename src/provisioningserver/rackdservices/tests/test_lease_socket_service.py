@@ -25,7 +25,7 @@ from provisioningserver.rackdservices.lease_socket_service import (
     LeaseSocketService,
 )
 from provisioningserver.rpc import getRegionClient
-from provisioningserver.rpc.region import UpdateLease
+from provisioningserver.rpc.region import UpdateLease, UpdateLeases
 from provisioningserver.rpc.testing import MockLiveClusterToRegionRPCFixture
 from provisioningserver.utils.twisted import DeferredValue, pause, retries
 
@@ -42,11 +42,6 @@ class TestLeaseSocketService(MAASTestCase):
         ).return_value = socket_path
         return socket_path
 
-    def patch_rpc_UpdateLease(self):
-        fixture = self.useFixture(MockLiveClusterToRegionRPCFixture())
-        protocol, connecting = fixture.makeEventLoop(UpdateLease)
-        return protocol, connecting
-
     def send_notification(self, socket_path, payload):
         conn = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
         conn.connect(socket_path)
@@ -108,16 +103,18 @@ class TestLeaseSocketService(MAASTestCase):
         self.assertEquals([packet], list(service.notifications))
 
     @defer.inlineCallbacks
-    def test_processNotification_gets_called_with_notification(self):
+    def test_processNotificationBatch_gets_called_with_notification(self):
         socket_path = self.patch_socket_path()
         service = LeaseSocketService(sentinel.service, reactor)
         dv = DeferredValue()
 
-        # Mock processNotifcation to catch the call.
-        def mock_processNotification(*args, **kwargs):
+        # Mock processNotificationBatch to catch the call.
+        def mock_processNotificationBatch(*args, **kwargs):
             dv.set(args)
 
-        self.patch(service, "processNotification", mock_processNotification)
+        self.patch(
+            service, "processNotificationBatch", mock_processNotificationBatch
+        )
 
         # Start the service and stop it at the end of the test.
         service.startService()
@@ -130,23 +127,26 @@ class TestLeaseSocketService(MAASTestCase):
         yield deferToThread(self.send_notification, socket_path, packet)
         yield dv.get(timeout=10)
 
-        # Packet should be the argument passed to processNotifcation
-        self.assertEquals((packet,), dv.value)
+        # Packet should be the only one in the batch passed to
+        # processNotificationBatch.
+        self.assertEquals(([packet],), dv.value)
 
     @defer.inlineCallbacks
-    def test_processNotification_gets_called_multiple_times(self):
+    def test_processNotificationBatch_gets_notifications_in_order(self):
         socket_path = self.patch_socket_path()
         service = LeaseSocketService(sentinel.service, reactor)
-        dvs = [DeferredValue(), DeferredValue()]
+        received = []
+        dv = DeferredValue()
 
-        # Mock processNotifcation to catch the call.
-        def mock_processNotification(*args, **kwargs):
-            for dv in dvs:
-                if not dv.isSet:
-                    dv.set(args)
-                    break
+        # Mock processNotificationBatch to catch the calls.
+        def mock_processNotificationBatch(notifications, **kwargs):
+            received.extend(notifications)
+            if len(received) == 2:
+                dv.set(None)
 
-        self.patch(service, "processNotification", mock_processNotification)
+        self.patch(
+            service, "processNotificationBatch", mock_processNotificationBatch
+        )
 
         # Start the service and stop it at the end of the test.
         service.startService()
@@ -159,26 +159,31 @@ class TestLeaseSocketService(MAASTestCase):
         # Send notifications to the socket and wait for notifications.
         yield deferToThread(self.send_notification, socket_path, packet1)
         yield deferToThread(self.send_notification, socket_path, packet2)
-        yield dvs[0].get(timeout=10)
-        yield dvs[1].get(timeout=10)
+        yield dv.get(timeout=10)
 
-        # Packet should be the argument passed to processNotification in
-        # order.
-        self.assertEquals((packet1,), dvs[0].value)
-        self.assertEquals((packet2,), dvs[1].value)
+        # Packets should be passed to processNotificationBatch in order.
+        self.assertEquals([packet1, packet2], received)
 
     @defer.inlineCallbacks
-    def test_processNotification_send_to_region(self):
-        protocol, connecting = self.patch_rpc_UpdateLease()
-        self.addCleanup((yield connecting))
+    def test_processNotifications_sends_batches_of_batch_size(self):
+        service = LeaseSocketService(sentinel.service, reactor)
+        service.batch_size = 3
+        batches = []
 
-        client = getRegionClient()
-        rpc_service = MagicMock()
-        rpc_service.getClientNow.return_value = defer.succeed(client)
-        service = LeaseSocketService(rpc_service, reactor)
+        def mock_processNotificationBatch(notifications, **kwargs):
+            batches.append(notifications)
 
-        # Notification to region.
-        packet = {
+        self.patch(
+            service, "processNotificationBatch", mock_processNotificationBatch
+        )
+        packets = [{"test": factory.make_name("test")} for _ in range(7)]
+        service.notifications.extend(packets)
+        yield service.processNotifications()
+        self.assertEquals([packets[0:3], packets[3:6], packets[6:7]], batches)
+        self.assertEquals(0, len(service.notifications))
+
+    def make_notification(self):
+        return {
             "action": "commit",
             "mac": factory.make_mac_address(),
             "ip_family": "ipv4",
@@ -187,7 +192,47 @@ class TestLeaseSocketService(MAASTestCase):
             "lease_time": 30,
             "hostname": factory.make_name("host"),
         }
-        yield service.processNotification(packet, clock=reactor)
+
+    def make_service_with_region(self, *commands):
+        fixture = self.useFixture(MockLiveClusterToRegionRPCFixture())
+        protocol, connecting = fixture.makeEventLoop(*commands)
+        return protocol, connecting
+
+    @defer.inlineCallbacks
+    def test_processNotificationBatch_sends_batch_to_region(self):
+        protocol, connecting = self.make_service_with_region(UpdateLeases)
+        self.addCleanup((yield connecting))
+
+        client = getRegionClient()
+        rpc_service = MagicMock()
+        rpc_service.getClientNow.return_value = defer.succeed(client)
+        service = LeaseSocketService(rpc_service, reactor)
+
+        packets = [self.make_notification() for _ in range(3)]
+        del packets[1]["lease_time"], packets[1]["hostname"]
+        yield service.processNotificationBatch(packets, clock=reactor)
+        # Missing optional fields arrive as None.
+        packets[1].update(lease_time=None, hostname=None)
+        self.assertThat(
+            protocol.UpdateLeases,
+            MockCalledOnceWith(
+                protocol, cluster_uuid=client.localIdent, updates=packets
+            ),
+        )
+
+    @defer.inlineCallbacks
+    def test_processNotificationBatch_falls_back_to_UpdateLease(self):
+        protocol, connecting = self.make_service_with_region(UpdateLease)
+        self.addCleanup((yield connecting))
+
+        client = getRegionClient()
+        rpc_service = MagicMock()
+        rpc_service.getClientNow.return_value = defer.succeed(client)
+        service = LeaseSocketService(rpc_service, reactor)
+
+        # Notification to region.
+        packet = self.make_notification()
+        yield service.processNotificationBatch([packet], clock=reactor)
         self.assertThat(
             protocol.UpdateLease,
             MockCalledOnceWith(
@@ -20,6 +20,7 @@ from maastesting.testcase import MAASTestCase, MAASTwistedRunTest
 from maastesting.twisted import extract_result, TwistedLoggerFixture
 from provisioningserver.rackdservices import node_power_monitor_service as npms
 from provisioningserver.rpc import exceptions, getRegionClient, region
+from provisioningserver.rpc.power import PowerQueryScheduler
 from provisioningserver.rpc.testing import MockClusterToRegionRPCFixture
 
 
@@ -65,7 +66,6 @@ class TestNodePowerMonitorService(MAASTestCase):
 
     def test_query_nodes_calls_query_all_nodes(self):
         service = self.make_monitor_service()
-        service.max_nodes_at_once = sentinel.max_nodes_at_once
 
         example_power_parameters = {
             "system_id": factory.make_UUID(),
@@ -94,10 +94,75 @@ class TestNodePowerMonitorService(MAASTestCase):
             query_all_nodes,
             MockCalledOnceWith(
                 [example_power_parameters],
-                max_concurrency=sentinel.max_nodes_at_once,
-                clock=service.clock,
+                scheduler=service.scheduler,
+                spread=service.query_spread,
             ),
         )
+        self.assertIsInstance(service.scheduler, PowerQueryScheduler)
+        self.assertIs(service.clock, service.scheduler.clock)
+
+    def test_query_nodes_queries_all_batches_together(self):
+        service = self.make_monitor_service()
+
+        def make_power_parameters():
+            return {
+                "system_id": factory.make_UUID(),
+                "hostname": factory.make_hostname(),
+                "power_state": factory.make_name("power_state"),
+                "power_type": factory.make_name("power_type"),
+                "context": {},
+            }
+
+        batch1 = [make_power_parameters() for _ in range(2)]
+        batch2 = [make_power_parameters() for _ in range(2)]
+
+        rpc_fixture = self.useFixture(MockClusterToRegionRPCFixture())
+        proto_region, io = rpc_fixture.makeEventLoop(
+            region.ListNodePowerParameters
+        )
+        proto_region.ListNodePowerParameters.side_effect = [
+            succeed({"nodes": batch1}),
+            succeed({"nodes": batch2}),
+            succeed({"nodes": []}),
+        ]
+
+        query_all_nodes = self.patch(npms, "query_all_nodes")
+
+        d = service.query_nodes(getRegionClient())
+        io.flush()
+
+        self.assertEqual(None, extract_result(d))
+        self.assertThat(
+            query_all_nodes,
+            MockCalledOnceWith(
+                batch1 + batch2,
+                scheduler=service.scheduler,
+                spread=service.query_spread,
+            ),
+        )
+
+    def test_query_nodes_keeps_scheduler_between_cycles(self):
+        service = self.make_monitor_service()
+        example_power_parameters = {
+            "system_id": factory.make_UUID(),
+            "hostname": factory.make_hostname(),
+            "power_state": factory.make_name("power_state"),
+            "power_type": factory.make_name("power_type"),
+            "context": {},
+        }
+        client = Mock(
+            side_effect=[
+                succeed({"nodes": [example_power_parameters]}),
+                succeed({"nodes": []}),
+                succeed({"nodes": [example_power_parameters]}),
+                succeed({"nodes": []}),
+            ]
+        )
+        self.patch(npms, "query_all_nodes")
+        extract_result(service.query_nodes(client))
+        scheduler = service.scheduler
+        extract_result(service.query_nodes(client))
+        self.assertIs(scheduler, service.scheduler)
 
     def test_query_nodes_copes_with_NoSuchCluster(self):
         service = self.make_monitor_service()
@@ -26,6 +26,7 @@ __all__ = [
     "PowerOff",
     "PowerOn",
     "PowerQuery",
+    "RefreshExternalServices",
     "ScanNetworks",
     "ValidateDHCPv4Config",
     "ValidateDHCPv4Config_V2",
@@ -932,3 +933,20 @@ class CheckIPs(amp.Command):
         )
     ]
     errors = {}
+
+
+class RefreshExternalServices(amp.Command):
+    """Tell a rack controller that its external services' configuration has
+    changed.
+
+    `digests` are those returned by
+    :py:class:`~provisioningserver.rpc.region.GetConfigurationDigests`. The
+    rack controller fetches the kinds of configuration whose digest differs
+    from what it last applied, and then returns; it doesn't wait for that.
+
+    :since: 2.9
+    """
+
+    arguments = [(b"digests", StructureAsJSON())]
+    response = []
+    errors = {}
@@ -38,7 +38,7 @@ from zope.interface import implementer
 
 from apiclient.creds import convert_string_to_tuple
 from apiclient.utils import ascii_url
-from provisioningserver import concurrency
+from provisioningserver import concurrency, services
 from provisioningserver.config import ClusterConfiguration, is_dev_environment
 from provisioningserver.drivers import ArchitectureRegistry
 from provisioningserver.drivers.hardware.seamicro import (
@@ -1035,6 +1035,24 @@ class Cluster(RPCProtocol):
         d.addErrback(log.err, "Failed to perform IP address checking.")
         return d
 
+    @cluster.RefreshExternalServices.responder
+    def refresh_external_services(self, digests):
+        """RefreshExternalServices()
+
+        Implementation of
+        :py:class:`~provisioningserver.rpc.cluster.RefreshExternalServices`.
+        """
+        try:
+            service = services.getServiceNamed("external")
+        except KeyError:
+            # The external services are not running; they'll fetch their
+            # configuration when they start.
+            pass
+        else:
+            d = service.refresh(digests)
+            d.addErrback(log.err, "Failed to refresh external services.")
+        return {}
+
 
 @implementer(IConnectionToRegion)
 class ClusterClient(Cluster):
@@ -23,7 +23,12 @@ from twisted.internet.threads import deferToThread
 
 from provisioningserver.dhcp import DHCPv4Server, DHCPv6Server
 from provisioningserver.dhcp.config import get_config
-from provisioningserver.dhcp.omshell import Omshell
+from provisioningserver.dhcp.omapi import (
+    HostMapFailure,
+    OmapiClient,
+    OmapiConnectionError,
+    OmapiError,
+)
 from provisioningserver.logger import get_maas_logger, LegacyLogger
 from provisioningserver.rpc.exceptions import (
     CannotConfigureDHCP,
@@ -187,70 +192,67 @@ def _delete_config(server):
         sudo_delete_file(server.config_filename)
 
 
-def _remove_host_map(omshell, mac):
-    """Remove host by `mac`."""
-    try:
-        omshell.remove(mac)
-    except ExternalProcessError as e:
-        if "not connected." in e.output_as_unicode:
-            msg = "The DHCP server could not be reached."
-        else:
-            msg = str(e)
-        err = "Could not remove host map for %s: %s" % (mac, msg)
-        maaslog.error(err)
-        raise CannotRemoveHostMap(err)
-
-
-def _create_host_map(omshell, mac, ip_address):
-    """Create host with `mac` -> `ip_address`."""
-    try:
-        omshell.create(ip_address, mac)
-    except ExternalProcessError as e:
-        if "not connected." in e.output_as_unicode:
-            msg = "The DHCP server could not be reached."
-        else:
-            msg = str(e)
-        err = "Could not create host map for %s -> %s: %s" % (
-            mac,
-            ip_address,
-            msg,
-        )
-        maaslog.error(err)
-        raise CannotCreateHostMap(err)
-
+def _host_map_error(action, host, error):
+    """Log and return the exception for failing to `action` `host`.
 
-def _modify_host_map(omshell, mac, ip_address):
-    """Modify host with `mac` -> `ip_address`."""
-    try:
-        omshell.modify(ip_address, mac)
-    except ExternalProcessError as e:
-        if "not connected." in e.output_as_unicode:
-            msg = "The DHCP server could not be reached."
-        else:
-            msg = str(e)
-        err = "Could not modify host map for %s -> %s: %s" % (
-            mac,
-            ip_address,
+    :param action: One of "remove", "create", or "modify".
+    :param error: The `OmapiError` raised.
+    """
+    if isinstance(error, OmapiConnectionError):
+        msg = "The DHCP server could not be reached."
+    else:
+        msg = str(error)
+    if action == "remove":
+        err = "Could not remove host map for %s: %s" % (host["mac"], msg)
+    else:
+        err = "Could not %s host map for %s -> %s: %s" % (
+            action,
+            host["mac"],
+            host["ip"],
             msg,
         )
-        maaslog.error(err)
-        raise CannotModifyHostMap(err)
+    maaslog.error(err)
+    exception = {
+        "remove": CannotRemoveHostMap,
+        "create": CannotCreateHostMap,
+        "modify": CannotModifyHostMap,
+    }[action]
+    return exception(err)
 
 
 @synchronous
 def _update_hosts(server, remove, add, modify):
-    """Update the hosts using the OMAPI."""
-    omshell = Omshell(
+    """Update the hosts using the OMAPI.
+
+    All the changes are sent over a single authenticated connection. Every
+    change is attempted; each failure is logged and the first is raised.
+    """
+    with OmapiClient(
         server_address="127.0.0.1",
         shared_key=server.omapi_key,
         ipv6=server.ipv6,
-    )
-    for host in remove:
-        _remove_host_map(omshell, host["mac"])
-    for host in add:
-        _create_host_map(omshell, host["mac"], host["ip"])
-    for host in modify:
-        _modify_host_map(omshell, host["mac"], host["ip"])
+    ) as omapi:
+        try:
+            failures = omapi.update_hosts(remove, add, modify)
+        except OmapiError as e:
+            # The connection failed, or could not be authenticated or
+            # trusted. Report it once, against the first change, as every
+            # change would fail the same way.
+            failures = [
+                HostMapFailure(action, hosts[0], e)
+                for action, hosts in (
+                    ("remove", remove),
+                    ("create", add),
+                    ("modify", modify),
+                )
+                if len(hosts) > 0
+            ][:1]
+    errors = [
+        _host_map_error(failure.action, failure.host, failure.error)
+        for failure in failures
+    ]
+    if len(errors) > 0:
+        raise errors[0]
 
 
 @asynchronous
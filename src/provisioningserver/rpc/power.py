@@ -7,6 +7,7 @@ __all__ = [
     "power_action_registry",
     "power_state_update",
     "maybe_change_power_state",
+    "PowerQueryScheduler",
 ]
 
 from datetime import timedelta
@@ -23,11 +24,13 @@ from twisted.internet.defer import (
     succeed,
 )
 from twisted.internet.task import deferLater
+from twisted.python.failure import Failure
 
 from provisioningserver.drivers.power import get_error_message, PowerError
 from provisioningserver.drivers.power.registry import PowerDriverRegistry
 from provisioningserver.events import EVENT_TYPES, send_node_event
 from provisioningserver.logger import get_maas_logger, LegacyLogger
+from provisioningserver.prometheus.metrics import PROMETHEUS_METRICS
 from provisioningserver.rpc import getRegionClient
 from provisioningserver.rpc.exceptions import (
     NoSuchNode,
@@ -50,6 +53,22 @@ log = LegacyLogger()
 # meant to cope with broken BMCs.
 CHANGE_POWER_STATE_TIMEOUT = timedelta(minutes=5).total_seconds()
 
+# Bounds for the adaptive timeout of a scheduled power query. Until a BMC has
+# answered at least once its queries get the maximum.
+POWER_QUERY_TIMEOUT_MIN = 15
+POWER_QUERY_TIMEOUT_MAX = timedelta(minutes=2).total_seconds()
+
+# Back-off for BMCs that keep failing. The region offers each node for
+# querying every five minutes, so the back-off starts there and doubles with
+# each further consecutive failure.
+POWER_QUERY_BACKOFF_MIN = timedelta(minutes=5).total_seconds()
+POWER_QUERY_BACKOFF_MAX = timedelta(hours=1).total_seconds()
+
+# Limits on concurrent queries for power types whose drivers are expensive
+# to run in parallel, e.g. because each query opens a session to the same
+# hypervisor. Other power types are only limited by the overall limit.
+POWER_TYPE_CONCURRENCY = {"hmc": 5, "virsh": 5, "vmware": 5}
+
 # We could use a Registry here, but it seems kind of like overkill.
 power_action_registry = {}
 
@@ -459,10 +478,15 @@ def maaslog_report_failure(node, failure):
         # log.err(failure, "Failed to refresh power state.")
 
 
-def query_node(node, clock):
+def query_node(node, clock, timeout=None, observer=None):
     """Calls `get_power_state` on the given node.
 
     Logs to maaslog as errors and power states change.
+
+    :param timeout: If given, cancel the query after this many seconds.
+    :param observer: If given, called with the result of `get_power_state`,
+        which may be a `Failure`, before it is reported. It must return the
+        result it was given.
     """
     if node["system_id"] in power_action_registry:
         log.debug(
@@ -479,6 +503,11 @@ def query_node(node, clock):
             node["context"],
             clock=clock,
         )
+        if timeout is not None:
+            timeoutCall = clock.callLater(timeout, d.cancel)
+            d.addBoth(callOut, _cancel_if_active, timeoutCall)
+        if observer is not None:
+            d.addBoth(observer)
         d = report_power_state(d, node["system_id"], node["hostname"])
         d.addCallbacks(
             partial(maaslog_report_success, node),
@@ -487,18 +516,220 @@ def query_node(node, clock):
         return d
 
 
-def query_all_nodes(nodes, max_concurrency=5, clock=reactor):
+def _cancel_if_active(delayedCall):
+    if delayedCall.active():
+        delayedCall.cancel()
+
+
+def get_bmc_key(node):
+    """Return a key identifying the BMC that controls `node`.
+
+    Nodes with no known BMC address are treated as having a BMC of their own.
+    """
+    context = node["context"]
+    address = context.get("power_address") or context.get("power_hostname")
+    if address:
+        return node["power_type"], address
+    else:
+        return node["power_type"], node["system_id"]
+
+
+class BMCQueryState:
+    """What a `PowerQueryScheduler` knows about one BMC.
+
+    Latency is estimated the same way TCP estimates round-trip time: a
+    smoothed mean plus four times the smoothed mean deviation makes a
+    timeout that very few healthy queries will hit.
+    """
+
+    def __init__(self, concurrency):
+        self.semaphore = DeferredSemaphore(tokens=concurrency)
+        self.latency = None
+        self.latency_deviation = 0.0
+        self.failures = 0
+        self.next_query = 0
+
+    def get_timeout(self, minimum, maximum):
+        if self.latency is None:
+            return maximum
+        timeout = self.latency + 4 * self.latency_deviation
+        return min(max(timeout, minimum), maximum)
+
+    def record_success(self, latency):
+        if self.latency is None:
+            self.latency = latency
+            self.latency_deviation = latency / 2
+        else:
+            self.latency_deviation = (
+                0.75 * self.latency_deviation
+                + 0.25 * abs(latency - self.latency)
+            )
+            self.latency = 0.875 * self.latency + 0.125 * latency
+        self.failures = 0
+        self.next_query = 0
+
+    def record_failure(self, now, minimum, maximum):
+        self.failures += 1
+        if self.failures > 1:
+            backoff = min(minimum * 2 ** (self.failures - 2), maximum)
+            self.next_query = now + backoff
+
+
+class PowerQueryScheduler:
+    """Schedule power queries so slow or broken BMCs don't hold up the rest.
+
+    Queries are limited overall, per power type and per BMC. Each query is
+    cancelled if it takes much longer than its BMC usually takes to answer,
+    and BMCs that fail repeatedly are left alone for exponentially longer
+    periods.
+
+    A scheduler remembers what it has learnt about each BMC, so the same
+    scheduler should be used for every polling cycle.
+    """
+
+    timeout_min = POWER_QUERY_TIMEOUT_MIN
+    timeout_max = POWER_QUERY_TIMEOUT_MAX
+    backoff_min = POWER_QUERY_BACKOFF_MIN
+    backoff_max = POWER_QUERY_BACKOFF_MAX
+
+    def __init__(
+        self,
+        max_concurrency=5,
+        type_concurrency=None,
+        bmc_concurrency=1,
+        clock=reactor,
+    ):
+        self.clock = reactor if clock is None else clock
+        self.semaphore = DeferredSemaphore(tokens=max_concurrency)
+        if type_concurrency is None:
+            type_concurrency = POWER_TYPE_CONCURRENCY
+        self.type_concurrency = type_concurrency
+        self.bmc_concurrency = bmc_concurrency
+        self.type_semaphores = {}
+        self.bmcs = {}
+
+    def get_type_semaphore(self, power_type):
+        semaphore = self.type_semaphores.get(power_type)
+        if semaphore is None:
+            tokens = self.type_concurrency.get(
+                power_type, self.semaphore.limit
+            )
+            semaphore = DeferredSemaphore(tokens=tokens)
+            self.type_semaphores[power_type] = semaphore
+        return semaphore
+
+    def get_bmc(self, node):
+        key = get_bmc_key(node)
+        bmc = self.bmcs.get(key)
+        if bmc is None:
+            bmc = self.bmcs[key] = BMCQueryState(self.bmc_concurrency)
+        return bmc
+
+    def query(self, nodes, spread=0):
+        """Query the given nodes for their power state.
+
+        :param spread: Spread the start of the queries evenly over this many
+            seconds rather than starting them all at once.
+        :return: A `DeferredList`, which fires once all nodes have been
+            queried, successfully or not.
+        """
+        nodes = [
+            node for node in nodes if node["power_type"] in PowerDriverRegistry
+        ]
+        started = self.clock.seconds()
+        queries = []
+        for index, node in enumerate(nodes):
+            delay = spread * index / len(nodes)
+            if delay > 0:
+                queries.append(
+                    deferLater(self.clock, delay, self.query_node, node)
+                )
+            else:
+                queries.append(self.query_node(node))
+        d = DeferredList(queries, consumeErrors=True)
+        d.addBoth(callOut, self._record_cycle, started)
+        return d
+
+    def query_node(self, node):
+        """Query a single node, subject to the scheduler's limits."""
+        bmc = self.get_bmc(node)
+        if bmc.next_query > self.clock.seconds():
+            log.debug(
+                "{hostname}: Skipping query power status, "
+                "BMC has failed {failures} times in a row.",
+                hostname=node["hostname"],
+                failures=bmc.failures,
+            )
+            return succeed(None)
+        # Wait for the BMC first, so queries waiting on a busy BMC don't
+        # hold any of the power type's or the overall tokens.
+        semaphores = [
+            bmc.semaphore,
+            self.get_type_semaphore(node["power_type"]),
+            self.semaphore,
+        ]
+        # Only release what was acquired; the query may be cancelled while
+        # still waiting for one of the semaphores.
+        acquired = []
+
+        def acquire(_, semaphore):
+            d = semaphore.acquire()
+            d.addCallback(acquired.append)
+            return d
+
+        d = succeed(None)
+        for semaphore in semaphores:
+            d.addCallback(acquire, semaphore)
+        d.addCallback(lambda _: self._query_node(node, bmc))
+        d.addBoth(callOut, self._release, acquired)
+        return d
+
+    def _query_node(self, node, bmc):
+        started = self.clock.seconds()
+
+        def observe(result):
+            now = self.clock.seconds()
+            latency = now - started
+            if isinstance(result, Failure):
+                bmc.record_failure(now, self.backoff_min, self.backoff_max)
+            else:
+                bmc.record_success(latency)
+            PROMETHEUS_METRICS.update(
+                "maas_power_query_latency",
+                "observe",
+                value=latency,
+                labels={"power_type": node["power_type"]},
+            )
+            return result
+
+        timeout = bmc.get_timeout(self.timeout_min, self.timeout_max)
+        return query_node(node, self.clock, timeout=timeout, observer=observe)
+
+    def _release(self, semaphores):
+        for semaphore in reversed(semaphores):
+            semaphore.release()
+
+    def _record_cycle(self, started):
+        PROMETHEUS_METRICS.update(
+            "maas_power_query_cycle_duration",
+            "observe",
+            value=self.clock.seconds() - started,
+        )
+
+
+def query_all_nodes(
+    nodes, max_concurrency=5, clock=reactor, scheduler=None, spread=0
+):
     """Queries the given nodes for their power state.
 
     Nodes' states are reported back to the region.
 
+    :param scheduler: The `PowerQueryScheduler` to use. If not given, a new
+        one is created that allows `max_concurrency` concurrent queries.
+    :param spread: See `PowerQueryScheduler.query`.
     :return: A deferred, which fires once all nodes have been queried,
         successfully or not.
     """
-    semaphore = DeferredSemaphore(tokens=max_concurrency)
-    queries = (
-        semaphore.run(query_node, node, clock)
-        for node in nodes
-        if node["power_type"] in PowerDriverRegistry
-    )
-    return DeferredList(queries, consumeErrors=True)
+    if scheduler is None:
+        scheduler = PowerQueryScheduler(max_concurrency, clock=clock)
+    return scheduler.query(nodes, spread=spread)
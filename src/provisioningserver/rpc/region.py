@@ -14,6 +14,7 @@ __all__ = [
     "GetBootConfig",
     "GetBootSources",
     "GetBootSourcesV2",
+    "GetConfigurationDigests",
     "GetControllerType",
     "GetDiscoveryState",
     "GetDNSConfiguration",
@@ -31,6 +32,7 @@ __all__ = [
     "RequestNodeInfoByMACAddress",
     "SendEvent",
     "SendEventMACAddress",
+    "SendEvents",
     "UpdateInterfaces",
     "UpdateLastImageSync",
     "UpdateNodePowerState",
@@ -416,6 +418,35 @@ class SendEventIPAddress(amp.Command):
     errors = {NoSuchNode: b"NoSuchNode", NoSuchEventType: b"NoSuchEventType"}
 
 
+class SendEvents(amp.Command):
+    """Send many node events at once.
+
+    Each event specifies its node by one of `system_id`, `mac_address` or
+    `ip_address`. The `timestamp` is when the event happened, in seconds
+    since the epoch. Events are stored in the order given.
+
+    :since: 2.9
+    """
+
+    arguments = [
+        (
+            b"events",
+            AmpList(
+                [
+                    (b"type_name", amp.Unicode()),
+                    (b"description", amp.Unicode()),
+                    (b"timestamp", amp.Float()),
+                    (b"system_id", amp.Unicode(optional=True)),
+                    (b"mac_address", amp.Unicode(optional=True)),
+                    (b"ip_address", amp.Unicode(optional=True)),
+                ]
+            ),
+        )
+    ]
+    response = []
+    errors = []
+
+
 class ReportForeignDHCPServer(amp.Command):
     """Report a foreign DHCP server on a rack controller's interface.
 
@@ -552,6 +583,36 @@ class UpdateLease(amp.Command):
     errors = {NoSuchCluster: b"NoSuchCluster"}
 
 
+class UpdateLeases(amp.Command):
+    """Report many DHCP lease updates from a cluster controller at once.
+
+    Each update has the same fields as the arguments to `UpdateLease`.
+    They are processed in the order given.
+
+    :since: 2.9
+    """
+
+    arguments = [
+        (b"cluster_uuid", amp.Unicode()),
+        (
+            b"updates",
+            AmpList(
+                [
+                    (b"action", amp.Unicode()),
+                    (b"mac", amp.Unicode()),
+                    (b"ip_family", amp.Unicode()),
+                    (b"ip", amp.Unicode()),
+                    (b"timestamp", amp.Integer()),
+                    (b"lease_time", amp.Integer(optional=True)),
+                    (b"hostname", amp.Unicode(optional=True)),
+                ]
+            ),
+        ),
+    ]
+    response = []
+    errors = {NoSuchCluster: b"NoSuchCluster"}
+
+
 class UpdateServices(amp.Command):
     """Report service statuses that are monitored on the rackd.
 
@@ -647,3 +708,18 @@ class GetSyslogConfiguration(amp.Command):
     arguments = [(b"system_id", amp.Unicode())]
     response = [(b"port", amp.Integer())]
     errors = {NoSuchNode: b"NoSuchNode"}
+
+
+class GetConfigurationDigests(amp.Command):
+    """Get a digest of each kind of configuration for a given system identifier.
+
+    The digests are keyed by the kind of configuration: "controller_type",
+    "time", "dns", "proxy" and "syslog". A rack controller only needs to
+    fetch a kind of configuration again when its digest changes.
+
+    :since: 2.9
+    """
+
+    arguments = [(b"system_id", amp.Unicode())]
+    response = [(b"digests", StructureAsJSON())]
+    errors = {NoSuchNode: b"NoSuchNode"}
@@ -9,6 +9,16 @@ from apiclient.maas_client import MAASClient, MAASDispatcher, MAASOAuth
 from provisioningserver.tags import process_node_tags
 from provisioningserver.utils.twisted import synchronous
 
+# How many nodes' details to fetch at once.
+DETAILS_CONCURRENCY = 4
+
+# Shared by every evaluation so that connections to the region are used
+# again. Turn off proxy detection, since the rack should talk directly to
+# the region, even if a system-wide proxy is configured.
+dispatcher = MAASDispatcher(
+    autodetect_proxies=False, concurrency=DETAILS_CONCURRENCY
+)
+
 
 @synchronous
 def evaluate_tag(
@@ -30,12 +40,8 @@ def evaluate_tag(
     :param credentials: A 3-tuple of OAuth credentials.
     :param maas_url: URL of the MAAS API.
     """
-    # Turn off proxy detection, since the rack should talk directly to
-    # the region, even if a system-wide proxy is configured.
     client = MAASClient(
-        auth=MAASOAuth(*credentials),
-        dispatcher=MAASDispatcher(autodetect_proxies=False),
-        base_url=maas_url,
+        auth=MAASOAuth(*credentials), dispatcher=dispatcher, base_url=maas_url
     )
     process_node_tags(
         rack_id=system_id,
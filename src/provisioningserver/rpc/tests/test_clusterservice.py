@@ -4300,3 +4300,61 @@ class TestClusterProtocol_CheckIPs(MAASTestCaseThatWaitsForDeferredThreads):
                 }
             ),
         )
+
+
+class TestClusterProtocol_RefreshExternalServices(MAASTestCase):
+
+    run_tests_with = MAASTwistedRunTest.make_factory(timeout=5)
+
+    def test__is_registered(self):
+        protocol = Cluster()
+        responder = protocol.locateResponder(
+            cluster.RefreshExternalServices.commandName
+        )
+        self.assertIsNotNone(responder)
+
+    @inlineCallbacks
+    def test__refreshes_external_service(self):
+        digests = {"dns": factory.make_name("digest")}
+        services = self.patch(clusterservice, "services")
+        external = services.getServiceNamed.return_value
+        external.refresh.return_value = succeed(None)
+        response = yield call_responder(
+            Cluster(), cluster.RefreshExternalServices, {"digests": digests}
+        )
+        self.assertEqual({}, response)
+        self.assertThat(
+            services.getServiceNamed, MockCalledOnceWith("external")
+        )
+        self.assertThat(external.refresh, MockCalledOnceWith(digests))
+
+    @inlineCallbacks
+    def test__returns_before_refresh_finishes(self):
+        services = self.patch(clusterservice, "services")
+        external = services.getServiceNamed.return_value
+        external.refresh.return_value = Deferred()
+        response = yield call_responder(
+            Cluster(), cluster.RefreshExternalServices, {"digests": {}}
+        )
+        self.assertEqual({}, response)
+
+    @inlineCallbacks
+    def test__logs_refresh_failure(self):
+        services = self.patch(clusterservice, "services")
+        external = services.getServiceNamed.return_value
+        external.refresh.return_value = fail(factory.make_exception())
+        with TwistedLoggerFixture() as logger:
+            response = yield call_responder(
+                Cluster(), cluster.RefreshExternalServices, {"digests": {}}
+            )
+        self.assertEqual({}, response)
+        self.assertIn("Failed to refresh external services.", logger.output)
+
+    @inlineCallbacks
+    def test__does_nothing_without_external_service(self):
+        services = self.patch(clusterservice, "services")
+        services.getServiceNamed.side_effect = KeyError("external")
+        response = yield call_responder(
+            Cluster(), cluster.RefreshExternalServices, {"digests": {}}
+        )
+        self.assertEqual({}, response)
@@ -5,7 +5,9 @@
 
 __all__ = []
 
+import base64
 import copy
+from functools import partial
 from operator import itemgetter
 from unittest.mock import ANY, call, Mock, sentinel
 
@@ -21,6 +23,13 @@ from maastesting.matchers import (
     MockNotCalled,
 )
 from maastesting.testcase import MAASTestCase, MAASTwistedRunTest
+from provisioningserver.dhcp.omapi import (
+    HostMapFailure,
+    OmapiClient,
+    OmapiConnectionError,
+    OmapiError,
+    pack_host_name,
+)
 from provisioningserver.dhcp.testing.config import (
     DHCPConfigNameResolutionDisabled,
     fix_shared_networks_failover,
@@ -32,6 +41,7 @@ from provisioningserver.dhcp.testing.config import (
     make_shared_network,
     make_subnet_dhcp_snippets,
 )
+from provisioningserver.dhcp.testing.omapi import FakeOmapiServer
 from provisioningserver.rpc import dhcp, exceptions
 from provisioningserver.utils.service_monitor import (
     SERVICE_STATE,
@@ -434,172 +444,169 @@ class TestDHCPState(MAASTestCase):
         )
 
 
-class TestRemoveHostMap(MAASTestCase):
-    def test_calls_omshell_remove(self):
-        omshell = Mock()
-        mac = factory.make_mac_address()
-        dhcp._remove_host_map(omshell, mac)
-        self.assertThat(omshell.remove, MockCalledOnceWith(mac))
-
-    def test_raises_error_when_omshell_crashes(self):
-        error_message = factory.make_name("error").encode("ascii")
-        omshell = Mock()
-        omshell.remove.side_effect = ExternalProcessError(
-            returncode=2, cmd=("omshell",), output=error_message
-        )
-        mac = factory.make_mac_address()
-        with FakeLogger("maas.dhcp") as logger:
-            error = self.assertRaises(
-                exceptions.CannotRemoveHostMap,
-                dhcp._remove_host_map,
-                omshell,
-                mac,
-            )
-        # The CannotRemoveHostMap exception includes a message describing the
-        # problematic mapping.
-        self.assertDocTestMatches(
-            "Could not remove host map for %s: ..." % mac, str(error)
+class TestUpdateHost(MAASTestCase):
+    def patch_omapi(self, failures=()):
+        client_class = self.patch(dhcp, "OmapiClient")
+        client = client_class.return_value.__enter__.return_value
+        client.update_hosts.return_value = list(failures)
+        return client_class, client
+
+    def test__creates_omapi_client_with_correct_arguments(self):
+        client_class, _ = self.patch_omapi()
+        server = Mock()
+        server.ipv6 = factory.pick_bool()
+        dhcp._update_hosts(server, [], [], [])
+        self.assertThat(
+            client_class,
+            MockCalledOnceWith(
+                ipv6=server.ipv6,
+                server_address="127.0.0.1",
+                shared_key=server.omapi_key,
+            ),
         )
-        # A message is also written to the maas.dhcp logger that describes the
-        # problematic mapping.
-        self.assertDocTestMatches(
-            "Could not remove host map for %s: ..." % mac, logger.output
+
+    def test__performs_operations(self):
+        _, client = self.patch_omapi()
+        remove_host = make_host()
+        add_host = make_host()
+        modify_host = make_host()
+        server = Mock()
+        server.ipv6 = factory.pick_bool()
+        dhcp._update_hosts(server, [remove_host], [add_host], [modify_host])
+        self.assertThat(
+            client.update_hosts,
+            MockCalledOnceWith([remove_host], [add_host], [modify_host]),
         )
 
-    def test_raises_error_when_omshell_not_connected(self):
-        error = ExternalProcessError(returncode=2, cmd=("omshell",), output="")
-        self.patch(ExternalProcessError, "output_as_unicode", "not connected.")
-        omshell = Mock()
-        omshell.remove.side_effect = error
-        mac = factory.make_mac_address()
+    def test__logs_each_failure_and_raises_first(self):
+        remove_host = make_host()
+        add_host = make_host()
+        modify_host = make_host()
+        self.patch_omapi(
+            [
+                HostMapFailure("remove", remove_host, OmapiError("gone")),
+                HostMapFailure("create", add_host, OmapiError("refused")),
+                HostMapFailure("modify", modify_host, OmapiError("missing")),
+            ]
+        )
+        server = Mock()
+        server.ipv6 = factory.pick_bool()
         with FakeLogger("maas.dhcp") as logger:
             error = self.assertRaises(
                 exceptions.CannotRemoveHostMap,
-                dhcp._remove_host_map,
-                omshell,
-                mac,
+                dhcp._update_hosts,
+                server,
+                [remove_host],
+                [add_host],
+                [modify_host],
             )
-        # The CannotCreateHostMap exception includes a message describing the
-        # problematic mapping.
-        self.assertDocTestMatches(
-            "Could not remove host map for %s: "
-            "The DHCP server could not be reached." % mac,
+        self.assertEqual(
+            "Could not remove host map for %s: gone" % remove_host["mac"],
             str(error),
         )
-        # A message is also written to the maas.dhcp logger that describes the
-        # problematic mapping.
         self.assertDocTestMatches(
-            "Could not remove host map for %s: "
-            "The DHCP server could not be reached." % mac,
+            "Could not remove host map for %s: gone\n"
+            "Could not create host map for %s -> %s: refused\n"
+            "Could not modify host map for %s -> %s: missing"
+            % (
+                remove_host["mac"],
+                add_host["mac"],
+                add_host["ip"],
+                modify_host["mac"],
+                modify_host["ip"],
+            ),
             logger.output,
         )
 
+    def test__raises_first_error_type_for_first_change(self):
+        modify_host = make_host()
+        self.patch_omapi([HostMapFailure("modify", modify_host, OmapiError())])
+        server = Mock()
+        server.ipv6 = factory.pick_bool()
+        with FakeLogger("maas.dhcp"):
+            self.assertRaises(
+                exceptions.CannotModifyHostMap,
+                dhcp._update_hosts,
+                server,
+                [],
+                [],
+                [modify_host],
+            )
 
-class TestCreateHostMap(MAASTestCase):
-    def test_calls_omshell_create(self):
-        omshell = Mock()
-        mac = factory.make_mac_address()
-        ip = factory.make_ip_address()
-        dhcp._create_host_map(omshell, mac, ip)
-        self.assertThat(omshell.create, MockCalledOnceWith(ip, mac))
-
-    def test_raises_error_when_omshell_crashes(self):
-        error_message = factory.make_name("error").encode("ascii")
-        omshell = Mock()
-        omshell.create.side_effect = ExternalProcessError(
-            returncode=2, cmd=("omshell",), output=error_message
-        )
-        mac = factory.make_mac_address()
-        ip = factory.make_ip_address()
+    def test__raises_error_when_not_connected(self):
+        _, client = self.patch_omapi()
+        client.update_hosts.side_effect = OmapiConnectionError("refused")
+        add_host = make_host()
+        server = Mock()
+        server.ipv6 = factory.pick_bool()
         with FakeLogger("maas.dhcp") as logger:
             error = self.assertRaises(
                 exceptions.CannotCreateHostMap,
-                dhcp._create_host_map,
-                omshell,
-                mac,
-                ip,
+                dhcp._update_hosts,
+                server,
+                [],
+                [add_host, make_host()],
+                [],
             )
-        # The CannotCreateHostMap exception includes a message describing the
-        # problematic mapping.
-        self.assertDocTestMatches(
-            "Could not create host map for %s -> %s: ..." % (mac, ip),
-            str(error),
-        )
-        # A message is also written to the maas.dhcp logger that describes the
-        # problematic mapping.
-        self.assertDocTestMatches(
-            "Could not create host map for %s -> %s: ..." % (mac, ip),
-            logger.output,
+        message = (
+            "Could not create host map for %s -> %s: "
+            "The DHCP server could not be reached."
+            % (add_host["mac"], add_host["ip"])
         )
+        self.assertEqual(message, str(error))
+        self.assertEqual(message + "\n", logger.output)
 
-    def test_raises_error_when_omshell_not_connected(self):
-        error = ExternalProcessError(returncode=2, cmd=("omshell",), output="")
-        self.patch(ExternalProcessError, "output_as_unicode", "not connected.")
-        omshell = Mock()
-        omshell.create.side_effect = error
-        mac = factory.make_mac_address()
-        ip = factory.make_ip_address()
+    def test__raises_error_when_not_authenticated(self):
+        omapi_server = self.useFixture(FakeOmapiServer())
+        self.patch(
+            dhcp,
+            "OmapiClient",
+            partial(OmapiClient, server_port=omapi_server.port),
+        )
+        remove_host = make_host()
+        server = Mock()
+        server.omapi_key = base64.b64encode(factory.make_bytes()).decode(
+            "ascii"
+        )
+        server.ipv6 = False
         with FakeLogger("maas.dhcp") as logger:
             error = self.assertRaises(
-                exceptions.CannotCreateHostMap,
-                dhcp._create_host_map,
-                omshell,
-                mac,
-                ip,
+                exceptions.CannotRemoveHostMap,
+                dhcp._update_hosts,
+                server,
+                [remove_host],
+                [make_host()],
+                [],
             )
-        # The CannotCreateHostMap exception includes a message describing the
-        # problematic mapping.
         self.assertDocTestMatches(
-            "Could not create host map for %s -> %s: "
-            "The DHCP server could not be reached." % (mac, ip),
+            "Could not remove host map for %s: ..." % remove_host["mac"],
             str(error),
         )
-        # A message is also written to the maas.dhcp logger that describes the
-        # problematic mapping.
-        self.assertDocTestMatches(
-            "Could not create host map for %s -> %s: "
-            "The DHCP server could not be reached." % (mac, ip),
-            logger.output,
-        )
-
+        self.assertEqual(str(error) + "\n", logger.output)
 
-class TestUpdateHost(MAASTestCase):
-    def test__creates_omshell_with_correct_arguments(self):
-        omshell = self.patch(dhcp, "Omshell")
-        server = Mock()
-        server.ipv6 = factory.pick_bool()
-        dhcp._update_hosts(server, [], [], [])
-        self.assertThat(
-            omshell,
-            MockCallsMatch(
-                call(
-                    ipv6=server.ipv6,
-                    server_address="127.0.0.1",
-                    shared_key=server.omapi_key,
-                )
-            ),
+    def test__updates_hosts_on_omapi_server(self):
+        omapi_server = self.useFixture(FakeOmapiServer())
+        self.patch(
+            dhcp,
+            "OmapiClient",
+            partial(OmapiClient, server_port=omapi_server.port),
         )
-
-    def test__performs_operations(self):
-        omshell = Mock()
-        self.patch(dhcp, "Omshell").return_value = omshell
-        remove_host = make_host()
+        remove_host, modify_host = make_host(), make_host()
+        for host in (remove_host, modify_host):
+            omapi_server.hosts[pack_host_name(host["mac"])] = {}
         add_host = make_host()
-        modify_host = make_host()
         server = Mock()
-        server.ipv6 = factory.pick_bool()
+        server.omapi_key = omapi_server.shared_key
+        server.ipv6 = False
         dhcp._update_hosts(server, [remove_host], [add_host], [modify_host])
-        self.assertThat(
-            omshell.remove, MockCallsMatch(call(remove_host["mac"]))
-        )
-        self.assertThat(
-            omshell.create,
-            MockCallsMatch(call(add_host["ip"], add_host["mac"])),
-        )
-        self.assertThat(
-            omshell.modify,
-            MockCallsMatch(call(modify_host["ip"], modify_host["mac"])),
+        self.assertItemsEqual(
+            [
+                pack_host_name(add_host["mac"]),
+                pack_host_name(modify_host["mac"]),
+            ],
+            list(omapi_server.hosts),
         )
+        self.assertEqual(1, omapi_server.connections)
 
 
 class TestConfigureDHCP(MAASTestCase):
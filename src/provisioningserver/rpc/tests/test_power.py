@@ -15,6 +15,7 @@ from testtools.deferredruntest import assert_fails_with
 from testtools.matchers import Equals, IsInstance, Not
 from twisted.internet import reactor
 from twisted.internet.defer import (
+    CancelledError,
     Deferred,
     fail,
     inlineCallbacks,
@@ -1309,3 +1310,197 @@ class TestPowerQueryAsync(MAASTestCase):
             [(True, node1["power_state"]), (True, node2["power_state"])],
             results,
         )
+
+
+class TestPowerQueryScheduler(MAASTestCase):
+    def setUp(self):
+        super(TestPowerQueryScheduler, self).setUp()
+        self.clock = Clock()
+        suppress_reporting(self)
+        self.get_power_state = self.patch(power, "get_power_state")
+
+    def make_node(self, power_address=None, power_type="ipmi"):
+        if power_address is None:
+            power_address = factory.make_ipv4_address()
+        return {
+            "context": {"power_address": power_address},
+            "hostname": factory.make_name("hostname"),
+            "power_state": "on",
+            "power_type": power_type,
+            "system_id": factory.make_name("system_id"),
+        }
+
+    def make_scheduler(self, **kwargs):
+        return power.PowerQueryScheduler(clock=self.clock, **kwargs)
+
+    def queried_nodes(self):
+        return [
+            call_args[0][0]
+            for call_args in self.get_power_state.call_args_list
+        ]
+
+    def test_query_limits_concurrency_per_bmc(self):
+        queries = [Deferred(), Deferred()]
+        self.get_power_state.side_effect = queries
+        address = factory.make_ipv4_address()
+        node1, node2 = self.make_node(address), self.make_node(address)
+        scheduler = self.make_scheduler()
+        d = scheduler.query([node1, node2])
+        self.assertEqual([node1["system_id"]], self.queried_nodes())
+        queries[0].callback("on")
+        self.assertEqual(
+            [node1["system_id"], node2["system_id"]], self.queried_nodes()
+        )
+        queries[1].callback("off")
+        self.assertEqual([(True, "on"), (True, "off")], extract_result(d))
+
+    def test_query_waiting_on_bmc_does_not_hold_overall_tokens(self):
+        self.get_power_state.side_effect = lambda *args, **kwargs: Deferred()
+        address = factory.make_ipv4_address()
+        node1, node2 = self.make_node(address), self.make_node(address)
+        node3 = self.make_node()
+        scheduler = self.make_scheduler(max_concurrency=2)
+        scheduler.query([node1, node2, node3])
+        self.assertEqual(
+            [node1["system_id"], node3["system_id"]], self.queried_nodes()
+        )
+
+    def test_query_node_cancelled_waiting_releases_only_acquired(self):
+        self.get_power_state.side_effect = lambda *args, **kwargs: Deferred()
+        address = factory.make_ipv4_address()
+        node1, node2 = self.make_node(address), self.make_node(address)
+        scheduler = self.make_scheduler(max_concurrency=2)
+        scheduler.query_node(node1)
+        d = scheduler.query_node(node2)
+        d.cancel()
+        self.assertRaises(CancelledError, extract_result, d)
+        self.assertEqual(0, scheduler.get_bmc(node1).semaphore.tokens)
+        self.assertEqual(
+            1, scheduler.get_type_semaphore(node1["power_type"]).tokens
+        )
+        self.assertEqual(1, scheduler.semaphore.tokens)
+
+    def test_query_limits_concurrency_per_power_type(self):
+        self.get_power_state.side_effect = lambda *args, **kwargs: Deferred()
+        node1, node2 = self.make_node(), self.make_node()
+        scheduler = self.make_scheduler(type_concurrency={"ipmi": 1})
+        scheduler.query([node1, node2])
+        self.assertEqual([node1["system_id"]], self.queried_nodes())
+
+    def test_query_spreads_queries(self):
+        self.get_power_state.side_effect = lambda *args, **kwargs: succeed(
+            "on"
+        )
+        node1, node2 = self.make_node(), self.make_node()
+        scheduler = self.make_scheduler()
+        d = scheduler.query([node1, node2], spread=10)
+        self.assertEqual([node1["system_id"]], self.queried_nodes())
+        self.clock.advance(5)
+        self.assertEqual(
+            [node1["system_id"], node2["system_id"]], self.queried_nodes()
+        )
+        self.assertEqual([(True, "on"), (True, "on")], extract_result(d))
+
+    def test_query_node_cancels_query_after_timeout(self):
+        self.get_power_state.return_value = Deferred()
+        node = self.make_node()
+        scheduler = self.make_scheduler()
+        with FakeLogger("maas.power"):
+            d = scheduler.query_node(node)
+            self.clock.advance(scheduler.timeout_max)
+        self.assertIsNone(extract_result(d))
+        self.assertEqual(1, scheduler.get_bmc(node).failures)
+
+    def test_query_node_backs_off_after_repeated_failures(self):
+        self.get_power_state.side_effect = lambda *args, **kwargs: fail(
+            PowerError(factory.make_name("error"))
+        )
+        node = self.make_node()
+        scheduler = self.make_scheduler()
+        with FakeLogger("maas.power"):
+            scheduler.query_node(node)
+            scheduler.query_node(node)
+            scheduler.query_node(node)
+            self.assertEqual(2, len(self.queried_nodes()))
+            self.clock.advance(scheduler.backoff_min)
+            scheduler.query_node(node)
+        self.assertEqual(3, len(self.queried_nodes()))
+        bmc = scheduler.get_bmc(node)
+        self.assertEqual(3, bmc.failures)
+        self.assertEqual(
+            self.clock.seconds() + scheduler.backoff_min * 2, bmc.next_query
+        )
+
+    def test_query_node_records_latency(self):
+        query = Deferred()
+        self.get_power_state.return_value = query
+        mock_metrics = self.patch(power.PROMETHEUS_METRICS, "update")
+        node = self.make_node()
+        scheduler = self.make_scheduler()
+        scheduler.query([node])
+        self.clock.advance(2)
+        query.callback("on")
+        self.assertThat(
+            mock_metrics,
+            MockCallsMatch(
+                call(
+                    "maas_power_query_latency",
+                    "observe",
+                    value=2,
+                    labels={"power_type": "ipmi"},
+                ),
+                call("maas_power_query_cycle_duration", "observe", value=2),
+            ),
+        )
+        self.assertEqual(2, scheduler.get_bmc(node).latency)
+
+
+class TestBMCQueryState(MAASTestCase):
+    def test_get_timeout_is_maximum_without_samples(self):
+        bmc = power.BMCQueryState(1)
+        self.assertEqual(120, bmc.get_timeout(15, 120))
+
+    def test_get_timeout_follows_latency(self):
+        bmc = power.BMCQueryState(1)
+        for _ in range(20):
+            bmc.record_success(10)
+        self.assertEqual(15, bmc.get_timeout(15, 120))
+        for _ in range(20):
+            bmc.record_success(40)
+        self.assertThat(bmc.get_timeout(15, 120), Not(Equals(15)))
+        self.assertLessEqual(bmc.get_timeout(15, 120), 120)
+
+    def test_record_failure_backs_off_exponentially(self):
+        bmc = power.BMCQueryState(1)
+        bmc.record_failure(100, 300, 3600)
+        self.assertEqual(0, bmc.next_query)
+        bmc.record_failure(100, 300, 3600)
+        self.assertEqual(400, bmc.next_query)
+        bmc.record_failure(100, 300, 3600)
+        self.assertEqual(700, bmc.next_query)
+        for _ in range(10):
+            bmc.record_failure(100, 300, 3600)
+        self.assertEqual(3700, bmc.next_query)
+
+    def test_record_success_resets_failures(self):
+        bmc = power.BMCQueryState(1)
+        bmc.record_failure(100, 300, 3600)
+        bmc.record_failure(100, 300, 3600)
+        bmc.record_success(1)
+        self.assertEqual(0, bmc.failures)
+        self.assertEqual(0, bmc.next_query)
+
+
+class TestGetBMCKey(MAASTestCase):
+    def test_uses_power_address(self):
+        node = {
+            "power_type": "ipmi",
+            "system_id": factory.make_name("system_id"),
+            "context": {"power_address": "10.0.0.1"},
+        }
+        self.assertEqual(("ipmi", "10.0.0.1"), power.get_bmc_key(node))
+
+    def test_falls_back_to_system_id(self):
+        system_id = factory.make_name("system_id")
+        node = {"power_type": "ipmi", "system_id": system_id, "context": {}}
+        self.assertEqual(("ipmi", system_id), power.get_bmc_key(node))
@@ -90,3 +90,26 @@ class TestEvaluateTag(MAASTestCase):
 
         client = process_node_tags.call_args[1]["client"]
         self.assertFalse(client.dispatcher.autodetect_proxies)
+
+    def test__shares_dispatcher_between_evaluations(self):
+        credentials = "aaa", "bbb", "ccc"
+        rack_id = factory.make_name("rack")
+        process_node_tags = self.patch_autospec(tags, "process_node_tags")
+        for _ in range(2):
+            tags.evaluate_tag(
+                rack_id,
+                [],
+                sentinel.tag_name,
+                sentinel.tag_definition,
+                sentinel.tag_nsmap,
+                credentials,
+                self.mock_url,
+            )
+        client1, client2 = (
+            call[1]["client"] for call in process_node_tags.call_args_list
+        )
+        self.assertIs(tags.dispatcher, client1.dispatcher)
+        self.assertIs(client1.dispatcher, client2.dispatcher)
+        self.assertEqual(
+            tags.DETAILS_CONCURRENCY, client1.dispatcher.concurrency
+        )
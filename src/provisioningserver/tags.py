@@ -3,12 +3,21 @@
 
 """Cluster-side evaluation of tags."""
 
-__all__ = ["merge_details", "merge_details_cleanly", "process_node_tags"]
+__all__ = [
+    "merge_details",
+    "merge_details_cleanly",
+    "process_node_tags",
+    "process_tags",
+]
 
 from collections import OrderedDict
 from functools import partial
+import hashlib
 import http.client
 import json
+import multiprocessing
+from operator import itemgetter
+import threading
 import urllib.error
 import urllib.parse
 import urllib.request
@@ -31,6 +40,19 @@ maaslog = get_maas_logger("tag_processing")
 # face of it, appears excessive.
 DEFAULT_BATCH_SIZE = 100
 
+# Merged documents are several times the size of the XML they came from,
+# so with an example lshw dump of 135kB this caps the cache at a few
+# hundred MB.
+DEFAULT_DETAILS_CACHE_SIZE = 1000
+
+# Starting worker processes and shipping details to them only pays off
+# when there are enough nodes; fewer are evaluated in-thread.
+POOL_THRESHOLD = DEFAULT_BATCH_SIZE
+MAX_POOL_WORKERS = 8
+
+# Seconds to wait for a worker to evaluate its share of a batch.
+POOL_TIMEOUT = 120
+
 
 def process_response(response):
     """All responses should be httplib.OK.
@@ -73,12 +95,18 @@ def get_details_for_nodes(client, system_ids):
     :param system_ids: List of UUIDs of systems for which to fetch LLDP data
     :return: Dictionary mapping node UUIDs to details, e.g. LLDP output
     """
-    details = {}
-    for system_id in system_ids:
+
+    def get_details(system_id):
         path = "/MAAS/api/2.0/nodes/%s/" % system_id
-        data = process_response(client.get(path, op="details"))
-        details[system_id] = data
-    return details
+        return process_response(client.get(path, op="details"))
+
+    # Fetch several at once if the client's dispatcher can.
+    fan_out = getattr(client.dispatcher, "fan_out", None)
+    if fan_out is None:
+        details = map(get_details, system_ids)
+    else:
+        details = fan_out(get_details, system_ids)
+    return dict(zip(system_ids, details))
 
 
 def post_updated_nodes(
@@ -267,6 +295,217 @@ def gen_batches(things, batch_size):
     return (things[s] for s in slices)
 
 
+def details_digest(details):
+    """Return a digest that identifies the content of node `details`.
+
+    Two details mappings with the same digest will merge into the same
+    document, so the digest can be used to cache merged documents.
+
+    :param details: A ``{"name": xml-as-bytes, ...}`` mapping, as
+        accepted by `merge_details`.
+    :return: A hex digest, as a string.
+    """
+    digest = hashlib.sha256()
+    for name in sorted(details):
+        data = details[name]
+        digest.update(name.encode("utf-8") + b"\0")
+        if data is None:
+            digest.update(b"-\0")
+        else:
+            if isinstance(data, str):
+                data = data.encode("utf-8")
+            digest.update(b"%d\0" % len(data))
+            digest.update(data)
+    return digest.hexdigest()
+
+
+class DetailsCache:
+    """A cache of merged node details documents, keyed by content.
+
+    Documents are keyed by `details_digest` so a node whose details have
+    not changed since it was last seen is not parsed and merged again.
+    When the cache holds more than `max_entries` documents the least
+    recently used are evicted.
+    """
+
+    def __init__(self, max_entries=DEFAULT_DETAILS_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._documents)
+
+    def get_document(self, details, digest=None):
+        """Return the merged document for `details`.
+
+        :param details: A mapping as accepted by `merge_details`.
+        :param digest: The `details_digest` of `details`, if the caller
+            already knows it.
+        """
+        if digest is None:
+            digest = details_digest(details)
+        with self._lock:
+            document = self._documents.get(digest)
+            if document is not None:
+                self._documents.move_to_end(digest)
+                return document
+        # Merge outside of the lock; it's the expensive part.
+        document = merge_details(details)
+        with self._lock:
+            self._documents[digest] = document
+            while len(self._documents) > self.max_entries:
+                self._documents.popitem(last=False)
+        return document
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+
+
+# Each process, including pool workers, keeps its own documents.
+details_cache = DetailsCache()
+
+
+class _WarningCollector:
+    """Stand-in for a logger that keeps warnings so they can be returned."""
+
+    def __init__(self):
+        self.warnings = []
+
+    def warning(self, msg, *args):
+        self.warnings.append(msg % args)
+
+
+def evaluate_documents(expressions, documents):
+    """Evaluate several tag expressions against several nodes' details.
+
+    This is also what runs in `TagEvaluationPool` workers, so it accepts
+    and returns only things that can be pickled.
+
+    :param expressions: A list of ``(tag_definition, tag_nsmap)`` tuples.
+    :param documents: A list of ``(system_id, digest, details)`` tuples,
+        as generated by `gen_details_batches`.
+    :return: A ``(results, warnings)`` tuple. `results` is a list of
+        ``(system_id, matches)`` tuples, where `matches` holds a boolean
+        for each expression, in order. `warnings` is a list of messages
+        about expressions that could not be evaluated.
+    """
+    xpaths = [
+        etree.XPath(definition, namespaces=nsmap)
+        for definition, nsmap in expressions
+    ]
+    logger = _WarningCollector()
+    results = []
+    for system_id, digest, details in documents:
+        document = details_cache.get_document(details, digest)
+        matches = tuple(
+            try_match_xpath(xpath, document, logger=logger) for xpath in xpaths
+        )
+        results.append((system_id, matches))
+    return results, logger.warnings
+
+
+def _init_pool_worker(cache_size):
+    details_cache.max_entries = cache_size
+
+
+class TagEvaluationPool:
+    """Evaluate tag expressions in worker processes.
+
+    There is one single-process pool per worker, and documents are
+    sharded between them by digest. This means a node's details always
+    go to the same worker, so they stay in that worker's `details_cache`
+    from one tag evaluation to the next.
+    """
+
+    def __init__(self, workers, cache_size=DEFAULT_DETAILS_CACHE_SIZE):
+        # Don't fork the rack controller; start clean interpreters.
+        context = multiprocessing.get_context("spawn")
+        self._pools = [
+            context.Pool(
+                processes=1,
+                initializer=_init_pool_worker,
+                initargs=(max(1, cache_size // workers),),
+            )
+            for _ in range(workers)
+        ]
+
+    def __len__(self):
+        return len(self._pools)
+
+    def submit(self, expressions, documents):
+        """Start evaluating `expressions` against `documents`.
+
+        :return: A list of ``(async_result, documents)`` tuples, one for
+            each worker that was given documents.
+        """
+        shards = [[] for _ in self._pools]
+        for document in documents:
+            digest = document[1]
+            shards[int(digest[:8], 16) % len(shards)].append(document)
+        return [
+            (pool.apply_async(evaluate_documents, (expressions, shard)), shard)
+            for pool, shard in zip(self._pools, shards)
+            if len(shard) > 0
+        ]
+
+    def close(self):
+        for pool in self._pools:
+            pool.terminate()
+        for pool in self._pools:
+            pool.join()
+
+
+_evaluation_pool = None
+_evaluation_pool_lock = threading.Lock()
+
+
+def get_evaluation_pool():
+    """Return the shared `TagEvaluationPool`, creating it if necessary.
+
+    :return: A `TagEvaluationPool`, or `None` if this machine has only
+        one CPU or worker processes cannot be started.
+    """
+    global _evaluation_pool
+    with _evaluation_pool_lock:
+        if _evaluation_pool is None:
+            workers = min(multiprocessing.cpu_count(), MAX_POOL_WORKERS)
+            if workers < 2:
+                return None
+            try:
+                _evaluation_pool = TagEvaluationPool(workers)
+            except OSError as error:
+                maaslog.warning(
+                    "Unable to start tag evaluation workers: %s", error
+                )
+                return None
+        return _evaluation_pool
+
+
+def reset_evaluation_pool():
+    """Close the shared `TagEvaluationPool`, if there is one."""
+    global _evaluation_pool
+    with _evaluation_pool_lock:
+        pool, _evaluation_pool = _evaluation_pool, None
+    if pool is not None:
+        pool.close()
+
+
+def gen_details_batches(client, batches):
+    """Fetch node details, a batch at a time.
+
+    :return: An iterator of lists of ``(system-id, digest, details)``
+        tuples, one list for each batch.
+    """
+    get_details = partial(get_details_for_nodes, client)
+    for batch in batches:
+        yield [
+            (system_id, details_digest(details), details)
+            for system_id, details in get_details(batch).items()
+        ]
+
+
 def gen_node_details(client, batches):
     """Fetch node details.
 
@@ -275,42 +514,118 @@ def gen_node_details(client, batches):
 
     :return: An iterator of ``(system-id, details-document)`` tuples.
     """
-    get_details = partial(get_details_for_nodes, client)
-    for batch in batches:
-        for system_id, details in get_details(batch).items():
-            yield system_id, merge_details(details)
+    for documents in gen_details_batches(client, batches):
+        for system_id, digest, details in documents:
+            yield system_id, details_cache.get_document(details, digest)
 
 
-def process_all(
-    client,
-    rack_id,
-    tag_name,
-    tag_definition,
-    system_ids,
-    xpath,
-    batch_size=None,
+def _collect_results(expressions, pending):
+    """Wait for the evaluations in `pending` and combine their results.
+
+    Evaluations that a worker failed to complete, in time or at all, are
+    repeated in this thread, and the shared pool is replaced.
+    """
+    results, warnings, pool_error = [], set(), None
+    for evaluation, documents in pending:
+        if evaluation is None:
+            outcome = evaluate_documents(expressions, documents)
+        else:
+            try:
+                outcome = evaluation.get(POOL_TIMEOUT)
+            except multiprocessing.TimeoutError:
+                pool_error = pool_error or "did not respond"
+                outcome = evaluate_documents(expressions, documents)
+            except Exception as error:
+                # For example, the worker died, or the documents or results
+                # could not be passed between processes.
+                pool_error = pool_error or "failed: %s" % error
+                outcome = evaluate_documents(expressions, documents)
+        results.extend(outcome[0])
+        warnings.update(outcome[1])
+    if pool_error is not None:
+        maaslog.warning(
+            "Tag evaluation workers %s; restarting them.", pool_error
+        )
+        reset_evaluation_pool()
+    for warning in sorted(warnings):
+        maaslog.warning("%s", warning)
+    return results
+
+
+def process_all_tags(
+    client, rack_id, tag_definitions, system_ids, batch_size=None, pool=None
 ):
+    """Evaluate several tags against the details of `system_ids`.
+
+    The details of each node are fetched and parsed once, however many
+    tags there are, and each tag is then updated with a single call.
+
+    :param tag_definitions: A list of ``(tag_name, tag_definition,
+        tag_nsmap)`` tuples.
+    :param pool: A `TagEvaluationPool` to evaluate the tags in, or
+        `None` to evaluate them in this thread.
+    """
     log.debug(
-        "Processing {nums} system_ids for tag {name}.",
+        "Processing {nums} system_ids for tags {names}.",
         nums=len(system_ids),
-        name=tag_name,
+        names=", ".join(name for name, _, _ in tag_definitions),
     )
 
     if batch_size is None:
         batch_size = DEFAULT_BATCH_SIZE
 
+    expressions = [
+        (definition, nsmap) for _, definition, nsmap in tag_definitions
+    ]
     batches = gen_batches(system_ids, batch_size)
-    node_details = gen_node_details(client, batches)
-    nodes_matched, nodes_unmatched = classify(
-        partial(try_match_xpath, xpath, logger=maaslog), node_details
-    )
-    post_updated_nodes(
+    pending = []
+    for documents in gen_details_batches(client, batches):
+        if pool is None:
+            pending.append((None, documents))
+        else:
+            # The workers evaluate this batch while the next downloads.
+            pending.extend(pool.submit(expressions, documents))
+    results = _collect_results(expressions, pending)
+
+    for index, (tag_name, tag_definition, _) in enumerate(tag_definitions):
+        nodes_matched, nodes_unmatched = classify(itemgetter(index), results)
+        post_updated_nodes(
+            client,
+            rack_id,
+            tag_name,
+            tag_definition,
+            nodes_matched,
+            nodes_unmatched,
+        )
+
+
+def process_tags(rack_id, nodes, tag_definitions, client, batch_size=None):
+    """Update the nodes for several new/changed tag definitions.
+
+    :param rack_id: System ID for the rack controller.
+    :param nodes: List of nodes to process tags for.
+    :param tag_definitions: A list of ``(tag_name, tag_definition,
+        tag_nsmap)`` tuples.
+    :param client: A `MAASClient` used to fetch the node's details via
+        calls to the web API.
+    :param batch_size: Size of batch
+    """
+    # We evaluate these early, so we can fail before sending a bunch of
+    # data to the server.
+    for _, tag_definition, tag_nsmap in tag_definitions:
+        etree.XPath(tag_definition, namespaces=tag_nsmap)
+    system_ids = [node["system_id"] for node in nodes]
+    if len(system_ids) >= POOL_THRESHOLD:
+        pool = get_evaluation_pool()
+    else:
+        pool = None
+    process_all_tags(
         client,
         rack_id,
-        tag_name,
-        tag_definition,
-        nodes_matched,
-        nodes_unmatched,
+        tag_definitions,
+        system_ids,
+        batch_size=batch_size,
+        pool=pool,
     )
 
 
@@ -333,16 +648,10 @@ def process_node_tags(
     :param tag_definition: Tag definition
     :param batch_size: Size of batch
     """
-    # We evaluate this early, so we can fail before sending a bunch of data to
-    # the server
-    xpath = etree.XPath(tag_definition, namespaces=tag_nsmap)
-    system_ids = [node["system_id"] for node in nodes]
-    process_all(
-        client,
+    process_tags(
         rack_id,
-        tag_name,
-        tag_definition,
-        system_ids,
-        xpath,
+        nodes,
+        [(tag_name, tag_definition, tag_nsmap)],
+        client,
         batch_size=batch_size,
     )
@@ -6,11 +6,18 @@
 __all__ = []
 
 import random
-from unittest.mock import ANY, sentinel
+from unittest.mock import ANY, call, Mock, sentinel
 
 from testtools import ExpectedException
 from testtools.matchers import AllMatch, Equals, HasLength, Is, IsInstance
 from twisted.internet.defer import fail, inlineCallbacks, succeed
+from twisted.internet.error import ConnectionLost
+from twisted.internet.task import Clock
+from twisted.protocols.amp import (
+    MAX_VALUE_LENGTH,
+    UnhandledCommand,
+    UnknownRemoteError,
+)
 
 from maastesting.factory import factory
 from maastesting.matchers import (
@@ -19,6 +26,8 @@ from maastesting.matchers import (
     MockNotCalled,
 )
 from maastesting.testcase import MAASTestCase, MAASTwistedRunTest
+from maastesting.twisted import extract_result, TwistedLoggerFixture
+from provisioningserver import events
 from provisioningserver.events import (
     EVENT_DETAILS,
     EVENT_TYPES,
@@ -31,7 +40,11 @@ from provisioningserver.events import (
     send_rack_event,
 )
 from provisioningserver.rpc import region
-from provisioningserver.rpc.exceptions import NoSuchEventType, NoSuchNode
+from provisioningserver.rpc.exceptions import (
+    NoConnectionsAvailable,
+    NoSuchEventType,
+    NoSuchNode,
+)
 from provisioningserver.rpc.testing import MockLiveClusterToRegionRPCFixture
 from provisioningserver.utils.enum import map_enum
 from provisioningserver.utils.testing import MAASIDFixture
@@ -69,14 +82,14 @@ class TestSendEventNode(MAASTestCase):
 class TestSendEventNodeMACAddress(MAASTestCase):
     """Tests for `send_node_event_mac_address`."""
 
-    def test__calls_singleton_hub_logByMAC_directly(self):
-        self.patch(nodeEventHub, "logByMAC").return_value = sentinel.d
+    def test__calls_singleton_hub_queueByMAC_directly(self):
+        self.patch(nodeEventHub, "queueByMAC").return_value = sentinel.d
         result = send_node_event_mac_address(
             sentinel.event_type, sentinel.mac_address, sentinel.description
         )
         self.assertThat(result, Is(sentinel.d))
         self.assertThat(
-            nodeEventHub.logByMAC,
+            nodeEventHub.queueByMAC,
             MockCalledOnceWith(
                 sentinel.event_type, sentinel.mac_address, sentinel.description
             ),
@@ -86,14 +99,14 @@ class TestSendEventNodeMACAddress(MAASTestCase):
 class TestSendEventNodeIPAddress(MAASTestCase):
     """Tests for `send_node_event_mac_address`."""
 
-    def test__calls_singleton_hub_logByIP_directly(self):
-        self.patch(nodeEventHub, "logByIP").return_value = sentinel.d
+    def test__calls_singleton_hub_queueByIP_directly(self):
+        self.patch(nodeEventHub, "queueByIP").return_value = sentinel.d
         result = send_node_event_ip_address(
             sentinel.event_type, sentinel.ip_address, sentinel.description
         )
         self.assertThat(result, Is(sentinel.d))
         self.assertThat(
-            nodeEventHub.logByIP,
+            nodeEventHub.queueByIP,
             MockCalledOnceWith(
                 sentinel.event_type, sentinel.ip_address, sentinel.description
             ),
@@ -439,3 +452,283 @@ class TestSendEventIPAddress(MAASTestCase):
             yield event_hub.logByIP(event_name, ip_address, description)
         # The event has been removed from the cache.
         self.assertThat(event_hub._types_registered, HasLength(0))
+
+
+class TestNodeEventHubQueue(MAASTestCase):
+    """Tests for `NodeEventHub.queueByID`, `queueByMAC` and `queueByIP`."""
+
+    def setUp(self):
+        super().setUp()
+        self.clock = Clock()
+        self.clock.advance(1000)
+        self.hub = NodeEventHub(self.clock)
+        self.client = Mock(return_value=succeed({}))
+        self.getRegionClient = self.patch(events, "getRegionClient")
+        self.getRegionClient.return_value = self.client
+
+    def queue_events(self, count):
+        queued = []
+        for _ in range(count):
+            event_type = random.choice(list(map_enum(EVENT_TYPES)))
+            ip_address = factory.make_ip_address()
+            description = factory.make_name("description")
+            self.hub.queueByIP(event_type, ip_address, description)
+            queued.append(
+                {
+                    "type_name": event_type,
+                    "ip_address": ip_address,
+                    "description": description,
+                    "timestamp": self.clock.seconds(),
+                }
+            )
+        return queued
+
+    def get_sent(self):
+        sent = []
+        for client_call in self.client.call_args_list:
+            self.assertEqual((region.SendEvents,), client_call[0])
+            sent.append(client_call[1]["events"])
+        return sent
+
+    def fail_to_store(self, *failing):
+        """Make the region fail to store any batch with `failing` events.
+
+        :return: A list of the events the region stores.
+        """
+        stored = []
+
+        def send(command, events):
+            if any(event in failing for event in events):
+                return fail(UnknownRemoteError("failed to store"))
+            stored.extend(events)
+            return succeed({})
+
+        self.client.side_effect = send
+        return stored
+
+    def test_sends_events_together_after_flush_interval(self):
+        self.hub.queueByID(EVENT_TYPES.NODE_POWERED_ON, "abc", "id")
+        self.hub.queueByMAC(EVENT_TYPES.NODE_PXE_REQUEST, "00:11:22:33:44:55")
+        queued = self.queue_events(3)
+        self.clock.advance(self.hub.flush_interval - 0.1)
+        self.assertThat(self.client, MockNotCalled())
+        self.clock.advance(0.1)
+        self.assertEqual(
+            [
+                [
+                    {
+                        "type_name": EVENT_TYPES.NODE_POWERED_ON,
+                        "system_id": "abc",
+                        "description": "id",
+                        "timestamp": 1000,
+                    },
+                    {
+                        "type_name": EVENT_TYPES.NODE_PXE_REQUEST,
+                        "mac_address": "00:11:22:33:44:55",
+                        "description": "",
+                        "timestamp": 1000,
+                    },
+                ]
+                + queued
+            ],
+            self.get_sent(),
+        )
+        self.assertThat(self.hub.queue, HasLength(0))
+
+    def test_sends_full_batches_immediately(self):
+        self.hub.batch_size = 3
+        queued = self.queue_events(7)
+        self.clock.advance(0)
+        self.assertEqual(
+            [queued[:3], queued[3:6], queued[6:]], self.get_sent()
+        )
+
+    def test_keeps_events_queued_until_region_is_available(self):
+        self.getRegionClient.side_effect = NoConnectionsAvailable()
+        queued = self.queue_events(2)
+        self.clock.advance(self.hub.flush_interval)
+        self.assertEqual(queued, list(self.hub.queue))
+        # New events don't cause another attempt before the retry interval.
+        queued.extend(self.queue_events(1))
+        self.clock.advance(self.hub.retry_interval - 0.1)
+        self.assertThat(self.getRegionClient, MockCalledOnce())
+        self.getRegionClient.side_effect = None
+        self.clock.advance(0.1)
+        self.assertEqual([queued], self.get_sent())
+
+    def test_keeps_events_queued_when_connection_is_lost(self):
+        self.client.side_effect = [fail(ConnectionLost()), succeed({})]
+        queued = self.queue_events(2)
+        self.clock.advance(self.hub.flush_interval)
+        queued.extend(self.queue_events(1))
+        self.assertEqual(queued, list(self.hub.queue))
+        self.clock.advance(self.hub.retry_interval)
+        self.assertEqual([queued[:2], queued], self.get_sent())
+
+    def test_keeps_events_queued_when_region_fails_to_store_them(self):
+        self.client.side_effect = lambda command, events: fail(
+            UnknownRemoteError("database is unavailable")
+        )
+        queued = self.queue_events(2)
+        self.clock.advance(self.hub.flush_interval)
+        self.assertEqual(queued, list(self.hub.queue))
+        self.client.side_effect = None
+        self.clock.advance(self.hub.retry_interval)
+        self.assertEqual([queued, queued[:1], queued], self.get_sent())
+        self.assertThat(self.hub.queue, HasLength(0))
+
+    def test_stores_events_ahead_of_one_the_region_fails_on(self):
+        queued = self.queue_events(4)
+        stored = self.fail_to_store(queued[2])
+        self.clock.advance(self.hub.flush_interval)
+        self.assertEqual(queued[:2], stored)
+        self.assertEqual(queued[2:], list(self.hub.queue))
+
+    def test_drops_event_the_region_keeps_failing_on(self):
+        queued = self.queue_events(4)
+        stored = self.fail_to_store(queued[1])
+        with TwistedLoggerFixture() as logger:
+            self.clock.advance(self.hub.flush_interval)
+            for _ in range(self.hub.max_attempts - 1):
+                self.assertEqual(queued[1:], list(self.hub.queue))
+                self.clock.advance(self.hub.retry_interval)
+        self.assertEqual(queued[:1] + queued[2:], stored)
+        self.assertThat(self.hub.queue, HasLength(0))
+        self.assertIn(
+            "Failed to send node event %d times; dropping it."
+            % self.hub.max_attempts,
+            logger.output,
+        )
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_splits_batches_to_fit_in_an_amp_value(self):
+        queued = []
+        for _ in range(self.hub.batch_size):
+            event_type = random.choice(list(map_enum(EVENT_TYPES)))
+            description = factory.make_string(600)
+            self.hub.queueByID(event_type, "abc", description)
+            queued.append(
+                {
+                    "type_name": event_type,
+                    "system_id": "abc",
+                    "description": description,
+                    "timestamp": self.clock.seconds(),
+                }
+            )
+        self.clock.advance(0)
+        sent = self.get_sent()
+        self.assertThat(sent, HasLength(2))
+        self.assertEqual(queued, [event for batch in sent for event in batch])
+        [(_, events_argument)] = region.SendEvents.arguments
+        for batch in sent:
+            self.assertLessEqual(
+                len(events_argument.toStringProto(batch, None)),
+                MAX_VALUE_LENGTH,
+            )
+
+    def test_drops_events_too_big_to_send(self):
+        self.hub.queueByID(
+            EVENT_TYPES.NODE_POWERED_ON, "abc", "x" * MAX_VALUE_LENGTH
+        )
+        queued = self.queue_events(1)
+        with TwistedLoggerFixture() as logger:
+            self.clock.advance(self.hub.flush_interval)
+        self.assertEqual([queued], self.get_sent())
+        self.assertIn(
+            "Dropped %s node event; it is too big to send."
+            % EVENT_TYPES.NODE_POWERED_ON,
+            logger.output,
+        )
+
+    def test_drops_oldest_events_when_too_many_are_queued(self):
+        self.hub.max_queued = 3
+        self.getRegionClient.side_effect = NoConnectionsAvailable()
+        queued = self.queue_events(5)
+        self.assertEqual(queued[2:], list(self.hub.queue))
+        self.assertEqual(2, self.hub.dropped)
+        with TwistedLoggerFixture() as logger:
+            self.clock.advance(self.hub.flush_interval)
+        self.assertIn(
+            "Dropped 2 node events; too many were queued.", logger.output
+        )
+
+    def test_drops_batch_on_other_errors(self):
+        self.client.side_effect = [fail(ZeroDivisionError()), succeed({})]
+        self.hub.batch_size = 2
+        with TwistedLoggerFixture() as logger:
+            queued = self.queue_events(4)
+            self.clock.advance(0)
+        self.assertEqual([queued[:2], queued[2:]], self.get_sent())
+        self.assertThat(self.hub.queue, HasLength(0))
+        self.assertIn("Failed to send 2 node events.", logger.output)
+
+    def test_sends_events_one_by_one_to_older_regions(self):
+        self.client.side_effect = fail(UnhandledCommand())
+        logByID = self.patch(self.hub, "logByID")
+        logByID.return_value = succeed(None)
+        logByIP = self.patch(self.hub, "logByIP")
+        logByIP.side_effect = [succeed(None), fail(NoConnectionsAvailable())]
+        self.hub.queueByID(EVENT_TYPES.NODE_POWERED_ON, "abc", "id")
+        queued = self.queue_events(3)
+        self.clock.advance(self.hub.flush_interval)
+        self.assertThat(
+            logByID,
+            MockCalledOnceWith(EVENT_TYPES.NODE_POWERED_ON, "abc", "id"),
+        )
+        self.assertEqual(
+            [
+                call(
+                    event["type_name"],
+                    event["ip_address"],
+                    event["description"],
+                )
+                for event in queued[:2]
+            ],
+            logByIP.call_args_list,
+        )
+        # Events not yet sent stay queued.
+        self.assertEqual(queued[1:], list(self.hub.queue))
+
+    def test_flush_sends_queued_events_now(self):
+        queued = self.queue_events(2)
+        d = self.hub.flush()
+        self.assertIsNone(extract_result(d))
+        self.assertEqual([queued], self.get_sent())
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+
+class TestNodeEventHubQueueRPC(MAASTestCase):
+    """Tests for `NodeEventHub` sending queued events with `SendEvents`."""
+
+    run_tests_with = MAASTwistedRunTest.make_factory(timeout=5)
+
+    @inlineCallbacks
+    def test__events_are_sent_to_region(self):
+        fixture = self.useFixture(MockLiveClusterToRegionRPCFixture())
+        protocol, connecting = fixture.makeEventLoop(region.SendEvents)
+        self.addCleanup((yield connecting))
+
+        ip_address = factory.make_ip_address()
+        description = factory.make_name("description")
+        event_name = random.choice(list(map_enum(EVENT_TYPES)))
+
+        event_hub = NodeEventHub()
+        yield event_hub.queueByIP(event_name, ip_address, description)
+        yield event_hub.flush()
+
+        self.assertThat(
+            protocol.SendEvents,
+            MockCalledOnceWith(
+                ANY,
+                events=[
+                    {
+                        "type_name": event_name,
+                        "description": description,
+                        "timestamp": ANY,
+                        "system_id": None,
+                        "mac_address": None,
+                        "ip_address": ip_address,
+                    }
+                ],
+            ),
+        )
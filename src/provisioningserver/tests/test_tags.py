@@ -9,8 +9,9 @@ import doctest
 import http.client
 from itertools import chain
 import json
+import multiprocessing
 from textwrap import dedent
-from unittest.mock import call, MagicMock, sentinel
+from unittest.mock import ANY, call, MagicMock, sentinel
 import urllib.error
 import urllib.parse
 import urllib.request
@@ -20,9 +21,15 @@ from fixtures import FakeLogger
 from lxml import etree
 from testtools.matchers import DocTestMatches, Equals, MatchesStructure
 
-from apiclient.maas_client import MAASClient
+from apiclient.maas_client import MAASClient, MAASDispatcher
 from maastesting.factory import factory
-from maastesting.matchers import IsCallable, MockCalledOnceWith, MockCallsMatch
+from maastesting.matchers import (
+    IsCallable,
+    MockCalledOnce,
+    MockCalledOnceWith,
+    MockCallsMatch,
+    MockNotCalled,
+)
 from maastesting.testcase import MAASTestCase
 from provisioningserver import tags
 from provisioningserver.testing.config import ClusterConfigurationFixture
@@ -537,6 +544,30 @@ class TestTagUpdating(MAASTestCase):
             ),
         )
 
+    def test_get_details_fans_out_with_dispatcher(self):
+        client = MAASClient(
+            None, MAASDispatcher(concurrency=2), factory.make_simple_http_url()
+        )
+        get = self.patch(client, "get")
+        get.side_effect = lambda path, op: factory.make_response(
+            http.client.OK,
+            bson.BSON.encode({"lshw": path.encode("ascii")}),
+            "application/bson",
+        )
+        fan_out = self.patch(client.dispatcher, "fan_out")
+        fan_out.side_effect = lambda func, items: list(map(func, items))
+        result = tags.get_details_for_nodes(client, ["system-1", "system-2"])
+        self.assertEqual(
+            {
+                "system-1": {"lshw": b"/MAAS/api/2.0/nodes/system-1/"},
+                "system-2": {"lshw": b"/MAAS/api/2.0/nodes/system-2/"},
+            },
+            result,
+        )
+        self.assertThat(
+            fan_out, MockCalledOnceWith(ANY, ["system-1", "system-2"])
+        )
+
     def test_post_updated_nodes_calls_correct_api_and_parses_result(self):
         client = self.fake_client()
         content = b'{"added": 1, "removed": 2}'
@@ -668,3 +699,309 @@ class TestTagUpdating(MAASTestCase):
                 remove=["system-id2"],
             ),
         )
+
+
+class TestDetailsDigest(MAASTestCase):
+    def test_is_independent_of_order(self):
+        self.assertEqual(
+            tags.details_digest({"lshw": b"<a/>", "lldp": b"<b/>"}),
+            tags.details_digest({"lldp": b"<b/>", "lshw": b"<a/>"}),
+        )
+
+    def test_changes_with_content(self):
+        self.assertNotEqual(
+            tags.details_digest({"lshw": b"<a/>"}),
+            tags.details_digest({"lshw": b"<b/>"}),
+        )
+
+    def test_does_not_confuse_names_and_content(self):
+        self.assertNotEqual(
+            tags.details_digest({"lshw": b"<a/>", "lldp": b""}),
+            tags.details_digest({"lshw": b"<a/>lldp"}),
+        )
+
+    def test_distinguishes_missing_from_empty(self):
+        self.assertNotEqual(
+            tags.details_digest({"lshw": None}),
+            tags.details_digest({"lshw": b""}),
+        )
+
+
+class TestDetailsCache(MAASTestCase):
+    def test_get_document_merges_details(self):
+        cache = tags.DetailsCache()
+        document = cache.get_document({"lshw": b"<node />"})
+        self.assertThat(
+            document, EqualsXML(tags.merge_details({"lshw": b"<node />"}))
+        )
+
+    def test_get_document_merges_same_content_once(self):
+        merge_details = self.patch(tags, "merge_details")
+        merge_details.side_effect = lambda details: object()
+        cache = tags.DetailsCache()
+        document = cache.get_document({"lshw": b"<node />"})
+        self.assertIs(document, cache.get_document({"lshw": b"<node />"}))
+        self.assertIsNot(document, cache.get_document({"lshw": b"<other />"}))
+        self.assertEqual(2, merge_details.call_count)
+
+    def test_get_document_uses_given_digest(self):
+        cache = tags.DetailsCache()
+        document = cache.get_document({"lshw": b"<node />"}, "digest")
+        self.assertIs(document, cache.get_document({}, "digest"))
+
+    def test_evicts_least_recently_used(self):
+        cache = tags.DetailsCache(max_entries=2)
+        first = cache.get_document({"lshw": b"<a />"})
+        cache.get_document({"lshw": b"<b />"})
+        # Touch the first document so the second becomes the oldest.
+        cache.get_document({"lshw": b"<a />"})
+        cache.get_document({"lshw": b"<c />"})
+        self.assertEqual(2, len(cache))
+        self.assertIs(first, cache.get_document({"lshw": b"<a />"}))
+        self.assertEqual(
+            {
+                tags.details_digest({"lshw": b"<a />"}),
+                tags.details_digest({"lshw": b"<c />"}),
+            },
+            set(cache._documents),
+        )
+
+    def test_clear(self):
+        cache = tags.DetailsCache()
+        cache.get_document({"lshw": b"<node />"})
+        cache.clear()
+        self.assertEqual(0, len(cache))
+
+
+def make_documents(*xmls):
+    return [
+        (
+            "system-%d" % index,
+            tags.details_digest({"lshw": xml}),
+            {"lshw": xml},
+        )
+        for index, xml in enumerate(xmls)
+    ]
+
+
+class TestEvaluateDocuments(MAASTestCase):
+    def setUp(self):
+        super(TestEvaluateDocuments, self).setUp()
+        self.addCleanup(tags.details_cache.clear)
+
+    def test_evaluates_every_expression_for_every_document(self):
+        documents = make_documents(b"<node />", b"<foo><bar /></foo>")
+        expressions = [("//node", {}), ("//bar", {}), ("/*", {})]
+        self.assertEqual(
+            (
+                [
+                    ("system-0", (True, False, True)),
+                    ("system-1", (False, True, True)),
+                ],
+                [],
+            ),
+            tags.evaluate_documents(expressions, documents),
+        )
+
+    def test_returns_warnings_for_invalid_expressions(self):
+        documents = make_documents(b"<node />")
+        results, warnings = tags.evaluate_documents(
+            [("/foo:bar", {}), ("//node", {})], documents
+        )
+        self.assertEqual([("system-0", (False, True))], results)
+        self.assertEqual(
+            ["Invalid expression '/foo:bar': Undefined namespace prefix"],
+            warnings,
+        )
+
+    def test_caches_documents(self):
+        documents = make_documents(b"<node />")
+        tags.evaluate_documents([("//node", {})], documents)
+        self.assertEqual(1, len(tags.details_cache))
+
+
+class TestTagEvaluationPool(MAASTestCase):
+    def test_evaluates_in_workers(self):
+        pool = tags.TagEvaluationPool(2)
+        self.addCleanup(pool.close)
+        documents = make_documents(*(b"<node%d />" % i for i in range(8)))
+        pending = pool.submit([("//node3", {})], documents)
+        results = []
+        for evaluation, shard in pending:
+            shard_results, warnings = evaluation.get(tags.POOL_TIMEOUT)
+            self.assertEqual([], warnings)
+            self.assertEqual(
+                [system_id for system_id, _, _ in shard],
+                [system_id for system_id, _ in shard_results],
+            )
+            results.extend(shard_results)
+        self.assertItemsEqual(
+            [("system-%d" % i, (i == 3,)) for i in range(8)], results
+        )
+
+    def test_shards_documents_by_digest(self):
+        pool = tags.TagEvaluationPool(2)
+        self.addCleanup(pool.close)
+        documents = make_documents(*(b"<node%d />" % i for i in range(8)))
+        first = [shard for _, shard in pool.submit([], documents)]
+        second = [shard for _, shard in pool.submit([], documents[::-1])]
+        self.assertItemsEqual(
+            [sorted(shard) for shard in first],
+            [sorted(shard) for shard in second],
+        )
+
+
+class FakeEvaluation:
+    def __init__(self, result=None, error=None):
+        self.result = result
+        self.error = error
+
+    def get(self, timeout=None):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class TestCollectResults(MAASTestCase):
+    def setUp(self):
+        super(TestCollectResults, self).setUp()
+        self.addCleanup(tags.details_cache.clear)
+
+    def test_evaluates_in_thread_without_evaluation(self):
+        documents = make_documents(b"<node />")
+        self.assertEqual(
+            [("system-0", (True,))],
+            tags._collect_results([("//node", {})], [(None, documents)]),
+        )
+
+    def test_combines_worker_results(self):
+        pending = [
+            (FakeEvaluation(([("a", (True,))], [])), []),
+            (FakeEvaluation(([("b", (False,))], [])), []),
+        ]
+        self.assertEqual(
+            [("a", (True,)), ("b", (False,))],
+            tags._collect_results([("//node", {})], pending),
+        )
+
+    def test_logs_warnings_once(self):
+        logger = self.useFixture(FakeLogger("maas"))
+        pending = [
+            (FakeEvaluation(([], ["Invalid expression"])), []),
+            (FakeEvaluation(([], ["Invalid expression"])), []),
+        ]
+        tags._collect_results([], pending)
+        self.assertEqual("Invalid expression\n", logger.output)
+
+    def test_evaluates_in_thread_and_resets_pool_on_timeout(self):
+        self.useFixture(FakeLogger("maas"))
+        reset_evaluation_pool = self.patch(tags, "reset_evaluation_pool")
+        documents = make_documents(b"<node />")
+        evaluation = FakeEvaluation(error=multiprocessing.TimeoutError())
+        self.assertEqual(
+            [("system-0", (True,))],
+            tags._collect_results([("//node", {})], [(evaluation, documents)]),
+        )
+        self.assertThat(reset_evaluation_pool, MockCalledOnceWith())
+
+    def test_evaluates_in_thread_and_resets_pool_on_worker_error(self):
+        logger = self.useFixture(FakeLogger("maas"))
+        reset_evaluation_pool = self.patch(tags, "reset_evaluation_pool")
+        documents = make_documents(b"<node />")
+        evaluation = FakeEvaluation(error=OSError("Broken pipe"))
+        self.assertEqual(
+            [("system-0", (True,))],
+            tags._collect_results([("//node", {})], [(evaluation, documents)]),
+        )
+        self.assertThat(reset_evaluation_pool, MockCalledOnceWith())
+        self.assertIn(
+            "Tag evaluation workers failed: Broken pipe", logger.output
+        )
+
+
+class TestProcessTags(MAASTestCase):
+    def setUp(self):
+        super(TestProcessTags, self).setUp()
+        self.useFixture(FakeLogger())
+        self.addCleanup(tags.details_cache.clear)
+
+    def test_fetches_details_once_for_several_tags(self):
+        get_details_for_nodes = self.patch(tags, "get_details_for_nodes")
+        get_details_for_nodes.side_effect = lambda client, system_ids: {
+            "system-1": {"lshw": b"<node />"},
+            "system-2": {"lshw": b"<other />"},
+        }
+        post_updated_nodes = self.patch(tags, "post_updated_nodes")
+        rack_id = factory.make_name("rack")
+        tags.process_tags(
+            rack_id,
+            [{"system_id": "system-1"}, {"system_id": "system-2"}],
+            [("tag1", "//node", {}), ("tag2", "//other", {})],
+            sentinel.client,
+        )
+        self.assertThat(get_details_for_nodes, MockCalledOnce())
+        self.assertThat(
+            post_updated_nodes,
+            MockCallsMatch(
+                call(
+                    sentinel.client,
+                    rack_id,
+                    "tag1",
+                    "//node",
+                    ["system-1"],
+                    ["system-2"],
+                ),
+                call(
+                    sentinel.client,
+                    rack_id,
+                    "tag2",
+                    "//other",
+                    ["system-2"],
+                    ["system-1"],
+                ),
+            ),
+        )
+
+    def test_checks_every_definition_before_fetching(self):
+        get_details_for_nodes = self.patch(tags, "get_details_for_nodes")
+        self.assertRaises(
+            etree.XPathSyntaxError,
+            tags.process_tags,
+            factory.make_name("rack"),
+            [{"system_id": "system-1"}],
+            [("tag1", "//node", {}), ("tag2", "//[", {})],
+            sentinel.client,
+        )
+        self.assertThat(get_details_for_nodes, MockNotCalled())
+
+    def test_uses_pool_for_many_nodes(self):
+        self.patch(tags, "POOL_THRESHOLD", 2)
+        get_evaluation_pool = self.patch(tags, "get_evaluation_pool")
+        process_all_tags = self.patch(tags, "process_all_tags")
+        nodes = [{"system_id": "system-1"}, {"system_id": "system-2"}]
+        tag_definitions = [("tag1", "//node", {})]
+        tags.process_tags(
+            sentinel.rack_id, nodes, tag_definitions, sentinel.client
+        )
+        self.assertThat(
+            process_all_tags,
+            MockCalledOnceWith(
+                sentinel.client,
+                sentinel.rack_id,
+                tag_definitions,
+                ["system-1", "system-2"],
+                batch_size=None,
+                pool=get_evaluation_pool.return_value,
+            ),
+        )
+
+    def test_evaluates_in_thread_for_few_nodes(self):
+        self.patch(tags, "POOL_THRESHOLD", 3)
+        get_evaluation_pool = self.patch(tags, "get_evaluation_pool")
+        process_all_tags = self.patch(tags, "process_all_tags")
+        nodes = [{"system_id": "system-1"}, {"system_id": "system-2"}]
+        tags.process_tags(
+            sentinel.rack_id, nodes, [("tag1", "//node", {})], sentinel.client
+        )
+        self.assertThat(get_evaluation_pool, MockNotCalled())
+        self.assertIsNone(process_all_tags.call_args[1]["pool"])
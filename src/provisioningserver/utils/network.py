@@ -19,6 +19,7 @@ __all__ = [
     "ip_range_within_network",
 ]
 
+from bisect import bisect_right, insort
 import codecs
 from collections import namedtuple
 from operator import attrgetter
@@ -413,6 +414,8 @@ class MAASIPSet(set):
         self.ranges = _normalize_ipranges(self.ranges)
         self.ranges = _combine_overlapping_maasipranges(self.ranges)
         self.ranges = _coalesce_adjacent_purposes(self.ranges)
+        # First address of each range, for bisecting in `find`.
+        self._firsts = [item.first for item in self.ranges]
 
     def __ior__(self, other):
         """Return self |= other."""
@@ -431,18 +434,16 @@ class MAASIPSet(set):
         within that range.)
         """
         if isinstance(search, IPRange):
-            for item in self.ranges:
-                if (
-                    item.first <= search.first <= item.last
-                    and item.first <= search.last <= item.last
-                ):
-                    return item
+            first, last = search.first, search.last
         else:
-            addr = IPAddress(search)
-            addr = int(addr)
-            for item in self.ranges:
-                if item.first <= addr <= item.last:
-                    return item
+            first = last = int(IPAddress(search))
+        # Ranges are sorted and do not overlap, so only the last range
+        # starting at or before `first` can contain it.
+        index = bisect_right(self._firsts, first) - 1
+        if index >= 0:
+            item = self.ranges[index]
+            if first <= item.last and last <= item.last:
+                return item
         return None
 
     @property
@@ -614,6 +615,131 @@ class MAASIPSet(set):
         return "%s(%s)" % (self.__class__.__name__, item_repr)
 
 
+class FreeIPRangeIndex:
+    """An index of free IP address ranges, for allocating addresses.
+
+    Ranges are kept sorted by first address and, separately, by size, so
+    finding the range containing an address and finding the smallest free
+    range are both done by bisection. Claiming an address splits the range
+    containing it, so an index can be kept up to date as addresses are
+    allocated rather than being recalculated. Copying an index is cheap,
+    so addresses that should only be avoided for one allocation can be
+    claimed in a copy.
+
+    Ranges given to an index must not overlap, which is the case for any
+    set of unused ranges from a `MAASIPSet`.
+    """
+
+    def __init__(self, ranges=(), version=4):
+        self.version = version
+        self._firsts = []
+        self._lasts = {}
+        self._by_size = []
+        for item in ranges:
+            self._add(item.first, item.last)
+
+    @classmethod
+    def from_maasipset(cls, ipset, version=None):
+        """Return an index of the ranges in `ipset`."""
+        if version is None:
+            if ipset.cidr is not None:
+                version = IPNetwork(ipset.cidr).version
+            elif len(ipset.ranges) > 0:
+                version = ipset.ranges[0].version
+            else:
+                version = 4
+        return cls(ipset.ranges, version=version)
+
+    def copy(self):
+        """Return a copy of this index that can be changed independently."""
+        index = self.__class__(version=self.version)
+        index._firsts = list(self._firsts)
+        index._lasts = dict(self._lasts)
+        index._by_size = list(self._by_size)
+        return index
+
+    def __len__(self):
+        return len(self._firsts)
+
+    def __iter__(self):
+        for first in self._firsts:
+            yield self._make_range(first, self._lasts[first])
+
+    def __contains__(self, address):
+        return self._find(self._to_int(address)) is not None
+
+    @property
+    def num_addresses(self):
+        """The number of free addresses in this index."""
+        return sum(last - first + 1 for first, last in self._lasts.items())
+
+    def find(self, address) -> Optional[MAASIPRange]:
+        """Return the free range containing `address`, or `None`."""
+        first = self._find(self._to_int(address))
+        if first is None:
+            return None
+        return self._make_range(first, self._lasts[first])
+
+    def get_smallest_range(self) -> Optional[MAASIPRange]:
+        """Return the smallest free range, or `None` if there are none.
+
+        Ties are broken by picking the range with the lowest address.
+        """
+        if len(self._by_size) == 0:
+            return None
+        size, first = self._by_size[0]
+        return self._make_range(first, first + size - 1)
+
+    def claim(self, address) -> bool:
+        """Mark `address` as no longer free.
+
+        :return: True if `address` was free, False otherwise.
+        """
+        address = self._to_int(address)
+        first = self._find(address)
+        if first is None:
+            return False
+        last = self._lasts[first]
+        self._remove(first)
+        if first < address:
+            self._add(first, address - 1)
+        if address < last:
+            self._add(address + 1, last)
+        return True
+
+    def _to_int(self, address):
+        if isinstance(address, int):
+            return address
+        return int(IPAddress(address))
+
+    def _make_range(self, first, last):
+        return make_iprange(
+            IPAddress(first, self.version),
+            IPAddress(last, self.version),
+            purpose=IPRANGE_TYPE.UNUSED,
+        )
+
+    def _find(self, address):
+        """Return the first address of the free range containing `address`."""
+        index = bisect_right(self._firsts, address) - 1
+        if index >= 0:
+            first = self._firsts[index]
+            if address <= self._lasts[first]:
+                return first
+        return None
+
+    def _add(self, first, last):
+        insort(self._firsts, first)
+        self._lasts[first] = last
+        insort(self._by_size, (last - first + 1, first))
+
+    def _remove(self, first):
+        last = self._lasts.pop(first)
+        del self._firsts[bisect_right(self._firsts, first) - 1]
+        size_key = (last - first + 1, first)
+        del self._by_size[bisect_right(self._by_size, size_key) - 1]
+
+
 def make_ipaddress(input: Optional[MaybeIPAddress]) -> Optional[IPAddress]:
     """Returns an `IPAddress` object for the specified input.
 
@@ -6,6 +6,7 @@
 __all__ = []
 
 import itertools
+from operator import attrgetter
 import random
 import socket
 from socket import EAI_BADFLAGS, EAI_NODATA, EAI_NONAME, gaierror, IPPROTO_TCP
@@ -59,6 +60,7 @@ from provisioningserver.utils.network import (
     find_ip_via_arp,
     find_mac_via_arp,
     format_eui,
+    FreeIPRangeIndex,
     generate_mac_address,
     get_all_addresses_for_interface,
     get_all_interface_addresses,
@@ -78,6 +80,7 @@ from provisioningserver.utils.network import (
     interface_children,
     intersect_iprange,
     ip_range_within_network,
+    IPRANGE_TYPE,
     IPRangeStatistics,
     is_loopback_address,
     LOOPBACK_INTERFACE_INFO,
@@ -913,6 +916,124 @@ class TestMAASIPSet(MAASTestCase):
         self.assertThat(str(IPAddress(s1.last)), Equals("10.0.0.8"))
 
 
+class TestFreeIPRangeIndex(MAASTestCase):
+    def make_index(self):
+        # Free: .1-.3, .5-.6, .10-.20
+        return FreeIPRangeIndex.from_maasipset(
+            MAASIPSet(
+                [
+                    make_iprange("10.0.0.1", "10.0.0.3"),
+                    make_iprange("10.0.0.5", "10.0.0.6"),
+                    make_iprange("10.0.0.10", "10.0.0.20"),
+                ]
+            )
+        )
+
+    def test__find(self):
+        index = self.make_index()
+        free_range = index.find("10.0.0.12")
+        self.assertEqual(
+            (IPAddress("10.0.0.10"), IPAddress("10.0.0.20")),
+            (IPAddress(free_range.first), IPAddress(free_range.last)),
+        )
+        self.assertIsNone(index.find("10.0.0.4"))
+        self.assertIsNone(index.find("10.0.0.21"))
+        self.assertIsNone(index.find("10.0.0.0"))
+
+    def test__contains(self):
+        index = self.make_index()
+        self.assertThat(index, Contains("10.0.0.1"))
+        self.assertThat(index, Contains(IPAddress("10.0.0.6")))
+        self.assertThat(index, Not(Contains("10.0.0.7")))
+
+    def test__get_smallest_range(self):
+        index = self.make_index()
+        smallest = index.get_smallest_range()
+        self.assertEqual(IPAddress("10.0.0.5"), IPAddress(smallest.first))
+        self.assertEqual(2, smallest.num_addresses)
+        self.assertEqual({IPRANGE_TYPE.UNUSED}, smallest.purpose)
+
+    def test__get_smallest_range_prefers_lowest_address_on_tie(self):
+        index = FreeIPRangeIndex(
+            [
+                make_iprange("10.0.0.8", "10.0.0.9"),
+                make_iprange("10.0.0.2", "10.0.0.3"),
+            ]
+        )
+        self.assertEqual(
+            IPAddress("10.0.0.2"), IPAddress(index.get_smallest_range().first)
+        )
+
+    def test__get_smallest_range_returns_None_when_empty(self):
+        self.assertIsNone(FreeIPRangeIndex().get_smallest_range())
+
+    def test__claim_splits_range(self):
+        index = self.make_index()
+        self.assertTrue(index.claim("10.0.0.15"))
+        self.assertEqual(4, len(index))
+        self.assertIsNone(index.find("10.0.0.15"))
+        self.assertEqual(5, index.find("10.0.0.14").num_addresses)
+        self.assertEqual(5, index.find("10.0.0.16").num_addresses)
+
+    def test__claim_shrinks_range_at_edges(self):
+        index = self.make_index()
+        self.assertTrue(index.claim("10.0.0.1"))
+        self.assertTrue(index.claim("10.0.0.3"))
+        self.assertEqual(3, len(index))
+        smallest = index.get_smallest_range()
+        self.assertEqual(IPAddress("10.0.0.2"), IPAddress(smallest.first))
+        self.assertEqual(1, smallest.num_addresses)
+
+    def test__claim_removes_single_address_range(self):
+        index = self.make_index()
+        index.claim("10.0.0.5")
+        index.claim("10.0.0.6")
+        self.assertEqual(2, len(index))
+        self.assertEqual(
+            IPAddress("10.0.0.1"), IPAddress(index.get_smallest_range().first)
+        )
+
+    def test__claim_returns_False_if_not_free(self):
+        index = self.make_index()
+        self.assertFalse(index.claim("10.0.0.4"))
+        self.assertEqual(16, index.num_addresses)
+
+    def test__copy_is_independent(self):
+        index = self.make_index()
+        copy = index.copy()
+        copy.claim("10.0.0.5")
+        self.assertThat(index, Contains("10.0.0.5"))
+        self.assertThat(copy, Not(Contains("10.0.0.5")))
+
+    def test__matches_unused_ranges(self):
+        network = IPNetwork("10.0.0.0/24")
+        used = MAASIPSet(
+            [
+                make_iprange("10.0.0.%d" % i)
+                for i in random.sample(range(1, 255), 50)
+            ]
+        )
+        unused = used.get_unused_ranges(network)
+        index = FreeIPRangeIndex.from_maasipset(unused)
+        self.assertEqual(
+            [(item.first, item.last) for item in unused.ranges],
+            [(item.first, item.last) for item in index],
+        )
+        self.assertEqual(
+            min(unused.ranges, key=attrgetter("num_addresses")).first,
+            index.get_smallest_range().first,
+        )
+
+    def test__ipv6(self):
+        index = FreeIPRangeIndex.from_maasipset(
+            MAASIPSet([make_iprange("2001:db8::1", "2001:db8::ff")])
+        )
+        index.claim("2001:db8::1")
+        smallest = index.get_smallest_range()
+        self.assertEqual(IPAddress("2001:db8::2"), IPAddress(smallest.first))
+        self.assertEqual(6, smallest.version)
+
+
 class TestIPRangeStatistics(MAASTestCase):
     def test__statistics_are_accurate(self):
         s = MAASIPSet(["10.0.0.2", "10.0.0.4", "10.0.0.6", "10.0.0.8"])